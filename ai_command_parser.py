@@ -6,17 +6,36 @@ AI 命令解析器模块
 - 2.2.2: 智能参数提取与验证
 - 2.2.3: 场景化 Prompt 优化
 """
+import asyncio
+import json
 import os
 import re
-from typing import Optional, Dict, List, Tuple
-from ai_provider import AIProvider
+import sys
+import threading
+from typing import Any, Callable, Optional, Dict, Iterator, List, Tuple
+from ai_provider import RequestCancelled, _env_bool, _env_float, _env_int, get_shared_provider
 from context_manager import ContextManager
+from conversation import ConversationMemory
+from example_store import DEFAULT_TOKEN_BUDGET, DEFAULT_TOP_K, ExampleStore
+from nlp_parser import is_destructive_command
+from path_validator import get_path_validator
+from prompt_registry import DEFAULT_PROMPT, get_prompt_registry
+from scenario_detector import get_scenario_detector
+from similarity_cache import (
+    DEFAULT_SIMILAR_CACHE_MAX_ENTRIES, DEFAULT_SIMILAR_CACHE_PATH,
+    DEFAULT_SIMILAR_CACHE_THRESHOLD, SimilarityCache
+)
+from template_learner import (
+    DEFAULT_MAX_TEMPLATES, DEFAULT_MIN_CONFIRMATIONS, DEFAULT_TEMPLATE_PATH, TemplateLearner
+)
+from token_utils import estimate_tokens
+import config
 
 
 class AICommandParser:
     """AI 命令解析器（增强版）"""
     
-    # 场景关键词映射（按优先级排序）
+    # 场景关键词映射（按优先级排序，特殊规则见 scenario_detector.SPECIAL_RULES）
     SCENARIO_KEYWORDS = {
         # 优先级高的场景应该有更具体的关键词
         'network_operations': [
@@ -43,23 +62,162 @@ class AICommandParser:
         ]
     }
     
-    def __init__(self, prompt_file: str = "prompts/command_generation.txt", use_context: bool = True):
+    # 批量模式的输出格式说明，追加在提示词之后（内容固定，不影响前缀缓存）
+    BATCH_INSTRUCTIONS = """## 批量模式
+用户会发送一个 JSON 数组，每个元素是一条自然语言描述。
+请返回一个长度相同的 JSON 数组，第 i 个元素是第 i 条描述对应的命令字符串。
+只返回 JSON 数组本身，不要添加解释文字或代码块标记。
+无法转换的描述对应位置返回空字符串。"""
+    
+    # 结构化输出模式的格式说明，追加在提示词之后（内容固定，不影响前缀缓存）
+    STRUCTURED_INSTRUCTIONS = """## 输出格式（JSON）
+以下要求优先于前面"只返回命令"的说明。
+只返回一个 JSON 对象，不要添加解释文字或代码块标记，字段如下：
+- command: 一行可以直接在终端执行的命令（字符串）
+- confidence: 命令符合用户意图的把握，0 到 1 之间的数字
+- is_dangerous: 命令是否可能删除数据、修改系统配置或造成不可恢复的后果（true/false）
+- needs_tty: 命令是否需要交互式终端，如编辑器、top、ssh 或需要输入密码（true/false）
+- explanation: 一句话说明命令的作用（字符串）
+例如：{"command": "df -h", "confidence": 0.95, "is_dangerous": false, "needs_tty": false, "explanation": "以易读格式显示磁盘空间使用情况"}"""
+    
+    # 结构化输出的字段及类型，本地校验用
+    STRUCTURED_SCHEMA = {
+        'command': str,
+        'confidence': (int, float),
+        'is_dangerous': bool,
+        'needs_tty': bool,
+        'explanation': str
+    }
+    
+    # validate_parameters 提取路径参数的正则（简单匹配，可能不完美）
+    PATH_PATTERNS = [
+        re.compile(r'(?:^|\s)([~/][\w/\-\.]+)'),  # 绝对路径或 ~ 路径
+        re.compile(r'(?:^|\s)(\.{1,2}/[\w/\-\.]+)'),  # 相对路径
+        re.compile(r'(?:^|\s)([\w\-]+\.\w+)(?:\s|$)'),  # 文件名
+    ]
+    
+    def __init__(
+        self,
+        prompt_file: str = "prompts/command_generation.txt",
+        use_context: bool = True,
+        stream: Optional[bool] = None,
+        structured: Optional[bool] = None,
+        conversation: Optional[ConversationMemory] = None
+    ):
         """
         初始化 AI 命令解析器
         
         Args:
             prompt_file: 提示词模板文件路径（可以为 None，将自动选择场景）
             use_context: 是否使用系统上下文信息
+            stream: 是否使用流式解析（收到第一行完整命令即结束），
+                默认读取 config.AI_STREAM_PARSING
+            structured: 是否要求模型返回 JSON（命令、置信度、是否危险、是否需要终端、说明），
+                默认读取环境变量 AI_STRUCTURED_OUTPUT
+            conversation: 会话的对话记忆，最近几轮作为对话历史随请求发送（None 表示单轮）
         """
-        self.ai_provider = AIProvider()
+        self.ai_provider = get_shared_provider()
         self.prompt_file = prompt_file
         self.use_context = use_context
+        self.stream = config.AI_STREAM_PARSING if stream is None else stream
+        self.structured = _env_bool("AI_STRUCTURED_OUTPUT") if structured is None else structured
         self.context_manager = ContextManager() if use_context else None
-        self.system_prompt = self._load_prompt() if prompt_file else None
+        # 场景关键词和特殊规则编译为 Aho-Corasick 自动机，一遍扫描完成检测
+        self.scenario_detector = get_scenario_detector(self.SCENARIO_KEYWORDS)
+        # 提示词常驻内存（进程内共享），解析时不读文件，文件修改后自动重新加载
+        self.prompts = get_prompt_registry()
+        if prompt_file:
+            self.prompts.get_file(prompt_file)
+        # 相似输入缓存：换一种说法的相同意图直接返回之前的命令
+        self.similar_cache = self._init_similar_cache()
+        # 参数模板：只有参数不同的输入在本地填充学到的命令模板
+        self.templates = self._init_templates()
+        # 动态示例：场景提示词只发送与输入最相似的几条示例
+        self.examples = self._init_examples()
+        # 路径校验（按目录批量检查并缓存）
+        self.path_validator = get_path_validator()
+        # 多轮对话：由调用方记录每一轮，这里只读取
+        self.conversation = conversation
+    
+    def _init_examples(self) -> Optional[ExampleStore]:
+        """
+        读取动态示例配置
+        
+        环境变量:
+            AI_DYNAMIC_EXAMPLES: 是否把场景提示词中的示例拆出来按输入挑选
+            AI_EXAMPLES_TOP_K: 每次请求最多包含的示例数
+            AI_EXAMPLES_TOKEN_BUDGET: 示例部分的 token 预算（估算值）
+        
+        Returns:
+            示例库；未启用时返回 None
+        """
+        if not _env_bool("AI_DYNAMIC_EXAMPLES"):
+            return None
+        return ExampleStore(
+            top_k=_env_int("AI_EXAMPLES_TOP_K", DEFAULT_TOP_K),
+            token_budget=_env_int("AI_EXAMPLES_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)
+        )
+    
+    def _init_templates(self) -> Optional[TemplateLearner]:
+        """
+        读取参数模板配置
+        
+        环境变量:
+            AI_TEMPLATES: 是否从确认执行的 AI 解析结果中学习参数模板
+            AI_TEMPLATES_PATH: 模板数据库路径
+            AI_TEMPLATES_MAX: 最多保存的模板数（LRU 淘汰）
+            AI_TEMPLATES_MIN_CONFIRMATIONS: 模板被确认多少次后才开始使用
+        
+        Returns:
+            模板学习器；未启用或数据库无法打开时返回 None
+        """
+        if not _env_bool("AI_TEMPLATES"):
+            return None
+        
+        try:
+            return TemplateLearner(
+                path=os.getenv("AI_TEMPLATES_PATH", DEFAULT_TEMPLATE_PATH),
+                max_templates=_env_int("AI_TEMPLATES_MAX", DEFAULT_MAX_TEMPLATES),
+                min_confirmations=_env_int("AI_TEMPLATES_MIN_CONFIRMATIONS", DEFAULT_MIN_CONFIRMATIONS)
+            )
+        except Exception as e:
+            print(f"⚠️  警告: 参数模板初始化失败，已禁用: {e}", file=sys.stderr)
+            return None
+    
+    def _init_similar_cache(self) -> Optional[SimilarityCache]:
+        """
+        读取相似输入缓存配置
+        
+        环境变量:
+            AI_SIMILAR_CACHE: 是否启用相似输入缓存
+            AI_SIMILAR_CACHE_PATH: 缓存数据库路径
+            AI_SIMILAR_CACHE_MAX_ENTRIES: 最多保存的记录数（LRU 淘汰）
+            AI_SIMILAR_CACHE_THRESHOLD: 命中所需的最低相似度（0~1）
+        
+        Returns:
+            缓存实例；未启用或数据库无法打开时返回 None
+        """
+        if not _env_bool("AI_SIMILAR_CACHE"):
+            return None
+        
+        try:
+            return SimilarityCache(
+                path=os.getenv("AI_SIMILAR_CACHE_PATH", DEFAULT_SIMILAR_CACHE_PATH),
+                max_entries=_env_int("AI_SIMILAR_CACHE_MAX_ENTRIES", DEFAULT_SIMILAR_CACHE_MAX_ENTRIES),
+                threshold=_env_float("AI_SIMILAR_CACHE_THRESHOLD", DEFAULT_SIMILAR_CACHE_THRESHOLD)
+            )
+        except Exception as e:
+            print(f"⚠️  警告: 相似输入缓存初始化失败，已禁用: {e}", file=sys.stderr)
+            return None
+    
+    @property
+    def system_prompt(self) -> Optional[str]:
+        """prompt_file 对应的系统提示词（未指定文件时为 None）"""
+        return self._load_prompt() if self.prompt_file else None
     
     def _load_prompt(self, prompt_file: Optional[str] = None) -> str:
         """
-        加载提示词模板
+        获取提示词模板（从内存中的注册表读取）
         
         Args:
             prompt_file: 提示词文件路径（可选）
@@ -70,19 +228,11 @@ class AICommandParser:
         file_to_load = prompt_file or self.prompt_file
         if not file_to_load:
             return self._get_default_prompt()
-        
-        try:
-            with open(file_to_load, 'r', encoding='utf-8') as f:
-                return f.read().strip()
-        except FileNotFoundError:
-            # 如果文件不存在，使用默认提示词
-            return self._get_default_prompt()
+        return self.prompts.get_file(file_to_load).text
     
     def _get_default_prompt(self) -> str:
         """获取默认提示词"""
-        return """你是一个专业的 Linux 命令助手。将用户的自然语言描述转换为准确的 Linux 命令。
-只返回命令本身，不要返回任何解释、说明或额外文字。
-不要使用 markdown 代码块标记。"""
+        return DEFAULT_PROMPT
     
     def _detect_scenario(self, user_input: str) -> str:
         """
@@ -90,48 +240,22 @@ class AICommandParser:
         
         Args:
             user_input: 用户输入的自然语言
-            
+        
         Returns:
             场景类型：file_operations, system_management, network_operations, text_processing
             如果无法判断，返回 'command_generation'（默认场景）
         """
-        user_input_lower = user_input.lower()
-        
-        # 特殊规则：优先级检测
-        # 1. 如果包含 URL，很可能是网络操作
-        if 'http://' in user_input_lower or 'https://' in user_input_lower or 'ftp://' in user_input_lower:
-            return 'network_operations'
-        
-        # 2. 如果包含"用户"且包含"创建/添加/删除"，是系统管理
-        if '用户' in user_input_lower or 'user' in user_input_lower:
-            if any(word in user_input_lower for word in ['创建', '添加', '删除', 'create', 'add', 'delete', 'remove']):
-                return 'system_management'
-        
-        # 3. 如果同时包含"编辑"和"文件"，优先文本处理
-        if ('编辑' in user_input_lower or 'edit' in user_input_lower) and ('文件' in user_input_lower or 'file' in user_input_lower):
-            if any(ext in user_input_lower for ext in ['.txt', '.log', '.conf', '.config', '.ini']):
-                return 'text_processing'
-        
-        # 4. 如果包含"查看内容"或特定的查看命令，是文本处理
-        if any(word in user_input_lower for word in ['查看内容', '显示内容', 'view content', 'show content', 'cat ', 'less ', 'more ']):
-            return 'text_processing'
-        
-        # 统计每个场景的关键词匹配数
-        scenario_scores = {}
-        for scenario, keywords in self.SCENARIO_KEYWORDS.items():
-            score = sum(1 for keyword in keywords if keyword.lower() in user_input_lower)
-            scenario_scores[scenario] = score
-        
-        # 找出得分最高的场景
-        max_score = max(scenario_scores.values())
-        if max_score > 0:
-            # 返回得分最高的场景（按定义顺序，优先级高的会先返回）
-            for scenario, score in scenario_scores.items():
-                if score == max_score:
-                    return scenario
+        return self.scenario_detector.detect(user_input)
+    
+    def get_scenario_scores(self, user_input: str) -> Dict[str, Any]:
+        """
+        场景检测的调试信息
         
-        # 默认场景
-        return 'command_generation'
+        Returns:
+            {'scenario': 场景, 'rule': 命中的特殊规则名（没有时为 None）,
+             'scores': {场景: 命中的关键词数}}
+        """
+        return self.scenario_detector.analyze(user_input)
     
     def _select_prompt_by_scenario(self, scenario: str) -> str:
         """
@@ -139,76 +263,425 @@ class AICommandParser:
         
         Args:
             scenario: 场景类型
-            
+        
         Returns:
             对应场景的提示词内容
         """
-        prompt_files = {
-            'file_operations': 'prompts/file_operations.txt',
-            'system_management': 'prompts/system_management.txt',
-            'network_operations': 'prompts/network_operations.txt',
-            'text_processing': 'prompts/text_processing.txt',
-            'command_generation': 'prompts/command_generation.txt'
-        }
-        
-        prompt_file = prompt_files.get(scenario, 'prompts/command_generation.txt')
-        return self._load_prompt(prompt_file)
+        return self.prompts.get(scenario)
     
-    def parse_command(self, user_input: str, auto_detect_scenario: bool = True) -> str:
+    def parse_command(
+        self,
+        user_input: str,
+        auto_detect_scenario: bool = True,
+        on_token: Optional[Callable[[str], None]] = None,
+        local_lookup: bool = True,
+        cancel: Optional[threading.Event] = None
+    ) -> str:
         """
         将自然语言输入转换为 Linux 命令
         
         Args:
             user_input: 用户的自然语言输入（支持中英文）
             auto_detect_scenario: 是否自动检测场景并选择对应的提示词
-            
+            on_token: 流式模式下每收到一段文本时的回调
+            local_lookup: 是否先查参数模板和相似输入缓存
+                （分层解析器已经查过时传 False，直接调用 AI）
+            cancel: 取消事件（投机解析时用户先确认了规则候选，设置后关闭 AI 请求）
+        
         Returns:
             清洗后的 Linux 命令字符串
-            
+        
+        Raises:
+            ValueError: 如果输入为空或无效
+            RequestCancelled: 如果请求已通过 cancel 取消
+            Exception: 如果 AI 调用失败
+        """
+        if self.structured:
+            command = self.parse_structured(user_input, auto_detect_scenario, local_lookup, cancel)['command']
+            if on_token:
+                on_token(command)
+            return command
+        
+        request = self._build_request(user_input, auto_detect_scenario, on_token)
+        cached = self._lookup_local(request) if local_lookup else None
+        if cached is not None:
+            return cached
+        
+        # 调用 AI 生成命令
+        try:
+            raw_response = self.ai_provider.generate_response(**request, cancel=cancel)
+            command = self._finish_command(raw_response)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            raise Exception(f"命令解析失败: {str(e)}")
+        self._put_similar(request, command)
+        return command
+    
+    async def aparse_command(
+        self,
+        user_input: str,
+        auto_detect_scenario: bool = True,
+        on_token: Optional[Callable[[str], None]] = None,
+        local_lookup: bool = True
+    ) -> str:
+        """
+        将自然语言输入转换为 Linux 命令（异步版本，参数与 parse_command 相同，
+        总是按文本解析，不使用结构化输出）
+        
+        Returns:
+            清洗后的 Linux 命令字符串
+        """
+        request = self._build_request(user_input, auto_detect_scenario, on_token)
+        cached = self._lookup_local(request) if local_lookup else None
+        if cached is not None:
+            return cached
+        
+        try:
+            raw_response = await self.ai_provider.agenerate_response(**request)
+            command = self._finish_command(raw_response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise Exception(f"命令解析失败: {str(e)}")
+        self._put_similar(request, command)
+        return command
+    
+    def parse_structured(
+        self,
+        user_input: str,
+        auto_detect_scenario: bool = True,
+        local_lookup: bool = True,
+        cancel: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        """
+        将自然语言输入转换为命令及模型对命令的判断（结构化输出）
+        
+        模型按 STRUCTURED_INSTRUCTIONS 返回 JSON，本地按 STRUCTURED_SCHEMA 校验；
+        JSON 无效时退回到清洗文本的方式只取命令。参数与 parse_command 相同。
+        
+        Returns:
+            {
+                'command': 命令,
+                'confidence': 置信度（0~1，未知时为 None）,
+                'is_dangerous': 是否危险（未知时为 None）,
+                'needs_tty': 是否需要交互式终端（未知时为 None）,
+                'explanation': 说明（没有时为空字符串）,
+                'structured': 是否来自有效的 JSON
+            }
+            本地模板或相似输入缓存命中时只有命令，其他字段为未知
+        
         Raises:
             ValueError: 如果输入为空或无效
+            RequestCancelled: 如果请求已通过 cancel 取消
             Exception: 如果 AI 调用失败
         """
+        request = self._build_request(user_input, auto_detect_scenario)
+        request['system_prompt'] = f"{request['system_prompt']}\n\n{self.STRUCTURED_INSTRUCTIONS}"
+        # 需要完整的 JSON 对象，不能收到第一行就结束
+        request['stop_when'] = None
+        request['max_tokens'] = 300
+        cached = self._lookup_local(request) if local_lookup else None
+        if cached is not None:
+            return self._unstructured(cached)
+        
+        try:
+            raw_response = self.ai_provider.generate_response(**request, cancel=cancel)
+            result = self._parse_structured_response(raw_response)
+            if result is None:
+                result = self._unstructured(self._finish_unstructured(raw_response))
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            raise Exception(f"命令解析失败: {str(e)}")
+        self._put_similar(request, result['command'])
+        return result
+    
+    def _parse_structured_response(self, raw_response: str) -> Optional[Dict[str, Any]]:
+        """
+        解析并校验结构化输出
+        
+        command 必须是非空的单行字符串；其他字段类型不符时视为未知，
+        confidence 限制在 0~1。
+        
+        Returns:
+            结果字典；不是有效的 JSON 对象或缺少命令时返回 None
+        """
+        start = raw_response.find('{')
+        end = raw_response.rfind('}')
+        if start < 0 or end < start:
+            return None
+        try:
+            data = json.loads(raw_response[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        
+        fields = {}
+        for name, expected in self.STRUCTURED_SCHEMA.items():
+            value = data.get(name)
+            # bool 是 int 的子类，不能当作置信度
+            valid = isinstance(value, expected) and not (name == 'confidence' and isinstance(value, bool))
+            fields[name] = value if valid else None
+        
+        command = (fields['command'] or "").strip()
+        if not command or '\n' in command or command.startswith('```'):
+            return None
+        
+        confidence = fields['confidence']
+        return {
+            'command': command,
+            'confidence': None if confidence is None else min(1.0, max(0.0, float(confidence))),
+            'is_dangerous': fields['is_dangerous'],
+            'needs_tty': fields['needs_tty'],
+            'explanation': (fields['explanation'] or "").strip(),
+            'structured': True
+        }
+    
+    def _finish_unstructured(self, raw_response: str) -> str:
+        """JSON 无效时按普通文本清洗（模型忽略了格式要求），残缺的 JSON 不当作命令"""
+        command = self._finish_command(raw_response)
+        if command.startswith(('{', '[')):
+            raise ValueError("AI 返回的 JSON 无效")
+        return command
+    
+    @staticmethod
+    def _unstructured(command: str) -> Dict[str, Any]:
+        """只有命令、没有模型判断的结果"""
+        return {
+            'command': command,
+            'confidence': None,
+            'is_dangerous': None,
+            'needs_tty': None,
+            'explanation': "",
+            'structured': False
+        }
+    
+    def _lookup_local(self, request: Dict[str, Any]) -> Optional[str]:
+        """
+        不访问网络得到命令：先匹配参数模板，再查相似输入缓存（只用于自动检测场景的请求）
+        
+        相似输入缓存中的破坏性命令只在归一化输入完全相同时使用。
+        
+        指代之前对话的输入不查（命令取决于上下文）。
+        
+        Returns:
+            命令；都没有命中时返回 None
+        """
+        user_input = request['user_message']
+        if self.is_follow_up(user_input):
+            return None
+        command = None
+        if self.templates:
+            command = self.templates.match(user_input, self.extract_parameters(user_input))
+        if command is None and self.similar_cache and request['scenario']:
+            match = self.similar_cache.lookup(user_input, request['scenario'])
+            # 破坏性命令只在归一化输入完全相同时直接使用，相近的输入交给 AI
+            if match and (match['similarity'] >= 1.0 or not is_destructive_command(match['command'])):
+                command = match['command']
+        if command is not None and request['on_token']:
+            request['on_token'](command)
+        return command
+    
+    def learn_template(self, user_input: str, command: str) -> bool:
+        """
+        记录用户确认执行的 AI 解析结果，学习参数模板（指代之前对话的输入不学习）
+        
+        Args:
+            user_input: 用户输入
+            command: 用户确认执行的命令
+        
+        Returns:
+            是否学到（或再次确认）了模板
+        """
+        if not self.templates or self.is_follow_up(user_input):
+            return False
+        user_input = user_input.strip()
+        params = self.extract_parameters(user_input)
+        return self.templates.learn(user_input, params, command) is not None
+    
+    def _put_similar(self, request: Dict[str, Any], command: str):
+        """把成功的解析结果写入相似输入缓存（指代之前对话的输入除外）"""
+        if self.similar_cache and request['scenario'] and not self.is_follow_up(request['user_message']):
+            self.similar_cache.put(request['user_message'], request['scenario'], command)
+    
+    def is_follow_up(self, user_input: str) -> bool:
+        """输入是否指代对话记忆中之前的对话（如"删除它"），未启用对话记忆时为 False"""
+        return bool(self.conversation and self.conversation.is_follow_up(user_input))
+    
+    def parse_many(self, inputs: List[str], batch_size: Optional[int] = None) -> List[Optional[str]]:
+        """
+        批量将自然语言描述转换为 Linux 命令（例如整份操作手册）
+        
+        多条输入合并为一次 AI 请求，要求模型返回 JSON 数组；每个元素
+        单独清洗验证，只有失败的条目会在下一轮重新请求。
+        
+        Args:
+            inputs: 自然语言描述列表
+            batch_size: 每个请求最多包含的条数，默认读取 config.AI_BATCH_SIZE
+        
+        Returns:
+            与 inputs 一一对应的命令列表，空输入或重试后仍无法解析的条目为 None
+        """
+        results: List[Optional[str]] = [None] * len(inputs)
+        pending = [i for i, text in enumerate(inputs) if text and text.strip()]
+        
+        for _ in range(1 + config.AI_BATCH_RETRIES):
+            if not pending:
+                break
+            
+            failed = []
+            for batch in self._split_batches(inputs, pending, batch_size):
+                commands = self._parse_batch([inputs[i].strip() for i in batch])
+                for index, command in zip(batch, commands):
+                    if command:
+                        results[index] = command
+                    else:
+                        failed.append(index)
+            pending = failed
+        
+        return results
+    
+    def _split_batches(
+        self,
+        inputs: List[str],
+        indices: List[int],
+        batch_size: Optional[int] = None
+    ) -> Iterator[List[int]]:
+        """按条数上限和输入 token 预算把待解析条目分组"""
+        max_items = max(1, batch_size or config.AI_BATCH_SIZE)
+        budget = config.AI_BATCH_MAX_INPUT_TOKENS
+        
+        batch: List[int] = []
+        used = 0
+        for index in indices:
+            cost = estimate_tokens(json.dumps(inputs[index].strip(), ensure_ascii=False)) + 1
+            if batch and (len(batch) >= max_items or used + cost > budget):
+                yield batch
+                batch, used = [], 0
+            batch.append(index)
+            used += cost
+        
+        if batch:
+            yield batch
+    
+    def _parse_batch(self, texts: List[str]) -> List[Optional[str]]:
+        """发送一个批量请求，返回与 texts 等长的结果（失败的条目为 None）"""
+        system_prompt = f"{self.system_prompt or self._get_default_prompt()}\n\n{self.BATCH_INSTRUCTIONS}"
+        
+        context = None
+        if self.use_context and self.context_manager:
+            context = f"系统上下文: {self.context_manager.get_context_for_ai()}"
+        
+        try:
+            raw_response = self.ai_provider.generate_response(
+                system_prompt=system_prompt,
+                user_message=json.dumps(texts, ensure_ascii=False),
+                context=context,
+                temperature=0.3,
+                max_tokens=config.AI_BATCH_TOKENS_PER_ITEM * len(texts) + 16,
+                caller='parser',
+                scenario='batch'
+            )
+        except Exception as e:
+            print(f"⚠️  批量解析失败: {e}", file=sys.stderr)
+            return [None] * len(texts)
+        
+        return self._parse_batch_response(raw_response, len(texts))
+    
+    def _parse_batch_response(self, raw_response: str, count: int) -> List[Optional[str]]:
+        """
+        解析批量请求返回的 JSON 数组
+        
+        数组长度与请求条数不一致时无法确定对应关系，整批视为失败。
+        """
+        failed: List[Optional[str]] = [None] * count
+        start = raw_response.find('[')
+        end = raw_response.rfind(']')
+        if start < 0 or end < start:
+            return failed
+        
+        try:
+            items = json.loads(raw_response[start:end + 1])
+        except ValueError:
+            return failed
+        
+        if not isinstance(items, list) or len(items) != count:
+            return failed
+        
+        commands: List[Optional[str]] = []
+        for item in items:
+            command = self._clean_command(item) if isinstance(item, str) else ""
+            commands.append(command if command and not command.startswith('```') else None)
+        return commands
+    
+    def _build_request(
+        self,
+        user_input: str,
+        auto_detect_scenario: bool = True,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        构建 generate_response / agenerate_response 的调用参数
+        
+        Raises:
+            ValueError: 如果输入为空或无效
+        """
         # 验证输入
         if not user_input or not user_input.strip():
             raise ValueError("输入不能为空")
         
         # 自动检测场景并选择提示词
         system_prompt = self.system_prompt
+        scenario = None
+        examples = None
         if auto_detect_scenario:
             scenario = self._detect_scenario(user_input)
             system_prompt = self._select_prompt_by_scenario(scenario)
+            if self.examples and system_prompt:
+                # 提示词去掉示例后保持不变，只有挑选出的示例随请求变化
+                prompt = self.examples.build(self.prompts.file_for(scenario), system_prompt, user_input)
+                system_prompt = prompt['system_prompt']
+                examples = prompt['examples_text'] or None
         
         # 如果没有系统提示词，使用默认的
         if not system_prompt:
             system_prompt = self._get_default_prompt()
         
-        # 添加系统上下文信息
+        # 系统上下文（当前目录等）和动态示例经常变化，单独放在用户消息之前，
+        # 场景提示词保持字节一致，以命中提供商的提示词前缀缓存
+        context_parts = [examples] if examples else []
         if self.use_context and self.context_manager:
             context_info = self.context_manager.get_context_for_ai()
-            system_prompt = f"{system_prompt}\n\n系统上下文: {context_info}"
+            context_parts.append(f"系统上下文: {context_info}")
+        context = "\n\n".join(context_parts) or None
         
-        # 调用 AI 生成命令
-        try:
-            raw_response = self.ai_provider.generate_response(
-                system_prompt=system_prompt,
-                user_message=user_input.strip(),
-                history=None,  # 单轮对话，不传递历史
-                temperature=0.3,  # 使用较低温度以获得更确定的输出
-                max_tokens=200  # 命令通常很短
-            )
-            
-            # 清洗命令
-            cleaned_command = self._clean_command(raw_response)
-            
-            # 验证清洗后的命令
-            if not cleaned_command:
-                raise ValueError("AI 返回了空命令")
-            
-            return cleaned_command
-            
-        except Exception as e:
-            raise Exception(f"命令解析失败: {str(e)}")
+        return {
+            'system_prompt': system_prompt,
+            'user_message': user_input.strip(),
+            # 对话历史位于场景提示词之后、动态上下文之前（渲染结果已缓存）；
+            # 只有后续输入才带，独立的输入请求不变，仍能命中响应缓存和合并相同请求
+            'history': self.conversation.history() if self.is_follow_up(user_input) else None,
+            'context': context,
+            'temperature': 0.3,  # 使用较低温度以获得更确定的输出
+            'max_tokens': 200,  # 命令通常很短
+            'stream': self.stream,
+            'on_token': on_token,
+            # 只需要第一行命令，收到完整的一行后立即关闭流
+            'stop_when': self._has_complete_command if self.stream else None,
+            'caller': 'parser',
+            'scenario': scenario
+        }
+    
+    def _finish_command(self, raw_response: str) -> str:
+        """清洗并验证 AI 返回的命令"""
+        cleaned_command = self._clean_command(raw_response)
+        
+        if not cleaned_command:
+            raise ValueError("AI 返回了空命令")
+        
+        return cleaned_command
     
     def _clean_command(self, raw_output: str) -> str:
         """
@@ -217,7 +690,7 @@ class AICommandParser:
         
         Args:
             raw_output: AI 返回的原始输出
-            
+        
         Returns:
             清洗后的命令字符串
         """
@@ -232,6 +705,9 @@ class AICommandParser:
         match = re.search(code_block_pattern, command, re.DOTALL | re.MULTILINE)
         if match:
             command = match.group(1).strip()
+        else:
+            # 流式提前结束时，代码块可能尚未闭合
+            command = re.sub(r'^```(?:bash|sh|shell)?[ \t]*\n', '', command)
         
         # 去除单独的反引号（如 `command`）
         if command.startswith('`') and command.endswith('`'):
@@ -263,13 +739,33 @@ class AICommandParser:
         
         return command
     
+    def _has_complete_command(self, partial_output: str) -> bool:
+        """
+        判断流式输出中是否已经包含一行完整的命令
+        
+        只考虑换行符之前的内容，清洗后得到非空命令即视为完整，
+        代码块开头、"命令是："之类的前缀行不算。
+        
+        Args:
+            partial_output: 目前为止收到的文本
+        
+        Returns:
+            是否可以提前结束流
+        """
+        newline = partial_output.rfind('\n')
+        if newline < 0:
+            return False
+        
+        command = self._clean_command(partial_output[:newline])
+        return bool(command) and not command.startswith('```')
+    
     def extract_parameters(self, user_input: str) -> Dict[str, List[str]]:
         """
         从用户输入中提取关键参数
         
         Args:
             user_input: 用户的自然语言输入
-            
+        
         Returns:
             包含提取参数的字典，键为参数类型，值为参数列表
         """
@@ -308,47 +804,28 @@ class AICommandParser:
         
         Args:
             command: 生成的命令字符串
-            
+        
         Returns:
             (是否全部有效, 警告信息列表)
         """
-        warnings = []
-        all_valid = True
-        
-        # 提取命令中的路径参数
-        # 简单的正则匹配，可能不完美
-        path_patterns = [
-            r'(?:^|\s)([~/][\w/\-\.]+)',  # 绝对路径或 ~ 路径
-            r'(?:^|\s)(\.{1,2}/[\w/\-\.]+)',  # 相对路径
-            r'(?:^|\s)([\w\-]+\.\w+)(?:\s|$)',  # 文件名
-        ]
+        # 创建操作的路径本来就不存在，不需要检查
+        if self._is_creation_command(command):
+            return True, []
         
+        # 提取命令中的路径参数（去重并保持顺序）
         paths_to_check = []
-        for pattern in path_patterns:
-            matches = re.findall(pattern, command)
-            paths_to_check.extend(matches)
-        
-        # 检查路径是否存在
-        for path in paths_to_check:
-            # 跳过一些特殊情况
-            if path in ['.', '..', '/', '~']:
-                continue
-            
-            # 扩展 ~ 为用户主目录
-            expanded_path = os.path.expanduser(path)
-            
-            # 如果是相对路径，基于当前目录检查
-            if not os.path.isabs(expanded_path):
-                expanded_path = os.path.join(os.getcwd(), expanded_path)
-            
-            # 检查读取操作的文件/目录是否存在
-            # 对于创建操作，不需要检查
-            if not self._is_creation_command(command):
-                if not os.path.exists(expanded_path):
-                    warnings.append(f"路径不存在: {path}")
-                    all_valid = False
-        
-        return all_valid, warnings
+        for pattern in self.PATH_PATTERNS:
+            for path in pattern.findall(command):
+                # 跳过一些特殊情况
+                if path not in ('.', '..', '/', '~') and path not in paths_to_check:
+                    paths_to_check.append(path)
+        if not paths_to_check:
+            return True, []
+        
+        # 按目录批量检查（~ 扩展为用户主目录，相对路径基于当前目录）
+        existing = self.path_validator.check_many(paths_to_check)
+        warnings = [f"路径不存在: {path}" for path in paths_to_check if not existing[path]]
+        return not warnings, warnings
     
     def _is_creation_command(self, command: str) -> bool:
         """判断是否是创建操作的命令"""
@@ -362,7 +839,7 @@ class AICommandParser:
         
         Args:
             partial_path: 部分路径或相对路径
-            
+        
         Returns:
             补全后的绝对路径
         """
@@ -378,28 +855,25 @@ class AICommandParser:
         
         return normalized
     
-    def get_scenario_info(self, user_input: str) -> Dict[str, str]:
+    def get_scenario_info(self, user_input: str) -> Dict[str, Any]:
         """
         获取场景检测信息
         
         Args:
             user_input: 用户输入
-            
-        Returns:
-            包含场景类型和提示词文件的字典
-        """
-        scenario = self._detect_scenario(user_input)
-        prompt_files = {
-            'file_operations': 'prompts/file_operations.txt',
-            'system_management': 'prompts/system_management.txt',
-            'network_operations': 'prompts/network_operations.txt',
-            'text_processing': 'prompts/text_processing.txt',
-            'command_generation': 'prompts/command_generation.txt'
-        }
         
+        Returns:
+            包含场景类型、命中的特殊规则、各场景得分、提示词文件及其字符数和 token 估算的字典
+        """
+        detection = self.get_scenario_scores(user_input)
+        template = self.prompts.get_template(detection['scenario'])
         return {
-            'scenario': scenario,
-            'prompt_file': prompt_files.get(scenario, 'prompts/command_generation.txt')
+            'scenario': detection['scenario'],
+            'rule': detection['rule'],
+            'scores': detection['scores'],
+            'prompt_file': template.display_path,
+            'prompt_chars': template.chars,
+            'prompt_tokens': template.tokens
         }
 
 
@@ -476,7 +950,7 @@ if __name__ == "__main__":
         print("=" * 60)
         print("基础功能测试完成！")
         print("=" * 60)
-        
+    
     except Exception as e:
         print(f"错误: {e}")
         import traceback
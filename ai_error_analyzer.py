@@ -2,9 +2,10 @@
 AI 错误分析器模块
 使用 AI 分析命令执行错误并提供解决方案
 """
+import asyncio
 import os
-from typing import Dict, Optional
-from ai_provider import AIProvider
+from typing import Any, Dict, Optional
+from ai_provider import get_shared_provider
 
 
 class AIErrorAnalyzer:
@@ -18,7 +19,7 @@ class AIErrorAnalyzer:
     def _init_ai_provider(self):
         """初始化 AI 提供商，如果失败则不使用 AI"""
         try:
-            self.ai_provider = AIProvider()
+            self.ai_provider = get_shared_provider()
         except Exception as e:
             print(f"⚠️  AI 提供商初始化失败: {e}")
             print("   错误分析将使用基础模式")
@@ -45,8 +46,42 @@ class AIErrorAnalyzer:
             return self._basic_error_analysis(command, error_output, return_code)
         
         try:
-            # 构建分析提示词
-            system_prompt = """你是一个 Linux 系统专家。你的任务是分析命令执行错误并提供解决方案。
+            # 调用 AI 分析
+            response = self.ai_provider.generate_response(
+                **self._build_request(command, error_output, return_code)
+            )
+            
+            # 解析响应
+            return self._parse_ai_response(response)
+            
+        except Exception as e:
+            print(f"⚠️  AI 错误分析失败: {e}")
+            return self._basic_error_analysis(command, error_output, return_code)
+    
+    async def aanalyze_error(self, command: str, error_output: str, return_code: int) -> Dict[str, str]:
+        """
+        分析命令执行错误（异步版本，参数和返回值与 analyze_error 相同）
+        
+        可以在后台与其他 AI 请求并发执行。
+        """
+        if not self.ai_provider:
+            return self._basic_error_analysis(command, error_output, return_code)
+        
+        try:
+            response = await self.ai_provider.agenerate_response(
+                **self._build_request(command, error_output, return_code)
+            )
+            return self._parse_ai_response(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  AI 错误分析失败: {e}")
+            return self._basic_error_analysis(command, error_output, return_code)
+    
+    def _build_request(self, command: str, error_output: str, return_code: int) -> Dict[str, Any]:
+        """构建错误分析请求参数"""
+        # 构建分析提示词
+        system_prompt = """你是一个 Linux 系统专家。你的任务是分析命令执行错误并提供解决方案。
 
 分析错误时请：
 1. 简明扼要地说明错误原因（1-2句话）
@@ -58,26 +93,19 @@ class AIErrorAnalyzer:
 解决方案：[具体步骤]
 替代命令：[如果有替代命令就提供，没有就写"无"]"""
 
-            user_message = f"""命令：{command}
+        user_message = f"""命令：{command}
 错误输出：{error_output}
 返回码：{return_code}
 
 请分析这个错误并提供解决方案。"""
 
-            # 调用 AI 分析
-            response = self.ai_provider.generate_response(
-                system_prompt=system_prompt,
-                user_message=user_message,
-                temperature=0.3,
-                max_tokens=500
-            )
-            
-            # 解析响应
-            return self._parse_ai_response(response)
-            
-        except Exception as e:
-            print(f"⚠️  AI 错误分析失败: {e}")
-            return self._basic_error_analysis(command, error_output, return_code)
+        return {
+            'system_prompt': system_prompt,
+            'user_message': user_message,
+            'temperature': 0.3,
+            'max_tokens': 500,
+            'caller': 'analyzer'
+        }
     
     def _parse_ai_response(self, response: str) -> Dict[str, str]:
         """解析 AI 响应"""
@@ -164,7 +192,7 @@ class AICommandSuggester:
     def _init_ai_provider(self):
         """初始化 AI 提供商"""
         try:
-            self.ai_provider = AIProvider()
+            self.ai_provider = get_shared_provider()
         except Exception as e:
             print(f"⚠️  AI 提供商初始化失败: {e}")
             self.ai_provider = None
@@ -185,7 +213,42 @@ class AICommandSuggester:
             return None
         
         try:
-            system_prompt = """你是一个 Linux 助手。根据用户刚执行的命令和结果，建议一个合理的下一步操作。
+            response = self.ai_provider.generate_response(
+                **self._build_request(command, output, success)
+            )
+            return self._parse_suggestion(response)
+            
+        except Exception as e:
+            # 建议功能不应中断主流程
+            # 可以考虑添加日志记录
+            pass
+        
+        return None
+    
+    async def asuggest_next_command(self, command: str, output: str, success: bool) -> Optional[str]:
+        """
+        根据命令执行结果建议下一步操作（异步版本，可用于后台预取建议）
+        
+        Returns:
+            建议的下一个命令（自然语言描述），如果没有建议则返回 None
+        """
+        if not self.ai_provider:
+            return None
+        
+        try:
+            response = await self.ai_provider.agenerate_response(
+                **self._build_request(command, output, success)
+            )
+            return self._parse_suggestion(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 建议功能不应中断主流程
+            return None
+    
+    def _build_request(self, command: str, output: str, success: bool) -> Dict[str, Any]:
+        """构建下一步建议请求参数"""
+        system_prompt = """你是一个 Linux 助手。根据用户刚执行的命令和结果，建议一个合理的下一步操作。
 
 规则：
 1. 只在有明确后续操作时才建议，不要强行建议
@@ -199,29 +262,26 @@ class AICommandSuggester:
 - 如果用户查看了磁盘空间发现空间不足，可能想清理
 - 如果命令失败，建议修复或查看更多信息"""
 
-            status = "成功" if success else "失败"
-            user_message = f"""命令：{command}
+        status = "成功" if success else "失败"
+        user_message = f"""命令：{command}
 状态：{status}
 输出：{output[:500]}
 
 请建议下一步操作（用自然语言描述，或返回"无"）。"""
 
-            response = self.ai_provider.generate_response(
-                system_prompt=system_prompt,
-                user_message=user_message,
-                temperature=0.5,
-                max_tokens=200
-            )
-            
-            response = response.strip()
-            if response and response != '无' and response.lower() != 'none':
-                return response
-            
-        except Exception as e:
-            # 建议功能不应中断主流程
-            # 可以考虑添加日志记录
-            pass
-        
+        return {
+            'system_prompt': system_prompt,
+            'user_message': user_message,
+            'temperature': 0.5,
+            'max_tokens': 200,
+            'caller': 'suggester'
+        }
+    
+    def _parse_suggestion(self, response: str) -> Optional[str]:
+        """解析建议响应，"无" 表示没有建议"""
+        response = response.strip()
+        if response and response != '无' and response.lower() != 'none':
+            return response
         return None
 
 
@@ -1,25 +1,89 @@
 """
 AI 提供商抽象层
-支持 OpenAI 和 DeepSeek API
+支持 OpenAI 和 DeepSeek API，以及用于离线测试的本地服务器（local_ai_server.py）
+
+同一进程内的所有 AI 调用方（命令解析、错误分析、命令建议）共享
+同一个 AIProvider 实例和底层 HTTP 连接池，避免重复加载 .env、
+重复建立 TCP/TLS 连接。
 """
+import asyncio
 import os
+import random
 import sys
+import threading
+import time
+import weakref
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Optional
-from openai import OpenAI
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Tuple
+from openai import (
+    APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI, RateLimitError
+)
 from dotenv import load_dotenv
 import httpx
 
-class AIProvider:
-    """AI 提供商基类"""
-    
-    def __init__(self):
-        self._load_env_with_validation()
-        self.provider = os.getenv("AI_PROVIDER", "deepseek").lower()
-        self.client = self._init_client()
+from rate_limiter import RateLimiter, RateLimitTimeout, retry_after_seconds
+from single_flight import CoalescedWaitTimeout, SingleFlight
+from telemetry import Telemetry, latency_summary
+from token_utils import estimate_message_tokens, estimate_tokens
+from response_cache import (
+    DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_PATH, DEFAULT_CACHE_TTL, ResponseCache
+)
+
+
+# HTTP 连接池默认配置（可通过环境变量覆盖）
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 5
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# 对冲请求默认延迟（毫秒）：主后端在此时间内没有返回第一个 token，
+# 就向备用后端发送同样的请求
+DEFAULT_HEDGE_DELAY_MS = 1500
+
+# 单次 AI 调用的默认截止时间（秒，包含重试），以及重试和熔断配置
+DEFAULT_TIMEOUT = 15.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_BREAKER_THRESHOLD = 3
+DEFAULT_BREAKER_COOLDOWN = 30.0
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+
+def _env_int(name: str, default: int) -> int:
+    """读取整数类型的环境变量，格式错误时使用默认值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    """读取浮点类型的环境变量，格式错误时使用默认值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    """读取布尔类型的环境变量"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def load_environment():
+    """加载并验证 .env 文件（每个进程只执行一次）"""
+    global _env_loaded
     
-    def _load_env_with_validation(self):
-        """加载并验证 .env 文件"""
+    with _env_lock:
+        if _env_loaded:
+            return
+        _env_loaded = True
+        
         env_path = Path(".env")
         
         # 尝试加载 .env 文件
@@ -39,6 +103,443 @@ class AIProvider:
             
             # 仍然尝试从环境变量加载（可能在系统环境变量中设置）
             load_dotenv()
+
+
+class ClientRegistry:
+    """
+    进程级 OpenAI 客户端注册表
+    
+    每个 (provider, base_url, api_key) 只创建一个客户端，所有调用方共享
+    同一个 httpx 连接池（keep-alive），解析请求之后紧跟的错误分析请求
+    可以直接复用已建立的连接。OpenAI/httpx 客户端本身是线程安全的。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str, str], OpenAI] = {}
+        self._limiters: Dict[Tuple[str, str, str], Optional[RateLimiter]] = {}
+        # httpx.AsyncClient 的连接绑定在事件循环上，因此按事件循环分别缓存
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+    
+    def get_client(self, provider: str, api_key: str, base_url: str) -> OpenAI:
+        """获取（必要时创建）共享客户端"""
+        key = (provider, base_url, api_key)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # 重试由 AIProvider 按截止时间统一处理，关闭 SDK 内置重试
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=self._build_http_client(limiter=self._limiter_for(key))
+                )
+                self._clients[key] = client
+            return client
+    
+    def get_async_client(self, provider: str, api_key: str, base_url: str) -> AsyncOpenAI:
+        """获取（必要时创建）当前事件循环的共享异步客户端"""
+        loop = asyncio.get_running_loop()
+        key = (provider, base_url, api_key)
+        
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,
+                    http_client=self._build_http_client(
+                        async_client=True, limiter=self._limiter_for(key)
+                    )
+                )
+                clients[key] = client
+            return client
+    
+    def get_rate_limiter(self, provider: str, api_key: str, base_url: str) -> Optional[RateLimiter]:
+        """获取（必要时创建）共享的限流器，未启用限流时返回 None"""
+        with self._lock:
+            return self._limiter_for((provider, base_url, api_key))
+    
+    def _limiter_for(self, key: Tuple[str, str, str]) -> Optional[RateLimiter]:
+        """
+        按连接参数获取限流器（调用方需持有 self._lock）
+        
+        环境变量:
+            AI_RATE_LIMIT: 是否启用客户端限流（默认启用）
+            AI_RATE_LIMIT_RPM: 每分钟最多请求数（不设置时根据响应头自动调整）
+            AI_RATE_LIMIT_TPM: 每分钟最多 token 数（同上）
+        """
+        if key not in self._limiters:
+            limiter = None
+            if _env_bool("AI_RATE_LIMIT", True):
+                limiter = RateLimiter(
+                    requests_per_minute=_env_float("AI_RATE_LIMIT_RPM", 0) or None,
+                    tokens_per_minute=_env_float("AI_RATE_LIMIT_TPM", 0) or None
+                )
+            self._limiters[key] = limiter
+        return self._limiters[key]
+    
+    def _build_http_client(self, async_client: bool = False, limiter: Optional[RateLimiter] = None):
+        """
+        创建带连接池配置的 httpx 客户端
+        
+        每个响应（包括 429）的状态码和限流响应头都会交给 limiter，
+        同一连接参数的同步、异步客户端共享同一个限流器。
+        
+        环境变量:
+            AI_HTTP_MAX_CONNECTIONS: 最大连接数
+            AI_HTTP_MAX_KEEPALIVE: 最大空闲 keep-alive 连接数
+            AI_HTTP_KEEPALIVE_EXPIRY: 空闲连接保持时间（秒）
+            AI_HTTP2: 是否启用 HTTP/2（需要安装 httpx[http2]）
+        """
+        limits = httpx.Limits(
+            max_connections=_env_int("AI_HTTP_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS),
+            max_keepalive_connections=_env_int("AI_HTTP_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE_CONNECTIONS),
+            keepalive_expiry=_env_float("AI_HTTP_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY)
+        )
+        
+        http2 = _env_bool("AI_HTTP2")
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("⚠️  警告: HTTP/2 需要安装额外依赖", file=sys.stderr)
+                print("   请运行: pip install httpx[http2]", file=sys.stderr)
+                print("   将继续使用 HTTP/1.1", file=sys.stderr)
+                http2 = False
+        
+        event_hooks = {}
+        if limiter:
+            if async_client:
+                async def observe(response):
+                    limiter.observe(response.status_code, response.headers)
+            else:
+                def observe(response):
+                    limiter.observe(response.status_code, response.headers)
+            event_hooks['response'] = [observe]
+        
+        # 与 OpenAI SDK 默认值保持一致：总超时 600 秒，连接超时 5 秒
+        client_class = httpx.AsyncClient if async_client else httpx.Client
+        return client_class(
+            limits=limits,
+            http2=http2,
+            timeout=httpx.Timeout(600.0, connect=5.0),
+            follow_redirects=True,
+            event_hooks=event_hooks
+        )
+    
+    def close_all(self):
+        """关闭所有共享客户端及其连接池"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._limiters.clear()
+            # 异步客户端需要在各自的事件循环中关闭，这里只释放引用
+            self._async_clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+_client_registry = ClientRegistry()
+_shared_providers: Dict[str, "AIProvider"] = {}
+_shared_lock = threading.Lock()
+
+
+def get_client_registry() -> ClientRegistry:
+    """获取进程级客户端注册表"""
+    return _client_registry
+
+
+def get_shared_provider() -> "AIProvider":
+    """
+    获取进程内共享的 AIProvider 实例
+    
+    按 AI_PROVIDER 缓存，命令解析器、错误分析器和命令建议器
+    共用同一个实例和连接池。初始化失败时抛出异常且不缓存。
+    """
+    load_environment()
+    provider_name = os.getenv("AI_PROVIDER", "deepseek").lower()
+    
+    with _shared_lock:
+        provider = _shared_providers.get(provider_name)
+        if provider is None:
+            provider = AIProvider()
+            _shared_providers[provider_name] = provider
+        return provider
+
+
+class HedgeStats:
+    """
+    对冲请求统计
+    
+    按后端记录请求数、胜出次数、错误数和首 token 延迟，
+    用于调整 AI_HEDGE_DELAY_MS。
+    """
+    
+    def __init__(self, max_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self.hedges_fired = 0
+        self._backends: Dict[str, Dict[str, Any]] = {}
+    
+    def _entry(self, backend: str) -> Dict[str, Any]:
+        entry = self._backends.get(backend)
+        if entry is None:
+            entry = {
+                'requests': 0,
+                'wins': 0,
+                'errors': 0,
+                'first_token_ms': deque(maxlen=self._max_samples)
+            }
+            self._backends[backend] = entry
+        return entry
+    
+    def record_attempt(self, backend: str):
+        """记录一次发往该后端的请求"""
+        with self._lock:
+            self._entry(backend)['requests'] += 1
+    
+    def record_hedge(self):
+        """记录一次触发的对冲（向备用后端发出请求）"""
+        with self._lock:
+            self.hedges_fired += 1
+    
+    def record_first_token(self, backend: str, latency_ms: float):
+        """记录该后端从发出请求到收到第一个 token 的时间"""
+        with self._lock:
+            self._entry(backend)['first_token_ms'].append(latency_ms)
+    
+    def record_win(self, backend: str):
+        """记录该后端赢得一次竞速"""
+        with self._lock:
+            self._entry(backend)['wins'] += 1
+    
+    def record_error(self, backend: str):
+        """记录该后端的一次失败"""
+        with self._lock:
+            self._entry(backend)['errors'] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            {'hedges_fired': n, 'backends': {后端: {requests, wins, errors,
+             win_rate, first_token_ms: {avg, p50, p95, p99}}}}
+        """
+        with self._lock:
+            backends = {}
+            for name, entry in self._backends.items():
+                samples = list(entry['first_token_ms'])
+                requests = entry['requests']
+                backends[name] = {
+                    'requests': requests,
+                    'wins': entry['wins'],
+                    'errors': entry['errors'],
+                    'win_rate': entry['wins'] / requests if requests else 0.0,
+                    'first_token_ms': latency_summary(samples)
+                }
+            return {'hedges_fired': self.hedges_fired, 'backends': backends}
+
+
+class _HedgeRace:
+    """一次对冲请求的共享状态：第一个收到 token 的后端胜出"""
+    
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.winner: Optional[str] = None
+        self.finished: Dict[str, Dict[str, Any]] = {}
+    
+    def claim(self, backend: str) -> bool:
+        """尝试成为胜出者，返回该后端是否胜出"""
+        with self.cond:
+            if self.winner is None:
+                self.winner = backend
+                self.cond.notify_all()
+            return self.winner == backend
+    
+    def lost(self, backend: str) -> bool:
+        """该后端是否已经输掉竞速"""
+        return self.winner is not None and self.winner != backend
+    
+    def finish(self, backend: str, outcome: Dict[str, Any]):
+        """记录某个后端的最终结果（result 或 error）"""
+        with self.cond:
+            self.finished[backend] = outcome
+            self.cond.notify_all()
+
+
+class CircuitOpenError(Exception):
+    """熔断器断开期间拒绝 AI 调用时抛出"""
+    
+    def __init__(self, reopen_at: float):
+        self.reopen_at = reopen_at
+        reopen_time = time.strftime("%H:%M:%S", time.localtime(reopen_at))
+        super().__init__(f"AI 服务暂时不可用（熔断中），将于 {reopen_time} 后重试")
+
+
+class RequestCancelled(Exception):
+    """调用方通过 cancel 事件取消了进行中的 AI 调用"""
+    
+    def __init__(self):
+        super().__init__("AI 调用已取消")
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    连续失败达到阈值后断开（open），冷却期内直接拒绝请求，不访问网络；
+    冷却期结束后进入半开（half_open）状态，只放行一个探测请求，
+    成功则恢复（closed），失败则重新断开。
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        """当前状态（冷却期已过的断开状态视为半开）"""
+        with self._lock:
+            if self._state == self.OPEN and time.time() >= self._opened_at + self.cooldown:
+                return self.HALF_OPEN
+            return self._state
+    
+    @property
+    def reopen_at(self) -> Optional[float]:
+        """允许再次尝试的时间戳（time.time()），未断开时为 None"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return None
+            return self._opened_at + self.cooldown
+    
+    def is_open(self) -> bool:
+        """是否正在拒绝请求（不改变状态，可用于提前跳过 AI）"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            if time.time() < self._opened_at + self.cooldown:
+                return True
+            return self._probe_in_flight
+    
+    def allow_request(self) -> bool:
+        """判断是否放行请求；冷却期结束后只放行一个探测请求"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.time() < self._opened_at + self.cooldown or self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+    
+    def record_success(self):
+        """记录一次成功调用，恢复到闭合状态"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+    
+    def record_failure(self):
+        """记录一次失败调用，达到阈值或探测失败时断开"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.time()
+            self._probe_in_flight = False
+    
+    def release_probe(self):
+        """释放探测名额（请求被取消、既不算成功也不算失败时调用）"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取熔断器状态快照，用于在 REPL 中显示"""
+        state = self.state
+        reopen_at = self.reopen_at
+        with self._lock:
+            failures = self._failures
+        return {
+            'state': state,
+            'consecutive_failures': failures,
+            'reopen_at': reopen_at,
+            'seconds_until_retry': max(0.0, reopen_at - time.time()) if reopen_at else 0.0
+        }
+
+
+def _store_usage(sink: Optional[Dict[str, int]], usage: Any):
+    """把响应中的 token 用量写入 sink（usage 为空时忽略）"""
+    if sink is None or usage is None:
+        return
+    sink['prompt_tokens'] = getattr(usage, "prompt_tokens", 0) or 0
+    sink['completion_tokens'] = getattr(usage, "completion_tokens", 0) or 0
+    
+    # 命中提供商前缀缓存的 prompt token：OpenAI 为 prompt_tokens_details.cached_tokens，
+    # DeepSeek 为 prompt_cache_hit_tokens
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    sink['cached_prompt_tokens'] = cached_tokens or 0
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429、5xx 以及连接错误/超时可以重试"""
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+class AIProvider:
+    """AI 提供商基类"""
+    
+    def __init__(self):
+        self._load_env_with_validation()
+        self.provider = os.getenv("AI_PROVIDER", "deepseek").lower()
+        self.client = self._init_client()
+        self.rate_limiter = _client_registry.get_rate_limiter(self.provider, self.api_key, self.base_url)
+        self.hedge_stats = HedgeStats()
+        self.hedge_backend = self._init_hedging()
+        self.timeout = _env_float("AI_TIMEOUT", DEFAULT_TIMEOUT)
+        self.max_retries = _env_int("AI_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+        self.retry_base_delay = _env_float("AI_RETRY_BASE_DELAY", DEFAULT_RETRY_BASE_DELAY)
+        self.breaker = CircuitBreaker(
+            failure_threshold=_env_int("AI_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD),
+            cooldown=_env_float("AI_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN)
+        )
+        self.cache = self._init_cache()
+        self.telemetry = Telemetry(log_path=os.getenv("AI_TELEMETRY_FILE"))
+        self.warmup_thread: Optional[threading.Thread] = None
+        # 相同请求合并（默认启用）
+        self.coalesce = _env_bool("AI_COALESCE", True)
+        self.flights = SingleFlight()
+    
+    def _load_env_with_validation(self):
+        """加载并验证 .env 文件"""
+        load_environment()
     
     def _get_proxy_config(self) -> Optional[httpx.HTTPTransport]:
         """配置代理设置，支持 HTTP 和 SOCKS5"""
@@ -63,7 +564,7 @@ class AIProvider:
             # 注意: OpenAI SDK 使用 httpx，它会自动处理代理设置
             # 我们只需要返回 None，让 httpx 从环境变量中读取代理
             return None
-            
+        
         except Exception as e:
             print(f"⚠️  警告: 代理配置失败: {e}", file=sys.stderr)
             print("   将继续不使用代理", file=sys.stderr)
@@ -78,43 +579,8 @@ class AIProvider:
         base_url = None
         
         try:
-            if self.provider == "openai":
-                api_key = os.getenv("OPENAI_API_KEY")
-                base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-                
-                if not api_key:
-                    raise ValueError(
-                        "OpenAI API 密钥未配置\n"
-                        "请在 .env 文件中设置 OPENAI_API_KEY\n"
-                        "或使用 'config' 命令配置"
-                    )
-                
-                return OpenAI(
-                    api_key=api_key,
-                    base_url=base_url
-                )
-                
-            elif self.provider == "deepseek":
-                api_key = os.getenv("DEEPSEEK_API_KEY")
-                base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-                
-                if not api_key:
-                    raise ValueError(
-                        "DeepSeek API 密钥未配置\n"
-                        "请在 .env 文件中设置 DEEPSEEK_API_KEY\n"
-                        "或使用 'config' 命令配置"
-                    )
-                
-                return OpenAI(
-                    api_key=api_key,
-                    base_url=base_url
-                )
-            else:
-                raise ValueError(
-                    f"不支持的 AI 提供商: {self.provider}\n"
-                    f"支持的提供商: openai, deepseek\n"
-                    f"请在 .env 文件中设置 AI_PROVIDER"
-                )
+            api_key, base_url = self._resolve_endpoint(self.provider)
+            return self._get_shared_client(api_key, base_url)
         except ImportError as e:
             # 处理 SOCKS5 代理相关的导入错误
             if "socksio" in str(e) or "socks" in str(e).lower():
@@ -135,20 +601,196 @@ class AIProvider:
                 print("", file=sys.stderr)
                 
                 # 重试初始化
-                if self.provider == "openai":
-                    return OpenAI(api_key=api_key, base_url=base_url)
-                elif self.provider == "deepseek":
-                    return OpenAI(api_key=api_key, base_url=base_url)
+                if api_key and base_url:
+                    return self._get_shared_client(api_key, base_url)
             raise
     
-    def get_model(self) -> str:
-        """获取当前使用的模型"""
-        if self.provider == "openai":
+    def _resolve_endpoint(self, provider: str) -> Tuple[str, str]:
+        """
+        解析提供商的 API 密钥和 base_url
+        
+        Raises:
+            ValueError: 提供商不支持或 API 密钥未配置
+        """
+        if provider == "openai":
+            api_key = os.getenv("OPENAI_API_KEY")
+            base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+            
+            if not api_key:
+                raise ValueError(
+                    "OpenAI API 密钥未配置\n"
+                    "请在 .env 文件中设置 OPENAI_API_KEY\n"
+                    "或使用 'config' 命令配置"
+                )
+            return api_key, base_url
+        
+        elif provider == "deepseek":
+            api_key = os.getenv("DEEPSEEK_API_KEY")
+            base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+            
+            if not api_key:
+                raise ValueError(
+                    "DeepSeek API 密钥未配置\n"
+                    "请在 .env 文件中设置 DEEPSEEK_API_KEY\n"
+                    "或使用 'config' 命令配置"
+                )
+            return api_key, base_url
+        
+        elif provider == "local":
+            # 本地测试服务器（local_ai_server.py），不校验 API 密钥
+            api_key = os.getenv("LOCAL_API_KEY", "local")
+            base_url = os.getenv("LOCAL_BASE_URL", "http://127.0.0.1:8765/v1")
+            return api_key, base_url
+        else:
+            raise ValueError(
+                f"不支持的 AI 提供商: {provider}\n"
+                f"支持的提供商: openai, deepseek, local\n"
+                f"请在 .env 文件中设置 AI_PROVIDER"
+            )
+    
+    def _init_hedging(self) -> Optional[Dict[str, str]]:
+        """
+        读取对冲请求配置
+        
+        环境变量:
+            AI_HEDGE: 是否启用对冲请求
+            AI_HEDGE_PROVIDER: 备用提供商（默认为 openai/deepseek 中的另一个）
+            AI_HEDGE_DELAY_MS: 主后端多久没有返回第一个 token 就发出对冲请求
+        
+        Returns:
+            备用后端信息；未启用或备用提供商未配置时返回 None
+        """
+        self.hedge_delay = _env_float("AI_HEDGE_DELAY_MS", DEFAULT_HEDGE_DELAY_MS) / 1000.0
+        if not _env_bool("AI_HEDGE"):
+            return None
+        
+        default_secondary = "deepseek" if self.provider == "openai" else "openai"
+        secondary = os.getenv("AI_HEDGE_PROVIDER", default_secondary).lower()
+        if secondary == self.provider:
+            return None
+        
+        try:
+            api_key, base_url = self._resolve_endpoint(secondary)
+        except ValueError:
+            print(f"⚠️  警告: 对冲请求需要同时配置备用提供商 {secondary}，已禁用", file=sys.stderr)
+            return None
+        
+        return {
+            'provider': secondary,
+            'api_key': api_key,
+            'base_url': base_url,
+            'model': self.get_model(secondary)
+        }
+    
+    def _init_cache(self) -> Optional[ResponseCache]:
+        """
+        读取响应缓存配置
+        
+        环境变量:
+            AI_CACHE: 是否启用磁盘响应缓存
+            AI_CACHE_PATH: 缓存数据库路径
+            AI_CACHE_MAX_ENTRIES: 最多缓存的响应数（LRU 淘汰）
+            AI_CACHE_TTL: 缓存有效期（秒）
+        
+        Returns:
+            缓存实例；未启用或数据库无法打开时返回 None
+        """
+        if not _env_bool("AI_CACHE"):
+            return None
+        
+        try:
+            return ResponseCache(
+                path=os.getenv("AI_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=_env_int("AI_CACHE_MAX_ENTRIES", DEFAULT_CACHE_MAX_ENTRIES),
+                ttl=_env_float("AI_CACHE_TTL", DEFAULT_CACHE_TTL)
+            )
+        except Exception as e:
+            print(f"⚠️  警告: 响应缓存初始化失败，已禁用: {e}", file=sys.stderr)
+            return None
+    
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """获取响应缓存统计（未启用缓存时返回 None）"""
+        return self.cache.stats() if self.cache else None
+    
+    def _cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stop_when: Optional[Callable[[str], bool]]
+    ) -> str:
+        """计算本次请求的缓存键（提前结束的流式响应与完整响应分开缓存）"""
+        return ResponseCache.make_key(
+            self.provider, self.get_model(), messages, temperature, max_tokens,
+            truncated=stop_when is not None
+        )
+    
+    def warm_up(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """
+        预热连接：请求廉价的模型列表接口，提前完成 DNS、TCP、TLS 握手，
+        连接保留在共享连接池中，之后的第一个 AI 请求可以直接复用
+        
+        连续请求两次，两次耗时之差作为节省的建连时间（估算）。
+        结果记录在遥测中，失败不计入熔断器。
+        
+        Returns:
+            {'success': bool, 'latency_ms': 首次请求耗时, 'saved_ms': 估算节省的时间}
+        """
+        started = time.perf_counter()
+        try:
+            self.client.models.list(timeout=timeout)
+            cold_ms = (time.perf_counter() - started) * 1000
+            
+            started = time.perf_counter()
+            self.client.models.list(timeout=timeout)
+            warm_ms = (time.perf_counter() - started) * 1000
+            result = {'success': True, 'latency_ms': cold_ms, 'saved_ms': max(0.0, cold_ms - warm_ms)}
+        except Exception as e:
+            result = {
+                'success': False,
+                'latency_ms': (time.perf_counter() - started) * 1000,
+                'saved_ms': 0.0,
+                'error': str(e)
+            }
+        
+        self.telemetry.record_warmup(
+            self.provider, result['success'], result['latency_ms'], result['saved_ms']
+        )
+        return result
+    
+    def start_warm_up(self) -> threading.Thread:
+        """在后台线程中预热连接（用户阅读欢迎信息、输入第一条指令期间完成）"""
+        thread = threading.Thread(target=self.warm_up, name="ai-warm-up", daemon=True)
+        thread.start()
+        self.warmup_thread = thread
+        return thread
+    
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计（各后端胜出次数与首 token 延迟）"""
+        return self.hedge_stats.snapshot()
+    
+    def _get_shared_client(self, api_key: str, base_url: str) -> OpenAI:
+        """记录连接参数并从注册表获取共享的同步客户端"""
+        self.api_key = api_key
+        self.base_url = base_url
+        return _client_registry.get_client(self.provider, api_key, base_url)
+    
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """当前事件循环对应的共享异步客户端（按需创建）"""
+        return _client_registry.get_async_client(self.provider, self.api_key, self.base_url)
+    
+    def get_model(self, provider: Optional[str] = None) -> str:
+        """获取当前使用的模型（可指定提供商）"""
+        provider = provider or self.provider
+        if provider == "openai":
             return os.getenv("OPENAI_MODEL", "gpt-4")
-        elif self.provider == "deepseek":
+        elif provider == "deepseek":
             return os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+        elif provider == "local":
+            return os.getenv("LOCAL_MODEL", "local-model")
         else:
-            raise ValueError(f"不支持的 AI 提供商: {self.provider}")
+            raise ValueError(f"不支持的 AI 提供商: {provider}")
     
     def generate_response(
         self,
@@ -156,7 +798,17 @@ class AIProvider:
         user_message: str,
         history: Optional[List[Dict[str, str]]] = None,
         temperature: float = 0.7,
-        max_tokens: int = 1000
+        max_tokens: int = 1000,
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        refresh_cache: bool = False,
+        caller: str = "unknown",
+        scenario: Optional[str] = None,
+        context: Optional[str] = None,
+        cancel: Optional[threading.Event] = None
     ) -> str:
         """
         生成 AI 响应
@@ -167,27 +819,969 @@ class AIProvider:
             history: 对话历史 [{"role": "user", "content": "..."}, ...]
             temperature: 温度参数（0-1）
             max_tokens: 最大 token 数
-            
+            stream: 是否使用流式输出
+            on_token: 流式模式下每收到一段文本时的回调
+            stop_when: 流式模式下的提前结束判断，参数为已收到的完整文本，
+                返回 True 时立即关闭连接，不再接收剩余内容
+            timeout: 本次调用的截止时间（秒，包含重试），默认读取 AI_TIMEOUT
+            use_cache: 是否使用响应缓存（False 时既不读也不写）
+            refresh_cache: 忽略已有缓存，重新请求并覆盖缓存
+            caller: 调用方名称（parser / analyzer / suggester），用于遥测统计
+            scenario: 请求所属场景，用于遥测统计
+            context: 动态上下文（当前目录、用户等），作为用户消息前的一条
+                独立消息发送，使系统提示词保持不变以命中服务端的前缀缓存
+            cancel: 取消事件，设置后在发出请求前或收到下一段流式文本时
+                关闭连接（非流式请求发出后无法中止，只能丢弃结果）
+        
         Returns:
             AI 生成的文本响应
+        
+        Raises:
+            CircuitOpenError: 熔断器断开期间直接拒绝，不访问网络
+            RequestCancelled: 调用已通过 cancel 取消
+            Exception: AI 调用失败
+        """
+        messages = self._build_messages(system_prompt, user_message, history, context)
+        started = time.perf_counter()
+        first_token_at: List[float] = []
+        usage: Dict[str, int] = {}
+        
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(messages, temperature, max_tokens, stop_when)
+            cached = None if refresh_cache else self.cache.get(cache_key)
+            if cached is not None:
+                if stream and on_token:
+                    on_token(cached)
+                self._record_call(caller, scenario, started, first_token_at, usage, cached=True)
+                return cached
+        
+        return self._coalesced(
+            messages, temperature, max_tokens, stop_when, cache_key, timeout,
+            lambda: self._request(
+                messages, temperature, max_tokens, stream, on_token, stop_when,
+                timeout, caller, scenario, started, cache_key, cancel
+            ),
+            lambda content: self._share_result(content, stream, on_token, caller, scenario, started)
+        )
+    
+    def _request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: Optional[float],
+        caller: str,
+        scenario: Optional[str],
+        started: float,
+        cache_key: Optional[str],
+        cancel: Optional[threading.Event] = None
+    ) -> str:
+        """发起请求（含熔断检查、限流排队和重试），记录遥测并写入缓存"""
+        first_token_at: List[float] = []
+        usage: Dict[str, int] = {}
+        
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(self.breaker.reopen_at)
+        
+        deadline = time.monotonic() + (timeout or self.timeout)
+        emitted: List[str] = []
+        reserved_tokens = self._estimate_request_tokens(messages, max_tokens)
+        queued = 0.0
+        # 当前尝试是否持有尚未结算的限流预约
+        holding = False
+        
+        def release_reservation():
+            if holding:
+                self._settle_rate_limit(reserved_tokens, usage, max_tokens, "".join(emitted))
+        
+        def cancelled() -> bool:
+            return cancel is not None and cancel.is_set()
+        
+        def track_token(delta: str):
+            if cancelled():
+                # 在流式读取循环中抛出，关闭连接，服务端停止生成
+                raise RequestCancelled()
+            if not emitted:
+                first_token_at.append(time.perf_counter())
+            emitted.append(delta)
+            if on_token:
+                on_token(delta)
+        
+        try:
+            attempt = 0
+            while True:
+                try:
+                    wait = self._reserve_rate_limit(reserved_tokens, deadline)
+                    holding = True
+                    if wait:
+                        time.sleep(wait)
+                        queued += wait
+                    if cancelled():
+                        raise RequestCancelled()
+                    content = self._complete(
+                        messages, temperature, max_tokens, stream,
+                        track_token, stop_when, deadline - time.monotonic(), usage
+                    )
+                    self._fill_estimated_usage(messages, content, usage)
+                    break
+                except Exception as e:
+                    # 已经向调用方输出过内容的流式请求和已取消的请求不能重试
+                    delay = None if emitted or cancelled() else self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    # 失败的尝试没有产生 completion，先结算它的预约再重试
+                    release_reservation()
+                    holding = False
+                    time.sleep(delay)
+                    attempt += 1
+        except RateLimitTimeout as e:
+            # 排队超时不是服务故障，不计入熔断器
+            self.breaker.release_probe()
+            self._record_call(caller, scenario, started, first_token_at, usage,
+                              success=False, queued=queued)
+            raise Exception(f"AI 调用失败: {str(e)}")
+        except Exception as e:
+            release_reservation()
+            if cancelled():
+                # 调用方主动取消（对冲模式下异常来自后台线程，按事件判断），不计入熔断器
+                self.breaker.release_probe()
+                self._record_call(caller, scenario, started, first_token_at, usage,
+                                  success=False, queued=queued)
+                raise RequestCancelled() from e
+            self.breaker.record_failure()
+            self._record_call(caller, scenario, started, first_token_at, usage,
+                              success=False, queued=queued)
+            raise Exception(f"AI 调用失败: {str(e)}")
+        except BaseException:
+            # 用户中断（Ctrl+C）不计入失败，但要释放半开状态下的探测名额
+            release_reservation()
+            self.breaker.release_probe()
+            raise
+        
+        self.breaker.record_success()
+        self._settle_rate_limit(reserved_tokens, usage, max_tokens)
+        self._record_call(caller, scenario, started, first_token_at, usage,
+                          success=bool(content), queued=queued)
+        if not content:
+            raise Exception("AI 调用失败: AI 返回了空响应")
+        
+        content = content.strip()
+        if cache_key:
+            self.cache.put(cache_key, content)
+        return content
+    
+    def _flight_key(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stop_when: Optional[Callable[[str], bool]],
+        cache_key: Optional[str]
+    ) -> Optional[str]:
+        """相同请求合并使用的键（与缓存键相同），未启用合并时返回 None"""
+        if not self.coalesce:
+            return None
+        return cache_key or self._cache_key(messages, temperature, max_tokens, stop_when)
+    
+    def _coalesced(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stop_when: Optional[Callable[[str], bool]],
+        cache_key: Optional[str],
+        timeout: Optional[float],
+        request: Callable[[], str],
+        share: Callable[[str], None]
+    ) -> str:
+        """
+        合并进行中的相同请求：第一个调用方执行 request，其余调用方等待并共享结果
+        
+        共享到结果的调用方通过 share 输出结果、记录遥测。
+        """
+        key = self._flight_key(messages, temperature, max_tokens, stop_when, cache_key)
+        if key is None:
+            return request()
+        try:
+            # 取消只针对发起取消的调用方（如被丢弃的投机解析），其余等待者接替发起请求
+            content, shared = self.flights.do(key, request, timeout=timeout or self.timeout,
+                                              retry_on=(RequestCancelled,))
+        except CoalescedWaitTimeout as e:
+            raise Exception(f"AI 调用失败: {str(e)}")
+        if shared:
+            share(content)
+        return content
+    
+    async def _acoalesced(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stop_when: Optional[Callable[[str], bool]],
+        cache_key: Optional[str],
+        timeout: Optional[float],
+        request: Callable[[], Awaitable[str]],
+        share: Callable[[str], None]
+    ) -> str:
+        """_coalesced 的异步版本（在同一事件循环内合并）"""
+        key = self._flight_key(messages, temperature, max_tokens, stop_when, cache_key)
+        if key is None:
+            return await request()
+        try:
+            content, shared = await self.flights.ado(key, request, timeout=timeout or self.timeout,
+                                                     retry_on=(RequestCancelled,))
+        except CoalescedWaitTimeout as e:
+            raise Exception(f"AI 调用失败: {str(e)}")
+        if shared:
+            share(content)
+        return content
+    
+    def _share_result(
+        self,
+        content: str,
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        caller: str,
+        scenario: Optional[str],
+        started: float
+    ):
+        """等待者拿到共享结果：流式模式下一次性输出，遥测记为合并调用（不计 token）"""
+        if stream and on_token:
+            on_token(content)
+        self._record_call(caller, scenario, started, [], {}, coalesced=True)
+    
+    def _record_call(
+        self,
+        caller: str,
+        scenario: Optional[str],
+        started: float,
+        first_token_at: List[float],
+        usage: Dict[str, int],
+        cached: bool = False,
+        success: bool = True,
+        queued: float = 0.0,
+        coalesced: bool = False
+    ):
+        """
+        记录一次调用的遥测数据（耗时、首 token 延迟、token 用量）
+        
+        queued 为在限流器中排队的秒数，单独记录，不计入耗时和首 token 延迟；
+        coalesced 表示共享了另一个相同请求的结果，没有发起网络请求。
+        """
+        self.telemetry.record(
+            caller=caller,
+            scenario=scenario,
+            provider=self.provider,
+            model=self.get_model(),
+            latency_ms=(time.perf_counter() - started - queued) * 1000,
+            prompt_tokens=usage.get('prompt_tokens', 0),
+            completion_tokens=usage.get('completion_tokens', 0),
+            cached_prompt_tokens=None if usage.get('estimated') else usage.get('cached_prompt_tokens', 0),
+            first_token_ms=(first_token_at[0] - started - queued) * 1000 if first_token_at else None,
+            cached=cached,
+            success=success,
+            queue_ms=queued * 1000,
+            coalesced=coalesced,
+            estimated=bool(usage.get('estimated'))
+        )
+    
+    def _fill_estimated_usage(
+        self,
+        messages: List[Dict[str, str]],
+        content: Optional[str],
+        usage: Dict[str, int]
+    ):
+        """
+        响应中没有 token 用量时按估算值补上，并标记为估算
+        
+        流式请求满足 stop_when 提前关闭时收不到最后一个带 usage 的数据块，
+        此时 prompt 按消息估算，completion 按已收到的文本估算；
+        命中前缀缓存的 token 数无从得知，记录为未知而不是 0。
+        """
+        if usage.get('prompt_tokens') or usage.get('completion_tokens'):
+            return
+        usage['prompt_tokens'] = sum(estimate_message_tokens(m['content']) for m in messages)
+        usage['completion_tokens'] = estimate_tokens(content or "")
+        usage['estimated'] = 1
+    
+    def _estimate_request_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """估算一次请求最多消耗的 token 数（prompt 估算值 + max_tokens），用于限流预约"""
+        return sum(estimate_message_tokens(m['content']) for m in messages) + max_tokens
+    
+    def _reserve_rate_limit(self, tokens: int, deadline: float) -> float:
+        """
+        在共享限流器中为一次请求预约额度
+        
+        Returns:
+            发送请求前需要等待的秒数（未启用限流时为 0）
+        
+        Raises:
+            RateLimitTimeout: 需要等待的时间超过了截止时间
+        """
+        if not self.rate_limiter:
+            return 0.0
+        return self.rate_limiter.reserve(tokens, max_wait=deadline - time.monotonic())
+    
+    def _settle_rate_limit(
+        self,
+        reserved_tokens: int,
+        usage: Dict[str, int],
+        max_tokens: int,
+        received: str = ""
+    ):
+        """
+        按实际 token 用量修正限流预约
+        
+        有用量（响应自带或提前结束时的估算值）时按用量结算；请求失败或被取消、
+        没有用量时，归还为 completion 预约的 max_tokens 中没有用到的部分，
+        已收到的文本按估算值计入。
+        """
+        if not self.rate_limiter:
+            return
+        if usage:
+            actual = usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+        else:
+            actual = reserved_tokens - max_tokens + estimate_tokens(received)
+        self.rate_limiter.settle(reserved_tokens, actual)
+    
+    def get_rate_limit_stats(self) -> Optional[Dict[str, Any]]:
+        """获取限流器状态（未启用限流时返回 None）"""
+        return self.rate_limiter.snapshot() if self.rate_limiter else None
+    
+    def get_telemetry_stats(self) -> Dict[str, Any]:
+        """获取 AI 调用遥测统计（按总计、调用方、场景汇总）"""
+        return self.telemetry.snapshot()
+    
+    def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: float,
+        usage: Optional[Dict[str, int]] = None
+    ) -> Optional[str]:
+        """发起一次请求（不含重试），根据配置选择对冲、流式或普通模式"""
+        if self.hedge_backend:
+            return self._hedged_completion(
+                messages, temperature, max_tokens,
+                on_token if stream else None,
+                stop_when if stream else None,
+                timeout, usage
+            )
+        if stream:
+            return self._stream_completion(
+                messages, temperature, max_tokens, on_token, stop_when, timeout, usage
+            )
+        
+        response = self.client.chat.completions.create(
+            model=self.get_model(),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        _store_usage(usage, getattr(response, "usage", None))
+        return response.choices[0].message.content
+    
+    def _retry_delay(self, error: Exception, attempt: int, deadline: float) -> Optional[float]:
+        """
+        计算重试前的等待时间（指数退避 + 抖动，优先遵循 Retry-After）
+        
+        Returns:
+            等待秒数；不可重试、次数用尽或会超过截止时间时返回 None
+        """
+        if attempt >= self.max_retries or not _is_retryable(error):
+            return None
+        
+        delay = self.retry_base_delay * (2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        
+        response = getattr(error, "response", None)
+        retry_after = retry_after_seconds(getattr(response, "headers", None))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+    
+    def _build_messages(
+        self,
+        system_prompt: str,
+        user_message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        context: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """
+        构建发送给模型的消息列表
+        
+        不变的内容在前（系统提示词、历史），随时变化的上下文放在最后，
+        这样请求的前缀在多次调用之间保持字节一致，可以命中提供商的提示词缓存。
         """
         messages = [{"role": "system", "content": system_prompt}]
         
         if history:
             messages.extend(history)
         
+        if context:
+            messages.append({"role": "system", "content": context})
+        
         messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def _stream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> Optional[str]:
+        """
+        以流式方式请求模型，逐段回调，满足 stop_when 时提前关闭流
+        
+        Returns:
+            已接收的文本（提前结束时为截断后的文本）
+        """
+        response_stream = self.client.chat.completions.create(
+            model=self.get_model(),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout
+        )
         
+        parts: List[str] = []
         try:
-            response = self.client.chat.completions.create(
-                model=self.get_model(),
+            for chunk in response_stream:
+                _store_usage(usage, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                
+                parts.append(delta)
+                if on_token:
+                    on_token(delta)
+                if stop_when and stop_when("".join(parts)):
+                    # 关闭连接，服务端停止生成，节省剩余的 completion token
+                    break
+        finally:
+            response_stream.close()
+        
+        return "".join(parts)
+    
+    def _hedged_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> str:
+        """
+        对冲请求：先发往主后端，若 hedge_delay 内没有收到第一个 token
+        （或主后端已失败），再向备用后端发送同样的请求。
+        第一个返回 token 的后端胜出，另一个在下次收到数据时关闭连接。
+        
+        Returns:
+            胜出后端的响应文本
+        """
+        race = _HedgeRace()
+        secondary = self.hedge_backend
+        backends = {
+            self.provider: (self.client, self.get_model()),
+            secondary['provider']: (
+                _client_registry.get_client(secondary['provider'], secondary['api_key'], secondary['base_url']),
+                secondary['model']
+            )
+        }
+        launched = []
+        
+        def launch(backend: str):
+            client, model = backends[backend]
+            launched.append(backend)
+            threading.Thread(
+                target=self._hedge_attempt,
+                args=(race, backend, client, model, messages, temperature, max_tokens,
+                      on_token, stop_when, timeout),
+                daemon=True
+            ).start()
+        
+        launch(self.provider)
+        hedge_at = time.monotonic() + self.hedge_delay
+        
+        with race.cond:
+            while True:
+                if race.winner is not None:
+                    if race.winner in race.finished:
+                        break
+                    race.cond.wait()
+                    continue
+                
+                if len(launched) == 1:
+                    remaining = hedge_at - time.monotonic()
+                    if remaining <= 0 or self.provider in race.finished:
+                        self.hedge_stats.record_hedge()
+                        launch(secondary['provider'])
+                        continue
+                    race.cond.wait(remaining)
+                elif len(race.finished) == len(launched):
+                    # 所有后端都失败或返回空响应
+                    break
+                else:
+                    race.cond.wait()
+        
+        return self._hedge_result(race, launched, usage)
+    
+    def _hedge_attempt(
+        self,
+        race: _HedgeRace,
+        backend: str,
+        client: OpenAI,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: Optional[float]
+    ):
+        """在后台线程中向单个后端发起流式请求，参与竞速"""
+        outcome: Dict[str, Any] = {}
+        attempt_usage: Dict[str, int] = {}
+        started = time.perf_counter()
+        self.hedge_stats.record_attempt(backend)
+        
+        try:
+            response_stream = client.chat.completions.create(
+                model=model,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout
             )
-            content = response.choices[0].message.content
-            if content is None:
-                raise Exception("AI 返回了空响应")
-            return content.strip()
+            parts: List[str] = []
+            try:
+                for chunk in response_stream:
+                    if race.lost(backend):
+                        break
+                    _store_usage(attempt_usage, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    
+                    if not parts:
+                        self.hedge_stats.record_first_token(
+                            backend, (time.perf_counter() - started) * 1000
+                        )
+                        if not race.claim(backend):
+                            break
+                    
+                    parts.append(delta)
+                    if on_token:
+                        on_token(delta)
+                    if stop_when and stop_when("".join(parts)):
+                        break
+            finally:
+                response_stream.close()
+            outcome['result'] = "".join(parts)
+            outcome['usage'] = attempt_usage
+        except Exception as e:
+            self.hedge_stats.record_error(backend)
+            outcome['error'] = e
+        finally:
+            race.finish(backend, outcome)
+    
+    def _hedge_result(
+        self,
+        race: _HedgeRace,
+        launched: List[str],
+        usage: Optional[Dict[str, int]] = None
+    ) -> str:
+        """根据竞速结果返回胜出者的响应，全部失败时抛出主后端的错误"""
+        if race.winner is not None:
+            outcome = race.finished[race.winner]
+            if 'error' in outcome:
+                raise outcome['error']
+            self.hedge_stats.record_win(race.winner)
+            if usage is not None:
+                usage.update(outcome.get('usage', {}))
+            return outcome['result']
+        
+        for backend in launched:
+            error = race.finished.get(backend, {}).get('error')
+            if error is not None:
+                raise error
+        raise Exception("AI 返回了空响应")
+    
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        user_message: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        refresh_cache: bool = False,
+        caller: str = "unknown",
+        scenario: Optional[str] = None,
+        context: Optional[str] = None
+    ) -> str:
+        """
+        生成 AI 响应（异步版本，参数与 generate_response 相同）
+        
+        多个调用可以在同一事件循环中并发进行，例如命令解析、
+        后台错误分析和下一步建议预取。
+        
+        Returns:
+            AI 生成的文本响应
+        """
+        messages = self._build_messages(system_prompt, user_message, history, context)
+        started = time.perf_counter()
+        first_token_at: List[float] = []
+        usage: Dict[str, int] = {}
+        
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self._cache_key(messages, temperature, max_tokens, stop_when)
+            cached = None if refresh_cache else self.cache.get(cache_key)
+            if cached is not None:
+                if stream and on_token:
+                    on_token(cached)
+                self._record_call(caller, scenario, started, first_token_at, usage, cached=True)
+                return cached
+        
+        return await self._acoalesced(
+            messages, temperature, max_tokens, stop_when, cache_key, timeout,
+            lambda: self._arequest(
+                messages, temperature, max_tokens, stream, on_token, stop_when,
+                timeout, caller, scenario, started, cache_key
+            ),
+            lambda content: self._share_result(content, stream, on_token, caller, scenario, started)
+        )
+    
+    async def _arequest(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: Optional[float],
+        caller: str,
+        scenario: Optional[str],
+        started: float,
+        cache_key: Optional[str]
+    ) -> str:
+        """_request 的异步版本"""
+        first_token_at: List[float] = []
+        usage: Dict[str, int] = {}
+        
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(self.breaker.reopen_at)
+        
+        deadline = time.monotonic() + (timeout or self.timeout)
+        emitted: List[str] = []
+        reserved_tokens = self._estimate_request_tokens(messages, max_tokens)
+        queued = 0.0
+        # 当前尝试是否持有尚未结算的限流预约
+        holding = False
+        
+        def release_reservation():
+            if holding:
+                self._settle_rate_limit(reserved_tokens, usage, max_tokens, "".join(emitted))
+        
+        def track_token(delta: str):
+            if not emitted:
+                first_token_at.append(time.perf_counter())
+            emitted.append(delta)
+            if on_token:
+                on_token(delta)
+        
+        try:
+            attempt = 0
+            while True:
+                try:
+                    wait = self._reserve_rate_limit(reserved_tokens, deadline)
+                    holding = True
+                    if wait:
+                        await asyncio.sleep(wait)
+                        queued += wait
+                    content = await self._acomplete(
+                        messages, temperature, max_tokens, stream,
+                        track_token, stop_when, deadline - time.monotonic(), usage
+                    )
+                    self._fill_estimated_usage(messages, content, usage)
+                    break
+                except Exception as e:
+                    delay = None if emitted else self._retry_delay(e, attempt, deadline)
+                    if delay is None:
+                        raise
+                    # 失败的尝试没有产生 completion，先结算它的预约再重试
+                    release_reservation()
+                    holding = False
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        except RateLimitTimeout as e:
+            # 排队超时不是服务故障，不计入熔断器
+            self.breaker.release_probe()
+            self._record_call(caller, scenario, started, first_token_at, usage,
+                              success=False, queued=queued)
+            raise Exception(f"AI 调用失败: {str(e)}")
         except Exception as e:
+            release_reservation()
+            self.breaker.record_failure()
+            self._record_call(caller, scenario, started, first_token_at, usage,
+                              success=False, queued=queued)
             raise Exception(f"AI 调用失败: {str(e)}")
+        except BaseException:
+            # 调用被取消，不计入失败，但要释放半开状态下的探测名额
+            release_reservation()
+            self.breaker.release_probe()
+            raise
+        
+        self.breaker.record_success()
+        self._settle_rate_limit(reserved_tokens, usage, max_tokens)
+        self._record_call(caller, scenario, started, first_token_at, usage,
+                          success=bool(content), queued=queued)
+        if not content:
+            raise Exception("AI 调用失败: AI 返回了空响应")
+        
+        content = content.strip()
+        if cache_key:
+            self.cache.put(cache_key, content)
+        return content
+    
+    async def _acomplete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: float,
+        usage: Optional[Dict[str, int]] = None
+    ) -> Optional[str]:
+        """_complete 的异步版本"""
+        if self.hedge_backend:
+            return await self._ahedged_completion(
+                messages, temperature, max_tokens,
+                on_token if stream else None,
+                stop_when if stream else None,
+                timeout, usage
+            )
+        if stream:
+            return await self._astream_completion(
+                messages, temperature, max_tokens, on_token, stop_when, timeout, usage
+            )
+        
+        response = await self.async_client.chat.completions.create(
+            model=self.get_model(),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+        _store_usage(usage, getattr(response, "usage", None))
+        return response.choices[0].message.content
+    
+    async def _astream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> Optional[str]:
+        """_stream_completion 的异步版本"""
+        response_stream = await self.async_client.chat.completions.create(
+            model=self.get_model(),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout
+        )
+        
+        parts: List[str] = []
+        try:
+            async for chunk in response_stream:
+                _store_usage(usage, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                
+                parts.append(delta)
+                if on_token:
+                    on_token(delta)
+                if stop_when and stop_when("".join(parts)):
+                    break
+        finally:
+            await response_stream.close()
+        
+        return "".join(parts)
+    
+    async def _ahedged_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None,
+        usage: Optional[Dict[str, int]] = None
+    ) -> str:
+        """_hedged_completion 的异步版本，输掉竞速的请求会被直接取消"""
+        race = _HedgeRace()
+        first_token = asyncio.Event()
+        secondary = self.hedge_backend
+        backends = {
+            self.provider: (self.async_client, self.get_model()),
+            secondary['provider']: (
+                _client_registry.get_async_client(
+                    secondary['provider'], secondary['api_key'], secondary['base_url']
+                ),
+                secondary['model']
+            )
+        }
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        def launch(backend: str):
+            client, model = backends[backend]
+            tasks[backend] = asyncio.ensure_future(self._ahedge_attempt(
+                race, first_token, backend, client, model,
+                messages, temperature, max_tokens, on_token, stop_when, timeout
+            ))
+        
+        launch(self.provider)
+        waiter = asyncio.ensure_future(first_token.wait())
+        try:
+            await asyncio.wait(
+                {tasks[self.provider], waiter},
+                timeout=self.hedge_delay,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            while True:
+                if race.winner is not None:
+                    # 取消输掉竞速的请求
+                    for backend, task in tasks.items():
+                        if backend != race.winner:
+                            task.cancel()
+                    await asyncio.gather(*tasks.values(), return_exceptions=True)
+                    break
+                
+                if secondary['provider'] not in tasks:
+                    self.hedge_stats.record_hedge()
+                    launch(secondary['provider'])
+                
+                pending = {task for task in tasks.values() if not task.done()}
+                if not pending:
+                    break
+                await asyncio.wait(pending | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        finally:
+            waiter.cancel()
+        
+        return self._hedge_result(race, list(tasks), usage)
+    
+    async def _ahedge_attempt(
+        self,
+        race: _HedgeRace,
+        first_token: asyncio.Event,
+        backend: str,
+        client: AsyncOpenAI,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        on_token: Optional[Callable[[str], None]],
+        stop_when: Optional[Callable[[str], bool]],
+        timeout: Optional[float]
+    ):
+        """_hedge_attempt 的异步版本"""
+        outcome: Dict[str, Any] = {}
+        attempt_usage: Dict[str, int] = {}
+        started = time.perf_counter()
+        self.hedge_stats.record_attempt(backend)
+        
+        try:
+            response_stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout
+            )
+            parts: List[str] = []
+            try:
+                async for chunk in response_stream:
+                    if race.lost(backend):
+                        break
+                    _store_usage(attempt_usage, getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    
+                    if not parts:
+                        self.hedge_stats.record_first_token(
+                            backend, (time.perf_counter() - started) * 1000
+                        )
+                        if not race.claim(backend):
+                            break
+                        first_token.set()
+                    
+                    parts.append(delta)
+                    if on_token:
+                        on_token(delta)
+                    if stop_when and stop_when("".join(parts)):
+                        break
+            finally:
+                await response_stream.close()
+            outcome['result'] = "".join(parts)
+            outcome['usage'] = attempt_usage
+        except asyncio.CancelledError:
+            outcome['error'] = Exception("请求已取消")
+            raise
+        except Exception as e:
+            self.hedge_stats.record_error(backend)
+            outcome['error'] = e
+        finally:
+            race.finish(backend, outcome)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+动态示例基准测试
+Benchmark: prompt tokens and latency of dynamic few-shot examples vs full prompts
+
+启动本地 OpenAI 兼容服务器（首 token 延迟随 prompt 长度增加，模拟服务端处理
+长提示词的时间），按场景分别用整份提示词和动态示例解析同一组输入，
+报告每次请求的 prompt token（估算值）和平均耗时。
+
+用法:
+    python bench_examples.py                          # 默认参数
+    python bench_examples.py --prefill 400 --rounds 5
+    python bench_examples.py --top-k 4 --budget 200   # 调整示例数和 token 预算
+"""
+import argparse
+import os
+import statistics
+import time
+
+from token_utils import estimate_tokens
+
+
+SCENARIO_INPUTS = {
+    'file_operations': [
+        "创建文件夹 backup",
+        "复制文件 a.txt 到 /tmp",
+        "删除所有 .tmp 文件",
+        "把 logs 目录压缩成 logs.tar.gz",
+    ],
+    'system_management': [
+        "杀死进程 1234",
+        "列出占用 CPU 最多的进程",
+        "重启 nginx 服务",
+        "添加用户 alice",
+    ],
+    'network_operations': [
+        "下载 https://example.com/file.zip",
+        "ping 一下 example.com",
+        "查看监听的端口",
+        "用 scp 上传 a.txt 到服务器",
+    ],
+    'text_processing': [
+        "在 app.log 中搜索 error",
+        "统计 data.csv 的行数",
+        "把 config.ini 里的 foo 替换为 bar",
+        "查看文件 notes.txt 的内容",
+    ],
+    'command_generation': [
+        "显示当前时间",
+        "显示日历",
+        "清屏",
+        "生成随机密码",
+    ],
+}
+
+
+def prompt_tokens(body) -> int:
+    """一次请求中所有消息的 token 估算"""
+    return sum(estimate_tokens(str(message.get("content", ""))) for message in body.get("messages", []))
+
+
+def run(parser, server, inputs, rounds: int):
+    """返回 (平均 prompt token, 平均耗时 ms, 场景列表)"""
+    start_index = len(server.requests)
+    latencies = []
+    scenarios = set()
+    for _ in range(rounds):
+        for text in inputs:
+            scenarios.add(parser._detect_scenario(text))
+            started = time.perf_counter()
+            parser.parse_command(text)
+            latencies.append((time.perf_counter() - started) * 1000)
+    tokens = [prompt_tokens(body) for body in server.requests[start_index:]]
+    return statistics.mean(tokens), statistics.mean(latencies), scenarios
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="动态示例基准测试")
+    parser.add_argument("--latency", type=float, default=50.0, help="本地服务器的基础首 token 延迟（毫秒）")
+    parser.add_argument("--prefill", type=float, default=200.0,
+                        help="每 1000 个 prompt token 增加的延迟（毫秒，默认 200）")
+    parser.add_argument("--rounds", type=int, default=3, help="每条输入重复次数")
+    parser.add_argument("--top-k", type=int, default=None, help="AI_EXAMPLES_TOP_K")
+    parser.add_argument("--budget", type=int, default=None, help="AI_EXAMPLES_TOKEN_BUDGET")
+    args = parser.parse_args(argv)
+    
+    from local_ai_server import LocalAIServer
+    
+    server = LocalAIServer(latency_ms=args.latency, prefill_ms_per_1k=args.prefill).start()
+    os.environ["AI_PROVIDER"] = "local"
+    os.environ["LOCAL_BASE_URL"] = server.base_url
+    # 关闭所有缓存，每次都真正发出请求
+    for name in ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE", "AI_TEMPLATES", "AI_DYNAMIC_EXAMPLES"):
+        os.environ[name] = "false"
+    if args.top_k is not None:
+        os.environ["AI_EXAMPLES_TOP_K"] = str(args.top_k)
+    if args.budget is not None:
+        os.environ["AI_EXAMPLES_TOKEN_BUDGET"] = str(args.budget)
+    
+    from ai_command_parser import AICommandParser
+    
+    try:
+        full = AICommandParser(use_context=False, stream=False)
+        os.environ["AI_DYNAMIC_EXAMPLES"] = "true"
+        dynamic = AICommandParser(use_context=False, stream=False)
+        
+        print(f"{'场景':<20} {'整份 token':>10} {'动态 token':>10} {'减少':>6} "
+              f"{'整份 ms':>9} {'动态 ms':>9} {'加速':>6}")
+        mismatched = False
+        for scenario, inputs in SCENARIO_INPUTS.items():
+            full_tokens, full_ms, detected = run(full, server, inputs, args.rounds)
+            dynamic_tokens, dynamic_ms, _ = run(dynamic, server, inputs, args.rounds)
+            label = scenario if detected == {scenario} else f"{scenario}*"
+            mismatched = mismatched or detected != {scenario}
+            print(f"{label:<20} {full_tokens:>10.0f} {dynamic_tokens:>10.0f} "
+                  f"{1 - dynamic_tokens / full_tokens:>6.0%} "
+                  f"{full_ms:>9.1f} {dynamic_ms:>9.1f} {full_ms / dynamic_ms:>5.2f}x")
+        if mismatched:
+            print("\n* 部分输入被检测为其他场景")
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+路径校验基准测试
+Benchmark: per-path os.path.exists vs batched, cached PathValidator
+
+在临时目录中建立若干子目录和文件，生成一条包含大量路径参数的长命令，
+分别测量：
+  - 逐个 os.path.exists（原来的做法）
+  - PathValidator 冷启动（每个目录一次 os.scandir，多个目录并行）
+  - PathValidator 预热后（缓存有效期内不做 I/O）
+--fs-latency 为每次文件系统调用增加固定延迟，模拟网络文件系统的往返。
+
+用法:
+    python bench_path_validation.py
+    python bench_path_validation.py --dirs 8 --paths 60 --fs-latency 2
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from unittest import mock
+
+from path_validator import PathValidator
+
+
+def build_tree(root: str, dirs: int, files: int):
+    """建立 dirs 个子目录，每个目录 files 个文件"""
+    for d in range(dirs):
+        directory = os.path.join(root, f"dir{d}")
+        os.makedirs(directory)
+        for f in range(files):
+            open(os.path.join(directory, f"file{f}.txt"), "w").close()
+        os.utime(directory, (1_000_000_000, 1_000_000_000))
+
+
+def build_paths(root: str, dirs: int, count: int):
+    """一半存在、一半不存在的路径，均匀分布在各目录中"""
+    paths = []
+    for i in range(count):
+        name = f"file{i // dirs}.txt" if i % 2 == 0 else f"missing{i}.txt"
+        paths.append(os.path.join(root, f"dir{i % dirs}", name))
+    return paths
+
+
+def slow(function, latency: float):
+    """给文件系统调用加上固定延迟"""
+    def wrapper(*args, **kwargs):
+        time.sleep(latency)
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def timed(function, rounds: int) -> float:
+    """平均耗时（毫秒）"""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.mean(samples)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="路径校验基准测试")
+    parser.add_argument("--dirs", type=int, default=4, help="路径分布的目录数")
+    parser.add_argument("--paths", type=int, default=40, help="命令中的路径数")
+    parser.add_argument("--fs-latency", type=float, default=0.0,
+                        help="每次文件系统调用增加的延迟（毫秒，模拟网络文件系统）")
+    parser.add_argument("--rounds", type=int, default=20, help="重复次数")
+    args = parser.parse_args(argv)
+    
+    root = tempfile.mkdtemp()
+    try:
+        build_tree(root, args.dirs, args.paths)
+        paths = build_paths(root, args.dirs, args.paths)
+        latency = args.fs_latency / 1000
+        
+        def cold():
+            PathValidator().check_many(paths)
+        
+        warm_validator = PathValidator(revalidate_interval=3600)
+        warm_validator.check_many(paths)
+        revalidating = PathValidator(revalidate_interval=0)
+        revalidating.check_many(paths)
+        
+        # os.path.exists 内部调用 os.stat，同样带上延迟
+        with mock.patch.object(os, "stat", slow(os.stat, latency)), \
+                mock.patch.object(os, "scandir", slow(os.scandir, latency)):
+            results = [
+                ("逐个 os.path.exists", timed(lambda: [os.path.exists(path) for path in paths], args.rounds)),
+                ("PathValidator 冷启动", timed(cold, args.rounds)),
+                ("PathValidator 检查 mtime", timed(lambda: revalidating.check_many(paths), args.rounds)),
+                ("PathValidator 预热", timed(lambda: warm_validator.check_many(paths), args.rounds)),
+            ]
+        
+        print(f"{args.paths} 个路径，{args.dirs} 个目录，文件系统延迟 {args.fs_latency}ms")
+        for label, elapsed in results:
+            print(f"{label:<28} {elapsed:>10.3f} ms")
+    finally:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
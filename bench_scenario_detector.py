@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+场景检测基准测试
+Microbenchmark: naive keyword scan vs the Aho-Corasick scenario detector
+
+按场景关键词数量（真实关键词 + 合成关键词）分别测量两种实现的单次检测耗时：
+  - naive: 原 _detect_scenario 的实现，逐个场景、逐个关键词做子串查找
+  - automaton: scenario_detector.ScenarioDetector，一遍扫描输入
+
+用法:
+    python bench_scenario_detector.py                    # 默认 100/1000/5000 个关键词
+    python bench_scenario_detector.py --sizes 100 10000  # 指定关键词数量
+    python bench_scenario_detector.py --rounds 2000      # 每个输入的重复次数
+"""
+import argparse
+import random
+import string
+import time
+from typing import Dict, List
+
+from ai_command_parser import AICommandParser
+from scenario_detector import DEFAULT_SCENARIO, SPECIAL_RULES, ScenarioDetector
+
+
+SAMPLE_INPUTS = [
+    "创建一个名为 test 的文件夹",
+    "下载 https://example.com/file.tar.gz 到当前目录",
+    "创建用户 alice 并添加到 sudo 组",
+    "编辑配置文件 /etc/nginx/nginx.conf",
+    "查看 /var/log/syslog 中包含 error 的行",
+    "show disk usage of the home directory sorted by size",
+    "把当前目录下所有 .log 文件打包压缩后通过 scp 复制到远程服务器",
+    "列出占用内存最多的 10 个进程",
+]
+
+
+def naive_detect(scenario_keywords: Dict[str, List[str]], user_input: str) -> str:
+    """原实现：特殊规则 + 逐个关键词子串查找（作为基准和正确性参照）"""
+    user_input_lower = user_input.lower()
+    
+    for scenario, _, groups in SPECIAL_RULES:
+        if all(any(word in user_input_lower for word in words) for words in groups):
+            return scenario
+    
+    scenario_scores = {}
+    for scenario, keywords in scenario_keywords.items():
+        scenario_scores[scenario] = sum(1 for keyword in keywords if keyword.lower() in user_input_lower)
+    
+    max_score = max(scenario_scores.values())
+    if max_score > 0:
+        for scenario, score in scenario_scores.items():
+            if score == max_score:
+                return scenario
+    return DEFAULT_SCENARIO
+
+
+def synthetic_keywords(total: int, seed: int = 0) -> Dict[str, List[str]]:
+    """在真实关键词表基础上补充随机关键词，使关键词总数约为 total"""
+    rng = random.Random(seed)
+    keywords = {scenario: list(words) for scenario, words in AICommandParser.SCENARIO_KEYWORDS.items()}
+    scenarios = list(keywords)
+    existing = sum(len(words) for words in keywords.values())
+    for _ in range(max(0, total - existing)):
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+        keywords[rng.choice(scenarios)].append(word)
+    return keywords
+
+
+def time_per_call(detect, rounds: int) -> float:
+    """每次检测的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in SAMPLE_INPUTS:
+            detect(text)
+    return (time.perf_counter() - start) / (rounds * len(SAMPLE_INPUTS)) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="场景检测基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="关键词总数（默认 100 1000 5000，不少于真实关键词数）")
+    parser.add_argument("--rounds", type=int, default=200, help="每个输入的重复次数")
+    args = parser.parse_args(argv)
+    
+    print(f"{'关键词数':>8} {'模式数':>8} {'编译(ms)':>10} {'naive(µs)':>11} {'automaton(µs)':>14} {'加速':>7}")
+    for size in args.sizes:
+        keywords = synthetic_keywords(size)
+        
+        start = time.perf_counter()
+        detector = ScenarioDetector(keywords)
+        compile_ms = (time.perf_counter() - start) * 1000
+        
+        for text in SAMPLE_INPUTS:
+            assert detector.detect(text) == naive_detect(keywords, text), text
+        
+        naive_us = time_per_call(lambda text: naive_detect(keywords, text), args.rounds)
+        automaton_us = time_per_call(detector.detect, args.rounds)
+        total = sum(len(words) for words in keywords.values())
+        print(f"{total:>8} {detector.pattern_count:>8} {compile_ms:>10.1f} "
+              f"{naive_us:>11.1f} {automaton_us:>14.1f} {naive_us / automaton_us:>6.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
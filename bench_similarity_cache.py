@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+相似输入缓存基准测试
+Microbenchmark: lookup latency of the near-duplicate query cache
+
+生成指定数量的合成输入（中文词组 + 部分带路径参数）写入缓存，
+再分别测量未命中（全新输入）和改写过的已有输入的单次查询耗时，
+以及重启时从磁盘重建索引的耗时。
+
+用法:
+    python bench_similarity_cache.py                  # 默认 1000/10000/50000 条
+    python bench_similarity_cache.py --sizes 20000    # 指定记录数
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from similarity_cache import SimilarityCache
+
+
+SCENARIOS = ["file_operations", "system_management", "network_operations",
+             "text_processing", "command_generation"]
+
+
+def make_inputs(count: int, seed: int = 0):
+    """生成 (输入, 场景) 列表"""
+    rng = random.Random(seed)
+    chars = [chr(0x4e00 + i) for i in range(0, 3000, 7)]
+    vocabulary = [''.join(rng.choice(chars) for _ in range(rng.randint(2, 3))) for _ in range(400)]
+    inputs = []
+    for _ in range(count):
+        text = ''.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 5)))
+        if rng.random() < 0.3:
+            text += f" /tmp/file{rng.randint(0, 999)}"
+        inputs.append((text, rng.choice(SCENARIOS)))
+    return inputs
+
+
+def time_per_lookup(cache: SimilarityCache, queries) -> float:
+    """每次查询的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for text, scenario in queries:
+        cache.find(text, scenario)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="相似输入缓存基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="缓存记录数（默认 1000 10000 50000）")
+    parser.add_argument("--queries", type=int, default=2000, help="每组查询次数")
+    args = parser.parse_args(argv)
+    
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print(f"{'记录数':>8} {'加载(ms)':>10} {'未命中(µs)':>12} {'命中(µs)':>10} {'命中率':>8}")
+        for size in args.sizes:
+            path = os.path.join(tmpdir, f"similar_{size}.db")
+            cache = SimilarityCache(path, max_entries=size)
+            entries = make_inputs(size, seed=size)
+            for index, (text, scenario) in enumerate(entries):
+                cache.put(text, scenario, f"command {index}")
+            cache.close()
+            
+            start = time.perf_counter()
+            cache = SimilarityCache(path, max_entries=size)
+            load_ms = (time.perf_counter() - start) * 1000
+            
+            misses = make_inputs(args.queries, seed=-size)
+            # 改写：加一个字、加语气词，归一化后与原输入不完全相同
+            rephrased = [("看看" + text + "吧", scenario) for text, scenario in entries[:args.queries]]
+            miss_us = time_per_lookup(cache, misses)
+            hit_us = time_per_lookup(cache, rephrased)
+            hit_rate = sum(cache.find(text, scenario) is not None
+                           for text, scenario in rephrased) / len(rephrased)
+            print(f"{size:>8} {load_ms:>10.0f} {miss_us:>12.1f} {hit_us:>10.1f} {hit_rate:>7.0%}")
+            cache.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+投机解析基准测试
+Benchmark: perceived latency of speculative vs sequential tiered parsing
+
+用固定延迟的模拟 AI 解析器代替真实 API，对一组输入分别测量：
+  - 顺序解析（当前流程）：本地各层没有把握时等待 AI 返回后才显示命令
+  - 投机解析：本地有低置信度候选时立即显示，AI 在后台确认
+感知延迟指从输入到第一次显示可执行命令的时间；AI 最终结果的到达时间两者相同。
+
+用法:
+    python bench_speculative.py                     # 模拟 AI 延迟 800ms
+    python bench_speculative.py --ai-latency 2.0    # 指定模拟延迟（秒）
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+from ai_provider import CircuitBreaker
+from nlp_parser import NLPParser
+from tiered_parser import TieredParser
+
+
+SAMPLE_INPUTS = [
+    "查看磁盘空间",
+    "创建文件夹 backup",
+    "帮我看一下磁盘空间还剩多少",
+    "显示当前目录下的所有文件",
+    "查看一下当前目录",
+    "列出文件并按大小排序",
+    "统计每个用户的进程数",
+    "查看系统进程情况",
+]
+
+
+class SlowAIParser:
+    """固定延迟的模拟 AI 解析器（可取消）"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.templates = None
+        self.similar_cache = None
+        self.ai_provider = SimpleNamespace(breaker=CircuitBreaker())
+    
+    def parse_command(self, user_input, local_lookup=True, cancel=None):
+        if cancel is not None:
+            cancel.wait(self.latency)
+        else:
+            time.sleep(self.latency)
+        return "echo ai"
+
+
+def first_display_ms(resolver: TieredParser, text: str, speculate: bool) -> float:
+    """从输入到第一次得到可显示命令的耗时（毫秒）"""
+    start = time.perf_counter()
+    result = resolver.resolve(text, speculate=speculate)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result['speculation']:
+        result['speculation'].cancel()
+    return elapsed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="投机解析基准测试")
+    parser.add_argument("--ai-latency", type=float, default=0.8, help="模拟 AI 延迟（秒，默认 0.8）")
+    args = parser.parse_args(argv)
+    
+    ai_parser = SlowAIParser(args.ai_latency)
+    resolver = TieredParser(NLPParser(), lambda: ai_parser)
+    
+    print(f"{'输入':<20} {'顺序(ms)':>10} {'投机(ms)':>10}")
+    totals = [0.0, 0.0]
+    for text in SAMPLE_INPUTS:
+        sequential = first_display_ms(resolver, text, speculate=False)
+        speculative = first_display_ms(resolver, text, speculate=True)
+        totals[0] += sequential
+        totals[1] += speculative
+        print(f"{text:<20} {sequential:>10.2f} {speculative:>10.2f}")
+    
+    count = len(SAMPLE_INPUTS)
+    print(f"{'平均':<20} {totals[0] / count:>10.2f} {totals[1] / count:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
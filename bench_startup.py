@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+启动时间基准测试
+Startup benchmark: import time of cli_ai and cold start to the CLI-AI> prompt
+
+每次测量都在新的子进程中进行（冷启动）：
+  1. python -X importtime -c "import cli_ai"，解析每个模块的累计导入耗时
+  2. 从进程启动到打印完欢迎信息（即将显示 CLI-AI> 提示符）的总耗时
+
+用法:
+    python bench_startup.py            # 测量并检查预算，超出预算时返回码为 1
+    python bench_startup.py --runs 10  # 多次测量取中位数
+    python bench_startup.py --top 15   # 显示导入最慢的 15 个模块
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# 预算（毫秒），在较慢的 CI 机器上也应留有余量
+IMPORT_BUDGET_MS = 250
+PROMPT_BUDGET_MS = 600
+
+# 启动时不应导入的重量级依赖（由 AI 功能首次使用时加载）
+LAZY_MODULES = ("openai", "httpx", "dotenv", "ai_provider", "ai_command_parser")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 构造 CLIAI 并打印欢迎信息（后台预热照常启动，与真实启动一致）
+PROMPT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import cli_ai
+app = cli_ai.CLIAI()
+app.print_welcome()
+sys.stderr.write("PROMPT_MS %.3f\\n" % ((time.perf_counter() - start) * 1000))
+"""
+
+
+def _child_env():
+    """子进程环境：不写 .pyc，保证每次测量条件一致"""
+    env = os.environ.copy()
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure_imports():
+    """
+    用 -X importtime 测量一次 import cli_ai
+    
+    Returns:
+        dict: 模块名 -> 累计导入耗时（毫秒）
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import cli_ai"],
+        cwd=ROOT, env=_child_env(), capture_output=True, text=True, check=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        # 格式: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative) / 1000
+    return timings
+
+
+def measure_prompt():
+    """
+    测量从进程启动到欢迎信息打印完毕的耗时
+    
+    Returns:
+        tuple: (进程总耗时毫秒, 进程内耗时毫秒)
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROMPT_SCRIPT],
+        cwd=ROOT, env=_child_env(), capture_output=True, text=True, check=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    inner_ms = 0.0
+    for line in result.stderr.splitlines():
+        if line.startswith("PROMPT_MS"):
+            inner_ms = float(line.split()[1])
+    return wall_ms, inner_ms
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="CLI-AI 启动时间基准测试")
+    arg_parser.add_argument("--runs", type=int, default=5, help="测量次数（取中位数）")
+    arg_parser.add_argument("--top", type=int, default=10, help="显示导入最慢的模块数")
+    args = arg_parser.parse_args()
+    
+    import_runs = [measure_imports() for _ in range(args.runs)]
+    prompt_runs = [measure_prompt() for _ in range(args.runs)]
+    
+    import_ms = statistics.median(run["cli_ai"] for run in import_runs)
+    wall_ms = statistics.median(run[0] for run in prompt_runs)
+    inner_ms = statistics.median(run[1] for run in prompt_runs)
+    eager = sorted(name for name in LAZY_MODULES if name in import_runs[-1])
+    
+    print(f"import cli_ai:          {import_ms:8.1f} ms（预算 {IMPORT_BUDGET_MS} ms）")
+    print(f"冷启动到 CLI-AI> 提示符: {wall_ms:8.1f} ms（进程内 {inner_ms:.1f} ms，"
+          f"预算 {PROMPT_BUDGET_MS} ms）")
+    
+    print(f"\n导入最慢的 {args.top} 个模块（累计耗时，最后一次测量）:")
+    slowest = sorted(import_runs[-1].items(), key=lambda item: item[1], reverse=True)
+    for name, ms in slowest[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+    
+    failures = []
+    if eager:
+        failures.append(f"启动时导入了应延迟加载的模块: {', '.join(eager)}")
+    if import_ms > IMPORT_BUDGET_MS:
+        failures.append(f"import cli_ai 超出预算: {import_ms:.1f} ms > {IMPORT_BUDGET_MS} ms")
+    if wall_ms > PROMPT_BUDGET_MS:
+        failures.append(f"冷启动超出预算: {wall_ms:.1f} ms > {PROMPT_BUDGET_MS} ms")
+    
+    if failures:
+        print()
+        for failure in failures:
+            print(f"✗ {failure}")
+        return 1
+    print("\n✓ 启动时间在预算内")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,11 @@ CLI-AI: Terminal AI Assistant for Linux Commands
 Helps Linux beginners execute commands using natural language
 """
 
+import importlib.util
 import sys
 import os
+import threading
+import time
 
 # Optional: colorama for colored terminal output
 try:
@@ -29,22 +32,28 @@ except ImportError:
     })()
 
 from nlp_parser import NLPParser
+from tiered_parser import TIER_NAMES, TieredParser, describe_resolution
+from conversation import ConversationMemory
 from command_executor import CommandExecutor
 from config_manager import handle_config_command
 import config
 
-# AI 相关导入（可选）
-HAS_AI = False
+# AI 相关依赖（可选）
+# 启动时只检查依赖是否已安装，不导入：openai/httpx 的导入耗时占启动时间的大部分，
+# 而规则匹配就能处理的输入（如 pwd）完全用不到它们。AI 模块在后台预热或首次使用时加载。
+AI_DEPENDENCIES = ("openai", "httpx", "dotenv")
+HAS_AI = all(importlib.util.find_spec(name) is not None for name in AI_DEPENDENCIES)
 AICommandParser = None
 AIErrorAnalyzer = None
 AICommandSuggester = None
 
-try:
-    from ai_command_parser import AICommandParser
-    from ai_error_analyzer import AIErrorAnalyzer, AICommandSuggester
-    HAS_AI = True
-except ImportError:
-    pass
+
+def _import_ai_modules():
+    """导入 AI 模块（只在第一次调用时真正导入）"""
+    global AICommandParser, AIErrorAnalyzer, AICommandSuggester
+    if AICommandParser is None:
+        from ai_command_parser import AICommandParser
+        from ai_error_analyzer import AIErrorAnalyzer, AICommandSuggester
 
 
 class CLIAI:
@@ -64,35 +73,92 @@ class CLIAI:
         self.error_analyzer = None
         self.command_suggester = None
         
-        # 尝试初始化 AI 模块
-        if self.use_ai_parsing and HAS_AI:
+        # AI 模块延迟加载：_load_ai 只执行一次，初始化失败的提示留到首次使用时显示
+        self._ai_lock = threading.Lock()
+        self._ai_loaded = not (self.use_ai_parsing or self.ai_error_analysis or self.auto_continue)
+        self._ai_notices = []
+        
+        # 分层解析：本地规则有把握时不加载 AI，也不访问网络
+        self.resolver = TieredParser(self.parser, self._get_ai_parser)
+        
+        # 多轮对话：每一轮都记录（包括本地解析的），AI 加载后随请求发送
+        self.conversation = ConversationMemory(
+            token_budget=config.AI_CONVERSATION_TOKEN_BUDGET,
+            max_turns=config.AI_CONVERSATION_MAX_TURNS
+        ) if config.AI_CONVERSATION_MEMORY else None
+        
+        if not self._ai_loaded and config.AI_PREWARM_CONNECTION:
+            # 在显示欢迎信息、等待用户输入期间加载 AI 模块并建立连接
+            threading.Thread(target=self._load_ai, kwargs={'warm_up': True}, daemon=True).start()
+    
+    def _load_ai(self, warm_up=False):
+        """
+        导入 AI 模块并初始化解析器、错误分析器和建议器（线程安全，只执行一次）
+        
+        Args:
+            warm_up (bool): 初始化完成后是否预热 AI 连接
+        """
+        with self._ai_lock:
+            if self._ai_loaded:
+                return
             try:
-                self.ai_parser = AICommandParser()
-                print(f"{Fore.GREEN}✓ AI 命令解析已启用{Style.RESET_ALL}")
+                self._init_ai_modules()
+            finally:
+                # 加载结束（无论成功与否）后才标记，首次使用时不会拿到未初始化完的对象
+                self._ai_loaded = True
+        
+        if warm_up and self.ai_parser:
+            self.ai_parser.ai_provider.warm_up()
+    
+    def _get_ai_parser(self):
+        """分层解析需要模板、缓存或 AI 时获取 AI 解析器（按需加载，未启用时返回 None）"""
+        if not self.use_ai_parsing:
+            return None
+        self._ensure_ai()
+        return self.ai_parser if self.use_ai_parsing else None
+    
+    def _init_ai_modules(self):
+        """导入 AI 模块并创建解析器、错误分析器和建议器，失败的功能退回规则匹配"""
+        try:
+            _import_ai_modules()
+        except ImportError as e:
+            self._ai_notices.append(f"⚠️  AI 模块加载失败，将使用规则匹配: {e}")
+            self.use_ai_parsing = self.ai_error_analysis = self.auto_continue = False
+            return
+        
+        if self.use_ai_parsing:
+            try:
+                self.ai_parser = AICommandParser(conversation=self.conversation)
             except ValueError as e:
                 # API 密钥或配置错误
-                print(f"{Fore.YELLOW}⚠️  AI 命令解析初始化失败: {Style.RESET_ALL}")
-                error_msg = str(e)
-                for line in error_msg.split('\n'):
-                    print(f"{Fore.YELLOW}   {line}{Style.RESET_ALL}")
-                print(f"{Fore.YELLOW}   将使用规则匹配模式{Style.RESET_ALL}")
+                self._ai_notices.append("⚠️  AI 命令解析初始化失败: ")
+                for line in str(e).split('\n'):
+                    self._ai_notices.append(f"   {line}")
+                self._ai_notices.append("   将使用规则匹配模式")
                 self.use_ai_parsing = False
             except Exception as e:
-                print(f"{Fore.YELLOW}⚠️  AI 命令解析初始化失败，将使用规则匹配: {e}{Style.RESET_ALL}")
+                self._ai_notices.append(f"⚠️  AI 命令解析初始化失败，将使用规则匹配: {e}")
                 self.use_ai_parsing = False
         
-        if self.ai_error_analysis and HAS_AI:
+        if self.ai_error_analysis:
             try:
                 self.error_analyzer = AIErrorAnalyzer()
             except Exception:
                 self.ai_error_analysis = False
         
-        if self.auto_continue and HAS_AI:
+        if self.auto_continue:
             try:
                 self.command_suggester = AICommandSuggester()
             except Exception:
                 self.auto_continue = False
     
+    def _ensure_ai(self):
+        """首次使用 AI 功能前确保 AI 模块已加载（后台加载未完成时等待），并显示初始化提示"""
+        if not self._ai_loaded:
+            self._load_ai()
+        while self._ai_notices:
+            print(f"{Fore.YELLOW}{self._ai_notices.pop(0)}{Style.RESET_ALL}")
+    
     def print_welcome(self):
         """Print welcome message"""
         print(f"{Fore.CYAN}{Style.BRIGHT}")
@@ -121,6 +187,11 @@ class CLIAI:
         print("  - 输入 'help' 查看常用命令")
         print("  - 输入 'history' 查看命令历史")
         print("  - 输入 'config' 查看或修改配置")
+        print("  - 输入 'status' 查看 AI 服务状态")
+        print("  - 输入 'stats' 查看 AI 调用的延迟和 token 统计")
+        print("  - 输入 'clear cache' 清空 AI 响应缓存")
+        print("  - 输入 'templates' 查看从 AI 解析结果中学到的参数模板")
+        print("  - 输入 'new' 开始新的对话（清空多轮对话记忆）")
         print("  - 输入 'exit' 或 'quit' 退出程序")
         print(f"{Style.RESET_ALL}")
     
@@ -156,24 +227,186 @@ class CLIAI:
         else:
             print(f"{Fore.YELLOW}暂无命令历史{Style.RESET_ALL}")
     
-    def confirm_execution(self, command):
+    def print_ai_status(self):
+        """Print AI provider status (circuit breaker, response cache, hedging)"""
+        self._ensure_ai()
+        if not self.ai_parser:
+            print(f"{Fore.YELLOW}AI 命令解析未启用，当前使用规则匹配模式{Style.RESET_ALL}")
+            return
+        
+        provider = self.ai_parser.ai_provider
+        breaker = provider.breaker.snapshot()
+        state_names = {
+            'closed': f"{Fore.GREEN}正常{Style.RESET_ALL}",
+            'open': f"{Fore.RED}熔断中{Style.RESET_ALL}",
+            'half_open': f"{Fore.YELLOW}半开（等待探测请求）{Style.RESET_ALL}"
+        }
+        
+        print(f"\n{Fore.CYAN}AI 服务状态:{Style.RESET_ALL}")
+        print(f"  提供商: {provider.provider} ({provider.get_model()})")
+        print(f"  熔断器: {state_names.get(breaker['state'], breaker['state'])}")
+        print(f"  连续失败次数: {breaker['consecutive_failures']}")
+        if breaker['reopen_at']:
+            reopen_time = time.strftime("%H:%M:%S", time.localtime(breaker['reopen_at']))
+            print(f"  恢复时间: {reopen_time}（{breaker['seconds_until_retry']:.0f} 秒后）")
+        
+        limiter = provider.get_rate_limit_stats()
+        if limiter:
+            rpm = f"{limiter['requests_per_minute']:.0f}" if limiter['requests_per_minute'] else "未知"
+            tpm = f"{limiter['tokens_per_minute']:.0f}" if limiter['tokens_per_minute'] else "未知"
+            line = (f"  客户端限流: 每分钟请求 {rpm}，token {tpm}，"
+                    f"已排队 {limiter['waits']} 次（共 {limiter['wait_seconds']:.1f} 秒），"
+                    f"收到 429 {limiter['throttled']} 次")
+            if limiter['paused_for']:
+                line += f"，暂停中（{limiter['paused_for']:.1f} 秒）"
+            print(line)
+        
+        cache = provider.get_cache_stats()
+        if cache:
+            print(f"  响应缓存: {cache['entries']}/{cache['max_entries']} 条，"
+                  f"命中 {cache['hits']}，未命中 {cache['misses']}"
+                  f"（命中率 {cache['hit_rate']:.0%}）")
+        
+        if self.ai_parser.templates:
+            templates = self.ai_parser.templates.stats()
+            print(f"  参数模板: {templates['templates']}/{templates['max_templates']} 个，"
+                  f"命中 {templates['hits']}，未命中 {templates['misses']}"
+                  f"（命中率 {templates['hit_rate']:.0%}）")
+        
+        if self.ai_parser.similar_cache:
+            similar = self.ai_parser.similar_cache.stats()
+            print(f"  相似输入缓存: {similar['entries']}/{similar['max_entries']} 条，"
+                  f"阈值 {similar['threshold']:.2f}，命中 {similar['hits']}，"
+                  f"未命中 {similar['misses']}（命中率 {similar['hit_rate']:.0%}）")
+        
+        if self.ai_parser.conversation:
+            conversation = self.ai_parser.conversation.stats()
+            print(f"  多轮对话: 已记录 {conversation['turns']} 轮，"
+                  f"发送 {conversation['included']} 轮"
+                  f"（另有 {conversation['summarized']} 轮压缩为摘要），"
+                  f"约 {conversation['tokens']}/{conversation['token_budget']} token")
+        
+        if self.ai_parser.examples:
+            examples = self.ai_parser.examples.stats()
+            print(f"  动态示例: {examples['examples']} 条（{examples['prompts']} 个提示词），"
+                  f"每次平均发送 {examples['avg_example_tokens']:.0f} token，"
+                  f"累计节省约 {examples['saved_tokens']} token")
+        
+        if provider.hedge_backend:
+            hedge = provider.get_hedge_stats()
+            print(f"  对冲请求: 已启用（备用: {provider.hedge_backend['provider']}，"
+                  f"延迟 {provider.hedge_delay * 1000:.0f}ms，已触发 {hedge['hedges_fired']} 次）")
+            for name, stats in hedge['backends'].items():
+                print(f"    {name}: 请求 {stats['requests']}，胜出 {stats['wins']}，"
+                      f"首 token p50 {stats['first_token_ms']['p50']:.0f}ms / "
+                      f"p95 {stats['first_token_ms']['p95']:.0f}ms")
+    
+    def print_ai_stats(self):
+        """Print tier statistics and AI call telemetry (latency percentiles and token totals)"""
+        tiers = self.resolver.stats()
+        answered = [(tier, summary) for tier, summary in tiers['tiers'].items() if summary['answered']]
+        if answered or tiers['unresolved']:
+            print(f"\n{Fore.CYAN}分层解析统计:{Style.RESET_ALL}")
+            for tier, summary in answered:
+                print(f"  {TIER_NAMES[tier]}: {summary['answered']} 次，平均 {summary['avg_ms']:.2f}ms")
+            if tiers['unresolved']:
+                print(f"  无法解析: {tiers['unresolved']} 次")
+        
+        self._ensure_ai()
+        if not self.ai_parser:
+            print(f"{Fore.YELLOW}AI 命令解析未启用，暂无 AI 调用统计{Style.RESET_ALL}")
+            return
+        
+        stats = self.ai_parser.ai_provider.get_telemetry_stats()
+        total = stats['total']
+        if not total and not stats['warmups']:
+            print(f"{Fore.YELLOW}暂无 AI 调用记录{Style.RESET_ALL}")
+            return
+        
+        def describe(summary):
+            latency = summary['latency_ms']
+            counts = f"失败 {summary['errors']}，缓存 {summary['cached']}"
+            if summary['coalesced']:
+                counts += f"，合并 {summary['coalesced']}"
+            line = (f"{summary['calls']} 次（{counts}），"
+                    f"耗时 p50 {latency['p50']:.0f}ms / p95 {latency['p95']:.0f}ms / "
+                    f"p99 {latency['p99']:.0f}ms，"
+                    f"token {summary['prompt_tokens']} + {summary['completion_tokens']}")
+            if summary['estimated']:
+                # 流式提前结束的调用没有用量数据，前缀缓存命中数只来自其余调用
+                line += f"（{summary['estimated']} 次为估算，不含前缀缓存命中数）"
+            if summary['cached_prompt_tokens']:
+                line += f"（前缀缓存命中 {summary['cached_prompt_tokens']}）"
+            first_token = summary['first_token_ms']
+            if first_token['p50']:
+                line += f"，首 token p50 {first_token['p50']:.0f}ms / p95 {first_token['p95']:.0f}ms"
+            queue = summary['queue_ms']
+            if queue['p95']:
+                line += f"，限流排队 p50 {queue['p50']:.0f}ms / p95 {queue['p95']:.0f}ms"
+            return line
+        
+        print(f"\n{Fore.CYAN}AI 调用统计:{Style.RESET_ALL}")
+        if total:
+            print(f"  总计: {describe(total)}")
+        for warmup in stats['warmups']:
+            if warmup['success']:
+                print(f"  连接预热: {warmup['provider']} 成功，耗时 {warmup['latency_ms']:.0f}ms，"
+                      f"首个请求约节省 {warmup['saved_ms']:.0f}ms")
+            else:
+                print(f"  连接预热: {warmup['provider']} 失败")
+        if stats['callers']:
+            print(f"{Fore.GREEN}按调用方:{Style.RESET_ALL}")
+            for name, summary in sorted(stats['callers'].items()):
+                print(f"  {name}: {describe(summary)}")
+        if stats['scenarios']:
+            print(f"{Fore.GREEN}按场景:{Style.RESET_ALL}")
+            for name, summary in sorted(stats['scenarios'].items()):
+                print(f"  {name}: {describe(summary)}")
+    
+    def clear_ai_cache(self):
+        """Clear the on-disk AI response cache and the similar-input cache"""
+        self._ensure_ai()
+        cache = self.ai_parser.ai_provider.cache if self.ai_parser else None
+        similar_cache = self.ai_parser.similar_cache if self.ai_parser else None
+        if not cache and not similar_cache:
+            print(f"{Fore.YELLOW}响应缓存未启用（在 .env 中设置 AI_CACHE=true 或 "
+                  f"AI_SIMILAR_CACHE=true 启用）{Style.RESET_ALL}")
+            return
+        if cache:
+            cache.clear()
+            print(f"{Fore.GREEN}✓ 响应缓存已清空{Style.RESET_ALL}")
+        if similar_cache:
+            similar_cache.clear()
+            print(f"{Fore.GREEN}✓ 相似输入缓存已清空{Style.RESET_ALL}")
+    
+    def print_templates(self):
+        """Print parametric templates learned from confirmed AI translations"""
+        self._ensure_ai()
+        learner = self.ai_parser.templates if self.ai_parser else None
+        if not learner:
+            print(f"{Fore.YELLOW}参数模板未启用（在 .env 中设置 AI_TEMPLATES=true 启用）{Style.RESET_ALL}")
+            return
+        templates = learner.templates()
+        if not templates:
+            print(f"{Fore.YELLOW}还没有学到参数模板（确认执行 AI 解析的命令后自动学习）{Style.RESET_ALL}")
+            return
+        print(f"\n{Fore.CYAN}已学到的参数模板:{Style.RESET_ALL}")
+        for template in templates:
+            print(f"  {template['input']}  →  {Fore.WHITE}{template['command']}{Style.RESET_ALL}"
+                  f"（确认 {template['confirmations']} 次，使用 {template['hits']} 次）")
+    
+    def confirm_execution(self, command, details=None):
         """
         Ask user to confirm command execution
         
         Args:
             command (str): Command to execute
+            details (dict): Structured AI output for the command (optional)
             
         Returns:
             bool: True if user confirms
         """
-        # Check if command is dangerous
-        is_dangerous = self.executor.is_dangerous_command(command)
-        
-        if is_dangerous:
-            print(f"\n{Fore.RED}{Style.BRIGHT}⚠️  警告: 这是一个危险命令！{Style.RESET_ALL}")
-            print(f"{Fore.RED}此命令可能会造成数据丢失或系统损坏！{Style.RESET_ALL}")
-        
-        print(f"\n{Fore.YELLOW}我将执行命令: {Fore.WHITE}{Style.BRIGHT}{command}{Style.RESET_ALL}")
+        self._print_command(command, details=details)
         
         while True:
             try:
@@ -188,21 +421,114 @@ class CLIAI:
                 print()
                 return False
     
-    def execute_command(self, command):
+    def _print_command(self, command, label="我将执行命令", details=None):
+        """
+        Print the command to be confirmed, with a warning if it is dangerous
+        
+        The model's own judgement (structured output) can only add a warning:
+        a command matching the local dangerous patterns is always flagged.
+        """
+        details = details or {}
+        if self.executor.is_dangerous_command(command) or details.get('is_dangerous'):
+            print(f"\n{Fore.RED}{Style.BRIGHT}⚠️  警告: 这是一个危险命令！{Style.RESET_ALL}")
+            print(f"{Fore.RED}此命令可能会造成数据丢失或系统损坏！{Style.RESET_ALL}")
+        
+        print(f"\n{Fore.YELLOW}{label}: {Fore.WHITE}{Style.BRIGHT}{command}{Style.RESET_ALL}")
+        if details.get('explanation'):
+            print(f"{Fore.CYAN}说明: {details['explanation']}{Style.RESET_ALL}")
+    
+    def confirm_speculative(self, resolution):
+        """
+        Show the local candidate while the AI parses the same input in the background
+        
+        Confirming the candidate runs it right away and cancels the AI request;
+        pressing Enter waits for the AI answer, which replaces the candidate.
+        
+        Args:
+            resolution (dict): Result of TieredParser.resolve with a running speculation
+            
+        Returns:
+            tuple: (command, confirmed)
+        """
+        speculation = resolution['speculation']
+        candidate = resolution['command']
+        prompt = f"{Fore.CYAN}是否继续？(y/n，回车等待 AI 结果): {Style.RESET_ALL}"
+        answered = threading.Event()
+        
+        def announce(done):
+            # AI 在用户回答之前完成：提示结果，再次显示输入提示
+            if answered.is_set():
+                return
+            if done.command and done.command != candidate:
+                print(f"\n{Fore.CYAN}🤖 AI 给出了不同的命令，回车查看{Style.RESET_ALL}")
+            elif done.command:
+                print(f"\n{Fore.CYAN}🤖 AI 确认了这条命令{Style.RESET_ALL}")
+            else:
+                return
+            print(prompt, end="", flush=True)
+        
+        self._print_command(candidate, label="规则候选（AI 正在确认）")
+        speculation.on_done(announce)
+        
+        while True:
+            try:
+                response = input(prompt).strip().lower()
+            except (EOFError, KeyboardInterrupt):
+                print()
+                response = 'n'
+            if response in ['y', 'yes', '是', 'ok']:
+                answered.set()
+                speculation.cancel()
+                return candidate, True
+            elif response in ['n', 'no', '否', 'cancel']:
+                answered.set()
+                speculation.cancel()
+                return candidate, False
+            elif not response:
+                answered.set()
+                break
+            else:
+                print(f"{Fore.RED}请输入 y 或 n，或直接回车等待 AI{Style.RESET_ALL}")
+        
+        if not speculation.done():
+            print(f"{Fore.CYAN}🤖 等待 AI 解析...{Style.RESET_ALL}")
+            try:
+                speculation.wait()
+            except KeyboardInterrupt:
+                print()
+                speculation.cancel()
+                return candidate, False
+        
+        if speculation.error:
+            print(f"{Fore.YELLOW}⚠️  AI 解析失败: {speculation.error}{Style.RESET_ALL}")
+            print(f"{Fore.YELLOW}   使用规则候选{Style.RESET_ALL}")
+        elif self.resolver.adopt(resolution):
+            print(f"{Fore.CYAN}🤖 {describe_resolution(resolution)}{Style.RESET_ALL}")
+        return resolution['command'], self.confirm_execution(resolution['command'], resolution['details'])
+    
+    def execute_command(self, command, details=None):
         """
         Execute a command and display results
         
         Args:
             command (str): Command to execute
+            details (dict): Structured AI output for the command (optional)
+        
+        Returns:
+            dict: Execution result from CommandExecutor.execute
         """
         # Check if command needs interactive mode
-        is_interactive = self.executor.is_interactive_command(command)
+        # 模型判断需要终端时同样以交互模式执行（本地规则识别出的交互命令不受影响）
+        is_interactive = (self.executor.is_interactive_command(command)
+                          or bool(details and details.get('needs_tty')))
         
         if is_interactive:
             print(f"{Fore.CYAN}执行交互式命令...{Style.RESET_ALL}")
         
         # Execute command
         result = self.executor.execute(command, interactive=is_interactive)
+        if self.ai_error_analysis or self.auto_continue:
+            self._ensure_ai()
         
         # Display results
         if result['success']:
@@ -223,6 +549,7 @@ class CLIAI:
             # AI 错误分析
             if self.ai_error_analysis and self.error_analyzer:
                 self._analyze_and_suggest_fix(command, result)
+        return result
     
     def _analyze_and_suggest_fix(self, command, result):
         """分析错误并提供修复建议"""
@@ -268,6 +595,32 @@ class CLIAI:
             # 建议功能失败不影响主流程，记录但不显示
             pass
     
+    def _remember_turn(self, user_input, command, result=None):
+        """
+        Record a turn in the conversation memory so follow-ups can refer to it
+        
+        Args:
+            user_input (str): User's input
+            command (str): Command shown to the user
+            result (dict): Execution result, None if the user did not confirm
+        """
+        if self.conversation is None:
+            return
+        if result is None:
+            self.conversation.add(user_input, command, 'cancelled')
+        elif result['success']:
+            self.conversation.add(user_input, command, 'success')
+        else:
+            self.conversation.add(user_input, command, 'failed', result.get('error', ''))
+    
+    def new_conversation(self):
+        """Forget earlier turns so the next request starts a fresh conversation"""
+        if self.conversation is None:
+            print(f"{Fore.YELLOW}多轮对话记忆未启用（config.AI_CONVERSATION_MEMORY）{Style.RESET_ALL}")
+            return
+        self.conversation.clear()
+        print(f"{Fore.GREEN}已开始新的对话{Style.RESET_ALL}")
+    
     def process_input(self, user_input):
         """
         Process user input and execute corresponding command
@@ -294,6 +647,26 @@ class CLIAI:
             self.print_history()
             return
         
+        if user_input.lower() in ['status', '状态']:
+            self.print_ai_status()
+            return
+        
+        if user_input.lower() in ['stats', '统计']:
+            self.print_ai_stats()
+            return
+        
+        if user_input.lower() in ['clear cache', '清除缓存']:
+            self.clear_ai_cache()
+            return
+        
+        if user_input.lower() in ['templates', '模板']:
+            self.print_templates()
+            return
+        
+        if user_input.lower() in ['new', '新对话']:
+            self.new_conversation()
+            return
+        
         # Handle config command
         if user_input.lower().startswith('config'):
             # Parse config command arguments
@@ -303,27 +676,43 @@ class CLIAI:
             return
         
         # Parse natural language to command
-        command = None
-        
-        # 尝试使用 AI 解析
-        if self.use_ai_parsing and self.ai_parser:
-            try:
-                command = self.ai_parser.parse_command(user_input)
-                print(f"{Fore.CYAN}🤖 AI 解析{Style.RESET_ALL}")
-            except Exception as e:
-                print(f"{Fore.YELLOW}⚠️  AI 解析失败: {e}{Style.RESET_ALL}")
+        # 分层解析：精确映射 → 参数规则 → 模糊匹配 → 参数模板 → 相似输入缓存 → AI，
+        # 第一个置信度达到阈值的层给出结果
+        # 投机解析：本地只有低置信度候选时先显示候选，AI 在后台确认
+        resolution = self.resolver.resolve(user_input, speculate=config.AI_SPECULATIVE_PARSING)
+        if resolution['circuit_open_until']:
+            # 熔断期间不访问网络，直接使用规则匹配
+            reopen_time = time.strftime("%H:%M:%S", time.localtime(resolution['circuit_open_until']))
+            print(f"{Fore.YELLOW}⚡ AI 服务熔断中（{reopen_time} 后重试），使用规则匹配{Style.RESET_ALL}")
+        for attempt in resolution['attempts']:
+            if attempt['tier'] == 'ai' and attempt['error']:
+                print(f"{Fore.YELLOW}⚠️  AI 解析失败: {attempt['error']}{Style.RESET_ALL}")
                 print(f"{Fore.YELLOW}   尝试使用规则匹配...{Style.RESET_ALL}")
         
-        # 如果 AI 解析失败或未启用，使用规则匹配
-        if not command:
-            command = self.parser.parse(user_input)
+        command = resolution['command']
+        if command:
+            icon = "🤖" if resolution['tier'] == 'ai' else "⚡"
+            print(f"{Fore.CYAN}{icon} {describe_resolution(resolution)}{Style.RESET_ALL}")
+        
+        # Confirm before execution
+        confirmed = False
+        if resolution['speculation']:
+            command, confirmed = self.confirm_speculative(resolution)
+        elif command:
+            confirmed = self.confirm_execution(command, resolution['details'])
+        # 模板和相似输入缓存的结果同样来自 AI，确认后可以继续学习
+        from_ai = resolution['tier'] in ('ai', 'templates', 'similar')
         
         if command:
-            # Confirm before execution
-            if self.confirm_execution(command):
-                self.execute_command(command)
+            if confirmed:
+                if from_ai:
+                    # 用户确认过的 AI 解析结果可以学习为参数模板
+                    self.ai_parser.learn_template(user_input, command)
+                result = self.execute_command(command, resolution['details'])
+                self._remember_turn(user_input, command, result)
             else:
                 print(f"{Fore.YELLOW}已取消执行{Style.RESET_ALL}")
+                self._remember_turn(user_input, command)
         else:
             print(f"{Fore.RED}抱歉，我不理解这个命令。{Style.RESET_ALL}")
             print(f"{Fore.YELLOW}提示: 输入 'help' 查看常用命令示例{Style.RESET_ALL}")
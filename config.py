@@ -37,6 +37,66 @@ FUZZY_MATCH_THRESHOLD = 0.5
 # Requires AI_PROVIDER configuration in .env file
 USE_AI_PARSING = True
 
+# Tiered parsing: exact mapping -> parametric rules -> fuzzy match -> learned
+# templates -> similar-input cache -> AI. The first tier whose confidence reaches
+# this threshold answers; rule hits resolve locally without loading the AI stack
+TIERED_CONFIDENCE_THRESHOLD = 0.8
+
+# Destructive commands (delete files, remove packages, stop processes, power off).
+# Local tiers only answer these outright when they account for the whole input;
+# otherwise the candidate stays below the threshold and the AI is asked
+DESTRUCTIVE_PATTERNS = [
+    r"^(?:sudo\s+)?(?:rm|rmdir|shred|unlink|truncate|dd|mkfs(?:\.\w+)?)\b",
+    r"^(?:sudo\s+)?(?:kill|pkill|killall|shutdown|reboot|halt|poweroff)\b",
+    r"^(?:sudo\s+)?(?:apt|apt-get|yum|dnf|snap)\s+(?:remove|purge|autoremove|erase)\b",
+    r"^(?:sudo\s+)?(?:pip3?|npm)\s+(?:uninstall|remove)\b",
+]
+
+# Speculative parsing: when the local tiers only have a low-confidence candidate,
+# show it immediately while the AI request runs in the background. Confirming the
+# candidate cancels the AI request; pressing Enter waits for the AI answer
+AI_SPECULATIVE_PARSING = True
+
+# Conversation memory: recent turns (input, command, outcome) are sent with AI
+# requests as history, so follow-ups like "now delete it" resolve in context.
+# Older turns are compressed to a command list or dropped to stay within the
+# token budget; type 'new' in the CLI to start a fresh conversation
+AI_CONVERSATION_MEMORY = True
+AI_CONVERSATION_TOKEN_BUDGET = 300
+AI_CONVERSATION_MAX_TURNS = 20
+
+# Streaming AI parsing
+# When enabled, the AI response is streamed and closed as soon as the first
+# complete command line arrives (saves latency and completion tokens)
+AI_STREAM_PARSING = True
+
+# Prompt template hot reload
+# Scenario prompts (prompts/*.txt) are kept in memory; at most once per this
+# many seconds their mtimes are checked and edited files are re-read.
+# Set to 0 to disable hot reload (prompts are read once at startup)
+PROMPT_RELOAD_INTERVAL = 2.0
+
+# Path validation cache
+# Directory listings used to check paths in generated commands are cached by
+# directory mtime; a directory's mtime is re-checked at most once per this
+# many seconds. Set to 0 to re-check on every validation
+PATH_REVALIDATE_INTERVAL = 1.0
+
+# Connection pre-warming
+# When enabled, CLIAI imports the AI modules and opens a connection to the AI
+# endpoint in a background thread at startup, so the first AI request skips
+# both the import cost and DNS/TCP/TLS setup. When disabled, the AI modules
+# are imported on first use.
+AI_PREWARM_CONNECTION = True
+
+# Batch AI parsing (AICommandParser.parse_many)
+# Maximum inputs per request, estimated input-token budget per request,
+# completion tokens reserved per input, and extra rounds for failed items
+AI_BATCH_SIZE = 20
+AI_BATCH_MAX_INPUT_TOKENS = 2000
+AI_BATCH_TOKENS_PER_ITEM = 64
+AI_BATCH_RETRIES = 1
+
 # Auto-continuation mode (v2.2)
 # When enabled, AI will suggest next commands after successful execution
 AUTO_CONTINUE_MODE = False
@@ -0,0 +1,206 @@
+"""
+多轮对话记忆
+Session conversation memory with a token-budgeted rolling window
+
+解析命令原本是单轮的（history=None），"现在删除它""用 sudo 再试一次"
+这类后续输入缺少上下文。这里记录本次会话最近的几轮
+（输入、命令、执行结果），作为对话历史随后续输入的 AI 请求发送
+（独立的输入不带历史，请求保持不变，仍能命中响应缓存）：
+  - 历史渲染为一条系统消息，位于场景提示词之后、动态上下文之前
+  - 严格遵守 token 预算：从最近一轮往前完整加入（放不下全部轮次时
+    最多占预算的 3/4），更早的几轮压缩为只列命令的一行摘要，
+    摘要也放不下的直接丢弃
+  - 每轮的 token 估算在记录时算好，渲染结果缓存到下一次记录，
+    每次请求取历史不需要重新拼接
+
+后续输入（含"它""刚才""again"等指代）的命令取决于上下文，
+不应由参数模板或相似输入缓存给出，见 refers_back。
+"""
+import re
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from token_utils import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+
+DEFAULT_TOKEN_BUDGET = 300
+DEFAULT_MAX_TURNS = 20
+
+HISTORY_HEADING = "## 最近的对话（从早到晚，用于理解\"它\"\"再试一次\"等指代，仍然只返回命令）"
+SUMMARY_PREFIX = "更早执行过: "
+# 放不下全部轮次时完整轮次占用的预算比例
+FULL_TURNS_SHARE = 0.75
+# 错误信息只保留第一行的前若干个字符
+MAX_ERROR_CHARS = 80
+
+OUTCOMES = {
+    'success': "成功",
+    'failed': "失败",
+    'cancelled': "未执行"
+}
+
+# 指代上一轮的词（中文按子串匹配，英文按单词匹配）
+FOLLOW_UP_WORDS_ZH = (
+    '刚才', '刚刚', '上一个', '上一条', '上面', '之前的', '再试', '再来', '再执行', '再运行', '同样', '一样'
+)
+# "它"不算"其它"中的；"这个""那个"等只在单独作代词时算（"删除这个"，而不是"这个目录下的文件"）
+DEMONSTRATIVES_ZH = ('这个', '那个', '这些', '那些')
+FOLLOW_UP_WORDS_EN = ('it', 'them', 'those', 'again', 'same', 'previous', 'instead')
+_FOLLOW_UP_ZH_RE = re.compile(r'(?<!其)它|(?:%s)(?=$|[\s，。！？、；：,.!?;])|%s' % (
+    '|'.join(DEMONSTRATIVES_ZH), '|'.join(FOLLOW_UP_WORDS_ZH)
+))
+_FOLLOW_UP_EN_RE = re.compile(r'\b(?:%s)\b' % '|'.join(FOLLOW_UP_WORDS_EN), re.IGNORECASE)
+
+
+def refers_back(text: str) -> bool:
+    """输入是否指代之前的对话"""
+    return bool(_FOLLOW_UP_ZH_RE.search(text) or _FOLLOW_UP_EN_RE.search(text))
+
+
+class Turn:
+    """一轮对话"""
+    
+    __slots__ = ('input', 'command', 'outcome', 'error', 'line', 'line_tokens', 'command_tokens')
+    
+    def __init__(self, user_input: str, command: str, outcome: Optional[str] = None, error: str = ""):
+        self.input = user_input
+        self.command = command
+        self.outcome = outcome
+        self.error = (error or "").strip().split('\n', 1)[0][:MAX_ERROR_CHARS]
+        
+        line = f"- 用户：{user_input} → {command}"
+        if outcome in OUTCOMES:
+            detail = f"：{self.error}" if outcome == 'failed' and self.error else ""
+            line += f"（{OUTCOMES[outcome]}{detail}）"
+        self.line = line
+        # 每行加上换行符估算，各行之和不小于整段文本的估算值
+        self.line_tokens = estimate_tokens(line + "\n")
+        self.command_tokens = estimate_tokens(command + "; ")
+
+
+class ConversationMemory:
+    """
+    会话内的对话记忆（线程安全）
+    """
+    
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, max_turns: int = DEFAULT_MAX_TURNS):
+        """
+        Args:
+            token_budget: 对话历史的 token 预算（估算值，含消息开销）
+            max_turns: 最多保留的轮数
+        """
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self._lock = threading.Lock()
+        self._turns: Deque[Turn] = deque(maxlen=max_turns)
+        self._heading_tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(HISTORY_HEADING + "\n")
+        self._summary_tokens = estimate_tokens(SUMMARY_PREFIX + "\n")
+        # 渲染结果缓存，记录新的一轮或清空时失效
+        self._rendered: Optional[Dict[str, Any]] = None
+    
+    def add(self, user_input: str, command: str, outcome: Optional[str] = None, error: str = "") -> Turn:
+        """
+        记录一轮对话
+        
+        Args:
+            user_input: 用户输入
+            command: 解析出的命令
+            outcome: 'success' / 'failed' / 'cancelled'（用户没有确认执行），未知时为 None
+            error: 执行失败时的错误信息
+        
+        Returns:
+            记录的一轮
+        """
+        turn = Turn(user_input.strip(), command.strip(), outcome, error)
+        with self._lock:
+            self._turns.append(turn)
+            self._rendered = None
+        return turn
+    
+    def clear(self):
+        """开始新的对话"""
+        with self._lock:
+            self._turns.clear()
+            self._rendered = None
+    
+    def __len__(self) -> int:
+        return len(self._turns)
+    
+    def is_follow_up(self, text: str) -> bool:
+        """已有对话且输入指代之前的对话"""
+        return bool(self._turns) and refers_back(text)
+    
+    def history(self) -> Optional[List[Dict[str, str]]]:
+        """
+        对话历史（generate_response 的 history 参数）
+        
+        Returns:
+            消息列表；没有对话或预算内放不下任何一轮时返回 None
+        """
+        message = self._render()['message']
+        return [message] if message else None
+    
+    def _render(self) -> Dict[str, Any]:
+        """在预算内渲染对话历史（结果缓存到下一次记录）"""
+        with self._lock:
+            if self._rendered is None:
+                self._rendered = self._build(list(self._turns))
+            return self._rendered
+    
+    def _build(self, turns: List[Turn]) -> Dict[str, Any]:
+        """从最近一轮往前完整加入，放不下的更早几轮压缩为命令摘要"""
+        remaining = self.token_budget - self._heading_tokens
+        # 放不下全部轮次时，完整的轮次最多占预算的 FULL_TURNS_SHARE，其余留给摘要
+        if sum(turn.line_tokens for turn in turns) <= remaining:
+            full_budget = remaining
+        else:
+            full_budget = int(remaining * FULL_TURNS_SHARE)
+        lines: List[str] = []
+        position = len(turns)
+        while position > 0 and turns[position - 1].line_tokens <= full_budget:
+            position -= 1
+            lines.append(turns[position].line)
+            full_budget -= turns[position].line_tokens
+            remaining -= turns[position].line_tokens
+        
+        summarized: List[str] = []
+        summary_left = remaining - self._summary_tokens
+        for turn in reversed(turns[:position]):
+            if turn.command_tokens > summary_left:
+                break
+            summarized.append(turn.command)
+            summary_left -= turn.command_tokens
+        if summarized:
+            remaining = summary_left
+        
+        if not lines and not summarized:
+            return {'message': None, 'tokens': 0, 'included': 0, 'summarized': 0}
+        
+        body = [HISTORY_HEADING]
+        if summarized:
+            body.append(SUMMARY_PREFIX + "; ".join(reversed(summarized)))
+        body.extend(reversed(lines))
+        return {
+            'message': {"role": "system", "content": "\n".join(body)},
+            'tokens': self.token_budget - remaining,
+            'included': len(lines),
+            'summarized': len(summarized)
+        }
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        统计信息
+        
+        Returns:
+            {'turns': 记录的轮数, 'included': 完整发送的轮数, 'summarized': 压缩为摘要的轮数,
+             'tokens': 对话历史的 token 估算, 'token_budget': 预算}
+        """
+        rendered = self._render()
+        return {
+            'turns': len(self._turns),
+            'included': rendered['included'],
+            'summarized': rendered['summarized'],
+            'tokens': rendered['tokens'],
+            'token_budget': self.token_budget
+        }
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+离线评测
+Offline accuracy/latency evaluation for natural-language-to-command translation
+
+修改提示词或解析器后，用同一份带标注的语料比较前后的准确率和延迟：
+  - 语料（eval_corpus.jsonl）每行一条：输入、可接受的命令列表、场景、语言、来源。
+    由 seed 子命令从 prompts/*.txt 的示例和测试文件中的用例生成，
+    另外补充一组手工标注的英文输入
+  - run 子命令用三种方式翻译语料中的每条输入：
+      rules   只用规则解析器（NLPParser）
+      ai      AICommandParser（关闭模板和相似输入缓存，每条都请求模型）
+      tiered  完整的分层解析（本地各层 → AI）
+    AI 后端可以是本地测试服务器（stub，默认，内置回复用规则解析器充当模型）、
+    录制的回复（replay），或 .env 中配置的真实服务（live，可以用 --record 录制回复供以后 replay）
+  - 报告为 JSON：精确匹配准确率、各场景的 p50/p99 延迟、每次 AI 请求的 token、
+    本地命中率（不请求 AI 就得到结果的比例）和失败的用例（ID、输入、实际结果），
+    compare 子命令比较两份报告，准确率下降超过容差时返回非零退出码
+
+注意：场景提示词中的示例同时出现在语料和发送给模型的提示词中，
+真实模型在这部分语料上的结果偏乐观，英文和测试用例部分没有这个问题。
+
+用法:
+    python eval_harness.py seed                                  # 重新生成语料
+    python eval_harness.py run --output before.json              # 本地测试服务器
+    python eval_harness.py run --modes rules,tiered --latency 300
+    python eval_harness.py run --backend live --record recorded.json
+    python eval_harness.py run --backend replay --recorded recorded.json
+    python eval_harness.py compare before.json after.json --tolerance 0.01
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telemetry import percentile
+
+
+DEFAULT_CORPUS = "eval_corpus.jsonl"
+MODES = ('rules', 'ai', 'tiered')
+BACKENDS = ('stub', 'replay', 'live')
+
+# 评测时关闭的功能：缓存会让同一条输入第二次不请求模型，结果不可比较
+DISABLED_FEATURES = ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE", "AI_TEMPLATES")
+# 写入报告的设置（影响请求内容，比较报告时需要一致）
+REPORTED_SETTINGS = ("AI_STRUCTURED_OUTPUT", "AI_DYNAMIC_EXAMPLES", "AI_EXAMPLES_TOP_K",
+                     "AI_EXAMPLES_TOKEN_BUDGET")
+
+_CJK_RE = re.compile(r'[一-鿿]')
+
+# 测试文件中的用例和手工标注的英文输入：(输入, 可接受的命令, 场景, 来源)
+SEED_CASES: List[Tuple[str, List[str], str, str]] = [
+    ("查看当前目录", ["pwd"], "command_generation", "test_cli_ai.py"),
+    ("show current directory", ["pwd"], "command_generation", "test_cli_ai.py"),
+    ("列出文件", ["ls -la"], "command_generation", "test_cli_ai.py"),
+    ("list files", ["ls -la"], "command_generation", "test_cli_ai.py"),
+    ("创建文件夹 test", ["mkdir test"], "file_operations", "test_cli_ai.py"),
+    ("create folder mydir", ["mkdir mydir"], "file_operations", "test_cli_ai.py"),
+    ("删除文件 test.txt", ["rm test.txt"], "file_operations", "test_cli_ai.py"),
+    ("查看磁盘空间", ["df -h"], "system_management", "test_cli_ai.py"),
+    ("disk space", ["df -h"], "system_management", "test_cli_ai.py"),
+    ("memory usage", ["free -h"], "system_management", "test_cli_ai.py"),
+    ("创建文件夹 foo", ["mkdir foo"], "file_operations", "test_tiered_parser.py"),
+    ("删除文件 a.txt", ["rm a.txt"], "file_operations", "test_example_store.py"),
+    ("统计每个用户的进程数", ["ps -eo user= | sort | uniq -c", "ps -eo user | sort | uniq -c"],
+     "system_management", "test_tiered_parser.py"),
+    ("list all files including hidden ones", ["ls -la", "ls -a"], "command_generation", "manual"),
+    ("copy a.txt to b.txt", ["cp a.txt b.txt"], "file_operations", "manual"),
+    ("move a.txt to /tmp", ["mv a.txt /tmp", "mv a.txt /tmp/"], "file_operations", "manual"),
+    ("rename old.txt to new.txt", ["mv old.txt new.txt"], "file_operations", "manual"),
+    ("find all .py files", ['find . -name "*.py"', "find . -name '*.py'"], "file_operations", "manual"),
+    ("make script.sh executable", ["chmod +x script.sh"], "system_management", "manual"),
+    ("show running processes", ["ps aux"], "system_management", "manual"),
+    ("kill process 1234", ["kill 1234"], "system_management", "manual"),
+    ("show system uptime", ["uptime"], "system_management", "manual"),
+    ("who am i", ["whoami"], "system_management", "manual"),
+    ("show the first 10 lines of log.txt", ["head -n 10 log.txt", "head log.txt"], "text_processing", "manual"),
+    ("show the last 20 lines of app.log", ["tail -n 20 app.log"], "text_processing", "manual"),
+    ("search for error in app.log", ["grep error app.log", 'grep "error" app.log'], "text_processing", "manual"),
+    ("count lines in data.csv", ["wc -l data.csv"], "text_processing", "manual"),
+    ("ping example.com", ["ping example.com", "ping -c 4 example.com"], "network_operations", "manual"),
+    ("download https://example.com/file.zip",
+     ["wget https://example.com/file.zip", "curl -O https://example.com/file.zip"], "network_operations", "manual"),
+    ("show listening ports", ["netstat -tuln", "ss -tuln", "ss -tlnp", "netstat -tlnp"], "network_operations", "manual"),
+    ("show ip address", ["ip addr", "ifconfig", "ip a"], "network_operations", "manual"),
+    ("compress logs into logs.tar.gz", ["tar -czf logs.tar.gz logs", "tar -czvf logs.tar.gz logs"],
+     "file_operations", "manual"),
+    ("extract archive.tar.gz", ["tar -xzf archive.tar.gz", "tar -xzvf archive.tar.gz"], "file_operations", "manual"),
+    ("show current time", ["date"], "command_generation", "manual"),
+    ("show calendar", ["cal"], "command_generation", "manual"),
+    ("clear the screen", ["clear"], "command_generation", "manual"),
+]
+
+
+def normalize_command(command: Optional[str]) -> str:
+    """比较前的归一化：合并空白，去掉结尾的分号"""
+    return re.sub(r'\s+', ' ', (command or "").strip()).rstrip(';').strip()
+
+
+def seed_corpus() -> List[Dict[str, Any]]:
+    """
+    从场景提示词的示例和 SEED_CASES 生成语料
+    
+    同一输入出现在多处时合并可接受的命令（保持首次出现的场景和来源）。
+    """
+    from example_store import split_prompt
+    from prompt_registry import SCENARIO_PROMPT_FILES, PromptRegistry
+    
+    registry = PromptRegistry(reload_interval=0)
+    entries: List[Tuple[str, List[str], str, str]] = []
+    for scenario, path in SCENARIO_PROMPT_FILES.items():
+        _, examples = split_prompt(registry.get_file(path).text)
+        entries.extend((example.input, [example.command], scenario, path) for example in examples)
+    entries.extend(SEED_CASES)
+    
+    cases: Dict[str, Dict[str, Any]] = {}
+    for user_input, expected, scenario, source in entries:
+        case = cases.get(user_input)
+        if case is None:
+            cases[user_input] = {
+                # ID 由输入决定，提示词增删示例后其他用例的 ID 不变
+                'id': f"{scenario}-{hashlib.sha1(user_input.encode('utf-8')).hexdigest()[:8]}",
+                'input': user_input,
+                'expected': list(expected),
+                'scenario': scenario,
+                'lang': 'zh' if _CJK_RE.search(user_input) else 'en',
+                'source': source
+            }
+        else:
+            case['expected'].extend(command for command in expected if command not in case['expected'])
+    return list(cases.values())
+
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """读取语料（JSONL，忽略空行）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_corpus(cases: List[Dict[str, Any]], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for case in cases:
+            f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+
+class RecordedResponder:
+    """按用户消息返回录制的回复（供 LocalAIServer 使用），没有录制的输入返回空回复"""
+    
+    def __init__(self, recorded: Dict[str, str]):
+        self.recorded = recorded
+    
+    def __call__(self, messages: List[Dict[str, str]]) -> str:
+        user_message = messages[-1].get('content', '') if messages else ''
+        return self.recorded.get(user_message, "")
+
+
+def _ai_usage(provider) -> Tuple[int, int]:
+    """(实际发出的 AI 请求数, prompt + completion token 总数)"""
+    total = provider.get_telemetry_stats()['total']
+    if not total:
+        return 0, 0
+    return (total['calls'] - total['cached'] - total['coalesced'],
+            total['prompt_tokens'] + total['completion_tokens'])
+
+
+def evaluate(cases: List[Dict[str, Any]], translate: Callable[[str], Tuple[Optional[str], bool]],
+             usage: Optional[Callable[[], Tuple[int, int]]] = None) -> Dict[str, Any]:
+    """
+    翻译语料中的每条输入并汇总
+    
+    Args:
+        cases: 语料
+        translate: 输入 -> (命令或 None, 是否在本地得到结果)，失败时可以抛出异常
+        usage: 返回累计 (AI 请求数, token 数) 的函数，None 表示不使用 AI
+    
+    Returns:
+        一种方式的评测结果（见 run_eval）
+    """
+    requests_before, tokens_before = usage() if usage else (0, 0)
+    latencies: List[float] = []
+    scenarios: Dict[str, Dict[str, Any]] = {}
+    failures: List[Dict[str, Any]] = []
+    correct = unresolved = errors = local_hits = 0
+    
+    for case in cases:
+        started = time.perf_counter()
+        try:
+            command, local = translate(case['input'])
+        except Exception:
+            command, local = None, False
+            errors += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        matched = command is not None and normalize_command(command) in {
+            normalize_command(expected) for expected in case['expected']
+        }
+        correct += matched
+        unresolved += command is None
+        local_hits += bool(command is not None and local)
+        latencies.append(elapsed_ms)
+        group = scenarios.setdefault(case['scenario'], {'total': 0, 'correct': 0, 'latency_ms': []})
+        group['total'] += 1
+        group['correct'] += matched
+        group['latency_ms'].append(elapsed_ms)
+        if not matched:
+            failures.append({'id': case['id'], 'input': case['input'], 'got': command})
+    
+    requests_after, tokens_after = usage() if usage else (0, 0)
+    ai_requests = requests_after - requests_before
+    total = len(cases)
+    return {
+        'total': total,
+        'correct': correct,
+        'accuracy': round(correct / total, 4) if total else 0.0,
+        'unresolved': unresolved,
+        'errors': errors,
+        'local_hit_rate': round(local_hits / total, 4) if total else 0.0,
+        'ai_requests': ai_requests,
+        'tokens_per_request': round((tokens_after - tokens_before) / ai_requests, 1) if ai_requests else 0.0,
+        'latency_ms': _latency(latencies),
+        'scenarios': {
+            scenario: {
+                'total': group['total'],
+                'correct': group['correct'],
+                'accuracy': round(group['correct'] / group['total'], 4),
+                'latency_ms': _latency(group['latency_ms'])
+            }
+            for scenario, group in sorted(scenarios.items())
+        },
+        'failures': failures
+    }
+
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    return {'p50': round(percentile(samples, 50), 3), 'p99': round(percentile(samples, 99), 3)}
+
+
+def _git_commit() -> Optional[str]:
+    """当前提交（不在 git 仓库中时为 None）"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=5, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run_eval(cases: List[Dict[str, Any]], modes=MODES, backend: str = 'stub',
+             recorded: Optional[Dict[str, str]] = None, record: Optional[Dict[str, str]] = None,
+             latency_ms: float = 0.0) -> Dict[str, Any]:
+    """
+    按各种方式评测语料
+    
+    Args:
+        cases: 语料
+        modes: 评测方式（rules / ai / tiered）
+        backend: AI 后端（stub / replay / live）
+        recorded: replay 使用的录制回复 {输入: 回复}
+        record: live 模式下把模型的命令写入这个字典 {输入: 命令}
+        latency_ms: stub / replay 的模拟首 token 延迟
+    
+    Returns:
+        {'commit', 'corpus': {'cases', 'sha256'}, 'backend', 'settings',
+         'modes': {方式: {'total', 'correct', 'accuracy', 'unresolved', 'errors', 'local_hit_rate',
+                          'ai_requests', 'tokens_per_request', 'latency_ms': {'p50', 'p99'},
+                          'scenarios': {场景: {'total', 'correct', 'accuracy', 'latency_ms'}},
+                          'failures': [{'id', 'input', 'got'}]}}}
+    """
+    from nlp_parser import NLPParser
+    from tiered_parser import TieredParser
+    
+    digest = hashlib.sha256(json.dumps(cases, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    report: Dict[str, Any] = {
+        'commit': _git_commit(),
+        'corpus': {'cases': len(cases), 'sha256': digest.hexdigest()[:16]},
+        'backend': backend if set(modes) & {'ai', 'tiered'} else None,
+        'settings': {name: os.getenv(name) for name in REPORTED_SETTINGS},
+        'modes': {}
+    }
+    
+    if 'rules' in modes:
+        rule_parser = NLPParser()
+        report['modes']['rules'] = evaluate(cases, lambda text: (rule_parser.parse(text), True))
+    
+    if not set(modes) & {'ai', 'tiered'}:
+        return report
+    
+    server = None
+    saved_env = os.environ.copy()
+    try:
+        if backend in ('stub', 'replay'):
+            from local_ai_server import LocalAIServer
+            
+            responder = RecordedResponder(recorded or {}) if backend == 'replay' else None
+            server = LocalAIServer(responder=responder, latency_ms=latency_ms).start()
+            os.environ["AI_PROVIDER"] = "local"
+            os.environ["LOCAL_BASE_URL"] = server.base_url
+        for name in DISABLED_FEATURES:
+            os.environ[name] = "false"
+        
+        from ai_command_parser import AICommandParser
+        from ai_provider import AIProvider
+        
+        ai_parser = AICommandParser(use_context=False, stream=False)
+        # 独立的实例：遥测只包含本次评测的请求
+        ai_parser.ai_provider = AIProvider()
+        usage = lambda: _ai_usage(ai_parser.ai_provider)
+        
+        if 'ai' in modes:
+            def translate_ai(text):
+                command = ai_parser.parse_command(text)
+                if record is not None:
+                    record[text] = command
+                return command, False
+            report['modes']['ai'] = evaluate(cases, translate_ai, usage)
+        
+        if 'tiered' in modes:
+            resolver = TieredParser(NLPParser(), lambda: ai_parser)
+            
+            def translate_tiered(text):
+                result = resolver.resolve(text)
+                return result['command'], result['tier'] not in (None, 'ai')
+            report['modes']['tiered'] = evaluate(cases, translate_tiered, usage)
+    finally:
+        if server is not None:
+            server.stop()
+        os.environ.clear()
+        os.environ.update(saved_env)
+    return report
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any],
+                    tolerance: float = 0.0) -> Tuple[List[str], bool]:
+    """
+    比较两份报告
+    
+    Returns:
+        (说明行, 是否有方式的准确率下降超过 tolerance)
+    """
+    lines: List[str] = []
+    regressed = False
+    if baseline.get('corpus', {}).get('sha256') != current.get('corpus', {}).get('sha256'):
+        lines.append("⚠️  两份报告使用的语料不同，结果只能粗略比较")
+    if baseline.get('settings') != current.get('settings'):
+        lines.append(f"⚠️  设置不同: {baseline.get('settings')} → {current.get('settings')}")
+    
+    for mode in MODES:
+        before = baseline['modes'].get(mode)
+        after = current['modes'].get(mode)
+        if not before or not after:
+            continue
+        drop = before['accuracy'] - after['accuracy']
+        regressed = regressed or drop > tolerance
+        lines.append(
+            f"{mode:<7} 准确率 {before['accuracy']:.2%} → {after['accuracy']:.2%}"
+            f"  p50 {before['latency_ms']['p50']:.2f} → {after['latency_ms']['p50']:.2f}ms"
+            f"  p99 {before['latency_ms']['p99']:.2f} → {after['latency_ms']['p99']:.2f}ms"
+            f"  token/请求 {before['tokens_per_request']} → {after['tokens_per_request']}"
+            f"  本地命中率 {before['local_hit_rate']:.2%} → {after['local_hit_rate']:.2%}"
+        )
+        failed_before = {failure['id'] for failure in before['failures']}
+        failed_after = {failure['id'] for failure in after['failures']}
+        newly_failing = sorted(failed_after - failed_before)
+        newly_passing = sorted(failed_before - failed_after)
+        if newly_failing:
+            lines.append(f"        新增失败: {', '.join(newly_failing)}")
+        if newly_passing:
+            lines.append(f"        新增通过: {', '.join(newly_passing)}")
+    return lines, regressed
+
+
+def print_report(report: Dict[str, Any]):
+    """打印报告摘要"""
+    print(f"语料 {report['corpus']['cases']} 条，提交 {report['commit'] or '未知'}，"
+          f"AI 后端 {report['backend'] or '无'}")
+    for mode, result in report['modes'].items():
+        print(f"\n{mode}: 准确率 {result['accuracy']:.2%}（{result['correct']}/{result['total']}），"
+              f"无结果 {result['unresolved']}，本地命中率 {result['local_hit_rate']:.2%}，"
+              f"AI 请求 {result['ai_requests']} 次，平均 {result['tokens_per_request']} token")
+        for scenario, group in result['scenarios'].items():
+            print(f"  {scenario:<20} {group['accuracy']:>7.2%}  ({group['correct']}/{group['total']})"
+                  f"  p50 {group['latency_ms']['p50']:>8.3f}ms  p99 {group['latency_ms']['p99']:>8.3f}ms")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="自然语言到命令翻译的离线评测")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    
+    seed = subparsers.add_parser("seed", help="从提示词示例和测试用例生成语料")
+    seed.add_argument("--output", default=DEFAULT_CORPUS)
+    
+    run = subparsers.add_parser("run", help="评测并输出 JSON 报告")
+    run.add_argument("--corpus", default=DEFAULT_CORPUS)
+    run.add_argument("--modes", default=",".join(MODES), help="逗号分隔: rules,ai,tiered")
+    run.add_argument("--backend", choices=BACKENDS, default="stub",
+                     help="AI 后端: stub 本地测试服务器 / replay 录制的回复 / live 真实服务（产生费用）")
+    run.add_argument("--recorded", help="replay 使用的录制文件（JSON: {输入: 回复}）")
+    run.add_argument("--record", help="live 模式下把模型的命令录制到这个文件")
+    run.add_argument("--latency", type=float, default=0.0, help="stub / replay 的模拟首 token 延迟（毫秒）")
+    run.add_argument("--output", help="报告文件（默认只打印摘要）")
+    
+    compare = subparsers.add_parser("compare", help="比较两份报告")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.0, help="允许的准确率下降（0~1）")
+    
+    args = parser.parse_args(argv)
+    
+    if args.action == "seed":
+        cases = seed_corpus()
+        write_corpus(cases, args.output)
+        languages = sum(case['lang'] == 'en' for case in cases)
+        print(f"已写入 {len(cases)} 条（英文 {languages} 条）: {args.output}")
+        return 0
+    
+    if args.action == "compare":
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        lines, regressed = compare_reports(baseline, current, args.tolerance)
+        print("\n".join(lines))
+        return 1 if regressed else 0
+    
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"未知的评测方式: {', '.join(sorted(unknown))}")
+    if args.backend == "replay" and not args.recorded:
+        parser.error("--backend replay 需要 --recorded")
+    if args.record and args.backend != "live":
+        parser.error("--record 只用于 --backend live")
+    
+    recorded = None
+    if args.recorded:
+        with open(args.recorded, 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+    record: Optional[Dict[str, str]] = {} if args.record else None
+    
+    report = run_eval(load_corpus(args.corpus), modes, args.backend, recorded, record, args.latency)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已写入: {args.output}")
+    if record is not None:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        print(f"已录制 {len(record)} 条回复: {args.record}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+动态少样本示例
+Dynamic few-shot example selection for scenario prompts
+
+场景提示词（prompts/*.txt）的大部分篇幅是命令参考表和示例对话，
+每次解析都整份发送。这里把示例从提示词中拆出来建立索引：
+  - 提示词去掉示例后的部分（角色、输出要求、安全事项等）作为系统提示词，
+    内容固定，可以命中服务端的前缀缓存
+  - 每次请求只挑选与用户输入最相似的 top-k 条示例，在 token 预算内
+    随动态上下文一起发送
+
+相似度为字符二元组的 Dice 系数（与相似输入缓存相同的归一化），
+通过倒排索引只对至少有一个共同二元组的示例打分。
+没有任何示例相似时使用提示词中的示例对话（演示输出格式）。
+提示词文件热加载后索引自动重建。
+"""
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from similarity_cache import ngrams, normalize
+from token_utils import estimate_tokens
+
+
+DEFAULT_TOP_K = 6
+DEFAULT_TOKEN_BUDGET = 300
+
+# 参考表中的示例行：- "创建文件夹 test" → mkdir test
+_REFERENCE_RE = re.compile(r'^\s*-\s*"(?P<input>[^"]+)"\s*→\s*(?P<command>.+?)\s*$')
+# 示例对话：用户：xxx / 你：xxx
+_DIALOG_USER_RE = re.compile(r'^\s*用户[：:]\s*(?P<input>.+?)\s*$')
+_DIALOG_REPLY_RE = re.compile(r'^\s*你[：:]\s*(?P<command>.+?)\s*$')
+_HEADING_RE = re.compile(r'^(#{1,6})\s')
+
+EXAMPLES_HEADING = "## 参考示例"
+
+
+class Example:
+    """一条示例（自然语言 → 命令）"""
+    
+    __slots__ = ('input', 'command', 'dialog', 'grams', 'text', 'tokens')
+    
+    def __init__(self, user_input: str, command: str, dialog: bool = False):
+        self.input = user_input
+        self.command = command
+        # 来自示例对话（没有相似示例时作为默认示例）
+        self.dialog = dialog
+        self.grams = ngrams(normalize(user_input))
+        self.text = f'- "{user_input}" → {command}'
+        self.tokens = estimate_tokens(self.text) + 1
+    
+    def __repr__(self) -> str:
+        return f"Example({self.input!r}, {self.command!r})"
+
+
+def split_prompt(text: str) -> Tuple[str, List[Example]]:
+    """
+    把提示词拆成不含示例的基础部分和示例列表
+    
+    示例行被删除后没有内容的标题（如 "### 创建操作"）一并删除；
+    示例对话所在小节的标题也删除，小节中的其他内容（如结尾的提醒）保留。
+    连续空行合并为一行。
+    
+    Returns:
+        (基础提示词, 示例列表)
+    """
+    lines = text.splitlines()
+    examples: List[Example] = []
+    kept: List[str] = []
+    seen = set()
+    heading_at: Optional[int] = None
+    dialog_headings = set()
+    
+    def add(user_input: str, command: str, dialog: bool):
+        key = (user_input, command)
+        if key not in seen:
+            seen.add(key)
+            examples.append(Example(user_input, command, dialog))
+    
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        match = _REFERENCE_RE.match(line)
+        if match:
+            add(match.group('input'), match.group('command'), False)
+            index += 1
+            continue
+        match = _DIALOG_USER_RE.match(line)
+        reply = _DIALOG_REPLY_RE.match(lines[index + 1]) if match and index + 1 < len(lines) else None
+        if reply:
+            add(match.group('input'), reply.group('command'), True)
+            if heading_at is not None:
+                dialog_headings.add(heading_at)
+            index += 2
+            continue
+        if _HEADING_RE.match(line):
+            heading_at = len(kept)
+        kept.append(line)
+        index += 1
+    
+    return _drop_empty_sections(kept, dialog_headings), examples
+
+
+def _drop_empty_sections(lines: List[str], dropped_headings=frozenset()) -> str:
+    """删除下面（含子标题）没有正文的标题和 dropped_headings 中的标题，合并连续空行"""
+    result: List[str] = []
+    # 每个标题在 result 中的位置和级别，遇到正文时清空
+    pending: List[Tuple[int, int]] = []
+    for position, line in enumerate(lines):
+        heading = _HEADING_RE.match(line)
+        if heading:
+            level = len(heading.group(1))
+            # 同级或更高级的新标题出现：之前没有正文的标题删除
+            while pending and pending[-1][1] >= level:
+                del result[pending.pop()[0]:]
+            if position not in dropped_headings:
+                pending.append((len(result), level))
+                result.append(line)
+        else:
+            if line.strip():
+                pending = []
+            result.append(line)
+    if pending:
+        del result[pending[0][0]:]
+    
+    text = re.sub(r'\n{3,}', '\n\n', '\n'.join(result))
+    return text.strip()
+
+
+class ExampleIndex:
+    """一个提示词文件的示例索引"""
+    
+    def __init__(self, text: str):
+        self.source = text
+        self.base_prompt, self.examples = split_prompt(text)
+        self.base_tokens = estimate_tokens(self.base_prompt)
+        self.full_tokens = estimate_tokens(text)
+        self._postings: Dict[str, List[int]] = {}
+        for position, example in enumerate(self.examples):
+            for gram in example.grams:
+                self._postings.setdefault(gram, []).append(position)
+        self.defaults = [example for example in self.examples if example.dialog]
+    
+    def search(self, user_input: str) -> List[Tuple[float, Example]]:
+        """按相似度从高到低返回与输入至少有一个共同二元组的示例"""
+        grams = ngrams(normalize(user_input))
+        overlaps: Dict[int, int] = {}
+        for gram in grams:
+            for position in self._postings.get(gram, ()):
+                overlaps[position] = overlaps.get(position, 0) + 1
+        
+        scored = []
+        for position, overlap in overlaps.items():
+            example = self.examples[position]
+            scored.append((2 * overlap / (len(grams) + len(example.grams)), position))
+        # 相似度相同时保持提示词中的顺序
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, self.examples[position]) for score, position in scored]
+    
+    def select(self, user_input: str, top_k: int, token_budget: int,
+               min_similarity: float = 0.0) -> List[Example]:
+        """在 token 预算内挑选最相似的 top_k 条示例（没有相似示例时使用示例对话）"""
+        candidates = [example for score, example in self.search(user_input) if score > min_similarity]
+        if not candidates:
+            candidates = self.defaults
+        
+        selected: List[Example] = []
+        used = 0
+        for example in candidates:
+            if len(selected) >= top_k:
+                break
+            if used + example.tokens > token_budget:
+                continue
+            selected.append(example)
+            used += example.tokens
+        return selected
+
+
+def format_examples(examples: List[Example]) -> str:
+    """把示例格式化为提示词片段（与提示词文件中的参考表写法相同）"""
+    if not examples:
+        return ""
+    return "\n".join([EXAMPLES_HEADING] + [example.text for example in examples])
+
+
+class ExampleStore:
+    """
+    动态示例选择（线程安全）
+    
+    按提示词文件缓存索引，文件内容变化（热加载）后重新建立。
+    """
+    
+    def __init__(self, top_k: int = DEFAULT_TOP_K, token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 min_similarity: float = 0.0):
+        """
+        Args:
+            top_k: 每次请求最多包含的示例数
+            token_budget: 示例部分的 token 预算（估算值）
+            min_similarity: 示例入选所需的最低相似度（不含）
+        """
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, ExampleIndex] = {}
+        self.requests = 0
+        self.example_tokens = 0
+        self.saved_tokens = 0
+    
+    def index_for(self, key: str, text: str) -> ExampleIndex:
+        """获取提示词的示例索引（内容变化时重建）"""
+        index = self._indexes.get(key)
+        if index is None or index.source != text:
+            index = ExampleIndex(text)
+            with self._lock:
+                self._indexes[key] = index
+        return index
+    
+    def build(self, key: str, text: str, user_input: str) -> Dict[str, Any]:
+        """
+        为一次请求构建提示词
+        
+        Args:
+            key: 提示词文件（索引缓存的键）
+            text: 提示词全文
+            user_input: 用户输入
+        
+        Returns:
+            {'system_prompt': 不含示例的提示词, 'examples': 入选的示例,
+             'examples_text': 示例片段（没有示例时为空字符串）,
+             'tokens': 系统提示词与示例的 token 估算, 'full_tokens': 整份提示词的 token 估算}
+        """
+        index = self.index_for(key, text)
+        examples = index.select(user_input, self.top_k, self.token_budget, self.min_similarity)
+        examples_text = format_examples(examples)
+        tokens = index.base_tokens + estimate_tokens(examples_text)
+        with self._lock:
+            self.requests += 1
+            self.example_tokens += tokens - index.base_tokens
+            self.saved_tokens += max(0, index.full_tokens - tokens)
+        return {
+            'system_prompt': index.base_prompt,
+            'examples': examples,
+            'examples_text': examples_text,
+            'tokens': tokens,
+            'full_tokens': index.full_tokens
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        统计信息
+        
+        Returns:
+            {'prompts': 已建立索引的提示词数, 'examples': 示例总数, 'requests': 构建次数,
+             'avg_example_tokens': 平均每次发送的示例 token, 'saved_tokens': 累计节省的 token 估算}
+        """
+        with self._lock:
+            return {
+                'prompts': len(self._indexes),
+                'examples': sum(len(index.examples) for index in self._indexes.values()),
+                'requests': self.requests,
+                'avg_example_tokens': self.example_tokens / self.requests if self.requests else 0.0,
+                'saved_tokens': self.saved_tokens
+            }
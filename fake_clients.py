@@ -0,0 +1,51 @@
+"""
+测试用的模拟 OpenAI 客户端
+Configurable fake OpenAI client shared by the tests (no real API calls)
+"""
+import time
+from types import SimpleNamespace
+
+
+class FakeClient:
+    """
+    模拟 OpenAI 客户端，只实现 chat.completions.create
+    
+    依次返回 script 中的条目（异常则抛出），用完后返回 content；
+    记录请求次数和每次请求的参数。
+    """
+    
+    def __init__(self, content="ls -la", script=(), delay=0.0, usage=None):
+        """
+        Args:
+            content: 返回的内容
+            script: 先按顺序返回（或抛出）的条目
+            delay: 每次请求的延迟（秒）
+            usage: 响应中的 token 用量（None 表示不带用量）
+        """
+        self.content = content
+        self.script = list(script)
+        self.delay = delay
+        self.usage = usage
+        self.calls = 0
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        self.calls += 1
+        self.requests.append(kwargs)
+        if self.delay:
+            time.sleep(self.delay)
+        item = self.script.pop(0) if self.script else self.content
+        if isinstance(item, Exception):
+            raise item
+        if kwargs.get("stream"):
+            return self._stream(item)
+        message = SimpleNamespace(content=item)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self.usage)
+    
+    def _stream(self, content):
+        """整段内容作为一个块输出（生成器可迭代、可关闭，与流式响应相同）"""
+        delta = SimpleNamespace(content=content)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        if self.usage is not None:
+            yield SimpleNamespace(choices=[], usage=self.usage)
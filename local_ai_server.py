@@ -0,0 +1,398 @@
+"""
+本地 OpenAI 兼容测试服务器
+Local OpenAI-compatible stand-in server for offline benchmarking
+
+实现 /v1/chat/completions 的一个子集（包括流式 SSE 和 usage），按脚本返回
+固定内容，并可以注入延迟、抖动、错误和限流。配合 AI_PROVIDER=local，
+可以在离线的 Linux 机器上测试和压测 AIProvider 的所有 AI 相关功能，
+不会访问付费 API。
+
+用法:
+    python local_ai_server.py --port 8765 --latency 300 --jitter 50 --error-rate 0.05
+
+然后在 .env 中设置:
+    AI_PROVIDER=local
+    LOCAL_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from token_utils import estimate_tokens
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MODEL = "local-model"
+
+
+class ScriptedResponder:
+    """
+    按规则生成回复
+    
+    依次用每条规则的正则匹配全部消息内容（系统提示词 + 上下文 + 用户消息），
+    第一条匹配的规则决定回复；都不匹配时使用内置的默认回复。
+    """
+    
+    def __init__(self, rules: Optional[List[Tuple[str, str]]] = None,
+                 default: Optional[str] = None):
+        """
+        Args:
+            rules: [(正则, 回复), ...]
+            default: 所有规则都不匹配时的回复，None 表示使用内置回复
+        """
+        self.rules = [(re.compile(pattern), response) for pattern, response in (rules or [])]
+        self.default = default
+        self._rule_parser = None
+    
+    @classmethod
+    def from_file(cls, path: str) -> "ScriptedResponder":
+        """
+        从 JSON 文件加载规则
+        
+        文件格式: {"rules": [{"match": "正则", "response": "回复"}], "default": "回复"}
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rules = [(rule['match'], rule['response']) for rule in data.get('rules', [])]
+        return cls(rules, data.get('default'))
+    
+    def __call__(self, messages: List[Dict[str, str]]) -> str:
+        text = "\n".join(str(message.get('content', '')) for message in messages)
+        for pattern, response in self.rules:
+            if pattern.search(text):
+                return response
+        if self.default is not None:
+            return self.default
+        return self._builtin_response(messages)
+    
+    def _builtin_response(self, messages: List[Dict[str, str]]) -> str:
+        """内置回复：模拟命令解析（含结构化输出）、批量解析、错误分析和下一步建议"""
+        system_prompt = messages[0].get('content', '') if messages else ''
+        user_message = messages[-1].get('content', '') if messages else ''
+        
+        if "分析命令执行错误" in system_prompt:
+            return "原因：命令执行失败\n解决方案：请检查命令参数和权限\n替代命令：无"
+        if "建议一个合理的下一步操作" in system_prompt:
+            return "无"
+        if "批量模式" in system_prompt:
+            try:
+                inputs = json.loads(user_message)
+            except ValueError:
+                inputs = []
+            return json.dumps([self._translate(str(text)) for text in inputs], ensure_ascii=False)
+        if "输出格式（JSON）" in system_prompt:
+            command = self._translate(user_message)
+            return json.dumps({
+                "command": command,
+                "confidence": 0.5 if command.startswith("echo ") else 0.9,
+                "is_dangerous": False,
+                "needs_tty": False,
+                "explanation": "本地测试服务器的模拟结果"
+            }, ensure_ascii=False)
+        return self._translate(user_message)
+    
+    def _translate(self, text: str) -> str:
+        """用规则匹配解析器充当"模型"，未匹配时返回 echo 命令"""
+        if self._rule_parser is None:
+            from nlp_parser import NLPParser
+            self._rule_parser = NLPParser()
+        command = self._rule_parser.parse(text)
+        return command or f"echo {json.dumps(text, ensure_ascii=False)}"
+
+
+class _RateLimiter:
+    """滑动窗口限流：每秒最多 limit 个请求"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._requests: deque = deque()
+    
+    def acquire(self) -> Tuple[bool, int, float]:
+        """
+        Returns:
+            (是否放行, 剩余请求数, 距离窗口重置的秒数)
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._requests and now - self._requests[0] >= 1.0:
+                self._requests.popleft()
+            reset = 1.0 - (now - self._requests[0]) if self._requests else 1.0
+            if len(self._requests) >= self.limit:
+                return False, 0, reset
+            self._requests.append(now)
+            return True, self.limit - len(self._requests), reset
+
+
+class LocalAIServer:
+    """本地 OpenAI 兼容服务器，可在测试中启动于后台线程"""
+    
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = 0,
+        responder: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        token_delay_ms: float = 0.0,
+        prefill_ms_per_1k: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: int = 0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            responder: 根据消息列表生成回复的函数，默认为 ScriptedResponder()
+            latency_ms: 返回第一个 token 前的延迟（毫秒）
+            jitter_ms: 延迟的随机抖动范围（± 毫秒）
+            token_delay_ms: 流式输出时每个块之间的延迟（毫秒）
+            prefill_ms_per_1k: 每 1000 个 prompt token 额外增加的首 token 延迟（毫秒），
+                模拟服务端处理长提示词的时间
+            error_rate: 返回 500/503 错误的概率（0-1）
+            rate_limit: 每秒最多处理的请求数，超出返回 429，0 表示不限流
+            seed: 随机数种子（用于复现抖动和错误注入）
+        """
+        self.responder = responder or ScriptedResponder()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_delay_ms = token_delay_ms
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.error_rate = error_rate
+        self.rate_limiter = _RateLimiter(rate_limit) if rate_limit > 0 else None
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.requests: List[Dict] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+    
+    @property
+    def port(self) -> int:
+        return self.httpd.server_port
+    
+    @property
+    def base_url(self) -> str:
+        """供 OpenAI 客户端使用的 base_url"""
+        return f"http://{self.httpd.server_address[0]}:{self.port}/v1"
+    
+    def start(self) -> "LocalAIServer":
+        """在后台线程中启动服务器"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """停止服务器并释放端口"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self) -> "LocalAIServer":
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def _record(self, body: Dict):
+        with self._lock:
+            self.request_count += 1
+            self.requests.append(body)
+    
+    def _delay(self) -> float:
+        """本次请求的首 token 延迟（秒）"""
+        jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+    
+    def _should_fail(self) -> bool:
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和正文分两次写出，不关闭 Nagle 算法时与客户端的延迟 ACK 叠加，
+            # 每个非流式响应会多出约 40ms
+            disable_nagle_algorithm = True
+            
+            def do_GET(self):
+                if self.path.rstrip('/').endswith("/models"):
+                    self._send_json(200, {
+                        "object": "list",
+                        "data": [{"id": DEFAULT_MODEL, "object": "model", "owned_by": "local"}]
+                    })
+                else:
+                    self._send_error(404, "not found")
+            
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_error(400, "invalid JSON body")
+                    return
+                
+                if not self.path.rstrip('/').endswith("/chat/completions"):
+                    self._send_error(404, "not found")
+                    return
+                server._record(body)
+                
+                limit_headers = {}
+                if server.rate_limiter:
+                    allowed, remaining, reset = server.rate_limiter.acquire()
+                    limit_headers = {
+                        "x-ratelimit-limit-requests": str(server.rate_limiter.limit),
+                        "x-ratelimit-remaining-requests": str(remaining),
+                        "x-ratelimit-reset-requests": f"{reset:.3f}s"
+                    }
+                    if not allowed:
+                        limit_headers["retry-after-ms"] = str(int(reset * 1000))
+                        limit_headers["retry-after"] = str(max(1, round(reset)))
+                        self._send_error(429, "rate limit exceeded", "rate_limit_exceeded", limit_headers)
+                        return
+                
+                messages = body.get("messages", [])
+                prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+                time.sleep(server._delay() + prompt_tokens * server.prefill_ms_per_1k / 1e6)
+                if server._should_fail():
+                    status = server.random.choice([500, 503])
+                    self._send_error(status, "injected server error", "server_error", limit_headers)
+                    return
+                
+                content = server.responder(messages)
+                model = body.get("model") or DEFAULT_MODEL
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": estimate_tokens(content)
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                
+                if body.get("stream"):
+                    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+                    self._send_stream(content, model, usage if include_usage else None, limit_headers)
+                else:
+                    self._send_json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content}
+                        }],
+                        "usage": usage
+                    }, limit_headers)
+            
+            def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _send_error(self, status: int, message: str, error_type: str = "invalid_request_error",
+                            headers: Optional[Dict[str, str]] = None):
+                self._send_json(status, {
+                    "error": {"message": message, "type": error_type, "code": status}
+                }, headers)
+            
+            def _send_stream(self, content: str, model: str, usage: Optional[Dict],
+                             headers: Dict[str, str]):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.close_connection = True
+                
+                chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                
+                def event(choices, extra=None):
+                    payload = {
+                        "id": chunk_id, "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": model, "choices": choices
+                    }
+                    payload.update(extra or {})
+                    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+                
+                try:
+                    for index, piece in enumerate(re.findall(r'\S+\s*|\s+', content)):
+                        if index and server.token_delay_ms:
+                            time.sleep(server.token_delay_ms / 1000.0)
+                        self.wfile.write(event([{
+                            "index": 0, "delta": {"content": piece}, "finish_reason": None
+                        }]))
+                        self.wfile.flush()
+                    self.wfile.write(event([{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                    if usage:
+                        self.wfile.write(event([], {"usage": usage}))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前关闭了流（例如收到完整命令后停止接收）
+                    return
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容测试服务器")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="首 token 延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟抖动（± 毫秒）")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式块间延迟（毫秒）")
+    parser.add_argument("--prefill", type=float, default=0.0,
+                        help="每 1000 个 prompt token 增加的首 token 延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入 5xx 错误的概率（0-1）")
+    parser.add_argument("--rate-limit", type=int, default=0, help="每秒最多请求数，0 表示不限")
+    parser.add_argument("--responses", help="回复规则 JSON 文件")
+    parser.add_argument("--seed", type=int, help="随机数种子")
+    args = parser.parse_args()
+    
+    responder = ScriptedResponder.from_file(args.responses) if args.responses else None
+    server = LocalAIServer(
+        host=args.host,
+        port=args.port,
+        responder=responder,
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        token_delay_ms=args.token_delay,
+        prefill_ms_per_1k=args.prefill,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed
+    )
+    print(f"本地 AI 服务器已启动: {server.base_url}")
+    print("在 .env 中设置 AI_PROVIDER=local 和 LOCAL_BASE_URL 使用，按 Ctrl+C 停止")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,31 @@ import re
 from command_mappings import COMMAND_MAPPINGS
 import config
 
+# Words that reverse a rule match ("不要删除文件 a.txt", "do not remove file a.txt")
+NEGATION_PATTERN = re.compile(r"不|别|勿|禁止|\b(?:not|don't|dont|never)\b", re.IGNORECASE)
+# Politeness words and punctuation left over around a rule match that don't change its meaning
+FILLER_PATTERN = re.compile(r"请帮我|帮我|帮忙|麻烦|请|一下|给我|谢谢|吧|\b(?:please|pls|thanks)\b|[\s，。！？、；：,.!?;]+", re.IGNORECASE)
+
+# Rule confidence: the match accounts for the whole input / leaves other words unmatched
+# (partial matches stay below config.TIERED_CONFIDENCE_THRESHOLD) / the input is negated
+FULL_RULE_CONFIDENCE = 0.95
+PARTIAL_RULE_CONFIDENCE = (0.5, 0.7)
+NEGATED_CONFIDENCE = 0.3
+
+
+def is_destructive_command(command):
+    """
+    Check whether a command deletes data, removes packages or stops processes
+    
+    Args:
+        command (str): Command to check
+    
+    Returns:
+        bool: True if the command matches config.DESTRUCTIVE_PATTERNS
+    """
+    command = command.strip()
+    return any(re.search(pattern, command) for pattern in config.DESTRUCTIVE_PATTERNS)
+
 
 class NLPParser:
     """Parse natural language input and convert to Linux commands"""
@@ -20,7 +45,7 @@ class NLPParser:
         
         Args:
             user_input (str): User's natural language input
-            
+        
         Returns:
             str: Linux command or None if no match found
         """
@@ -31,8 +56,8 @@ class NLPParser:
         if normalized_input in self.mappings:
             return self.mappings[normalized_input]
         
-        # Try to match commands with parameters
-        command = self._parse_with_parameters(normalized_input)
+        # Try to match commands with parameters (arguments keep their case)
+        command = self._parse_with_parameters(user_input.strip())
         if command:
             return command
         
@@ -45,109 +70,131 @@ class NLPParser:
     
     def _parse_with_parameters(self, user_input):
         """Parse commands that require parameters"""
+        result = self._match_with_parameters(user_input)
+        return result[0] if result else None
+    
+    def _match_with_parameters(self, user_input):
+        """
+        Match parametric rules
+        
+        Returns:
+            tuple: (command, regex match of the phrase and its arguments) or None
+        """
+        # Match phrases case-insensitively but keep arguments (paths, names) as typed
+        lowered = user_input.lower()
         
         # Create folder/directory: "创建文件夹 test" -> "mkdir test"
-        if any(phrase in user_input for phrase in ["创建文件夹", "新建文件夹", "create folder", "make directory", "mkdir"]):
-            match = re.search(r'(?:创建文件夹|新建文件夹|create folder|make directory|mkdir)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["创建文件夹", "新建文件夹", "create folder", "make directory", "mkdir"]):
+            match = re.search(r'(?:创建文件夹|新建文件夹|create folder|make directory|mkdir)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 folder_name = match.group(1)
-                return f"mkdir {folder_name}"
+                return f"mkdir {folder_name}", match
         
         # Delete file: "删除文件 test.txt" -> "rm test.txt"
-        if any(phrase in user_input for phrase in ["删除文件", "remove file"]) and "文件夹" not in user_input and "folder" not in user_input:
-            match = re.search(r'(?:删除文件|remove file)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["删除文件", "remove file"]) and "文件夹" not in lowered and "folder" not in lowered:
+            match = re.search(r'(?:删除文件|remove file)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 file_name = match.group(1)
-                return f"rm {file_name}"
+                return f"rm {file_name}", match
         
         # Delete folder: "删除文件夹 test" -> "rm -r test"
-        if any(phrase in user_input for phrase in ["删除文件夹", "remove folder", "delete folder"]):
-            match = re.search(r'(?:删除文件夹|remove folder|delete folder)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["删除文件夹", "remove folder", "delete folder"]):
+            match = re.search(r'(?:删除文件夹|remove folder|delete folder)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 folder_name = match.group(1)
-                return f"rm -r {folder_name}"
+                return f"rm -r {folder_name}", match
         
         # Find file: "查找文件 test.txt" -> "find . -name test.txt"
-        if any(phrase in user_input for phrase in ["查找文件", "find file", "search file"]):
-            match = re.search(r'(?:查找文件|find file|search file)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["查找文件", "find file", "search file"]):
+            match = re.search(r'(?:查找文件|find file|search file)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 file_name = match.group(1)
-                return f"find . -name {file_name}"
+                return f"find . -name {file_name}", match
         
         # Show file content: "查看文件内容 test.txt" -> "cat test.txt"
-        if any(phrase in user_input for phrase in ["查看文件内容", "show file", "read file", "cat"]):
-            match = re.search(r'(?:查看文件内容|show file|read file|cat)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["查看文件内容", "show file", "read file", "cat"]):
+            match = re.search(r'(?:查看文件内容|show file|read file|cat)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 file_name = match.group(1)
-                return f"cat {file_name}"
+                return f"cat {file_name}", match
         
         # Edit file: "编辑文件 test.txt" -> "nano test.txt"
-        if any(phrase in user_input for phrase in ["编辑文件", "edit file"]):
-            match = re.search(r'(?:编辑文件|edit file)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["编辑文件", "edit file"]):
+            match = re.search(r'(?:编辑文件|edit file)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 file_name = match.group(1)
-                return f"nano {file_name}"
+                return f"nano {file_name}", match
         
         # Copy file: "复制文件 a.txt b.txt" -> "cp a.txt b.txt"
-        if any(phrase in user_input for phrase in ["复制文件", "copy file"]):
-            match = re.search(r'(?:复制文件|copy file)\s+(\S+)\s+(?:到|to)?\s*(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["复制文件", "copy file"]):
+            match = re.search(r'(?:复制文件|copy file)\s+(\S+)\s+(?:到|to)?\s*(\S+)', user_input, re.IGNORECASE)
             if match:
                 source = match.group(1)
                 dest = match.group(2)
-                return f"cp {source} {dest}"
+                return f"cp {source} {dest}", match
         
         # Move/rename file: "移动文件 a.txt b.txt" -> "mv a.txt b.txt"
-        if any(phrase in user_input for phrase in ["移动文件", "move file", "重命名", "rename"]):
-            match = re.search(r'(?:移动文件|move file|重命名|rename)\s+(\S+)\s+(?:到|to)?\s*(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["移动文件", "move file", "重命名", "rename"]):
+            match = re.search(r'(?:移动文件|move file|重命名|rename)\s+(\S+)\s+(?:到|to)?\s*(\S+)', user_input, re.IGNORECASE)
             if match:
                 source = match.group(1)
                 dest = match.group(2)
-                return f"mv {source} {dest}"
+                return f"mv {source} {dest}", match
         
         # Change directory: "切换到 /home" -> "cd /home", "进入 test" -> "cd test"
-        if any(phrase in user_input for phrase in ["切换到", "进入", "cd ", "go to", "change to"]):
-            match = re.search(r'(?:切换到|进入|cd|go to|change to)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["切换到", "进入", "cd ", "go to", "change to"]):
+            match = re.search(r'(?:切换到|进入|cd|go to|change to)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 path = match.group(1)
                 # Skip if it's "切换到管理员" (handled separately)
                 if path not in ["管理员", "administrator", "root"]:
-                    return f"cd {path}"
+                    return f"cd {path}", match
         
         # Install package: "安装软件 vim" -> "sudo apt install vim"
-        if any(phrase in user_input for phrase in ["安装软件", "install package", "install"]):
-            match = re.search(r'(?:安装软件|install package|install)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["安装软件", "install package", "install"]):
+            # "uninstall vim" is the remove-package rule below
+            match = re.search(r'(?:安装软件|install package|\binstall)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 package = match.group(1)
-                return f"sudo apt install {package}"
+                return f"sudo apt install {package}", match
         
         # Remove package: "删除软件 vim" -> "sudo apt remove vim"
-        if any(phrase in user_input for phrase in ["删除软件", "remove package", "uninstall"]):
-            match = re.search(r'(?:删除软件|remove package|uninstall)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["删除软件", "remove package", "uninstall"]):
+            match = re.search(r'(?:删除软件|remove package|uninstall)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 package = match.group(1)
-                return f"sudo apt remove {package}"
+                return f"sudo apt remove {package}", match
         
         # Change permission: "修改权限 755 test.txt" -> "chmod 755 test.txt"
-        if any(phrase in user_input for phrase in ["修改权限", "change permission", "chmod"]):
-            match = re.search(r'(?:修改权限|change permission|chmod)\s+(\S+)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["修改权限", "change permission", "chmod"]):
+            match = re.search(r'(?:修改权限|change permission|chmod)\s+(\S+)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 mode = match.group(1)
                 file = match.group(2)
-                return f"chmod {mode} {file}"
+                return f"chmod {mode} {file}", match
         
         # Search in file: "搜索内容 pattern file.txt" -> "grep pattern file.txt"
-        if any(phrase in user_input for phrase in ["搜索内容", "search in file", "grep"]):
-            match = re.search(r'(?:搜索内容|search in file|grep)\s+(\S+)\s+(\S+)', user_input)
+        if any(phrase in lowered for phrase in ["搜索内容", "search in file", "grep"]):
+            match = re.search(r'(?:搜索内容|search in file|grep)\s+(\S+)\s+(\S+)', user_input, re.IGNORECASE)
             if match:
                 pattern = match.group(1)
                 file = match.group(2)
-                return f"grep {pattern} {file}"
+                return f"grep {pattern} {file}", match
         
         return None
     
     def _fuzzy_match(self, user_input):
         """Try fuzzy matching for similar phrases"""
+        result = self._match_fuzzy(user_input)
+        return result[0] if result else None
+    
+    def _match_fuzzy(self, user_input):
+        """
+        Fuzzy match against mapping phrases
         
+        Returns:
+            tuple: (command, matched phrase) or None
+        """
         # Check if any mapping key is a substring or superset of input
         for phrase, command in self.mappings.items():
             # Skip template commands (containing {})
@@ -159,10 +206,72 @@ class NLPParser:
                 # Additional check to avoid false positives
                 # Make sure it's a reasonable match based on threshold from config
                 if len(user_input) >= len(phrase) * config.FUZZY_MATCH_THRESHOLD:
-                    return command
+                    return command, phrase
         
         return None
     
+    def match_exact(self, user_input):
+        """
+        Exact mapping lookup with a confidence score
+        
+        Returns:
+            tuple: (command, confidence) or None
+        """
+        command = self.mappings.get(user_input.strip().lower())
+        if command is None:
+            return None
+        # Phrases mapped to a template ("创建文件夹" -> "mkdir {folder}") still lack the argument
+        return command, (0.2 if '{' in command else 1.0)
+    
+    def match_rules(self, user_input):
+        """
+        Parametric rule matching with a confidence score
+        
+        Only a match that accounts for the whole input (apart from politeness
+        words and punctuation) is confident. Leftover words may narrow or change
+        the meaning ("删除文件夹 build 里的日志"), so partial matches score below
+        the tiered threshold, growing with coverage; negated input scores lowest.
+        Destructive rules (rm, uninstall) are thus only answered locally when
+        the whole input is the rule.
+        
+        Returns:
+            tuple: (command, confidence) or None
+        """
+        normalized_input = user_input.strip()
+        result = self._match_with_parameters(normalized_input)
+        if not result:
+            return None
+        command, match = result
+        if NEGATION_PATTERN.search(normalized_input):
+            return command, NEGATED_CONFIDENCE
+        
+        leftover = normalized_input[:match.start()] + " " + normalized_input[match.end():]
+        if not FILLER_PATTERN.sub("", leftover):
+            return command, FULL_RULE_CONFIDENCE
+        low, high = PARTIAL_RULE_CONFIDENCE
+        coverage = (match.end() - match.start()) / len(normalized_input)
+        return command, round(low + (high - low) * coverage, 3)
+    
+    def match_fuzzy(self, user_input):
+        """
+        Fuzzy phrase matching with a confidence score
+        
+        Confidence is the length ratio of the phrase and the input, capped below
+        the exact and full-coverage rule scores; negated input scores lowest.
+        
+        Returns:
+            tuple: (command, confidence) or None
+        """
+        normalized_input = user_input.strip().lower()
+        result = self._match_fuzzy(normalized_input)
+        if not result:
+            return None
+        command, phrase = result
+        if NEGATION_PATTERN.search(normalized_input) and not NEGATION_PATTERN.search(phrase):
+            return command, NEGATED_CONFIDENCE
+        ratio = min(len(phrase), len(normalized_input)) / max(len(phrase), len(normalized_input))
+        return command, round(0.9 * ratio, 3)
+    
     def get_all_commands(self):
         """Return all available command mappings"""
         return self.mappings
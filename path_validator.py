@@ -0,0 +1,246 @@
+"""
+路径校验服务
+Batched, cached path existence checks for generated commands
+
+validate_parameters 需要检查命令中的每个路径是否存在。逐个调用
+os.path.exists 在网络文件系统上每次都是一次往返，这里改为：
+  - 按父目录分组，每个目录只做一次 os.scandir，得到目录中的全部名称
+  - 目录列表按目录的 mtime 缓存：目录中增删文件会改变 mtime，
+    mtime 不变时直接使用缓存；两次 mtime 检查之间至少间隔
+    config.PATH_REVALIDATE_INTERVAL 秒，间隔内的重复检查不做任何 I/O
+  - 需要读取的目录不止一个时，在小线程池中并行读取
+
+读取时目录刚被修改过（mtime 距读取不到 RACY_WINDOW_NS）的列表不按 mtime 复用，
+下次检查时重新读取，避免同一 mtime 粒度内的修改被漏掉。
+符号链接和不可读的目录退回到 os.path.exists，结果与逐个检查一致。
+中间带 '..'、'.' 或以 '/' 结尾的路径也直接检查：abspath 只做字符串处理，
+会把 "missing/../x"、"file.txt/" 化简成存在的路径。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Iterable, Optional
+
+import config
+
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_DIRECTORIES = 512
+# 部分文件系统的 mtime 精度为 1~2 秒
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class _Listing:
+    """一个目录的缓存列表"""
+    
+    __slots__ = ('mtime_ns', 'names', 'links', 'readable', 'checked_at', 'racy')
+    
+    def __init__(self, mtime_ns: Optional[int], names: FrozenSet[str] = frozenset(),
+                 links: FrozenSet[str] = frozenset(), readable: bool = True):
+        # 目录不存在时 mtime_ns 为 None，其中的路径都不存在
+        self.mtime_ns = mtime_ns
+        self.names = names
+        # 符号链接需要跟随到目标才能判断是否存在
+        self.links = links
+        self.readable = readable
+        self.checked_at = time.monotonic()
+        # 目录在读取前刚被修改过：之后的修改可能不改变 mtime
+        self.racy = mtime_ns is not None and time.time_ns() - mtime_ns < RACY_WINDOW_NS
+    
+    def contains(self, directory: str, name: str) -> bool:
+        """名称是否存在（语义与 os.path.exists 相同）"""
+        if not self.readable or name in self.links:
+            return os.path.exists(os.path.join(directory, name))
+        return name in self.names
+
+
+def _mtime_ns(directory: str) -> Optional[int]:
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _needs_direct_check(path: str) -> bool:
+    """
+    化简后结果可能不同的路径：中间的 '..'、'.' 要求前面的部分是目录，末尾的 '/' 要求是目录
+    
+    开头的 '.' 和 '..' 相对于当前目录，化简不改变结果。
+    """
+    if os.altsep:
+        path = path.replace(os.altsep, os.sep)
+    parts = [part for part in path.split(os.sep) if part]
+    while parts and parts[0] in (".", ".."):
+        parts.pop(0)
+    if not parts:
+        return False
+    return path.endswith(os.sep) or "." in parts or ".." in parts
+
+
+def _scan(directory: str) -> _Listing:
+    """读取目录列表（先取 mtime，读取期间的修改会在下次检查时发现）"""
+    mtime_ns = _mtime_ns(directory)
+    if mtime_ns is None:
+        return _Listing(None)
+    names = set()
+    links = set()
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                names.add(entry.name)
+                if entry.is_symlink():
+                    links.add(entry.name)
+    except PermissionError:
+        return _Listing(mtime_ns, readable=False)
+    except OSError:
+        # 不是目录或已被删除
+        return _Listing(None)
+    return _Listing(mtime_ns, frozenset(names), frozenset(links))
+
+
+class PathValidator:
+    """
+    批量路径存在性检查（线程安全）
+    """
+    
+    def __init__(self, revalidate_interval: Optional[float] = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_directories: int = DEFAULT_MAX_DIRECTORIES):
+        """
+        Args:
+            revalidate_interval: 两次检查同一目录 mtime 之间的最短间隔（秒），
+                0 表示每次都检查，None 使用 config.PATH_REVALIDATE_INTERVAL
+            max_workers: 并行读取目录的线程数
+            max_directories: 最多缓存的目录数（超出时淘汰最久未用的）
+        """
+        self.revalidate_interval = (config.PATH_REVALIDATE_INTERVAL
+                                    if revalidate_interval is None else revalidate_interval)
+        self.max_workers = max_workers
+        self.max_directories = max_directories
+        self._lock = threading.Lock()
+        self._listings: "OrderedDict[str, _Listing]" = OrderedDict()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.lookups = 0
+        self.scans = 0
+        self.revalidations = 0
+    
+    def exists(self, path: str) -> bool:
+        """检查单个路径是否存在"""
+        return self.check_many([path])[path]
+    
+    def check_many(self, paths: Iterable[str]) -> Dict[str, bool]:
+        """
+        批量检查路径是否存在
+        
+        Args:
+            paths: 路径列表（支持 ~ 和相对当前目录的路径）
+        
+        Returns:
+            {原始路径: 是否存在}
+        """
+        targets = {}
+        result = {}
+        for path in paths:
+            expanded = os.path.expanduser(path)
+            if _needs_direct_check(expanded):
+                result[path] = os.path.exists(expanded)
+            else:
+                # 化简后的路径只用来定位缓存的目录列表
+                targets[path] = os.path.split(os.path.abspath(expanded))
+        
+        listings = self._listings_for({directory for directory, name in targets.values() if name})
+        
+        for path, (directory, name) in targets.items():
+            if not name:
+                # 根目录
+                result[path] = os.path.exists(directory)
+            else:
+                result[path] = listings[directory].contains(directory, name)
+        with self._lock:
+            self.lookups += len(result)
+        return result
+    
+    def _listings_for(self, directories) -> Dict[str, _Listing]:
+        """获取目录列表，过期的重新检查（多个目录时并行）"""
+        now = time.monotonic()
+        listings = {}
+        stale = []
+        with self._lock:
+            for directory in directories:
+                listing = self._listings.get(directory)
+                if listing is not None and now - listing.checked_at < self.revalidate_interval:
+                    self._listings.move_to_end(directory)
+                    listings[directory] = listing
+                else:
+                    stale.append((directory, listing))
+        
+        if len(stale) > 1:
+            refreshed = list(self._get_pool().map(lambda item: self._refresh(*item), stale))
+        else:
+            refreshed = [self._refresh(*item) for item in stale]
+        
+        with self._lock:
+            for (directory, _), listing in zip(stale, refreshed):
+                self._listings[directory] = listing
+                self._listings.move_to_end(directory)
+                listings[directory] = listing
+            while len(self._listings) > self.max_directories:
+                self._listings.popitem(last=False)
+        return listings
+    
+    def _refresh(self, directory: str, listing: Optional[_Listing]) -> _Listing:
+        """mtime 未变时沿用缓存的列表，否则重新读取"""
+        if listing is not None:
+            mtime_ns = _mtime_ns(directory)
+            with self._lock:
+                self.revalidations += 1
+            if mtime_ns == listing.mtime_ns and not listing.racy:
+                listing.checked_at = time.monotonic()
+                return listing
+        with self._lock:
+            self.scans += 1
+        return _scan(directory)
+    
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="path-validator")
+            return self._pool
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._listings.clear()
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        统计信息
+        
+        Returns:
+            {'directories': 缓存的目录数, 'lookups': 检查的路径数,
+             'scans': 读取目录的次数, 'revalidations': 检查目录 mtime 的次数}
+        """
+        with self._lock:
+            return {
+                'directories': len(self._listings),
+                'lookups': self.lookups,
+                'scans': self.scans,
+                'revalidations': self.revalidations
+            }
+
+
+_validator: Optional[PathValidator] = None
+_validator_lock = threading.Lock()
+
+
+def get_path_validator() -> PathValidator:
+    """获取进程内共享的路径校验服务"""
+    global _validator
+    if _validator is None:
+        with _validator_lock:
+            if _validator is None:
+                _validator = PathValidator()
+    return _validator
@@ -0,0 +1,193 @@
+"""
+提示词模板注册表
+Prompt template registry with mtime-based hot reload
+
+启动时一次性读取所有场景的提示词（prompts/*.txt）并保存在内存中，
+同时预先计算字符数和 token 估算值。解析命令时直接从内存取提示词，
+不读文件；每隔 config.PROMPT_RELOAD_INTERVAL 秒最多检查一次文件的
+修改时间，只有 mtime 变化的文件才重新读取，编辑提示词后无需重启即可生效。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from token_utils import estimate_tokens
+import config
+
+
+# 场景 -> 提示词文件（相对路径先按当前目录查找，再按本模块所在目录查找）
+SCENARIO_PROMPT_FILES = {
+    'file_operations': 'prompts/file_operations.txt',
+    'system_management': 'prompts/system_management.txt',
+    'network_operations': 'prompts/network_operations.txt',
+    'text_processing': 'prompts/text_processing.txt',
+    'command_generation': 'prompts/command_generation.txt'
+}
+
+DEFAULT_SCENARIO = 'command_generation'
+
+# 提示词文件不存在时使用的默认提示词
+DEFAULT_PROMPT = """你是一个专业的 Linux 命令助手。将用户的自然语言描述转换为准确的 Linux 命令。
+只返回命令本身，不要返回任何解释、说明或额外文字。
+不要使用 markdown 代码块标记。"""
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class PromptTemplate:
+    """内存中的一个提示词模板"""
+    
+    def __init__(self, path: str, display_path: str):
+        self.path = path
+        self.display_path = display_path
+        self.text = DEFAULT_PROMPT
+        self.mtime: Optional[float] = None
+        self._signature = None
+        self.chars = len(self.text)
+        self.tokens = estimate_tokens(self.text)
+        self.loads = 0
+    
+    def load(self) -> bool:
+        """
+        mtime 变化时重新读取文件
+        
+        Returns:
+            是否重新读取了文件
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # 文件不存在或被临时移走：保留内存中的内容
+            return False
+        # 同时比较大小，避免文件系统时间精度不足时漏掉同一时刻内的修改
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return False
+        
+        self.text = text or DEFAULT_PROMPT
+        self.mtime = stat.st_mtime
+        self._signature = signature
+        self.chars = len(self.text)
+        self.tokens = estimate_tokens(self.text)
+        self.loads += 1
+        return True
+    
+    def info(self) -> Dict[str, Any]:
+        """模板信息：路径、字符数、token 估算、修改时间、读取次数"""
+        return {
+            'prompt_file': self.display_path,
+            'path': self.path,
+            'chars': self.chars,
+            'tokens': self.tokens,
+            'mtime': self.mtime,
+            'loads': self.loads
+        }
+
+
+class PromptRegistry:
+    """
+    提示词模板注册表（线程安全）
+    
+    场景提示词在创建时全部加载；其他提示词文件在第一次使用时加载，
+    之后同样常驻内存并参与 mtime 检查。
+    """
+    
+    def __init__(self, scenario_files: Optional[Dict[str, str]] = None,
+                 reload_interval: Optional[float] = None):
+        """
+        Args:
+            scenario_files: 场景 -> 提示词文件，默认使用 SCENARIO_PROMPT_FILES
+            reload_interval: 两次 mtime 检查之间的最短间隔（秒），0 表示不热加载，
+                默认读取 config.PROMPT_RELOAD_INTERVAL
+        """
+        self.scenario_files = dict(scenario_files or SCENARIO_PROMPT_FILES)
+        self.reload_interval = (config.PROMPT_RELOAD_INTERVAL
+                                if reload_interval is None else reload_interval)
+        self._lock = threading.Lock()
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._next_check = time.monotonic() + self.reload_interval
+        
+        for path in self.scenario_files.values():
+            self._template(path)
+    
+    @staticmethod
+    def resolve(path: str) -> str:
+        """把提示词文件路径解析为绝对路径（启动后切换目录不影响热加载）"""
+        if os.path.isabs(path):
+            return path
+        if os.path.exists(path):
+            return os.path.abspath(path)
+        return os.path.join(_MODULE_DIR, path)
+    
+    def _template(self, path: str) -> PromptTemplate:
+        """获取（必要时创建并加载）模板"""
+        template = self._templates.get(path)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(path)
+                if template is None:
+                    template = PromptTemplate(self.resolve(path), path)
+                    template.load()
+                    self._templates[path] = template
+        return template
+    
+    def _maybe_reload(self):
+        """距离上次检查超过 reload_interval 时检查所有模板的 mtime"""
+        if self.reload_interval <= 0 or time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            for template in self._templates.values():
+                template.load()
+    
+    def get(self, scenario: str) -> str:
+        """获取场景对应的提示词（未知场景使用通用命令生成提示词）"""
+        return self.get_template(scenario).text
+    
+    def get_template(self, scenario: str) -> PromptTemplate:
+        """获取场景对应的提示词模板"""
+        return self.get_file(self.file_for(scenario))
+    
+    def get_file(self, path: str) -> PromptTemplate:
+        """获取指定提示词文件的模板（文件不存在时内容为默认提示词）"""
+        self._maybe_reload()
+        return self._template(path)
+    
+    def file_for(self, scenario: str) -> str:
+        """场景对应的提示词文件路径"""
+        return self.scenario_files.get(scenario, self.scenario_files[DEFAULT_SCENARIO])
+    
+    def reload(self) -> int:
+        """立即检查所有模板，返回重新读取的文件数"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.reload_interval
+            return sum(template.load() for template in self._templates.values())
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各提示词文件的信息"""
+        with self._lock:
+            return {path: template.info() for path, template in self._templates.items()}
+
+
+_registry: Optional[PromptRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """获取进程内共享的提示词注册表（第一次调用时加载所有场景提示词）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptRegistry()
+    return _registry
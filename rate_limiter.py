@@ -0,0 +1,254 @@
+"""
+客户端限流
+Client-side rate limiting for AI calls
+
+进程内所有 AI 调用方共享同一个限流器（按 provider/base_url/api_key 区分），
+用两个令牌桶分别限制每分钟请求数和每分钟 token 数，在发送请求前排队等待，
+而不是先把请求发出去、收到 429 之后再重试。
+
+除了 .env 中配置的静态限额，限流器还会根据服务端的响应自动调整：
+  - x-ratelimit-{limit,remaining,reset}-{requests,tokens} 响应头：同步剩余额度，
+    未配置静态限额时据此推算补充速率
+  - 429 响应的 Retry-After / retry-after-ms：所有调用方一起暂停到指定时间
+"""
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+
+# OpenAI 风格的时长格式，如 "1s"、"6m0s"、"20ms"、"0.500s"
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+
+class RateLimitTimeout(Exception):
+    """排队等待时间超过了调用的截止时间"""
+    
+    def __init__(self, wait: float):
+        self.wait = wait
+        super().__init__(f"限流排队需要等待 {wait:.1f} 秒，超过了本次调用的截止时间")
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """从响应头中解析 Retry-After（秒数或 HTTP 日期），无法解析时返回 None"""
+    if headers is None:
+        return None
+    
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """解析 x-ratelimit-reset-* 中的时长（"6m0s"、"20ms" 或纯秒数），无法解析时返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_number(headers, name: str) -> Optional[float]:
+    """读取数值类型的响应头，缺失或格式错误时返回 None"""
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """
+    令牌桶
+    
+    capacity 为 None 表示不限制（直到从响应头中得知限额）。
+    预约时直接扣减，余额可以为负：后来的调用方排在前面的预约之后，
+    按补充速率依次放行，不会在额度恢复的瞬间一起涌出。
+    """
+    
+    def __init__(self, per_minute: Optional[float] = None):
+        self.configured = bool(per_minute)
+        self.capacity: Optional[float] = float(per_minute) if per_minute else None
+        self.rate = self.capacity / 60.0 if self.capacity else 0.0
+        self.level = self.capacity or 0.0
+        self._updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """预约 amount 个令牌需要等待的秒数"""
+        self._refill(now)
+        if self.capacity is None or self.level >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.level) / self.rate
+    
+    def take(self, amount: float):
+        """扣减令牌（在 wait_time 之后调用）"""
+        if self.capacity is not None:
+            self.level -= amount
+    
+    def refund(self, amount: float, now: float):
+        """归还多扣的令牌（amount 为负时补扣）"""
+        if self.capacity is not None:
+            self._refill(now)
+            self.level = min(self.capacity, self.level + amount)
+    
+    def sync(self, limit: Optional[float], remaining: Optional[float],
+             reset: Optional[float], now: float):
+        """
+        根据服务端返回的限额同步
+        
+        Args:
+            limit: 服务端限额（x-ratelimit-limit-*）
+            remaining: 剩余额度（x-ratelimit-remaining-*）
+            reset: 额度完全恢复所需的秒数（x-ratelimit-reset-*）
+        """
+        self._refill(now)
+        if not self.configured and limit:
+            if self.capacity is None:
+                self.level = limit
+            self.capacity = limit
+            if remaining is not None and reset and limit > remaining:
+                # 已用掉的额度在 reset 秒内恢复
+                self.rate = (limit - remaining) / reset
+            elif not self.rate:
+                # 无法推算时按每分钟限额处理（OpenAI/DeepSeek 的约定）
+                self.rate = limit / 60.0
+        if remaining is not None and self.capacity is not None:
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    每分钟请求数 + 每分钟 token 数的双令牌桶限流器（线程安全）
+    
+    reserve() 只计算并预约，不睡眠，返回需要等待的秒数，
+    同步调用方用 time.sleep、异步调用方用 asyncio.sleep 等待。
+    """
+    
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        """
+        Args:
+            requests_per_minute: 每分钟最多请求数，None 表示只根据响应头限流
+            tokens_per_minute: 每分钟最多 token 数（prompt + completion），None 同上
+        """
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._throttled = 0
+    
+    def reserve(self, tokens: int = 0, max_wait: Optional[float] = None) -> float:
+        """
+        为一次请求预约 1 个请求额度和 tokens 个 token 额度
+        
+        Args:
+            tokens: 预计消耗的 token 数
+            max_wait: 最多愿意等待的秒数，超过时不预约并抛出 RateLimitTimeout
+        
+        Returns:
+            发送请求前需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.tokens.capacity is not None:
+                tokens = min(tokens, self.tokens.capacity)
+            wait = max(
+                self._paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+                0.0
+            )
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitTimeout(wait)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            if wait > 0:
+                self._waits += 1
+                self._wait_seconds += wait
+            return wait
+    
+    def settle(self, reserved_tokens: int, actual_tokens: int):
+        """请求完成后按实际 token 用量修正预约（归还多预约的部分）"""
+        with self._lock:
+            self.tokens.refund(reserved_tokens - actual_tokens, time.monotonic())
+    
+    def pause(self, seconds: float):
+        """所有调用方暂停 seconds 秒（收到 429 时调用）"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def observe(self, status_code: int, headers):
+        """根据一次响应的状态码和限流响应头调整限流器"""
+        now = time.monotonic()
+        reset_requests = parse_duration(headers.get("x-ratelimit-reset-requests"))
+        remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+        
+        with self._lock:
+            self.requests.sync(
+                _header_number(headers, "x-ratelimit-limit-requests"),
+                remaining_requests, reset_requests, now
+            )
+            self.tokens.sync(
+                _header_number(headers, "x-ratelimit-limit-tokens"),
+                _header_number(headers, "x-ratelimit-remaining-tokens"),
+                parse_duration(headers.get("x-ratelimit-reset-tokens")),
+                now
+            )
+            
+            pause = None
+            if status_code == 429:
+                self._throttled += 1
+                pause = retry_after_seconds(headers)
+                if pause is None:
+                    pause = reset_requests
+            elif remaining_requests == 0:
+                pause = reset_requests
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """获取限流器状态快照"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'requests_per_minute': self.requests.capacity and self.requests.rate * 60,
+                'tokens_per_minute': self.tokens.capacity and self.tokens.rate * 60,
+                'paused_for': max(0.0, self._paused_until - now),
+                'waits': self._waits,
+                'wait_seconds': self._wait_seconds,
+                'throttled': self._throttled
+            }
@@ -0,0 +1,169 @@
+"""
+AI 响应磁盘缓存
+Persistent on-disk cache for AI responses
+
+使用 SQLite（WAL 模式）保存 AI 响应，键为 (提供商, 模型, 消息, 温度, max_tokens)
+的哈希。支持条目数上限（LRU 淘汰）、过期时间（TTL）以及命中/未命中统计，
+程序重启后缓存依然有效。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+# 默认缓存配置（可通过环境变量覆盖）
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "cli_ai", "response_cache.db")
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+
+
+class ResponseCache:
+    """基于 SQLite 的 AI 响应缓存"""
+    
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+                 ttl: float = DEFAULT_CACHE_TTL):
+        """
+        初始化缓存
+        
+        Args:
+            path: 数据库文件路径，":memory:" 表示仅使用内存
+            max_entries: 最多保存的条目数，超出后淘汰最久未使用的条目
+            ttl: 条目有效期（秒），0 表示永不过期
+        """
+        self.path = path if path == ":memory:" else os.path.expanduser(path)
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库并创建表"""
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)"
+        )
+        return conn
+    
+    @staticmethod
+    def make_key(provider: str, model: str, messages: List[Dict[str, str]],
+                 temperature: float, max_tokens: int, **extra: Any) -> str:
+        """
+        计算缓存键
+        
+        Args:
+            extra: 其他会影响响应内容的参数（例如流式提前结束）
+        """
+        payload = json.dumps({
+            'provider': provider,
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens,
+            'extra': extra
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存
+        
+        Returns:
+            缓存的响应；不存在或已过期时返回 None
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                
+                if row and self.ttl and now - row[1] > self.ttl:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                
+                if row is None:
+                    self.misses += 1
+                    return None
+                
+                self._conn.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self.hits += 1
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"⚠️  读取响应缓存失败: {e}", file=sys.stderr)
+            return None
+    
+    def put(self, key: str, response: str):
+        """写入缓存，超过条目上限时淘汰最久未使用的条目"""
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        " SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+        except sqlite3.Error as e:
+            print(f"⚠️  写入响应缓存失败: {e}", file=sys.stderr)
+    
+    def invalidate(self, key: str):
+        """删除一个缓存条目"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+    
+    def clear(self):
+        """清空缓存并重置统计"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,209 @@
+"""
+场景检测
+Single-pass scenario detection with an Aho-Corasick automaton
+
+把所有场景关键词和特殊规则中的词编译成一个 Aho-Corasick 自动机，
+对输入只扫描一遍，就能得到每个场景命中的关键词数和每条特殊规则的命中情况。
+耗时与关键词数量基本无关（原实现为 场景数 × 关键词数 × 输入长度）。
+
+匹配语义与原实现保持一致：
+  - 不区分大小写（关键词和输入都转为小写后按子串匹配）
+  - 场景得分 = 该场景关键词列表中出现在输入里的条目数（每个条目最多计 1 次，
+    列表中大小写不同的重复条目如 'SSH' 和 'ssh' 各计 1 次）
+  - 特殊规则按顺序检查，先命中的直接决定场景
+  - 得分相同时按场景定义顺序取第一个，全部为 0 时返回默认场景
+"""
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+
+DEFAULT_SCENARIO = 'command_generation'
+
+# 特殊规则：(场景, 规则名, 词组列表)，每个词组至少命中一个词时规则成立
+SPECIAL_RULES: Tuple[Tuple[str, str, Tuple[Tuple[str, ...], ...]], ...] = (
+    # 1. 包含 URL，很可能是网络操作
+    ('network_operations', 'url', (
+        ('http://', 'https://', 'ftp://'),
+    )),
+    # 2. 包含"用户"且包含"创建/添加/删除"，是系统管理
+    ('system_management', 'user_admin', (
+        ('用户', 'user'),
+        ('创建', '添加', '删除', 'create', 'add', 'delete', 'remove'),
+    )),
+    # 3. 同时包含"编辑"和"文件"以及文本文件扩展名，优先文本处理
+    ('text_processing', 'edit_text_file', (
+        ('编辑', 'edit'),
+        ('文件', 'file'),
+        ('.txt', '.log', '.conf', '.config', '.ini'),
+    )),
+    # 4. 包含"查看内容"或特定的查看命令，是文本处理
+    ('text_processing', 'view_content', (
+        ('查看内容', '显示内容', 'view content', 'show content', 'cat ', 'less ', 'more '),
+    )),
+)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick 多模式匹配自动机
+    
+    find_all() 一遍扫描返回输入中出现过的所有模式编号。
+    """
+    
+    def __init__(self, patterns: Sequence[str]):
+        """
+        Args:
+            patterns: 模式串列表（非空、已去重），编号即列表下标
+        """
+        self.patterns = list(patterns)
+        # 每个状态：转移表、失败链接、在该状态结束的模式编号（含失败链上的）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+        
+        for index, pattern in enumerate(self.patterns):
+            self._insert(pattern, index)
+        self._build_failure_links()
+    
+    def _insert(self, pattern: str, index: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] += (index,)
+    
+    def _build_failure_links(self):
+        """按广度优先顺序计算失败链接，并把失败链上的输出合并到每个状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+    
+    def find_all(self, text: str) -> Set[int]:
+        """返回 text 中出现过的模式编号集合"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found: Set[int] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class ScenarioDetector:
+    """
+    场景检测器
+    
+    构建时把关键词和特殊规则编译成一个自动机，之后每次检测只扫描输入一遍。
+    """
+    
+    def __init__(self, scenario_keywords: Dict[str, Iterable[str]],
+                 rules=SPECIAL_RULES, default: str = DEFAULT_SCENARIO):
+        """
+        Args:
+            scenario_keywords: 场景 -> 关键词列表（字典顺序即同分时的优先级）
+            rules: 特殊规则，格式同 SPECIAL_RULES
+            default: 没有任何关键词命中时的场景
+        """
+        self.scenarios = list(scenario_keywords)
+        self.rules = rules
+        self.default = default
+        
+        patterns: Dict[str, int] = {}
+        
+        def pattern_id(word: str) -> int:
+            return patterns.setdefault(word.lower(), len(patterns))
+        
+        # 模式编号 -> [(场景下标, 该模式在场景关键词列表中出现的条目数)]
+        keyword_hits: Dict[int, Dict[int, int]] = {}
+        for scenario_index, keywords in enumerate(scenario_keywords.values()):
+            for keyword in keywords:
+                if not keyword:
+                    continue
+                hits = keyword_hits.setdefault(pattern_id(keyword), {})
+                hits[scenario_index] = hits.get(scenario_index, 0) + 1
+        
+        # 特殊规则的每个词组对应一个位：(规则下标, 词组下标)
+        self._rule_groups: Dict[int, List[Tuple[int, int]]] = {}
+        for rule_index, (_, _, groups) in enumerate(rules):
+            for group_index, words in enumerate(groups):
+                for word in words:
+                    self._rule_groups.setdefault(pattern_id(word), []).append(
+                        (rule_index, group_index)
+                    )
+        
+        self._keyword_hits = {
+            pid: tuple(hits.items()) for pid, hits in keyword_hits.items()
+        }
+        self.automaton = AhoCorasick(list(patterns))
+    
+    @property
+    def pattern_count(self) -> int:
+        """自动机中的模式数（关键词与规则词去重后）"""
+        return len(self.automaton.patterns)
+    
+    def analyze(self, text: str) -> Dict[str, Any]:
+        """
+        检测场景并返回调试信息
+        
+        Returns:
+            {'scenario': 场景, 'rule': 命中的特殊规则名（没有时为 None）,
+             'scores': {场景: 命中的关键词数}}
+        """
+        found = self.automaton.find_all(text.lower())
+        
+        scores = [0] * len(self.scenarios)
+        matched_groups: Set[Tuple[int, int]] = set()
+        for pid in found:
+            for scenario_index, count in self._keyword_hits.get(pid, ()):
+                scores[scenario_index] += count
+            matched_groups.update(self._rule_groups.get(pid, ()))
+        
+        result = {
+            'scenario': self.default,
+            'rule': None,
+            'scores': dict(zip(self.scenarios, scores))
+        }
+        
+        for rule_index, (scenario, name, groups) in enumerate(self.rules):
+            if all((rule_index, group_index) in matched_groups for group_index in range(len(groups))):
+                result['scenario'] = scenario
+                result['rule'] = name
+                return result
+        
+        best = max(scores, default=0)
+        if best > 0:
+            result['scenario'] = self.scenarios[scores.index(best)]
+        return result
+    
+    def detect(self, text: str) -> str:
+        """检测输入所属的场景"""
+        return self.analyze(text)['scenario']
+
+
+@lru_cache(maxsize=8)
+def _compile(frozen_keywords: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> ScenarioDetector:
+    return ScenarioDetector({scenario: keywords for scenario, keywords in frozen_keywords})
+
+
+def get_scenario_detector(scenario_keywords: Dict[str, Iterable[str]]) -> ScenarioDetector:
+    """获取关键词表对应的检测器（相同的关键词表只编译一次）"""
+    frozen = tuple((scenario, tuple(keywords)) for scenario, keywords in scenario_keywords.items())
+    return _compile(frozen)
@@ -0,0 +1,344 @@
+"""
+相似输入缓存
+Near-duplicate query cache for AI command parsing (character n-gram similarity)
+
+同一个意图经常有不同的说法（"查看磁盘空间" / "看看磁盘空间吧"），
+响应缓存按消息的字节哈希匹配，换一种说法就要重新调用一次 AI。
+这里把成功解析过的输入归一化后按字符二元组（bigram）建立倒排索引，
+新输入与历史输入的 Dice 相似度达到阈值时直接返回历史命令：
+  - 场景必须一致（由场景检测器判断）
+  - 参数必须完全一致：路径、文件名、数字、URL 等（以及中文输入中的英文单词）
+    不同的输入即使字面相似也不会命中，避免 "删除 a.txt" 返回 "rm b.txt"
+  - 否定词必须一致，避免 "不显示隐藏文件" 命中 "显示隐藏文件"
+
+磁盘上（SQLite）只保存归一化文本、场景、参数和命令，倒排索引在加载时于内存中重建。
+查询时按二元组的稀有程度做前缀过滤，只检查可能达到阈值的候选，
+几万条记录下单次查询仍在微秒级。
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
+
+
+# 默认配置（可通过环境变量覆盖）
+DEFAULT_SIMILAR_CACHE_PATH = os.path.join("~", ".cache", "cli_ai", "similar_cache.db")
+DEFAULT_SIMILAR_CACHE_MAX_ENTRIES = 20000
+DEFAULT_SIMILAR_CACHE_THRESHOLD = 0.75
+
+# 不影响意图的客套话和语气词（归一化时去掉）
+FILLER_WORDS = ('请帮我', '帮我', '帮忙', '麻烦', '请', '一下', '给我', '谢谢', '吧', '呢', '啊', '呀')
+ASCII_FILLER_WORDS = ('please', 'pls', 'thanks', 'thank you')
+# 否定词：字面很相似但意思相反（"显示隐藏文件" / "不显示隐藏文件"），必须一致才能命中
+NEGATION_WORDS = ('不', '别', '没', '勿', '禁止', '除了', '排除', '忽略')
+ASCII_NEGATION_WORDS = ('not', 'no', "don't", 'dont', 'without', 'except', 'exclude', 'ignore')
+
+_FILLER_RE = re.compile(
+    '|'.join(re.escape(word) for word in FILLER_WORDS) +
+    '|' + '|'.join(r'\b' + re.escape(word) + r'\b' for word in ASCII_FILLER_WORDS)
+)
+# 空白和句子标点（路径、URL 中的符号由参数负责比较）
+_SEPARATOR_RE = re.compile(r"[\s，。！？、；：,!?;…\"'“”‘’（）()]+")
+_TOKEN_RE = re.compile(r"[a-z0-9_./~:@%+=\-]+")
+_CJK_RE = re.compile(r"[一-鿿]")
+_NEGATION_RE = re.compile(
+    '|'.join(re.escape(word) for word in NEGATION_WORDS) +
+    '|' + '|'.join(r'\b' + re.escape(word) + r'\b' for word in ASCII_NEGATION_WORDS)
+)
+# 动词重叠（"看看" -> "看"）
+_REDUPLICATION_RE = re.compile(r"([一-鿿])\1")
+
+
+def normalize(text: str) -> str:
+    """归一化输入：全角转半角、小写、去掉客套话、动词重叠、空白和句子标点"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = _REDUPLICATION_RE.sub(r'\1', _FILLER_RE.sub(' ', text))
+    return _SEPARATOR_RE.sub('', text)
+
+
+def extract_arguments(text: str) -> Tuple[str, ...]:
+    """
+    提取输入中类似命令参数的部分（排序后的元组）
+    
+    包含数字或路径符号的词一定算参数；中文输入中的英文单词也算参数
+    （通常是文件名、用户名、命令名）。纯英文输入的普通单词由相似度负责比较。
+    否定词以 "!" 前缀记入参数。
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    has_cjk = bool(_CJK_RE.search(text))
+    arguments = {'!' + word for word in _NEGATION_RE.findall(text)}
+    for token in _TOKEN_RE.findall(_FILLER_RE.sub(' ', text)):
+        token = token.strip('.:-')
+        if not token:
+            continue
+        if has_cjk or any(char.isdigit() or char in "/.~:@=" for char in token):
+            arguments.add(token)
+    return tuple(sorted(arguments))
+
+
+def ngrams(normalized: str) -> FrozenSet[str]:
+    """字符二元组集合（首尾加边界标记，短文本也至少有两个元素）"""
+    padded = f"\x02{normalized}\x03"
+    return frozenset(padded[i:i + 2] for i in range(len(padded) - 1))
+
+
+def dice(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Dice 相似度"""
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 1.0
+
+
+class _Entry:
+    """内存中的一条记录"""
+    
+    __slots__ = ('key', 'grams', 'scenario', 'arguments', 'command')
+    
+    def __init__(self, key: Tuple[str, str, Tuple[str, ...]], grams: FrozenSet[str],
+                 scenario: str, arguments: Tuple[str, ...], command: str):
+        self.key = key
+        self.grams = grams
+        self.scenario = scenario
+        self.arguments = arguments
+        self.command = command
+
+
+class SimilarityCache:
+    """基于字符 n-gram 相似度的输入 → 命令缓存（线程安全）"""
+    
+    def __init__(self, path: str = DEFAULT_SIMILAR_CACHE_PATH,
+                 max_entries: int = DEFAULT_SIMILAR_CACHE_MAX_ENTRIES,
+                 threshold: float = DEFAULT_SIMILAR_CACHE_THRESHOLD):
+        """
+        初始化缓存并加载已有记录
+        
+        Args:
+            path: 数据库文件路径，":memory:" 表示仅使用内存
+            max_entries: 最多保存的记录数，超出后淘汰最久未使用的记录
+            threshold: 命中所需的最低相似度（0~1）
+        """
+        self.path = path if path == ":memory:" else os.path.expanduser(path)
+        self.max_entries = max(1, max_entries)
+        self.threshold = min(1.0, max(0.01, threshold))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: Dict[int, _Entry] = {}
+        # (场景, 参数) -> 二元组 -> 记录 id；场景和参数必须一致，只在同一个桶内查找
+        self._buckets: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Set[int]]] = {}
+        # (归一化文本, 场景, 参数) -> 记录 id，完全相同的输入直接命中
+        self._exact: Dict[Tuple[str, str, Tuple[str, ...]], int] = {}
+        self._conn = self._connect()
+        self._load()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库并创建表"""
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queries ("
+            " id INTEGER PRIMARY KEY,"
+            " normalized TEXT NOT NULL,"
+            " scenario TEXT NOT NULL,"
+            " arguments TEXT NOT NULL,"
+            " command TEXT NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " UNIQUE (normalized, scenario, arguments))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_queries_accessed ON queries(accessed_at)"
+        )
+        return conn
+    
+    def _load(self):
+        """读取所有记录并重建倒排索引"""
+        rows = self._conn.execute(
+            "SELECT id, normalized, scenario, arguments, command FROM queries"
+        ).fetchall()
+        for entry_id, normalized, scenario, arguments, command in rows:
+            self._index(entry_id, normalized, scenario, tuple(json.loads(arguments)), command)
+    
+    def _index(self, entry_id: int, normalized: str, scenario: str,
+               arguments: Tuple[str, ...], command: str):
+        key = (normalized, scenario, arguments)
+        grams = ngrams(normalized)
+        self._entries[entry_id] = _Entry(key, grams, scenario, arguments, command)
+        self._exact[key] = entry_id
+        postings = self._buckets.setdefault((scenario, arguments), {})
+        for gram in grams:
+            postings.setdefault(gram, set()).add(entry_id)
+    
+    def _unindex(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        bucket = (entry.scenario, entry.arguments)
+        postings = self._buckets.get(bucket, {})
+        for gram in entry.grams:
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del postings[gram]
+        if not postings:
+            self._buckets.pop(bucket, None)
+        self._exact.pop(entry.key, None)
+    
+    def _search(self, normalized: str, scenario: str,
+                arguments: Tuple[str, ...]) -> Optional[Tuple[int, float]]:
+        """返回相似度最高且达到阈值的 (记录 id, 相似度)"""
+        exact = self._exact.get((normalized, scenario, arguments))
+        if exact is not None:
+            return exact, 1.0
+        
+        postings = self._buckets.get((scenario, arguments))
+        if not postings:
+            return None
+        
+        grams = ngrams(normalized)
+        # 达到阈值所需的最少公共二元组数（与候选长度无关的下界）：
+        # 候选只要不含查询中最稀有的 len - min_overlap + 1 个二元组，就不可能命中
+        min_overlap = math.ceil(self.threshold * len(grams) / (2 - self.threshold))
+        ordered = sorted(grams, key=lambda gram: len(postings.get(gram, ())))
+        candidates: Set[int] = set()
+        for gram in ordered[:len(grams) - max(1, min_overlap) + 1]:
+            candidates.update(postings.get(gram, ()))
+        
+        # 长度过滤：二元组数相差过大的候选不可能达到阈值
+        shortest = self.threshold * len(grams) / (2 - self.threshold) - 1e-9
+        longest = (2 - self.threshold) * len(grams) / self.threshold + 1e-9
+        best: Optional[Tuple[int, float]] = None
+        for entry_id in candidates:
+            entry_grams = self._entries[entry_id].grams
+            if not shortest <= len(entry_grams) <= longest:
+                continue
+            similarity = dice(grams, entry_grams)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (entry_id, similarity)
+        return best
+    
+    def find(self, user_input: str, scenario: str) -> Optional[Dict[str, Any]]:
+        """
+        查找相似的历史输入（不更新统计，便于调试）
+        
+        Returns:
+            {'command', 'similarity'}；没有达到阈值的记录时返回 None
+        """
+        normalized = normalize(user_input)
+        if not normalized:
+            return None
+        with self._lock:
+            match = self._search(normalized, scenario, extract_arguments(user_input))
+            if match is None:
+                return None
+            return {'command': self._entries[match[0]].command, 'similarity': match[1]}
+    
+    def get(self, user_input: str, scenario: str) -> Optional[str]:
+        """
+        读取缓存
+        
+        Returns:
+            相似输入对应的命令；没有命中时返回 None
+        """
+        match = self.lookup(user_input, scenario)
+        return match['command'] if match else None
+    
+    def lookup(self, user_input: str, scenario: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存并返回相似度（更新统计和最近使用时间）
+        
+        Returns:
+            {'command', 'similarity'}；没有命中时返回 None
+        """
+        normalized = normalize(user_input)
+        if not normalized:
+            return None
+        try:
+            with self._lock:
+                match = self._search(normalized, scenario, extract_arguments(user_input))
+                if match is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute(
+                    "UPDATE queries SET accessed_at = ? WHERE id = ?", (time.time(), match[0])
+                )
+                self.hits += 1
+                return {'command': self._entries[match[0]].command, 'similarity': match[1]}
+        except sqlite3.Error as e:
+            print(f"⚠️  读取相似输入缓存失败: {e}", file=sys.stderr)
+            return None
+    
+    def put(self, user_input: str, scenario: str, command: str):
+        """保存一次成功的解析，超过条目上限时淘汰最久未使用的记录"""
+        normalized = normalize(user_input)
+        if not normalized or not command:
+            return
+        arguments = extract_arguments(user_input)
+        now = time.time()
+        try:
+            with self._lock:
+                entry_id = self._exact.get((normalized, scenario, arguments))
+                if entry_id is not None:
+                    self._conn.execute(
+                        "UPDATE queries SET command = ?, accessed_at = ? WHERE id = ?",
+                        (command, now, entry_id)
+                    )
+                    self._entries[entry_id].command = command
+                    return
+                
+                cursor = self._conn.execute(
+                    "INSERT INTO queries (normalized, scenario, arguments, command, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (normalized, scenario, json.dumps(arguments, ensure_ascii=False), command, now)
+                )
+                self._index(cursor.lastrowid, normalized, scenario, arguments, command)
+                
+                excess = len(self._entries) - self.max_entries
+                if excess > 0:
+                    stale = self._conn.execute(
+                        "SELECT id FROM queries ORDER BY accessed_at ASC LIMIT ?", (excess,)
+                    ).fetchall()
+                    self._conn.executemany("DELETE FROM queries WHERE id = ?", stale)
+                    for (stale_id,) in stale:
+                        self._unindex(stale_id)
+        except sqlite3.Error as e:
+            print(f"⚠️  写入相似输入缓存失败: {e}", file=sys.stderr)
+    
+    def clear(self):
+        """清空缓存并重置统计"""
+        with self._lock:
+            self._conn.execute("DELETE FROM queries")
+            self._entries.clear()
+            self._buckets.clear()
+            self._exact.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'path': self.path,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,159 @@
+"""
+相同请求合并（single-flight）
+Coalesce concurrent identical AI requests into one network call
+
+同一时刻有多个完全相同的请求（相同的消息、场景、上下文和参数）时，
+只有第一个调用方（leader）真正发出请求，其余调用方等待并共享它的结果：
+  - leader 成功：所有等待者得到同一个结果
+  - leader 失败：所有等待者收到同一个异常
+  - leader 被中断（Ctrl+C / 任务取消），或抛出 retry_on 中只与它自己有关的异常
+    （如调用方主动取消请求）：等待者不受影响，其中一个接替成为新的 leader
+  - 等待者超时或被取消：只影响它自己，leader 的请求照常进行
+
+同步调用（多线程）和异步调用（每个事件循环）分别合并。
+"""
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+
+class CoalescedWaitTimeout(Exception):
+    """等待相同请求的结果超时"""
+
+
+class _LeaderInterrupted(Exception):
+    """leader 被中断，等待者需要重新发起请求（内部使用）"""
+
+
+class _Flight:
+    """一次进行中的同步请求"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.interrupted = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并进行中的相同请求（线程安全）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        # asyncio.Future 绑定在事件循环上，按事件循环分别记录
+        self._async_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.coalesced = 0
+    
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None,
+           retry_on: Tuple[Type[BaseException], ...] = ()) -> Tuple[Any, bool]:
+        """
+        执行 fn，或等待相同 key 正在进行中的调用
+        
+        Args:
+            key: 请求的唯一标识
+            fn: 实际发起请求的函数
+            timeout: 等待者最多等待的秒数
+            retry_on: 只与 leader 自己有关的异常类型，leader 因此结束时等待者重新发起请求
+        
+        Returns:
+            (结果, 是否共享了其他调用方的结果)
+        
+        Raises:
+            CoalescedWaitTimeout: 等待超时
+            Exception: leader 抛出的异常
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _Flight()
+                    self._flights[key] = flight
+                else:
+                    flight.waiters += 1
+                    self.coalesced += 1
+            
+            if leader:
+                return self._lead(key, flight, fn, retry_on), False
+            
+            if not flight.done.wait(timeout):
+                raise CoalescedWaitTimeout("等待相同请求的结果超时")
+            if flight.interrupted:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+    
+    def _lead(self, key: Hashable, flight: _Flight, fn: Callable[[], Any],
+              retry_on: Tuple[Type[BaseException], ...]) -> Any:
+        """以 leader 身份执行请求，并把结果或异常交给等待者"""
+        try:
+            flight.result = fn()
+            return flight.result
+        except retry_on:
+            flight.interrupted = True
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.interrupted = True
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+    
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None,
+                  retry_on: Tuple[Type[BaseException], ...] = ()) -> Tuple[Any, bool]:
+        """do 的异步版本，fn 返回协程；在同一事件循环内合并"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flights = self._async_flights.setdefault(loop, {})
+        
+        while True:
+            future = flights.get(key)
+            if future is None:
+                future = loop.create_future()
+                flights[key] = future
+                return await self._alead(flights, key, future, fn, retry_on), False
+            
+            with self._lock:
+                self.coalesced += 1
+            try:
+                # shield：等待者超时或被取消时不影响 leader 的请求
+                return await asyncio.wait_for(asyncio.shield(future), timeout), True
+            except asyncio.TimeoutError:
+                raise CoalescedWaitTimeout("等待相同请求的结果超时")
+            except _LeaderInterrupted:
+                continue
+    
+    async def _alead(self, flights: Dict, key: Hashable, future: "asyncio.Future",
+                     fn: Callable[[], Awaitable[Any]], retry_on: Tuple[Type[BaseException], ...]) -> Any:
+        """以 leader 身份执行异步请求，并把结果或异常交给等待者"""
+        try:
+            result = await fn()
+        except retry_on:
+            future.set_exception(_LeaderInterrupted())
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.set_exception(_LeaderInterrupted())
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if flights.get(key) is future:
+                del flights[key]
+            if future.done() and not future.cancelled():
+                # 没有等待者时避免 "Future exception was never retrieved" 警告
+                future.exception()
@@ -0,0 +1,228 @@
+"""
+AI 调用遥测
+Token and latency telemetry for AI calls
+
+记录每次 AI 调用的 prompt/completion token 数（含命中前缀缓存的部分）、总耗时、首 token 延迟（流式）、
+在客户端限流器中的排队时间（与耗时分开统计），
+以及调用方（parser / analyzer / suggester）和场景，在内存中按维度汇总为直方图，
+并可选地将原始记录追加到 JSONL 文件中用于离线分析。
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """计算样本的百分位数（最近秩法），样本为空时返回 0"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """汇总延迟样本：平均值与 p50/p95/p99"""
+    return {
+        'avg': sum(samples) / len(samples) if samples else 0.0,
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99)
+    }
+
+
+class Telemetry:
+    """
+    AI 调用遥测
+    
+    按 "总计"、调用方、场景三个维度汇总，每个维度保留最近
+    max_samples 个延迟样本用于计算百分位数。
+    """
+    
+    def __init__(self, log_path: Optional[str] = None, max_samples: int = 1000):
+        """
+        Args:
+            log_path: JSONL 原始记录文件路径，None 表示不写文件
+            max_samples: 每个维度保留的延迟样本数
+        """
+        self.log_path = os.path.expanduser(log_path) if log_path else None
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+        self._groups: Dict[str, Dict[str, Any]] = {}
+        self._warmups: List[Dict[str, Any]] = []
+    
+    def _group(self, name: str) -> Dict[str, Any]:
+        group = self._groups.get(name)
+        if group is None:
+            group = {
+                'calls': 0,
+                'errors': 0,
+                'cached': 0,
+                'coalesced': 0,
+                'estimated': 0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cached_prompt_tokens': 0,
+                'latency_ms': deque(maxlen=self._max_samples),
+                'first_token_ms': deque(maxlen=self._max_samples),
+                'queue_ms': deque(maxlen=self._max_samples)
+            }
+            self._groups[name] = group
+        return group
+    
+    def record(
+        self,
+        caller: str,
+        scenario: Optional[str],
+        provider: str,
+        model: str,
+        latency_ms: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_prompt_tokens: Optional[int] = 0,
+        first_token_ms: Optional[float] = None,
+        cached: bool = False,
+        success: bool = True,
+        queue_ms: float = 0.0,
+        coalesced: bool = False,
+        estimated: bool = False
+    ):
+        """
+        记录一次 AI 调用（latency_ms 不含 queue_ms 排队时间）
+        
+        coalesced 表示共享了另一个进行中的相同请求的结果，
+        耗时为等待时间，token 由发出请求的调用方记录；
+        estimated 表示响应中没有用量（流式提前结束），token 数为估算值，
+        此时不知道命中前缀缓存的 token 数，cached_prompt_tokens 为 None。
+        """
+        record = {
+            'timestamp': time.time(),
+            'caller': caller,
+            'scenario': scenario,
+            'provider': provider,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_prompt_tokens': cached_prompt_tokens,
+            'latency_ms': round(latency_ms, 3),
+            'first_token_ms': round(first_token_ms, 3) if first_token_ms is not None else None,
+            'queue_ms': round(queue_ms, 3),
+            'cached': cached,
+            'coalesced': coalesced,
+            'estimated': estimated,
+            'success': success
+        }
+        
+        names = ['total', f"caller:{caller}"]
+        if scenario:
+            names.append(f"scenario:{scenario}")
+        
+        with self._lock:
+            for name in names:
+                group = self._group(name)
+                group['calls'] += 1
+                group['prompt_tokens'] += prompt_tokens
+                group['completion_tokens'] += completion_tokens
+                group['cached_prompt_tokens'] += cached_prompt_tokens or 0
+                if not success:
+                    group['errors'] += 1
+                if coalesced:
+                    group['coalesced'] += 1
+                if estimated:
+                    group['estimated'] += 1
+                if cached:
+                    group['cached'] += 1
+                else:
+                    # 缓存命中的耗时不代表模型延迟，不计入直方图
+                    group['latency_ms'].append(latency_ms)
+                    group['queue_ms'].append(queue_ms)
+                    if first_token_ms is not None:
+                        group['first_token_ms'].append(first_token_ms)
+            
+            if self.log_path:
+                self._append(record)
+    
+    def record_warmup(self, provider: str, success: bool, latency_ms: float, saved_ms: float):
+        """
+        记录一次连接预热
+        
+        Args:
+            provider: 预热的提供商
+            success: 是否成功
+            latency_ms: 预热请求（含建连）耗时
+            saved_ms: 估算为后续首个请求节省的建连时间
+        """
+        record = {
+            'timestamp': time.time(),
+            'event': 'warmup',
+            'provider': provider,
+            'success': success,
+            'latency_ms': round(latency_ms, 3),
+            'saved_ms': round(saved_ms, 3)
+        }
+        with self._lock:
+            self._warmups.append(record)
+            if self.log_path:
+                self._append(record)
+    
+    def _append(self, record: Dict[str, Any]):
+        """追加一条原始记录到 JSONL 文件（写入失败时停止记录文件）"""
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️  写入遥测文件失败，已停止记录: {e}", file=sys.stderr)
+            self.log_path = None
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        获取统计快照
+        
+        Returns:
+            {'total': {...}, 'callers': {调用方: {...}}, 'scenarios': {场景: {...}},
+             'warmups': [连接预热记录]}，
+            每项包含 calls, errors, cached, coalesced（共享相同请求结果的调用）,
+            estimated（token 数为估算值的调用）, prompt_tokens, completion_tokens,
+            cached_prompt_tokens（命中提供商前缀缓存的 prompt token，只有响应中带用量的调用才有，
+            estimated 的调用不计入）, latency_ms、first_token_ms
+            和 queue_ms（限流排队时间）（avg/p50/p95/p99）
+        """
+        with self._lock:
+            result: Dict[str, Any] = {
+                'total': None, 'callers': {}, 'scenarios': {}, 'warmups': list(self._warmups)
+            }
+            for name, group in self._groups.items():
+                summary = {
+                    'calls': group['calls'],
+                    'errors': group['errors'],
+                    'cached': group['cached'],
+                    'coalesced': group['coalesced'],
+                    'estimated': group['estimated'],
+                    'prompt_tokens': group['prompt_tokens'],
+                    'completion_tokens': group['completion_tokens'],
+                    'cached_prompt_tokens': group['cached_prompt_tokens'],
+                    'latency_ms': latency_summary(list(group['latency_ms'])),
+                    'first_token_ms': latency_summary(list(group['first_token_ms'])),
+                    'queue_ms': latency_summary(list(group['queue_ms']))
+                }
+                if name == 'total':
+                    result['total'] = summary
+                elif name.startswith("caller:"):
+                    result['callers'][name[len("caller:"):]] = summary
+                else:
+                    result['scenarios'][name[len("scenario:"):]] = summary
+            return result
+    
+    def reset(self):
+        """清空内存中的统计"""
+        with self._lock:
+            self._groups.clear()
+            self._warmups.clear()
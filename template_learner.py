@@ -0,0 +1,369 @@
+"""
+参数模板学习
+Learn parametric templates from confirmed AI translations
+
+"创建文件夹 foo" 和 "创建文件夹 bar" 只有参数不同，却各要调用一次 AI。
+用户确认执行 AI 解析出的命令后，用 extract_parameters 提取输入中的文件、路径、
+数字（以及中文输入中的英文名称），找出它们在命令中作为独立参数出现的位置，
+学习一个参数模板：
+
+    "创建文件夹 {0}"  ->  "mkdir {0}"
+
+之后只有参数不同的输入直接在本地填充模板，不再访问网络。填入的参数一律经过
+shlex.quote 转义（~ 开头的路径保留 ~ 展开），参数中的空格、引号、$() 等
+不会被 shell 解释。
+
+以下情况不学习，保证模板的结果与 AI 给出的命令一致：
+  - 命令无法被 shlex 解析
+  - 参数出现在命令的其他参数内部（如 "压缩 foo" -> "tar czf foo.tar.gz foo"）
+  - 输入中同一个参数出现多次
+  - 没有任何参数出现在命令中
+命令名（每段管道的第一个词）和以 "-" 开头的选项从不作为参数；
+在命令中没有出现的参数作为模板的固定文字，必须完全一致才匹配。
+"""
+import json
+import os
+import re
+import shlex
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# 默认配置（可通过环境变量覆盖）
+DEFAULT_TEMPLATE_PATH = os.path.join("~", ".cache", "cli_ai", "templates.db")
+DEFAULT_MAX_TEMPLATES = 500
+DEFAULT_MIN_CONFIRMATIONS = 1
+
+# 参数类型（按优先级排列，重叠时保留更长、优先级更高的）
+SLOT_TYPES = ('paths', 'files', 'numbers', 'names')
+
+# 中文输入中的英文名称（文件夹名、用户名等），extract_parameters 不提取这一类
+_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_.\-]*")
+_CJK_RE = re.compile(r"[一-鿿]")
+# 参数两侧不能紧挨着的字符（避免匹配到更长的词的一部分）
+_BOUNDARY = r"A-Za-z0-9_.\-/~"
+# 管道、命令列表之后是新的命令名
+_COMMAND_SEPARATORS = ('|', '||', '&&', ';')
+
+# (起始位置, 结束位置, 参数类型)
+Slot = Tuple[int, int, str]
+
+
+def find_slots(text: str, params: Dict[str, List[str]]) -> List[Slot]:
+    """
+    定位输入中的参数
+    
+    Args:
+        text: 用户输入
+        params: extract_parameters(text) 的结果
+    
+    Returns:
+        按位置排列、互不重叠的参数
+    """
+    candidates: List[Slot] = []
+    for slot_type in SLOT_TYPES[:3]:
+        for value in set(params.get(slot_type, ())):
+            pattern = rf"(?<![{_BOUNDARY}]){re.escape(value)}(?![{_BOUNDARY}])"
+            candidates.extend((m.start(), m.end(), slot_type) for m in re.finditer(pattern, text))
+    if _CJK_RE.search(text):
+        pattern = rf"(?<![{_BOUNDARY}]){_NAME_RE.pattern}"
+        candidates.extend((m.start(), m.end(), 'names') for m in re.finditer(pattern, text))
+    
+    # 长的优先，同样长时按类型优先级
+    candidates.sort(key=lambda slot: (slot[0] - slot[1], SLOT_TYPES.index(slot[2]), slot[0]))
+    taken: List[Slot] = []
+    for slot in candidates:
+        if all(slot[1] <= other[0] or slot[0] >= other[1] for other in taken):
+            taken.append(slot)
+    return sorted(taken)
+
+
+def quote_argument(value: str) -> str:
+    """转义一个参数（~ 开头的路径保留 ~ 展开）"""
+    if value == '~':
+        return value
+    if value.startswith('~/'):
+        return '~/' + shlex.quote(value[2:]) if len(value) > 2 else value
+    return shlex.quote(value)
+
+
+class Template:
+    """一个参数模板"""
+    
+    def __init__(self, literals: List[str], slot_types: List[str], command: List[Any],
+                 confirmations: int = 0, hits: int = 0, last_used: float = 0.0):
+        """
+        Args:
+            literals: 参数之间的固定文字（比参数多一个）
+            slot_types: 每个参数的类型
+            command: 命令的各个词，字符串为原样保留的词，整数为参数编号
+        """
+        self.literals = literals
+        self.slot_types = slot_types
+        self.command = command
+        self.confirmations = confirmations
+        self.hits = hits
+        self.last_used = last_used
+        # 固定文字原样匹配（连续空白可以是任意空白），参数匹配不含空白的词
+        parts = []
+        for index, literal in enumerate(literals):
+            parts.extend(r"\s+" if piece.isspace() else re.escape(piece)
+                         for piece in re.split(r"(\s+)", literal) if piece)
+            if index < len(slot_types):
+                parts.append(r"(\S+?)")
+        self.regex = re.compile(''.join(parts))
+    
+    @property
+    def key(self) -> str:
+        """模板的输入形式，如 "创建文件夹 {0}" """
+        pieces = [self.literals[0]]
+        for index, literal in enumerate(self.literals[1:]):
+            pieces.append(f"{{{index}}}{literal}")
+        return ''.join(pieces)
+    
+    def command_text(self) -> str:
+        """模板的命令形式，如 "mkdir {0}" """
+        return ' '.join(f"{{{part}}}" if isinstance(part, int) else part for part in self.command)
+    
+    def fill(self, values: List[str]) -> str:
+        """把参数填入命令"""
+        return ' '.join(quote_argument(values[part]) if isinstance(part, int) else part
+                        for part in self.command)
+    
+    def to_json(self) -> str:
+        return json.dumps({
+            'literals': self.literals,
+            'slot_types': self.slot_types,
+            'command': self.command
+        }, ensure_ascii=False)
+
+
+def build_template(user_input: str, params: Dict[str, List[str]],
+                   command: str) -> Optional[Template]:
+    """
+    从一次确认过的解析结果中学习模板
+    
+    Returns:
+        模板；无法安全地参数化时返回 None
+    """
+    text = user_input.strip()
+    try:
+        shlex.split(command)
+    except ValueError:
+        return None
+    words = command.split()
+    if not words:
+        return None
+    
+    # 命令中可以替换为参数的位置：不是命令名、不是选项的词（允许带引号）
+    positions: Dict[str, List[int]] = {}
+    for index, word in enumerate(words):
+        if index == 0 or words[index - 1] in _COMMAND_SEPARATORS or word.startswith('-'):
+            continue
+        value = word[1:-1] if len(word) > 1 and word[0] == word[-1] and word[0] in "'\"" else word
+        positions.setdefault(value, []).append(index)
+    
+    slots = find_slots(text, params)
+    values = [text[start:end] for start, end, _ in slots]
+    command_parts: List[Any] = list(words)
+    literals: List[str] = []
+    slot_types: List[str] = []
+    cursor = 0
+    for (start, end, slot_type), value in zip(slots, values):
+        if value not in positions:
+            continue
+        if values.count(value) > 1:
+            return None
+        # 参数出现在命令中的其他词内部时无法安全替换
+        for index, word in enumerate(words):
+            if value in word and index not in positions[value]:
+                return None
+        for index in positions[value]:
+            command_parts[index] = len(slot_types)
+        literals.append(text[cursor:start])
+        slot_types.append(slot_type)
+        cursor = end
+    literals.append(text[cursor:])
+    
+    if not slot_types:
+        return None
+    return Template(literals, slot_types, command_parts)
+
+
+class TemplateLearner:
+    """参数模板的学习与匹配（线程安全）"""
+    
+    def __init__(self, path: str = DEFAULT_TEMPLATE_PATH,
+                 max_templates: int = DEFAULT_MAX_TEMPLATES,
+                 min_confirmations: int = DEFAULT_MIN_CONFIRMATIONS):
+        """
+        初始化并加载已学习的模板
+        
+        Args:
+            path: 数据库文件路径，":memory:" 表示仅使用内存
+            max_templates: 最多保存的模板数，超出后淘汰最久未使用的模板
+            min_confirmations: 模板被确认多少次后才开始使用
+        """
+        self.path = path if path == ":memory:" else os.path.expanduser(path)
+        self.max_templates = max(1, max_templates)
+        self.min_confirmations = max(1, min_confirmations)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Template] = {}
+        self._conn = self._connect()
+        self._load()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库并创建表"""
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS templates ("
+            " key TEXT PRIMARY KEY,"
+            " template TEXT NOT NULL,"
+            " confirmations INTEGER NOT NULL,"
+            " hits INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        return conn
+    
+    def _load(self):
+        rows = self._conn.execute(
+            "SELECT template, confirmations, hits, last_used FROM templates"
+        ).fetchall()
+        for data, confirmations, hits, last_used in rows:
+            try:
+                fields = json.loads(data)
+                template = Template(fields['literals'], fields['slot_types'], fields['command'],
+                                    confirmations, hits, last_used)
+            except (ValueError, KeyError, TypeError, re.error):
+                continue
+            self._templates[template.key] = template
+    
+    def _save(self, template: Template):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO templates (key, template, confirmations, hits, last_used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (template.key, template.to_json(), template.confirmations,
+             template.hits, template.last_used)
+        )
+    
+    def learn(self, user_input: str, params: Dict[str, List[str]],
+              command: str) -> Optional[Template]:
+        """
+        记录一次用户确认的解析结果
+        
+        Args:
+            user_input: 用户输入
+            params: extract_parameters(user_input) 的结果
+            command: 用户确认执行的命令
+        
+        Returns:
+            学到（或再次确认）的模板；无法参数化时返回 None
+        """
+        template = build_template(user_input, params, command)
+        if template is None:
+            return None
+        try:
+            with self._lock:
+                existing = self._templates.get(template.key)
+                if existing is not None and existing.command == template.command:
+                    template = existing
+                # 同一个输入模板学到不同的命令时，以最新确认的为准并重新计数
+                template.confirmations += 1
+                template.last_used = time.time()
+                self._templates[template.key] = template
+                self._save(template)
+                
+                excess = len(self._templates) - self.max_templates
+                if excess > 0:
+                    stale = sorted(self._templates.values(), key=lambda t: t.last_used)[:excess]
+                    for old in stale:
+                        del self._templates[old.key]
+                        self._conn.execute("DELETE FROM templates WHERE key = ?", (old.key,))
+        except sqlite3.Error as e:
+            print(f"⚠️  保存参数模板失败: {e}", file=sys.stderr)
+        return template
+    
+    def match(self, user_input: str, params: Dict[str, List[str]]) -> Optional[str]:
+        """
+        用已学习的模板生成命令
+        
+        Args:
+            user_input: 用户输入
+            params: extract_parameters(user_input) 的结果
+        
+        Returns:
+            填充后的命令；没有匹配的模板时返回 None
+        """
+        text = user_input.strip()
+        slots = find_slots(text, params)
+        with self._lock:
+            for template in self._templates.values():
+                if template.confirmations < self.min_confirmations:
+                    continue
+                match = template.regex.fullmatch(text)
+                if match is None:
+                    continue
+                # 模板位置上的词必须恰好是同类型的参数
+                captured = [(match.start(i + 1), match.end(i + 1), slot_type)
+                            for i, slot_type in enumerate(template.slot_types)]
+                if not all(slot in slots for slot in captured):
+                    continue
+                template.hits += 1
+                template.last_used = time.time()
+                self.hits += 1
+                try:
+                    self._save(template)
+                except sqlite3.Error:
+                    pass
+                return template.fill(list(match.groups()))
+            self.misses += 1
+            return None
+    
+    def templates(self) -> List[Dict[str, Any]]:
+        """已学习的模板（按使用时间倒序）"""
+        with self._lock:
+            ordered = sorted(self._templates.values(), key=lambda t: t.last_used, reverse=True)
+            return [{
+                'input': template.key,
+                'command': template.command_text(),
+                'confirmations': template.confirmations,
+                'hits': template.hits
+            } for template in ordered]
+    
+    def clear(self):
+        """删除所有模板并重置统计"""
+        with self._lock:
+            self._conn.execute("DELETE FROM templates")
+            self._templates.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """返回统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'path': self.path,
+                'templates': len(self._templates),
+                'max_templates': self.max_templates,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -4,7 +4,7 @@ This module tests the AI provider abstraction layer without making actual API ca
 For complete testing with real API calls, configure your .env file with valid API keys.
 """
 import os
-from ai_provider import AIProvider
+from ai_provider import AIProvider, get_shared_provider, get_client_registry
 
 def test_ai_provider():
     """Test AI provider initialization and configuration"""
@@ -63,5 +63,44 @@ def test_ai_provider():
         os.environ.clear()
         os.environ.update(original_env)
 
+def test_shared_client_registry():
+    """Test that providers share one pooled client per provider/base_url"""
+    original_env = os.environ.copy()
+    try:
+        print("Testing Shared Client Registry...")
+        
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["DEEPSEEK_BASE_URL"] = "https://api.deepseek.com/v1"
+        
+        # 多个 AIProvider 实例应复用同一个客户端（同一个连接池）
+        first = AIProvider()
+        second = AIProvider()
+        assert first.client is second.client
+        print("✓ AIProvider instances share one client")
+        
+        # 进程级共享实例
+        assert get_shared_provider() is get_shared_provider()
+        print("✓ get_shared_provider returns a single instance")
+        
+        # 不同 base_url 使用不同客户端
+        os.environ["DEEPSEEK_BASE_URL"] = "https://mirror.example.com/v1"
+        third = AIProvider()
+        assert third.client is not first.client
+        print("✓ Different base_url gets its own client")
+        
+        # 连接池配置
+        os.environ["AI_HTTP_MAX_CONNECTIONS"] = "3"
+        http_client = get_client_registry()._build_http_client()
+        pool = http_client._transport._pool
+        assert pool._max_connections == 3
+        http_client.close()
+        print("✓ Pool limits are configurable")
+    finally:
+        os.environ.clear()
+        os.environ.update(original_env)
+
+
 if __name__ == "__main__":
     test_ai_provider()
+    test_shared_client_registry()
@@ -0,0 +1,101 @@
+"""
+测试异步 AI 接口
+Test async AI API against the local stand-in server (no real API calls)
+"""
+import asyncio
+import os
+import time
+import unittest
+
+from ai_provider import AIProvider
+from ai_command_parser import AICommandParser
+from ai_error_analyzer import AIErrorAnalyzer, AICommandSuggester
+from local_ai_server import LocalAIServer, ScriptedResponder
+
+
+# 每个请求的模拟推理延迟（秒）
+STUB_DELAY = 0.3
+
+# 根据系统提示词返回固定内容
+STUB_RESPONDER = ScriptedResponder(
+    rules=[
+        ("分析命令执行错误", "原因：权限不足\n解决方案：使用 sudo\n替代命令：sudo cat /root/a.txt"),
+        ("建议一个合理的下一步操作", "进入 test 文件夹"),
+    ],
+    default="ls -la\n这个命令会列出所有文件"
+)
+
+
+class TestAsyncAI(unittest.TestCase):
+    """测试异步 AI 调用及并发"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalAIServer(
+            responder=STUB_RESPONDER, latency_ms=STUB_DELAY * 1000
+        ).start()
+        
+        cls.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "local"
+        os.environ["LOCAL_BASE_URL"] = cls.server.base_url
+        cls.provider = AIProvider()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        os.environ.clear()
+        os.environ.update(cls.original_env)
+    
+    def _parser(self, stream=False):
+        parser = AICommandParser(stream=stream)
+        parser.ai_provider = self.provider
+        return parser
+    
+    def test_agenerate_response(self):
+        """测试异步生成响应"""
+        result = asyncio.run(self.provider.agenerate_response("system", "列出文件"))
+        self.assertTrue(result.startswith("ls -la"))
+    
+    def test_aparse_command(self):
+        """测试异步命令解析"""
+        command = asyncio.run(self._parser().aparse_command("列出所有文件"))
+        self.assertEqual(command, "ls -la")
+    
+    def test_aparse_command_streaming(self):
+        """测试异步流式命令解析"""
+        tokens = []
+        command = asyncio.run(
+            self._parser(stream=True).aparse_command("列出所有文件", on_token=tokens.append)
+        )
+        self.assertEqual(command, "ls -la")
+        self.assertTrue(tokens)
+    
+    def test_concurrent_calls(self):
+        """测试解析、错误分析、建议三个请求并发执行"""
+        parser = self._parser()
+        analyzer = AIErrorAnalyzer()
+        analyzer.ai_provider = self.provider
+        suggester = AICommandSuggester()
+        suggester.ai_provider = self.provider
+        
+        async def run_all():
+            return await asyncio.gather(
+                parser.aparse_command("列出所有文件"),
+                analyzer.aanalyze_error("cat /root/a.txt", "Permission denied", 1),
+                suggester.asuggest_next_command("mkdir test", "", True),
+            )
+        
+        start = time.perf_counter()
+        command, analysis, suggestion = asyncio.run(run_all())
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(command, "ls -la")
+        self.assertEqual(analysis['analysis'], "权限不足")
+        self.assertEqual(analysis['alternative_command'], "sudo cat /root/a.txt")
+        self.assertEqual(suggestion, "进入 test 文件夹")
+        # 三个请求并发执行，总耗时应明显小于串行的 3 倍延迟
+        self.assertLess(elapsed, STUB_DELAY * 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+"""
+测试批量命令解析
+Test AICommandParser.parse_many (no real API calls)
+"""
+import io
+import json
+import os
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from types import SimpleNamespace
+
+import config
+from ai_command_parser import AICommandParser
+from ai_provider import AIProvider
+from token_utils import estimate_tokens
+
+
+# 模拟模型的翻译表
+TRANSLATIONS = {
+    "列出所有文件": "ls -la",
+    "查看磁盘空间": "df -h",
+    "查看内存使用": "free -h",
+    "显示当前目录": "pwd",
+    "查看进程": "ps aux",
+}
+
+
+class BatchClient:
+    """根据用户消息中的 JSON 数组返回命令数组的模拟客户端"""
+    
+    def __init__(self, broken=None):
+        self.requests = []
+        # 第一次请求时故意返回空字符串的条目
+        self.broken = set(broken or [])
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        texts = json.loads(kwargs["messages"][-1]["content"])
+        commands = []
+        for text in texts:
+            if text in self.broken:
+                self.broken.discard(text)
+                commands.append("")
+            else:
+                commands.append(f"`{TRANSLATIONS.get(text, 'echo unknown')}`")
+        content = "```json\n" + json.dumps(commands, ensure_ascii=False) + "\n```"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class TestParseMany(unittest.TestCase):
+    """测试批量解析"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ.pop("AI_CACHE", None)
+        os.environ.pop("AI_HEDGE", None)
+        self.parser = AICommandParser(use_context=False)
+        self.parser.ai_provider = AIProvider()
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def _use_client(self, client):
+        self.parser.ai_provider.client = client
+        return client
+    
+    def test_single_request(self):
+        """测试多条输入合并为一次请求，结果与输入一一对应"""
+        client = self._use_client(BatchClient())
+        inputs = list(TRANSLATIONS)
+        
+        self.assertEqual(self.parser.parse_many(inputs), list(TRANSLATIONS.values()))
+        self.assertEqual(len(client.requests), 1)
+        self.assertIn("批量模式", client.requests[0]["messages"][0]["content"])
+    
+    def test_batch_size(self):
+        """测试按批量大小拆分请求"""
+        client = self._use_client(BatchClient())
+        results = self.parser.parse_many(list(TRANSLATIONS), batch_size=2)
+        
+        self.assertEqual(results, list(TRANSLATIONS.values()))
+        self.assertEqual(len(client.requests), 3)
+    
+    def test_retry_only_failed(self):
+        """测试只重试失败的条目"""
+        client = self._use_client(BatchClient(broken=["查看内存使用"]))
+        results = self.parser.parse_many(list(TRANSLATIONS))
+        
+        self.assertEqual(results, list(TRANSLATIONS.values()))
+        self.assertEqual(len(client.requests), 2)
+        self.assertEqual(json.loads(client.requests[1]["messages"][-1]["content"]), ["查看内存使用"])
+    
+    def test_blank_inputs_skipped(self):
+        """测试空输入不发送请求，结果为 None"""
+        client = self._use_client(BatchClient())
+        self.assertEqual(self.parser.parse_many(["", "  ", "显示当前目录"]), [None, None, "pwd"])
+        self.assertEqual(json.loads(client.requests[0]["messages"][-1]["content"]), ["显示当前目录"])
+    
+    def test_request_failure_not_printed_to_stdout(self):
+        """测试请求失败时结果为 None，警告写到 stderr，不混入标准输出"""
+        def fail(**kwargs):
+            raise ValueError("boom")
+        self._use_client(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=fail))))
+        self.parser.ai_provider.max_retries = 0
+        
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            self.assertEqual(self.parser._parse_batch(["查看磁盘空间", "显示当前目录"]), [None, None])
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn("批量解析失败", stderr.getvalue())
+    
+    def test_length_mismatch_fails_batch(self):
+        """测试返回数组长度不一致时整批视为失败"""
+        self.assertEqual(self.parser._parse_batch_response('["ls -la"]', 2), [None, None])
+        self.assertEqual(self.parser._parse_batch_response('not json', 1), [None])
+        self.assertEqual(self.parser._parse_batch_response('["ls -la", ""]', 2), ["ls -la", None])
+    
+    def test_token_budget_splits_batches(self):
+        """测试超过输入 token 预算时拆分请求"""
+        original = config.AI_BATCH_MAX_INPUT_TOKENS
+        config.AI_BATCH_MAX_INPUT_TOKENS = 12
+        try:
+            batches = list(self.parser._split_batches(list(TRANSLATIONS), list(range(5))))
+        finally:
+            config.AI_BATCH_MAX_INPUT_TOKENS = original
+        
+        self.assertGreater(len(batches), 1)
+        self.assertEqual([i for batch in batches for i in batch], list(range(5)))
+    
+    def test_estimate_tokens(self):
+        """测试 token 估算"""
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("查看磁盘空间"), 4)
+        self.assertEqual(estimate_tokens("list files"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
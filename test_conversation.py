@@ -0,0 +1,214 @@
+"""
+测试多轮对话记忆
+Test the token-budgeted conversation window and how follow-up inputs are resolved (no real API calls)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from ai_command_parser import AICommandParser
+from ai_provider import AIProvider, CircuitBreaker
+from conversation import HISTORY_HEADING, SUMMARY_PREFIX, ConversationMemory, refers_back
+from fake_clients import FakeClient
+from nlp_parser import NLPParser
+from tiered_parser import TieredParser
+from token_utils import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+
+class TestConversationMemory(unittest.TestCase):
+    """测试对话记忆的渲染和 token 预算"""
+    
+    def test_render(self):
+        """测试按时间顺序渲染，包含执行结果和错误的第一行"""
+        memory = ConversationMemory()
+        self.assertIsNone(memory.history())
+        memory.add("创建文件夹 foo", "mkdir foo", 'success')
+        memory.add("进入它", "cd foo", 'failed', "cd: foo: Permission denied\nmore")
+        memory.add("删除它", "rm -r foo", 'cancelled')
+        history = memory.history()
+        self.assertEqual(history, [{"role": "system", "content": "\n".join([
+            HISTORY_HEADING,
+            "- 用户：创建文件夹 foo → mkdir foo（成功）",
+            "- 用户：进入它 → cd foo（失败：cd: foo: Permission denied）",
+            "- 用户：删除它 → rm -r foo（未执行）",
+        ])}])
+    
+    def test_token_budget(self):
+        """测试超出预算时更早的轮压缩为命令摘要，总量不超过预算"""
+        memory = ConversationMemory(token_budget=120)
+        for i in range(12):
+            memory.add(f"查看文件 log{i}.txt 的最后二十行内容", f"tail -n 20 log{i}.txt", 'success')
+        content = memory.history()[0]['content']
+        stats = memory.stats()
+        self.assertLessEqual(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS, 120)
+        self.assertLessEqual(stats['tokens'], 120)
+        self.assertGreater(stats['summarized'], 0)
+        self.assertLess(stats['included'] + stats['summarized'], 12)
+        # 最近一轮完整保留，摘要中是紧挨着的更早几轮
+        self.assertTrue(content.endswith("tail -n 20 log11.txt（成功）"))
+        summary = next(line for line in content.split("\n") if line.startswith(SUMMARY_PREFIX))
+        self.assertTrue(summary.endswith(f"tail -n 20 log{11 - stats['included']}.txt"))
+    
+    def test_max_turns_and_clear(self):
+        """测试最多保留 max_turns 轮，清空后没有历史"""
+        memory = ConversationMemory(max_turns=2)
+        for i in range(3):
+            memory.add(f"输入 {i}", f"echo {i}")
+        self.assertEqual(len(memory), 2)
+        self.assertNotIn("echo 0", memory.history()[0]['content'])
+        memory.clear()
+        self.assertIsNone(memory.history())
+    
+    def test_render_cached(self):
+        """测试渲染结果缓存到下一次记录"""
+        memory = ConversationMemory()
+        memory.add("列出文件", "ls", 'success')
+        self.assertIs(memory.history()[0], memory.history()[0])
+        first = memory.history()[0]
+        memory.add("显示日历", "cal", 'success')
+        self.assertIsNot(memory.history()[0], first)
+    
+    def test_follow_up(self):
+        """测试识别指代之前对话的输入（没有对话时不算）"""
+        self.assertTrue(refers_back("现在删除它"))
+        self.assertTrue(refers_back("run it again with sudo"))
+        self.assertFalse(refers_back("列出当前目录的文件"))
+        self.assertFalse(refers_back("edit the item list"))
+        self.assertTrue(refers_back("删除这个"))
+        self.assertTrue(refers_back("也删除那些。"))
+        # "其它"里的"它"和修饰名词的"这个"不算指代
+        self.assertFalse(refers_back("列出其它用户的进程"))
+        self.assertFalse(refers_back("查看这个目录下的文件"))
+        self.assertFalse(refers_back("那些日志文件占了多少空间"))
+        memory = ConversationMemory()
+        self.assertFalse(memory.is_follow_up("删除它"))
+        memory.add("创建文件夹 foo", "mkdir foo", 'success')
+        self.assertTrue(memory.is_follow_up("删除它"))
+
+
+class TestParserHistory(unittest.TestCase):
+    """测试 AICommandParser 发送对话历史"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE", "AI_TEMPLATES", "AI_DYNAMIC_EXAMPLES"):
+            os.environ.pop(name, None)
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_history_in_request(self):
+        """测试对话历史位于提示词之后、用户消息之前"""
+        memory = ConversationMemory()
+        parser = AICommandParser(use_context=False, conversation=memory)
+        self.assertIsNone(parser._build_request("列出文件")['history'])
+        memory.add("创建文件夹 foo", "mkdir foo", 'success')
+        request = parser._build_request("现在删除它")
+        self.assertEqual(request['history'], memory.history())
+        # 独立的输入不带对话历史
+        self.assertIsNone(parser._build_request("列出文件")['history'])
+        messages = parser.ai_provider._build_messages(
+            request['system_prompt'], request['user_message'], request['history'], request['context']
+        )
+        self.assertEqual([message['role'] for message in messages], ["system", "system", "user"])
+        self.assertIn("mkdir foo", messages[1]['content'])
+    
+    def test_standalone_input_still_cached(self):
+        """测试经过几轮对话后，重复的独立输入仍然命中响应缓存"""
+        tmpdir = tempfile.mkdtemp()
+        os.environ["AI_CACHE"] = "true"
+        os.environ["AI_CACHE_PATH"] = os.path.join(tmpdir, "cache.db")
+        memory = ConversationMemory()
+        parser = AICommandParser(use_context=False, stream=False, conversation=memory)
+        parser.ai_provider = AIProvider()
+        parser.ai_provider.client = FakeClient(content="df -h")
+        try:
+            self.assertEqual(parser.parse_command("查看磁盘空间"), "df -h")
+            for index in range(3):
+                memory.add(f"创建文件夹 dir{index}", f"mkdir dir{index}", 'success')
+            self.assertEqual(parser.parse_command("查看磁盘空间"), "df -h")
+            self.assertEqual(parser.ai_provider.client.calls, 1)
+        finally:
+            parser.ai_provider.cache.close()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    
+    def test_follow_up_skips_local_lookup(self):
+        """测试指代之前对话的输入不查也不写相似输入缓存"""
+        memory = ConversationMemory()
+        parser = AICommandParser(use_context=False, conversation=memory)
+        stored = []
+        parser.similar_cache = SimpleNamespace(lookup=lambda text, scenario: {'command': "rm -r bar", 'similarity': 1.0},
+                                               put=lambda *args: stored.append(args))
+        memory.add("创建文件夹 foo", "mkdir foo", 'success')
+        request = parser._build_request("删除它")
+        self.assertIsNone(parser._lookup_local(request))
+        parser._put_similar(request, "rm -r foo")
+        self.assertEqual(stored, [])
+        self.assertEqual(parser._lookup_local(parser._build_request("删除文件夹 bar")), "rm -r bar")
+        self.assertFalse(AICommandParser(use_context=False).is_follow_up("删除它"))
+
+
+class TestResolverFollowUp(unittest.TestCase):
+    """测试分层解析器处理后续输入"""
+    
+    def test_follow_up_goes_to_ai(self):
+        """测试后续输入跳过相似输入缓存且不投机，直接由 AI 解析"""
+        calls = []
+        ai_parser = SimpleNamespace(
+            templates=None,
+            similar_cache=SimpleNamespace(lookup=lambda text, scenario: {'command': "sudo su", 'similarity': 0.99}),
+            ai_provider=SimpleNamespace(breaker=CircuitBreaker()),
+            structured=False,
+            is_follow_up=lambda text: True,
+            _detect_scenario=lambda text: "command_generation",
+            parse_command=lambda text, local_lookup=True, cancel=None: calls.append(text) or "sudo rm -r foo"
+        )
+        resolver = TieredParser(NLPParser(), lambda: ai_parser)
+        result = resolver.resolve("用 sudo 再试一次", speculate=True)
+        self.assertEqual((result['command'], result['tier'], result['speculation']), ("sudo rm -r foo", 'ai', None))
+        self.assertEqual(calls, ["用 sudo 再试一次"])
+
+
+class TestCLIConversation(unittest.TestCase):
+    """测试 CLI 记录每一轮"""
+    
+    def setUp(self):
+        from cli_ai import CLIAI
+        
+        self.app = CLIAI.__new__(CLIAI)
+        self.app._ai_loaded = True
+        self.app._ai_notices = []
+        self.app.use_ai_parsing = False
+        self.app.parser = NLPParser()
+        self.app.resolver = TieredParser(self.app.parser, None)
+        self.app.conversation = ConversationMemory()
+        self.app.confirm_execution = lambda command, details=None: self.confirm
+        self.app.execute_command = lambda command, details=None: {
+            'success': False, 'output': "", 'error': "mkdir: cannot create directory", 'return_code': 1
+        }
+    
+    def test_turns_recorded(self):
+        """测试执行和取消的命令都记录，'new' 开始新的对话"""
+        with redirect_stdout(io.StringIO()):
+            self.confirm = True
+            self.app.process_input("创建文件夹 foo")
+            self.confirm = False
+            self.app.process_input("创建文件夹 bar")
+        content = self.app.conversation.history()[0]['content']
+        self.assertIn("mkdir foo（失败：mkdir: cannot create directory）", content)
+        self.assertIn("mkdir bar（未执行）", content)
+        
+        with redirect_stdout(io.StringIO()):
+            self.app.process_input("new")
+        self.assertEqual(len(self.app.conversation), 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -4,7 +4,9 @@ Test Enhanced AI Command Parser (v2.2.1 - v2.2.3)
 """
 import os
 import unittest
+from types import SimpleNamespace
 from ai_command_parser import AICommandParser
+from ai_provider import AIProvider
 
 
 class TestEnhancedAICommandParser(unittest.TestCase):
@@ -252,6 +254,105 @@ class TestParameterExtraction(unittest.TestCase):
         self.assertIsInstance(params, dict)
 
 
+class FakeStream:
+    """模拟 OpenAI 流式响应，记录消费的块数和是否被关闭"""
+    
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.consumed = 0
+        self.closed = False
+    
+    def __iter__(self):
+        for piece in self.pieces:
+            self.consumed += 1
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+    
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """模拟 OpenAI 客户端，只实现 chat.completions.create"""
+    
+    def __init__(self, pieces):
+        self.stream = FakeStream(pieces)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        return self.stream
+
+
+class TestStreamingParse(unittest.TestCase):
+    """测试流式解析与提前结束"""
+    
+    def setUp(self):
+        """测试前准备"""
+        os.environ.setdefault("AI_PROVIDER", "deepseek")
+        os.environ.setdefault("DEEPSEEK_API_KEY", "sk-test-key")
+        self.parser = AICommandParser(stream=True)
+    
+    def _use_fake_client(self, pieces):
+        """为解析器换上独立的模拟提供商，避免影响共享实例"""
+        provider = AIProvider()
+        provider.client = FakeClient(pieces)
+        self.parser.ai_provider = provider
+        return provider.client
+    
+    def test_has_complete_command(self):
+        """测试完整命令行判断"""
+        self.assertFalse(self.parser._has_complete_command("ls -l"))
+        self.assertTrue(self.parser._has_complete_command("ls -la\n"))
+        self.assertFalse(self.parser._has_complete_command("```bash\n"))
+        self.assertTrue(self.parser._has_complete_command("```bash\nls -la\n"))
+        self.assertFalse(self.parser._has_complete_command("命令是：\n"))
+    
+    def test_clean_unclosed_code_block(self):
+        """测试清洗未闭合的代码块（流式提前结束）"""
+        cleaned = self.parser._clean_command("```bash\nls -la")
+        self.assertEqual(cleaned, "ls -la")
+    
+    def test_stream_stops_after_first_line(self):
+        """测试收到第一行完整命令后立即关闭流"""
+        client = self._use_fake_client(
+            ["ls", " -la", "\n", "这个命令", "会列出", "所有文件"]
+        )
+        tokens = []
+        command = self.parser.parse_command("列出所有文件", on_token=tokens.append)
+        
+        self.assertEqual(command, "ls -la")
+        self.assertEqual(tokens, ["ls", " -la", "\n"])
+        self.assertEqual(client.stream.consumed, 3)
+        self.assertTrue(client.stream.closed)
+        self.assertTrue(client.requests[0]["stream"])
+    
+    def test_stream_without_newline(self):
+        """测试没有换行的完整响应"""
+        client = self._use_fake_client(["df", " -h"])
+        command = self.parser.parse_command("查看磁盘空间")
+        self.assertEqual(command, "df -h")
+        self.assertTrue(client.stream.closed)
+    
+    def test_static_prompt_prefix(self):
+        """测试场景提示词作为固定前缀，系统上下文放在用户消息之前的独立消息中"""
+        client = self._use_fake_client(["df", " -h"])
+        contexts = iter(["User: root | Dir: /root", "User: root | Dir: /tmp"])
+        self.parser.context_manager = SimpleNamespace(get_context_for_ai=lambda: next(contexts))
+        
+        self.parser.parse_command("查看磁盘空间")
+        client.stream = FakeStream(["df", " -h"])
+        self.parser.parse_command("查看磁盘空间")
+        
+        first, second = (request["messages"] for request in client.requests)
+        self.assertEqual(first[0], second[0])
+        self.assertNotIn("系统上下文", first[0]["content"])
+        self.assertEqual([m["role"] for m in first], ["system", "system", "user"])
+        self.assertIn("Dir: /root", first[1]["content"])
+        self.assertIn("Dir: /tmp", second[1]["content"])
+        self.assertEqual(second[2], {"role": "user", "content": "查看磁盘空间"})
+
 def run_basic_tests():
     """运行基本功能测试（不使用 unittest）"""
     print("=" * 60)
@@ -0,0 +1,124 @@
+"""
+测试离线评测
+Test corpus seeding, scoring, stub-backed evaluation runs and report comparison
+"""
+import os
+import unittest
+
+import eval_harness
+from eval_harness import (
+    RecordedResponder, compare_reports, evaluate, load_corpus, normalize_command, run_eval, seed_corpus
+)
+
+
+CASES = [
+    {'id': "a", 'input': "查看磁盘空间", 'expected': ["df -h"], 'scenario': "system_management"},
+    {'id': "b", 'input': "show calendar", 'expected': ["cal"], 'scenario': "command_generation"},
+    {'id': "c", 'input': "统计每个用户的进程数", 'expected': ["ps -eo user= | sort | uniq -c"],
+     'scenario': "system_management"},
+]
+
+
+class TestCorpus(unittest.TestCase):
+    """测试语料"""
+    
+    def test_seed(self):
+        """测试语料包含提示词示例、测试用例和英文输入，ID 唯一且由输入决定"""
+        cases = seed_corpus()
+        sources = {case['source'] for case in cases}
+        self.assertIn("prompts/file_operations.txt", sources)
+        self.assertIn("test_cli_ai.py", sources)
+        self.assertGreater(sum(case['lang'] == 'en' for case in cases), 20)
+        self.assertEqual(len({case['id'] for case in cases}), len(cases))
+        self.assertEqual([case['id'] for case in seed_corpus()], [case['id'] for case in cases])
+        # 同一输入出现在多处时合并，不重复
+        self.assertEqual(len({case['input'] for case in cases}), len(cases))
+    
+    def test_committed_corpus(self):
+        """测试仓库中的语料可以读取"""
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), eval_harness.DEFAULT_CORPUS)
+        cases = load_corpus(path)
+        self.assertGreater(len(cases), 200)
+        self.assertTrue(all(case['expected'] and case['scenario'] for case in cases))
+
+
+class TestEvaluate(unittest.TestCase):
+    """测试评分和汇总"""
+    
+    def test_scores(self):
+        """测试准确率、无结果、异常和本地命中率"""
+        answers = {"查看磁盘空间": ("df  -h;", True), "show calendar": (None, True)}
+        
+        def translate(text):
+            if text not in answers:
+                raise RuntimeError("AI 不可用")
+            return answers[text]
+        
+        result = evaluate(CASES, translate)
+        self.assertEqual((result['correct'], result['unresolved'], result['errors']), (1, 2, 1))
+        self.assertEqual(result['accuracy'], round(1 / 3, 4))
+        self.assertEqual(result['local_hit_rate'], round(1 / 3, 4))
+        self.assertEqual(result['scenarios']['system_management']['correct'], 1)
+        self.assertEqual([failure['id'] for failure in result['failures']], ["b", "c"])
+        self.assertEqual(normalize_command(" ls   -la ; "), "ls -la")
+
+
+class TestRunEval(unittest.TestCase):
+    """测试用本地测试服务器评测"""
+    
+    def test_stub_run(self):
+        """测试三种方式都有结果，AI 请求数和 token 来自本次评测，环境变量恢复"""
+        environ = os.environ.copy()
+        report = run_eval(CASES)
+        self.assertEqual(os.environ, environ)
+        self.assertEqual(set(report['modes']), {'rules', 'ai', 'tiered'})
+        self.assertEqual(report['corpus']['cases'], 3)
+        
+        ai = report['modes']['ai']
+        self.assertEqual(ai['ai_requests'], 3)
+        self.assertGreater(ai['tokens_per_request'], 0)
+        self.assertEqual(ai['local_hit_rate'], 0.0)
+        # 内置回复用规则解析器充当模型
+        self.assertEqual(ai['correct'], report['modes']['rules']['correct'])
+        
+        tiered = report['modes']['tiered']
+        self.assertLess(tiered['ai_requests'], 3)
+        self.assertGreater(tiered['local_hit_rate'], 0.0)
+    
+    def test_replay(self):
+        """测试录制的回复按用户消息返回"""
+        responder = RecordedResponder({"统计每个用户的进程数": "ps -eo user= | sort | uniq -c"})
+        self.assertEqual(responder([{"role": "user", "content": "统计每个用户的进程数"}]),
+                         "ps -eo user= | sort | uniq -c")
+        self.assertEqual(responder([{"role": "user", "content": "其他"}]), "")
+        
+        report = run_eval(CASES[2:], modes=('ai',), backend='replay', recorded=responder.recorded)
+        self.assertEqual(report['modes']['ai']['accuracy'], 1.0)
+
+
+class TestCompare(unittest.TestCase):
+    """测试比较报告"""
+    
+    def report(self, accuracy, failures):
+        return {
+            'corpus': {'sha256': "x"}, 'settings': {},
+            'modes': {'rules': {
+                'accuracy': accuracy, 'latency_ms': {'p50': 0.1, 'p99': 0.2},
+                'tokens_per_request': 0.0, 'local_hit_rate': 1.0,
+                'failures': [{'id': case_id, 'input': case_id, 'got': None} for case_id in failures]
+            }}
+        }
+    
+    def test_regression(self):
+        """测试准确率下降超过容差时判定为退化，并列出新增失败的用例"""
+        lines, regressed = compare_reports(self.report(0.9, ["a"]), self.report(0.8, ["b"]))
+        self.assertTrue(regressed)
+        self.assertTrue(any("新增失败: b" in line for line in lines))
+        self.assertTrue(any("新增通过: a" in line for line in lines))
+        
+        _, regressed = compare_reports(self.report(0.9, ["a"]), self.report(0.85, ["a"]), tolerance=0.1)
+        self.assertFalse(regressed)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+"""
+测试动态少样本示例
+Test splitting scenario prompts into an example index and per-request selection (no real API calls)
+"""
+import os
+import unittest
+
+from ai_command_parser import AICommandParser
+from example_store import ExampleStore, split_prompt
+from prompt_registry import SCENARIO_PROMPT_FILES, PromptRegistry
+from token_utils import estimate_tokens
+
+
+PROMPT = """你是一个 Linux 助手。
+
+## 输出要求
+1. 只输出一行命令
+
+## 命令参考
+
+### 创建操作
+- "创建文件夹 test" → mkdir test
+- "创建空文件 test.txt" → touch test.txt
+
+### 删除操作
+- "删除文件 test.txt" → rm test.txt
+
+## 示例对话
+
+用户：复制 a.txt 到 b.txt
+你：cp a.txt b.txt
+
+记住：只返回命令！"""
+
+
+class TestSplitPrompt(unittest.TestCase):
+    """测试从提示词中拆出示例"""
+    
+    def test_split(self):
+        """测试示例行和示例对话被拆出，空标题删除，其他内容保留"""
+        base, examples = split_prompt(PROMPT)
+        self.assertEqual(base, "你是一个 Linux 助手。\n\n## 输出要求\n1. 只输出一行命令\n\n记住：只返回命令！")
+        self.assertEqual([(example.input, example.command, example.dialog) for example in examples], [
+            ("创建文件夹 test", "mkdir test", False),
+            ("创建空文件 test.txt", "touch test.txt", False),
+            ("删除文件 test.txt", "rm test.txt", False),
+            ("复制 a.txt 到 b.txt", "cp a.txt b.txt", True),
+        ])
+    
+    def test_scenario_prompts(self):
+        """测试所有场景提示词的示例都被拆出，基础部分保留输出要求"""
+        registry = PromptRegistry(reload_interval=0)
+        for path in SCENARIO_PROMPT_FILES.values():
+            text = registry.get_file(path).text
+            base, examples = split_prompt(text)
+            self.assertGreater(len(examples), 30, path)
+            self.assertNotIn("→", base, path)
+            self.assertNotIn("用户：", base, path)
+            self.assertIn("## 输出要求", base, path)
+            self.assertLess(estimate_tokens(base), estimate_tokens(text) / 2, path)
+
+
+class TestExampleStore(unittest.TestCase):
+    """测试按输入挑选示例"""
+    
+    def test_most_similar_first(self):
+        """测试最相似的示例排在前面，不超过 top_k"""
+        store = ExampleStore(top_k=2)
+        prompt = store.build("test", PROMPT, "创建文件夹 foo")
+        self.assertEqual([example.command for example in prompt['examples']], ["mkdir test", "touch test.txt"])
+        self.assertIn('- "创建文件夹 test" → mkdir test', prompt['examples_text'])
+        self.assertLess(prompt['tokens'], prompt['full_tokens'])
+    
+    def test_token_budget(self):
+        """测试示例总 token 不超过预算"""
+        store = ExampleStore(top_k=10, token_budget=12)
+        prompt = store.build("test", PROMPT, "创建文件夹 foo")
+        self.assertEqual(len(prompt['examples']), 1)
+        self.assertLessEqual(sum(example.tokens for example in prompt['examples']), 12)
+    
+    def test_dialog_fallback(self):
+        """测试没有相似示例时使用示例对话"""
+        prompt = ExampleStore().build("test", PROMPT, "xyz")
+        self.assertEqual([example.command for example in prompt['examples']], ["cp a.txt b.txt"])
+    
+    def test_rebuilt_on_change(self):
+        """测试提示词内容变化（热加载）后重建索引"""
+        store = ExampleStore()
+        store.build("test", PROMPT, "创建文件夹 foo")
+        changed = PROMPT.replace("mkdir test", "mkdir -p test")
+        prompt = store.build("test", changed, "创建文件夹 foo")
+        self.assertEqual(prompt['examples'][0].command, "mkdir -p test")
+        self.assertEqual(store.stats()['requests'], 2)
+
+
+class TestParserExamples(unittest.TestCase):
+    """测试 AICommandParser 使用动态示例"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["AI_DYNAMIC_EXAMPLES"] = "true"
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_request_uses_selected_examples(self):
+        """测试系统提示词不含示例，挑选出的示例放在动态上下文中"""
+        parser = AICommandParser(use_context=False)
+        request = parser._build_request("创建文件夹 foo")
+        self.assertEqual(request['scenario'], "file_operations")
+        self.assertNotIn("→", request['system_prompt'])
+        self.assertIn("→ mkdir", request['context'])
+        
+        # 系统提示词与输入无关，保持字节一致以命中前缀缓存
+        other = parser._build_request("删除文件 a.txt")
+        self.assertEqual(other['system_prompt'], request['system_prompt'])
+        self.assertIn("→ rm", other['context'])
+    
+    def test_disabled_by_default(self):
+        """测试未设置 AI_DYNAMIC_EXAMPLES 时发送整份提示词"""
+        os.environ.pop("AI_DYNAMIC_EXAMPLES")
+        parser = AICommandParser(use_context=False)
+        self.assertIsNone(parser.examples)
+        request = parser._build_request("创建文件夹 foo")
+        self.assertIn("→ mkdir", request['system_prompt'])
+        self.assertIsNone(request['context'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,192 @@
+"""
+测试对冲请求（主备后端竞速）
+Test hedged requests racing two backends (no real API calls)
+"""
+import asyncio
+import os
+import time
+import unittest
+from types import SimpleNamespace
+
+from ai_provider import AIProvider, get_client_registry
+
+
+def make_chunk(piece):
+    """构造一个流式响应块"""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+class SlowStream:
+    """首个 token 前等待 delay 秒的模拟流式响应"""
+    
+    def __init__(self, pieces, delay):
+        self.pieces = pieces
+        self.delay = delay
+        self.closed = False
+    
+    def __iter__(self):
+        time.sleep(self.delay)
+        for piece in self.pieces:
+            yield make_chunk(piece)
+    
+    async def _aiter(self):
+        await asyncio.sleep(self.delay)
+        for piece in self.pieces:
+            yield make_chunk(piece)
+    
+    def __aiter__(self):
+        return self._aiter()
+    
+    def close(self):
+        self.closed = True
+
+
+class AsyncSlowStream(SlowStream):
+    """异步版本：close 为协程"""
+    
+    async def close(self):
+        self.closed = True
+
+
+class SlowClient:
+    """模拟 OpenAI 客户端，记录请求次数"""
+    
+    def __init__(self, pieces, delay, fail=False, async_mode=False):
+        self.pieces = pieces
+        self.delay = delay
+        self.fail = fail
+        self.async_mode = async_mode
+        self.calls = 0
+        self.streams = []
+        create = self._acreate if async_mode else self._create
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+    
+    def _make_stream(self):
+        self.calls += 1
+        if self.fail:
+            raise Exception("backend unavailable")
+        stream_class = AsyncSlowStream if self.async_mode else SlowStream
+        stream = stream_class(self.pieces, self.delay)
+        self.streams.append(stream)
+        return stream
+    
+    def _create(self, **kwargs):
+        return self._make_stream()
+    
+    async def _acreate(self, **kwargs):
+        return self._make_stream()
+
+
+class TestHedgedRequests(unittest.TestCase):
+    """测试对冲请求"""
+    
+    def _provider(self, primary, secondary, delay=0.05):
+        """构造一个主备后端都为模拟客户端的提供商"""
+        original_env = os.environ.copy()
+        self.addCleanup(self._restore_env, original_env)
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["OPENAI_API_KEY"] = "sk-test-key"
+        os.environ["AI_HEDGE"] = "true"
+        
+        provider = AIProvider()
+        provider.hedge_delay = delay
+        provider.client = primary
+        clients = {'deepseek': primary, 'openai': secondary}
+        
+        registry = get_client_registry()
+        self._original = (registry.get_client, registry.get_async_client)
+        registry.get_client = lambda name, key, url: clients[name]
+        registry.get_async_client = lambda name, key, url: clients[name]
+        self.addCleanup(self._restore, registry)
+        return provider
+    
+    def _restore(self, registry):
+        registry.get_client, registry.get_async_client = self._original
+    
+    def _restore_env(self, original_env):
+        os.environ.clear()
+        os.environ.update(original_env)
+    
+    def test_primary_fast_no_hedge(self):
+        """测试主后端及时响应时不发出对冲请求"""
+        primary = SlowClient(["ls", " -la"], delay=0)
+        secondary = SlowClient(["dir"], delay=0)
+        provider = self._provider(primary, secondary, delay=0.5)
+        
+        self.assertEqual(provider.generate_response("system", "列出文件"), "ls -la")
+        self.assertEqual(secondary.calls, 0)
+        stats = provider.get_hedge_stats()
+        self.assertEqual(stats['hedges_fired'], 0)
+        self.assertEqual(stats['backends']['deepseek']['wins'], 1)
+    
+    def test_secondary_wins_when_primary_slow(self):
+        """测试主后端迟迟没有首 token 时备用后端胜出"""
+        primary = SlowClient(["ls -la"], delay=1.0)
+        secondary = SlowClient(["ls -l"], delay=0)
+        provider = self._provider(primary, secondary, delay=0.05)
+        
+        start = time.perf_counter()
+        result = provider.generate_response("system", "列出文件")
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(result, "ls -l")
+        self.assertLess(elapsed, 0.5)
+        stats = provider.get_hedge_stats()
+        self.assertEqual(stats['hedges_fired'], 1)
+        self.assertEqual(stats['backends']['openai']['wins'], 1)
+        self.assertEqual(stats['backends']['deepseek']['wins'], 0)
+    
+    def test_primary_failure_hedges_immediately(self):
+        """测试主后端失败时立即转向备用后端"""
+        primary = SlowClient(["unused"], delay=0, fail=True)
+        secondary = SlowClient(["pwd"], delay=0)
+        provider = self._provider(primary, secondary, delay=5.0)
+        
+        start = time.perf_counter()
+        self.assertEqual(provider.generate_response("system", "当前目录"), "pwd")
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(provider.get_hedge_stats()['backends']['deepseek']['errors'], 1)
+    
+    def test_both_fail(self):
+        """测试两个后端都失败时抛出异常"""
+        primary = SlowClient(["x"], delay=0, fail=True)
+        secondary = SlowClient(["y"], delay=0, fail=True)
+        provider = self._provider(primary, secondary, delay=0.01)
+        
+        with self.assertRaises(Exception):
+            provider.generate_response("system", "当前目录")
+    
+    def test_async_secondary_wins_and_primary_cancelled(self):
+        """测试异步对冲：备用后端胜出，主后端请求被取消"""
+        primary = SlowClient(["ls -la"], delay=1.0, async_mode=True)
+        secondary = SlowClient(["ls -l"], delay=0, async_mode=True)
+        provider = self._provider(primary, secondary, delay=0.05)
+        
+        start = time.perf_counter()
+        result = asyncio.run(provider.agenerate_response("system", "列出文件"))
+        
+        self.assertEqual(result, "ls -l")
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertTrue(primary.streams[0].closed)
+        self.assertEqual(provider.get_hedge_stats()['backends']['openai']['wins'], 1)
+    
+    def test_hedging_disabled_without_secondary_key(self):
+        """测试备用提供商未配置时不启用对冲"""
+        original_env = os.environ.copy()
+        try:
+            os.environ["AI_PROVIDER"] = "deepseek"
+            os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+            os.environ["AI_HEDGE"] = "true"
+            os.environ.pop("OPENAI_API_KEY", None)
+            self.assertIsNone(AIProvider().hedge_backend)
+            
+            os.environ["OPENAI_API_KEY"] = "sk-test-key"
+            self.assertEqual(AIProvider().hedge_backend['provider'], "openai")
+        finally:
+            os.environ.clear()
+            os.environ.update(original_env)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,155 @@
+"""
+测试本地 OpenAI 兼容服务器与 local 提供商
+Test the local stand-in server and AI_PROVIDER=local (no real API calls)
+"""
+import os
+import time
+import unittest
+
+import httpx
+
+from ai_command_parser import AICommandParser
+from ai_provider import AIProvider
+from local_ai_server import LocalAIServer, ScriptedResponder
+
+
+class LocalServerTestCase(unittest.TestCase):
+    """启动本地服务器并把 AI_PROVIDER 指向它"""
+    
+    server_options = {}
+    
+    def setUp(self):
+        self.server = LocalAIServer(**self.server_options).start()
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "local"
+        os.environ["LOCAL_BASE_URL"] = self.server.base_url
+        os.environ["AI_RETRY_BASE_DELAY"] = "0.01"
+        for name in ("AI_CACHE", "AI_HEDGE"):
+            os.environ.pop(name, None)
+        self.provider = AIProvider()
+    
+    def tearDown(self):
+        self.server.stop()
+        os.environ.clear()
+        os.environ.update(self.original_env)
+
+
+class TestLocalProvider(LocalServerTestCase):
+    """测试 local 提供商的基本功能"""
+    
+    def test_local_provider_config(self):
+        """测试 local 提供商不需要 API 密钥"""
+        self.assertEqual(self.provider.provider, "local")
+        self.assertEqual(self.provider.get_model(), "local-model")
+    
+    def test_builtin_responses(self):
+        """测试内置回复：用规则匹配解析器充当模型"""
+        parser = AICommandParser(stream=False)
+        parser.ai_provider = self.provider
+        self.assertEqual(parser.parse_command("查看磁盘空间"), "df -h")
+        self.assertEqual(parser.parse_many(["列出文件", "查看内存"]), ["ls -la", "free -h"])
+    
+    def test_streaming_with_usage(self):
+        """测试流式输出和 include_usage"""
+        tokens = []
+        result = self.provider.generate_response("system", "查看磁盘空间", stream=True,
+                                                 on_token=tokens.append, caller="parser")
+        self.assertEqual(result, "df -h")
+        self.assertEqual("".join(tokens), "df -h")
+        self.assertGreater(self.provider.get_telemetry_stats()['total']['prompt_tokens'], 0)
+    
+    def test_streamed_parse_tokens_estimated(self):
+        """测试流式解析拿到完整命令后提前结束，token 用量按估算值记录"""
+        self.server.responder = ScriptedResponder(default="df -h\n查看各分区的磁盘使用情况")
+        parser = AICommandParser(stream=True)
+        parser.ai_provider = self.provider
+        self.assertEqual(parser.parse_command("查看磁盘空间"), "df -h")
+        total = self.provider.get_telemetry_stats()['total']
+        self.assertGreater(total['prompt_tokens'], 0)
+        self.assertGreater(total['completion_tokens'], 0)
+        self.assertEqual(total['estimated'], 1)
+    
+    def test_scripted_rules(self):
+        """测试脚本规则优先于内置回复"""
+        self.server.responder = ScriptedResponder(rules=[("磁盘", "du -sh *")], default="pwd")
+        self.assertEqual(self.provider.generate_response("system", "查看磁盘空间"), "du -sh *")
+        self.assertEqual(self.provider.generate_response("system", "当前目录"), "pwd")
+
+
+class TestWarmUp(LocalServerTestCase):
+    """测试连接预热"""
+    
+    def test_warm_up_recorded(self):
+        """测试后台预热成功并记录在遥测中"""
+        self.provider.start_warm_up().join(timeout=5)
+        
+        warmups = self.provider.get_telemetry_stats()['warmups']
+        self.assertEqual(len(warmups), 1)
+        self.assertTrue(warmups[0]['success'])
+        self.assertEqual(warmups[0]['provider'], "local")
+        self.assertGreaterEqual(warmups[0]['saved_ms'], 0.0)
+        # 预热不是 AI 调用，不计入调用统计
+        self.assertIsNone(self.provider.get_telemetry_stats()['total'])
+    
+    def test_warm_up_failure_does_not_trip_breaker(self):
+        """测试预热失败不影响熔断器"""
+        os.environ["LOCAL_BASE_URL"] = "http://127.0.0.1:9/v1"
+        provider = AIProvider()
+        provider.breaker.failure_threshold = 1
+        result = provider.warm_up(timeout=1.0)
+        
+        self.assertFalse(result['success'])
+        self.assertFalse(provider.breaker.is_open())
+        self.assertFalse(provider.get_telemetry_stats()['warmups'][0]['success'])
+
+class TestLatencyInjection(LocalServerTestCase):
+    """测试延迟注入"""
+    
+    server_options = {'latency_ms': 200, 'jitter_ms': 20, 'seed': 1}
+    
+    def test_latency(self):
+        """测试首 token 前的延迟"""
+        start = time.perf_counter()
+        self.provider.generate_response("system", "查看磁盘空间")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.18)
+
+
+class TestErrorInjection(LocalServerTestCase):
+    """测试错误注入：5xx 会被重试，最终失败"""
+    
+    server_options = {'error_rate': 1.0, 'seed': 1}
+    
+    def test_server_errors_retried(self):
+        """测试 5xx 按重试次数重试后抛出异常"""
+        with self.assertRaises(Exception):
+            self.provider.generate_response("system", "查看磁盘空间")
+        self.assertEqual(self.server.request_count, 1 + self.provider.max_retries)
+
+
+class TestRateLimit(LocalServerTestCase):
+    """测试限流：超出后返回 429 和 Retry-After"""
+    
+    server_options = {'rate_limit': 2}
+    
+    def test_rate_limit_headers(self):
+        """测试限流响应头"""
+        url = f"{self.server.base_url}/chat/completions"
+        body = {"model": "local-model", "messages": [{"role": "user", "content": "pwd"}]}
+        with httpx.Client(trust_env=False) as client:
+            statuses = [client.post(url, json=body) for _ in range(3)]
+        
+        self.assertEqual([r.status_code for r in statuses], [200, 200, 429])
+        self.assertEqual(statuses[0].headers["x-ratelimit-remaining-requests"], "1")
+        self.assertIn("retry-after-ms", statuses[2].headers)
+    
+    def test_provider_waits_for_retry_after(self):
+        """测试不使用客户端限流时，AIProvider 遵循 Retry-After 等待后重试成功"""
+        self.provider.rate_limiter = None
+        for _ in range(2):
+            self.provider.generate_response("system", "查看磁盘空间")
+        self.assertEqual(self.provider.generate_response("system", "查看磁盘空间"), "df -h")
+        self.assertEqual(self.server.request_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,141 @@
+"""
+测试路径校验服务
+Test batched, mtime-cached path existence checks
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import path_validator
+from path_validator import PathValidator
+
+
+class TestPathValidator(unittest.TestCase):
+    """测试批量路径检查"""
+    
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "sub"))
+        for name in ("a.txt", "b.txt", os.path.join("sub", "c.log")):
+            open(os.path.join(self.root, name), "w").close()
+        os.symlink(os.path.join(self.root, "a.txt"), os.path.join(self.root, "good_link"))
+        os.symlink(os.path.join(self.root, "gone"), os.path.join(self.root, "broken_link"))
+        # 把目录 mtime 调到过去，避免"刚修改过"的目录每次都重新读取
+        self.age(self.root, os.path.join(self.root, "sub"))
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+    
+    def age(self, *directories):
+        for directory in directories:
+            os.utime(directory, (1_000_000_000, 1_000_000_000))
+    
+    def test_same_as_os_path_exists(self):
+        """测试结果与 os.path.exists 一致"""
+        paths = [os.path.join(self.root, name) for name in (
+            "a.txt", "missing.txt", "sub", "sub/c.log", "sub/missing", "nodir/x.txt",
+            "a.txt/x", "good_link", "broken_link", "sub/../b.txt"
+        )] + ["/", "~", "."]
+        result = PathValidator().check_many(paths)
+        self.assertEqual(result, {path: os.path.exists(os.path.expanduser(path)) for path in paths})
+    
+    def test_not_simplified_before_check(self):
+        """测试 '..' 前的目录不存在、文件名后带 '/' 或 '.' 时与 os.path.exists 一致"""
+        paths = [os.path.join(self.root, name) for name in (
+            "missing_dir/../a.txt", "a.txt/../b.txt", "a.txt/", "a.txt/.", "sub/", "sub/./c.log"
+        )] + ["./", "../"]
+        result = PathValidator().check_many(paths)
+        self.assertEqual(result, {path: os.path.exists(path) for path in paths})
+        self.assertFalse(result[os.path.join(self.root, "missing_dir/../a.txt")])
+        self.assertFalse(result[os.path.join(self.root, "a.txt/")])
+        self.assertTrue(result[os.path.join(self.root, "sub/")])
+    
+    def test_one_scan_per_directory(self):
+        """测试同一目录的路径只读取一次目录，缓存有效期内不再做 I/O"""
+        validator = PathValidator(revalidate_interval=60)
+        paths = [os.path.join(self.root, name) for name in ("a.txt", "b.txt", "x", "sub/c.log")]
+        with mock.patch("path_validator.os.scandir", wraps=os.scandir) as scandir:
+            validator.check_many(paths)
+            self.assertEqual(scandir.call_count, 2)
+            with mock.patch("path_validator.os.stat", side_effect=AssertionError("I/O")):
+                self.assertTrue(validator.exists(os.path.join(self.root, "a.txt")))
+        self.assertEqual(validator.stats()['scans'], 2)
+    
+    def test_directory_change_invalidates(self):
+        """测试目录 mtime 变化后重新读取，未变化时只检查 mtime"""
+        validator = PathValidator(revalidate_interval=0)
+        target = os.path.join(self.root, "new.txt")
+        self.assertFalse(validator.exists(target))
+        self.assertTrue(validator.exists(os.path.join(self.root, "a.txt")))
+        self.assertEqual(validator.stats()['scans'], 1)
+        
+        open(target, "w").close()
+        self.assertTrue(validator.exists(target))
+        self.assertEqual(validator.stats()['scans'], 2)
+    
+    def test_recently_modified_directory_rescanned(self):
+        """测试读取时刚被修改过的目录，即使 mtime 不变也重新读取"""
+        validator = PathValidator(revalidate_interval=0)
+        os.utime(self.root)
+        target = os.path.join(self.root, "new.txt")
+        self.assertFalse(validator.exists(target))
+        mtime = os.stat(self.root).st_mtime_ns
+        open(target, "w").close()
+        os.utime(self.root, ns=(mtime, mtime))
+        self.assertTrue(validator.exists(target))
+    
+    def test_cold_directories_in_parallel(self):
+        """测试多个目录在线程池中读取"""
+        validator = PathValidator()
+        validator.check_many([os.path.join(self.root, "a.txt"), os.path.join(self.root, "sub/c.log")])
+        self.assertIsNotNone(validator._pool)
+        self.assertEqual(validator.stats()['directories'], 2)
+    
+    def test_max_directories(self):
+        """测试缓存的目录数有上限"""
+        validator = PathValidator(max_directories=1)
+        validator.check_many([os.path.join(self.root, "a.txt"), os.path.join(self.root, "sub/c.log")])
+        self.assertEqual(validator.stats()['directories'], 1)
+    
+    def test_shared_instance(self):
+        """测试进程内共享同一个实例"""
+        self.assertIs(path_validator.get_path_validator(), path_validator.get_path_validator())
+
+
+class TestValidateParameters(unittest.TestCase):
+    """测试 AICommandParser.validate_parameters 使用路径校验服务"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        from ai_command_parser import AICommandParser
+        self.parser = AICommandParser(use_context=False)
+        self.root = tempfile.mkdtemp()
+        self.existing = os.path.join(self.root, "data.csv")
+        open(self.existing, "w").close()
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_missing_paths_reported_once(self):
+        """测试不存在的路径各报告一次"""
+        missing = os.path.join(self.root, "missing.csv")
+        valid, warnings = self.parser.validate_parameters(f"cat {self.existing} {missing} {missing}")
+        self.assertFalse(valid)
+        self.assertEqual(warnings, [f"路径不存在: {missing}"])
+        self.assertEqual(self.parser.validate_parameters(f"wc -l {self.existing}"), (True, []))
+    
+    def test_creation_command_not_checked(self):
+        """测试创建命令不检查路径"""
+        with mock.patch.object(self.parser.path_validator, "check_many") as check_many:
+            self.assertEqual(self.parser.validate_parameters(f"mkdir {self.root}/x/y"), (True, []))
+        check_many.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
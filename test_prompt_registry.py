@@ -0,0 +1,132 @@
+"""
+测试提示词模板注册表
+Test the in-memory prompt registry and mtime-based hot reload
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from ai_command_parser import AICommandParser
+from prompt_registry import DEFAULT_PROMPT, SCENARIO_PROMPT_FILES, PromptRegistry
+from token_utils import estimate_tokens
+
+
+class TestPromptRegistry(unittest.TestCase):
+    """测试提示词的加载、统计与热加载"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "custom.txt")
+        self._write("你是 Linux 命令助手。")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def _write(self, text):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    
+    def test_scenario_prompts_loaded_at_startup(self):
+        """测试所有场景提示词在创建时加载，并预先计算大小"""
+        registry = PromptRegistry()
+        stats = registry.stats()
+        
+        self.assertEqual(set(stats), set(SCENARIO_PROMPT_FILES.values()))
+        for path, info in stats.items():
+            with open(path, encoding='utf-8') as f:
+                text = f.read().strip()
+            self.assertEqual(info['chars'], len(text))
+            self.assertEqual(info['tokens'], estimate_tokens(text))
+            self.assertEqual(info['loads'], 1)
+    
+    def test_no_file_io_on_get(self):
+        """测试获取提示词时不读文件"""
+        registry = PromptRegistry(reload_interval=3600)
+        with mock.patch("builtins.open", side_effect=AssertionError("file read")), \
+                mock.patch("os.stat", side_effect=AssertionError("stat")):
+            for scenario in SCENARIO_PROMPT_FILES:
+                self.assertTrue(registry.get(scenario))
+    
+    def test_reload_on_mtime_change(self):
+        """测试文件修改后重新加载，未修改时不重复读取"""
+        registry = PromptRegistry(scenario_files={'command_generation': self.path},
+                                  reload_interval=0.01)
+        self.assertEqual(registry.get('command_generation'), "你是 Linux 命令助手。")
+        
+        time.sleep(0.02)
+        registry.get('command_generation')
+        self.assertEqual(registry.stats()[self.path]['loads'], 1)
+        
+        self._write("只返回命令。")
+        time.sleep(0.02)
+        self.assertEqual(registry.get('command_generation'), "只返回命令。")
+        self.assertEqual(registry.get_template('command_generation').tokens,
+                         estimate_tokens("只返回命令。"))
+    
+    def test_reload_disabled(self):
+        """测试 reload_interval 为 0 时不热加载，但可以手动 reload"""
+        registry = PromptRegistry(scenario_files={'command_generation': self.path},
+                                  reload_interval=0)
+        self._write("只返回命令。")
+        self.assertEqual(registry.get('command_generation'), "你是 Linux 命令助手。")
+        self.assertEqual(registry.reload(), 1)
+        self.assertEqual(registry.get('command_generation'), "只返回命令。")
+    
+    def test_missing_file_uses_default(self):
+        """测试文件不存在时使用默认提示词，删除后保留已加载的内容"""
+        registry = PromptRegistry(
+            scenario_files={'command_generation': os.path.join(self.tmpdir, "missing.txt")}
+        )
+        self.assertEqual(registry.get('command_generation'), DEFAULT_PROMPT)
+        
+        registry = PromptRegistry(scenario_files={'command_generation': self.path})
+        os.remove(self.path)
+        registry.reload()
+        self.assertEqual(registry.get('command_generation'), "你是 Linux 命令助手。")
+    
+    def test_relative_paths_survive_chdir(self):
+        """测试相对路径在启动时解析，之后切换目录不影响"""
+        original_dir = os.getcwd()
+        registry = PromptRegistry()
+        try:
+            os.chdir(self.tmpdir)
+            self.assertEqual(registry.reload(), 0)
+            self.assertNotEqual(registry.get('network_operations'), DEFAULT_PROMPT)
+        finally:
+            os.chdir(original_dir)
+
+
+class TestParserUsesRegistry(unittest.TestCase):
+    """测试命令解析器从注册表获取提示词"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_build_request_without_file_io(self):
+        """测试构建请求时不读提示词文件"""
+        parser = AICommandParser(use_context=False)
+        with mock.patch.object(parser.prompts, "reload_interval", 3600), \
+                mock.patch("builtins.open", side_effect=AssertionError("file read")):
+            request = parser._build_request("下载文件 http://example.com", True, None)
+        self.assertEqual(request['system_prompt'], parser.prompts.get('network_operations'))
+    
+    def test_scenario_info(self):
+        """测试场景信息包含提示词大小"""
+        parser = AICommandParser(use_context=False)
+        info = parser.get_scenario_info("创建文件夹 test")
+        self.assertEqual(info['prompt_file'], SCENARIO_PROMPT_FILES['file_operations'])
+        self.assertEqual(info['prompt_chars'], len(parser._select_prompt_by_scenario('file_operations')))
+        self.assertGreater(info['prompt_tokens'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,203 @@
+"""
+测试客户端限流
+Test the shared token-bucket rate limiter (no real API calls)
+"""
+import os
+import threading
+import time
+import unittest
+
+import ai_provider
+from ai_provider import AIProvider, get_client_registry
+from local_ai_server import LocalAIServer, ScriptedResponder
+from rate_limiter import RateLimiter, RateLimitTimeout, parse_duration
+
+
+class TestRateLimiter(unittest.TestCase):
+    """测试令牌桶与响应头解析"""
+    
+    def test_parse_duration(self):
+        """测试解析 OpenAI 风格的重置时长"""
+        self.assertEqual(parse_duration("1s"), 1.0)
+        self.assertEqual(parse_duration("6m0s"), 360.0)
+        self.assertAlmostEqual(parse_duration("20ms"), 0.02)
+        self.assertEqual(parse_duration("0.500s"), 0.5)
+        self.assertEqual(parse_duration("2"), 2.0)
+        self.assertIsNone(parse_duration("soon"))
+        self.assertIsNone(parse_duration(None))
+    
+    def test_requests_per_minute(self):
+        """测试超出每分钟请求数后按补充速率排队"""
+        limiter = RateLimiter(requests_per_minute=120)
+        waits = [limiter.reserve() for _ in range(122)]
+        
+        self.assertEqual(waits[:120], [0.0] * 120)
+        # 每秒补充 2 个请求额度，后面的调用依次排队
+        self.assertAlmostEqual(waits[120], 0.5, delta=0.05)
+        self.assertAlmostEqual(waits[121], 1.0, delta=0.05)
+    
+    def test_tokens_per_minute_and_settle(self):
+        """测试 token 额度预约与按实际用量归还"""
+        limiter = RateLimiter(tokens_per_minute=600)
+        self.assertEqual(limiter.reserve(tokens=500), 0.0)
+        self.assertGreater(limiter.reserve(tokens=500, max_wait=60), 0.0)
+        
+        limiter = RateLimiter(tokens_per_minute=600)
+        limiter.reserve(tokens=500)
+        limiter.settle(500, 100)
+        self.assertEqual(limiter.reserve(tokens=500), 0.0)
+    
+    def test_max_wait(self):
+        """测试排队时间超过上限时不预约并抛出异常"""
+        limiter = RateLimiter(requests_per_minute=1)
+        limiter.reserve()
+        with self.assertRaises(RateLimitTimeout):
+            limiter.reserve(max_wait=1.0)
+        self.assertEqual(limiter.snapshot()['waits'], 0)
+    
+    def test_retry_after_pauses_all_callers(self):
+        """测试 429 的 Retry-After 让所有调用方暂停"""
+        limiter = RateLimiter()
+        limiter.observe(429, {"retry-after-ms": "2000"})
+        
+        self.assertAlmostEqual(limiter.reserve(), 2.0, delta=0.05)
+        self.assertEqual(limiter.snapshot()['throttled'], 1)
+    
+    def test_headers_adapt_limits(self):
+        """测试根据 x-ratelimit-* 响应头推算限额并在额度用完时暂停"""
+        limiter = RateLimiter()
+        limiter.observe(200, {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "59",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": "1000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "6s"
+        })
+        stats = limiter.snapshot()
+        self.assertAlmostEqual(stats['requests_per_minute'], 60.0)
+        self.assertAlmostEqual(stats['tokens_per_minute'], 10000.0)
+        self.assertAlmostEqual(limiter.reserve(tokens=100), 0.6, delta=0.05)
+        
+        limiter.observe(200, {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "3s"
+        })
+        self.assertAlmostEqual(limiter.snapshot()['paused_for'], 3.0, delta=0.05)
+
+
+class TestProviderRateLimit(unittest.TestCase):
+    """测试 AIProvider 通过共享限流器平滑请求"""
+    
+    def setUp(self):
+        self.server = LocalAIServer(rate_limit=2).start()
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "local"
+        os.environ["LOCAL_BASE_URL"] = self.server.base_url
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_RATE_LIMIT", "AI_RATE_LIMIT_RPM", "AI_RATE_LIMIT_TPM"):
+            os.environ.pop(name, None)
+        self.provider = AIProvider()
+    
+    def tearDown(self):
+        self.server.stop()
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_paced_instead_of_429(self):
+        """测试根据响应头排队，不触发 429"""
+        for _ in range(4):
+            self.assertEqual(self.provider.generate_response("system", "查看磁盘空间"), "df -h")
+        
+        self.assertEqual(self.server.request_count, 4)
+        self.assertEqual(self.provider.get_rate_limit_stats()['throttled'], 0)
+        total = self.provider.get_telemetry_stats()['total']
+        # 排队时间单独统计，不计入耗时
+        self.assertGreater(total['queue_ms']['p99'], 100.0)
+        self.assertLess(total['latency_ms']['p99'], total['queue_ms']['p99'])
+    
+    def test_shared_between_providers(self):
+        """测试同一进程内的 AIProvider 实例和多个线程共享限流器"""
+        other = AIProvider()
+        self.assertIs(other.rate_limiter, self.provider.rate_limiter)
+        
+        errors = []
+        
+        def call(provider, index):
+            try:
+                # 系统提示词各不相同，避免被合并为同一个请求
+                provider.generate_response(f"system {index}", "查看磁盘空间")
+            except Exception as e:
+                errors.append(e)
+        
+        # 先完成一次请求，让限流器从响应头得知限额
+        call(self.provider, 0)
+        threads = [
+            threading.Thread(target=call, args=(provider, index))
+            for index, provider in enumerate((self.provider, other) * 2, start=1)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.request_count, 5)
+    
+    def test_queue_timeout_does_not_trip_breaker(self):
+        """测试排队超过截止时间时失败，但不计入熔断器"""
+        self.provider.breaker.failure_threshold = 1
+        self.provider.rate_limiter.pause(30)
+        
+        start = time.monotonic()
+        with self.assertRaises(Exception) as ctx:
+            self.provider.generate_response("system", "查看磁盘空间", timeout=1.0)
+        
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertIn("限流", str(ctx.exception))
+        self.assertFalse(self.provider.breaker.is_open())
+        self.assertEqual(self.server.request_count, 0)
+    
+    def _record_settlements(self):
+        settled = []
+        settle = self.provider.rate_limiter.settle
+        self.provider.rate_limiter.settle = lambda reserved, actual: (settled.append((reserved, actual)),
+                                                                     settle(reserved, actual))
+        return settled
+    
+    def test_early_stopped_stream_settled(self):
+        """测试流式提前结束、没有收到 usage 时按估算用量结算预约"""
+        self.server.responder = ScriptedResponder(default="df -h\n查看各分区的磁盘使用情况")
+        settled = self._record_settlements()
+        self.provider.generate_response("system", "查看磁盘空间", stream=True, max_tokens=500,
+                                        stop_when=lambda text: "\n" in text)
+        
+        total = self.provider.get_telemetry_stats()['total']
+        self.assertEqual(total['estimated'], 1)
+        self.assertEqual(settled, [(settled[0][0], total['prompt_tokens'] + total['completion_tokens'])])
+        self.assertLess(settled[0][1], settled[0][0] - 400)
+    
+    def test_cancelled_stream_settled(self):
+        """测试取消的流式请求归还没有用到的 max_tokens 预约"""
+        self.server.responder = ScriptedResponder(default="df -h\n查看各分区的磁盘使用情况")
+        settled = self._record_settlements()
+        cancel = threading.Event()
+        with self.assertRaises(ai_provider.RequestCancelled):
+            self.provider.generate_response("system", "查看磁盘空间", stream=True, max_tokens=500,
+                                            on_token=lambda delta: cancel.set(), cancel=cancel)
+        
+        self.assertEqual(len(settled), 1)
+        reserved, actual = settled[0]
+        self.assertLess(actual, reserved - 400)
+    
+    def test_disabled(self):
+        """测试 AI_RATE_LIMIT=false 时不创建限流器"""
+        os.environ["AI_RATE_LIMIT"] = "false"
+        registry = get_client_registry()
+        limiter = registry.get_rate_limiter("local", "key-for-disabled-test", "http://127.0.0.1:1/v1")
+        self.assertIsNone(limiter)
+        self.assertIsInstance(self.provider.rate_limiter, ai_provider.RateLimiter)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
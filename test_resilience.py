@@ -0,0 +1,162 @@
+"""
+测试截止时间、重试和熔断器
+Test deadlines, bounded retries and the circuit breaker (no real API calls)
+"""
+import io
+import os
+import time
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import httpx
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+import ai_provider
+from ai_provider import AIProvider, CircuitBreaker
+from fake_clients import FakeClient
+
+
+def make_status_error(error_class, status, headers=None):
+    """构造带 HTTP 响应的 OpenAI 状态错误"""
+    request = httpx.Request("POST", "http://stub/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return error_class(f"status {status}", response=response, body=None)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """测试熔断器状态转换"""
+    
+    def test_opens_after_threshold(self):
+        """测试连续失败达到阈值后断开"""
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+        breaker.record_failure()
+        self.assertFalse(breaker.is_open())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertGreater(breaker.reopen_at, time.time())
+    
+    def test_half_open_single_probe(self):
+        """测试冷却期后只放行一个探测请求"""
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertIsNone(breaker.reopen_at)
+    
+    def test_failed_probe_reopens(self):
+        """测试探测失败后重新断开"""
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=0.05)
+        for _ in range(3):
+            breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+
+
+class TestRetries(unittest.TestCase):
+    """测试重试与截止时间"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["AI_RETRY_BASE_DELAY"] = "0.01"
+        os.environ["AI_MAX_RETRIES"] = "2"
+        os.environ["AI_BREAKER_THRESHOLD"] = "2"
+        self.provider = AIProvider()
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_retry_on_429_and_5xx(self):
+        """测试 429 和 5xx 会重试"""
+        self.provider.client = FakeClient(script=[
+            make_status_error(RateLimitError, 429, {"retry-after": "0.01"}),
+            make_status_error(InternalServerError, 503),
+            "df -h"
+        ])
+        self.assertEqual(self.provider.generate_response("system", "磁盘空间"), "df -h")
+        self.assertEqual(self.provider.client.calls, 3)
+        self.assertEqual(self.provider.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_no_retry_on_client_error(self):
+        """测试 4xx（非 429）不重试"""
+        self.provider.client = FakeClient(script=[make_status_error(BadRequestError, 400)])
+        with self.assertRaises(Exception):
+            self.provider.generate_response("system", "磁盘空间")
+        self.assertEqual(self.provider.client.calls, 1)
+    
+    def test_retry_respects_deadline(self):
+        """测试 Retry-After 超过截止时间时不再等待"""
+        self.provider.client = FakeClient(script=[
+            make_status_error(RateLimitError, 429, {"retry-after": "30"}),
+            "df -h"
+        ])
+        start = time.perf_counter()
+        with self.assertRaises(Exception):
+            self.provider.generate_response("system", "磁盘空间", timeout=1.0)
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(self.provider.client.calls, 1)
+    
+    def test_breaker_blocks_network(self):
+        """测试熔断后直接拒绝请求，不访问网络"""
+        self.provider.client = FakeClient(script=[
+            make_status_error(BadRequestError, 400),
+            make_status_error(BadRequestError, 400)
+        ])
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.provider.generate_response("system", "磁盘空间")
+        
+        # test_config_and_env 会 reload ai_provider，因此运行时再取异常类
+        with self.assertRaises(ai_provider.CircuitOpenError):
+            self.provider.generate_response("system", "磁盘空间")
+        self.assertEqual(self.provider.client.calls, 2)
+
+
+class TestCLIFallback(unittest.TestCase):
+    """测试熔断期间 CLI 直接使用规则匹配"""
+    
+    def test_process_input_skips_ai_when_open(self):
+        """测试熔断时 process_input 不调用 AI 解析"""
+        from cli_ai import CLIAI
+        from nlp_parser import NLPParser
+        from tiered_parser import TieredParser
+        
+        app = CLIAI.__new__(CLIAI)
+        app.running = True
+        app._ai_loaded = True
+        app._ai_notices = []
+        app.use_ai_parsing = True
+        app.conversation = None
+        app.parser = NLPParser()
+        app.resolver = TieredParser(app.parser, app._get_ai_parser)
+        
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+        breaker.record_failure()
+        calls = []
+        app.ai_parser = SimpleNamespace(
+            ai_provider=SimpleNamespace(breaker=breaker),
+            parse_command=lambda text, **kwargs: calls.append(text)
+        )
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            app.process_input("统计每个用户的进程数")
+        
+        self.assertEqual(calls, [])
+        self.assertIn("熔断", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,144 @@
+"""
+测试 AI 响应磁盘缓存
+Test the SQLite-backed AI response cache (no real API calls)
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ai_provider import AIProvider
+from fake_clients import FakeClient
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """测试 ResponseCache"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "cache.db")
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_put_get_and_stats(self):
+        """测试读写与命中统计"""
+        cache = ResponseCache(self.path)
+        key = ResponseCache.make_key("deepseek", "deepseek-chat",
+                                     [{"role": "user", "content": "磁盘空间"}], 0.3, 200)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, "df -h")
+        self.assertEqual(cache.get(key), "df -h")
+        
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+    
+    def test_key_depends_on_parameters(self):
+        """测试温度、模型等参数不同时键不同"""
+        messages = [{"role": "user", "content": "列出文件"}]
+        base = ResponseCache.make_key("deepseek", "deepseek-chat", messages, 0.3, 200)
+        self.assertEqual(base, ResponseCache.make_key("deepseek", "deepseek-chat", messages, 0.3, 200))
+        self.assertNotEqual(base, ResponseCache.make_key("deepseek", "deepseek-chat", messages, 0.7, 200))
+        self.assertNotEqual(base, ResponseCache.make_key("openai", "gpt-4", messages, 0.3, 200))
+        self.assertNotEqual(base, ResponseCache.make_key("deepseek", "deepseek-chat", messages, 0.3, 200,
+                                                         truncated=True))
+    
+    def test_lru_eviction(self):
+        """测试超过上限时淘汰最久未使用的条目"""
+        cache = ResponseCache(self.path, max_entries=2)
+        cache.put("a", "1")
+        time.sleep(0.01)
+        cache.put("b", "2")
+        time.sleep(0.01)
+        cache.get("a")
+        time.sleep(0.01)
+        cache.put("c", "3")
+        
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+    
+    def test_ttl_expiry(self):
+        """测试过期条目不再返回"""
+        cache = ResponseCache(self.path, ttl=0.05)
+        cache.put("a", "1")
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()['entries'], 0)
+    
+    def test_survives_restart(self):
+        """测试重新打开数据库后缓存依然有效，且命中足够快"""
+        cache = ResponseCache(self.path)
+        cache.put("a", "ls -la")
+        cache.close()
+        
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get("a"), "ls -la")
+        
+        start = time.perf_counter()
+        for _ in range(100):
+            reopened.get("a")
+        self.assertLess((time.perf_counter() - start) / 100, 0.001)
+
+
+class TestProviderCache(unittest.TestCase):
+    """测试 AIProvider 使用响应缓存"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["AI_CACHE"] = "true"
+        os.environ["AI_CACHE_PATH"] = os.path.join(self.tmpdir, "cache.db")
+        self.provider = AIProvider()
+        self.provider.client = FakeClient(content="df -h")
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+        self.provider.cache.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_cache_disabled_by_default(self):
+        """测试未设置 AI_CACHE 时不启用缓存"""
+        os.environ.pop("AI_CACHE")
+        self.assertIsNone(AIProvider().cache)
+    
+    def test_second_call_hits_cache(self):
+        """测试相同请求第二次直接返回缓存"""
+        first = self.provider.generate_response("system", "磁盘空间", temperature=0.3)
+        second = self.provider.generate_response("system", "磁盘空间", temperature=0.3)
+        self.assertEqual(first, second)
+        self.assertEqual(self.provider.client.calls, 1)
+        self.assertEqual(self.provider.get_cache_stats()['hits'], 1)
+        
+        # 参数不同则重新请求
+        self.provider.generate_response("system", "磁盘空间", temperature=0.7)
+        self.assertEqual(self.provider.client.calls, 2)
+    
+    def test_bypass_and_refresh(self):
+        """测试绕过缓存与强制刷新"""
+        self.provider.generate_response("system", "磁盘空间")
+        self.provider.generate_response("system", "磁盘空间", use_cache=False)
+        self.assertEqual(self.provider.client.calls, 2)
+        
+        self.provider.client.content = "du -sh"
+        self.assertEqual(self.provider.generate_response("system", "磁盘空间", refresh_cache=True), "du -sh")
+        self.assertEqual(self.provider.generate_response("system", "磁盘空间"), "du -sh")
+        self.assertEqual(self.provider.client.calls, 3)
+    
+    def test_cache_hit_ignores_open_breaker(self):
+        """测试熔断期间缓存命中仍可返回"""
+        self.provider.generate_response("system", "磁盘空间")
+        for _ in range(self.provider.breaker.failure_threshold):
+            self.provider.breaker.record_failure()
+        self.assertEqual(self.provider.generate_response("system", "磁盘空间"), "df -h")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
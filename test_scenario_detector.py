@@ -0,0 +1,108 @@
+"""
+测试场景检测器
+Test the Aho-Corasick scenario detector against the original keyword scan
+"""
+import os
+import random
+import unittest
+
+from ai_command_parser import AICommandParser
+from bench_scenario_detector import SAMPLE_INPUTS, naive_detect, synthetic_keywords
+from scenario_detector import AhoCorasick, ScenarioDetector, get_scenario_detector
+
+
+class TestAhoCorasick(unittest.TestCase):
+    """测试多模式匹配自动机"""
+    
+    def test_overlapping_patterns(self):
+        """测试重叠、嵌套的模式都能找到"""
+        patterns = ["he", "she", "his", "hers", "e"]
+        automaton = AhoCorasick(patterns)
+        found = automaton.find_all("ushers")
+        self.assertEqual({patterns[i] for i in found}, {"he", "she", "hers", "e"})
+    
+    def test_matches_substring_search(self):
+        """测试结果与逐个子串查找一致"""
+        rng = random.Random(1)
+        patterns = sorted({''.join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+                           for _ in range(30)})
+        automaton = AhoCorasick(patterns)
+        for _ in range(200):
+            text = ''.join(rng.choice("abcd") for _ in range(rng.randint(0, 12)))
+            expected = {i for i, pattern in enumerate(patterns) if pattern in text}
+            self.assertEqual(automaton.find_all(text), expected, text)
+
+
+class TestScenarioDetector(unittest.TestCase):
+    """测试场景检测与原实现一致"""
+    
+    def setUp(self):
+        self.keywords = AICommandParser.SCENARIO_KEYWORDS
+        self.detector = get_scenario_detector(self.keywords)
+    
+    def test_same_as_naive(self):
+        """测试真实关键词表上与原实现结果一致"""
+        inputs = SAMPLE_INPUTS + [
+            "", "hello", "SSH 连接到服务器", "用 ssh 登录",
+            "FTP://mirror 下载", "删除 user bob", "edit file app.LOG",
+            "cat /etc/hosts", "more readme", "编辑文件 notes.txt",
+            "查看内容", "ping 一下网关", "grep 日志并排序",
+        ]
+        for text in inputs:
+            self.assertEqual(self.detector.detect(text), naive_detect(self.keywords, text), text)
+    
+    def test_same_as_naive_synthetic(self):
+        """测试大关键词表上与原实现结果一致"""
+        keywords = synthetic_keywords(2000, seed=3)
+        detector = ScenarioDetector(keywords)
+        rng = random.Random(3)
+        vocabulary = [word for words in keywords.values() for word in words]
+        for _ in range(200):
+            text = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 5)))
+            self.assertEqual(detector.detect(text), naive_detect(keywords, text), text)
+    
+    def test_scores(self):
+        """测试返回各场景得分，大小写不同的重复关键词各计一次"""
+        result = self.detector.analyze("SSH 连接")
+        self.assertIsNone(result['rule'])
+        self.assertEqual(result['scenario'], 'network_operations')
+        expected = sum(1 for keyword in self.keywords['network_operations']
+                       if keyword.lower() in "ssh 连接")
+        self.assertEqual(result['scores']['network_operations'], expected)
+        self.assertEqual(set(result['scores']), set(self.keywords))
+    
+    def test_special_rule(self):
+        """测试特殊规则优先于关键词得分"""
+        result = self.detector.analyze("创建用户 alice")
+        self.assertEqual(result['scenario'], 'system_management')
+        self.assertEqual(result['rule'], 'user_admin')
+        self.assertEqual(self.detector.analyze("打开 https://example.com")['rule'], 'url')
+    
+    def test_compiled_once(self):
+        """测试相同关键词表共享同一个检测器"""
+        self.assertIs(get_scenario_detector(dict(self.keywords)), self.detector)
+
+
+class TestParserScenario(unittest.TestCase):
+    """测试命令解析器使用检测器"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_scenario_info_has_scores(self):
+        """测试场景信息包含各场景得分"""
+        parser = AICommandParser(use_context=False)
+        info = parser.get_scenario_info("下载文件 https://example.com/a.zip")
+        self.assertEqual(info['scenario'], 'network_operations')
+        self.assertEqual(info['rule'], 'url')
+        self.assertIn('file_operations', info['scores'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
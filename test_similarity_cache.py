@@ -0,0 +1,162 @@
+"""
+测试相似输入缓存
+Test the character n-gram near-duplicate query cache (no real API calls)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ai_command_parser import AICommandParser
+from fake_clients import FakeClient
+from similarity_cache import SimilarityCache, dice, extract_arguments, ngrams, normalize
+
+
+class TestNormalization(unittest.TestCase):
+    """测试归一化与参数提取"""
+    
+    def test_normalize(self):
+        """测试去掉客套话、语气词、动词重叠和标点"""
+        self.assertEqual(normalize("请帮我查看一下磁盘空间！"), "查看磁盘空间")
+        self.assertEqual(normalize("看看磁盘空间吧"), "看磁盘空间")
+        self.assertEqual(normalize("Show disk usage, please"), "showdiskusage")
+    
+    def test_arguments(self):
+        """测试路径、数字、中文输入中的英文单词和否定词算作参数"""
+        self.assertEqual(extract_arguments("删除 a.txt"), ("a.txt",))
+        self.assertEqual(extract_arguments("用 ssh 连接 10.0.0.1"), ("10.0.0.1", "ssh"))
+        self.assertEqual(extract_arguments("show disk usage of /home"), ("/home",))
+        self.assertEqual(extract_arguments("不显示隐藏文件"), ("!不",))
+
+
+class TestSimilarityCache(unittest.TestCase):
+    """测试 SimilarityCache"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "similar.db")
+        self.cache = SimilarityCache(self.path)
+    
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_near_duplicate_hit(self):
+        """测试换一种说法命中，统计命中和未命中"""
+        self.cache.put("查看磁盘空间", "system_management", "df -h")
+        self.assertEqual(self.cache.get("看看磁盘空间吧", "system_management"), "df -h")
+        self.assertIsNone(self.cache.get("查看内存使用", "system_management"))
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (1, 1, 1))
+    
+    def test_scenario_must_agree(self):
+        """测试场景不一致时不命中"""
+        self.cache.put("查看磁盘空间", "system_management", "df -h")
+        self.assertIsNone(self.cache.get("查看磁盘空间", "file_operations"))
+    
+    def test_arguments_must_agree(self):
+        """测试参数或否定词不同的相似输入不命中"""
+        self.cache.put("删除文件 a.txt", "file_operations", "rm a.txt")
+        self.cache.put("显示隐藏文件", "file_operations", "ls -a")
+        self.assertIsNone(self.cache.get("删除文件 b.txt", "file_operations"))
+        self.assertIsNone(self.cache.get("不显示隐藏文件", "file_operations"))
+        self.assertEqual(self.cache.get("请删除文件 a.txt", "file_operations"), "rm a.txt")
+    
+    def test_threshold(self):
+        """测试相似度低于阈值时不命中"""
+        strict = SimilarityCache(":memory:", threshold=0.95)
+        strict.put("查看磁盘空间", "system_management", "df -h")
+        self.assertIsNone(strict.get("看看磁盘空间吧", "system_management"))
+        self.assertEqual(strict.get("查看磁盘空间。", "system_management"), "df -h")
+    
+    def test_best_match_wins(self):
+        """测试返回相似度最高的记录"""
+        self.cache.put("查看磁盘空间使用情况", "system_management", "df -h")
+        self.cache.put("查看磁盘空间", "system_management", "df")
+        match = self.cache.find("看看磁盘空间", "system_management")
+        self.assertEqual(match['command'], "df")
+        expected = dice(ngrams(normalize("看看磁盘空间")), ngrams(normalize("查看磁盘空间")))
+        self.assertAlmostEqual(match['similarity'], expected)
+    
+    def test_persistent_and_evicts(self):
+        """测试重启后依然有效，超过上限时淘汰最久未使用的记录"""
+        self.cache.put("查看磁盘空间", "system_management", "df -h")
+        self.cache.close()
+        
+        self.cache = SimilarityCache(self.path, max_entries=2)
+        self.assertEqual(self.cache.get("看看磁盘空间吧", "system_management"), "df -h")
+        self.cache.put("查看内存使用", "system_management", "free -h")
+        self.cache.put("列出所有进程", "system_management", "ps aux")
+        self.cache.get("查看内存使用", "system_management")
+        self.cache.put("查看网络连接", "network_operations", "ss -tunap")
+        
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertIsNone(self.cache.get("查看磁盘空间", "system_management"))
+        self.assertEqual(self.cache.get("查看内存使用", "system_management"), "free -h")
+    
+    def test_clear(self):
+        """测试清空缓存"""
+        self.cache.put("查看磁盘空间", "system_management", "df -h")
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("查看磁盘空间", "system_management"))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+
+class TestParserSimilarCache(unittest.TestCase):
+    """测试 AICommandParser 使用相似输入缓存"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["AI_SIMILAR_CACHE"] = "true"
+        os.environ["AI_SIMILAR_CACHE_PATH"] = os.path.join(self.tmpdir, "similar.db")
+        for name in ("AI_CACHE", "AI_HEDGE"):
+            os.environ.pop(name, None)
+        self.parser = AICommandParser(use_context=False, stream=False)
+        self.client = FakeClient(content="df -h")
+        self.original_client = self.parser.ai_provider.client
+        self.parser.ai_provider.client = self.client
+    
+    def tearDown(self):
+        self.parser.ai_provider.client = self.original_client
+        self.parser.similar_cache.close()
+        os.environ.clear()
+        os.environ.update(self.original_env)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_rephrased_input_skips_ai(self):
+        """测试换一种说法不再调用 AI"""
+        self.assertEqual(self.parser.parse_command("查看磁盘空间"), "df -h")
+        tokens = []
+        self.assertEqual(self.parser.parse_command("查看下磁盘空间吧", on_token=tokens.append), "df -h")
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(tokens, ["df -h"])
+    
+    def test_destructive_needs_identical_input(self):
+        """测试破坏性命令只在输入相同时从缓存返回，相近的输入仍然调用 AI"""
+        self.client.content = "rm *.log"
+        self.assertEqual(self.parser.parse_command("删除所有日志文件"), "rm *.log")
+        self.assertEqual(self.parser.parse_command("删除所有日志文件"), "rm *.log")
+        self.assertEqual(self.client.calls, 1)
+        
+        self.client.content = "rm -r *log*/"
+        self.assertEqual(self.parser.parse_command("删除所有日志文件夹"), "rm -r *log*/")
+        self.assertEqual(self.client.calls, 2)
+    
+    def test_failed_parse_not_cached(self):
+        """测试解析失败的结果不写入缓存"""
+        self.client.content = ""
+        with self.assertRaises(Exception):
+            self.parser.parse_command("查看磁盘空间")
+        self.assertEqual(self.parser.similar_cache.stats()['entries'], 0)
+    
+    def test_disabled_by_default(self):
+        """测试未设置 AI_SIMILAR_CACHE 时不启用"""
+        os.environ.pop("AI_SIMILAR_CACHE")
+        self.assertIsNone(AICommandParser(use_context=False).similar_cache)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,312 @@
+"""
+测试相同请求合并
+Test single-flight coalescing of identical in-flight AI requests (no real API calls)
+"""
+import asyncio
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import ai_provider
+from ai_provider import AIProvider
+from fake_clients import FakeClient
+from local_ai_server import LocalAIServer
+from single_flight import CoalescedWaitTimeout, SingleFlight
+
+
+def run_threads(target, count):
+    """并发运行 count 个线程，返回 (结果列表, 异常列表)"""
+    results, errors = [], []
+    
+    def run():
+        try:
+            results.append(target())
+        except BaseException as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results, errors
+
+
+class TestSingleFlight(unittest.TestCase):
+    """测试 SingleFlight 的同步合并"""
+    
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+    
+    def slow(self, result="ls -la", error=None, delay=0.2):
+        def fn():
+            self.calls += 1
+            time.sleep(delay)
+            if error:
+                raise error
+            return result
+        return fn
+    
+    def test_shared_result(self):
+        """测试并发的相同请求只执行一次"""
+        results, errors = run_threads(lambda: self.flights.do("key", self.slow()), 5)
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 4)
+        self.assertEqual({result for result, _ in results}, {"ls -la"})
+        self.assertEqual(self.flights.coalesced, 4)
+    
+    def test_shared_error(self):
+        """测试 leader 的异常传递给所有等待者"""
+        error = ValueError("boom")
+        results, errors = run_threads(lambda: self.flights.do("key", self.slow(error=error)), 3)
+        
+        self.assertEqual(results, [])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(errors, [error] * 3)
+    
+    def test_sequential_calls_not_shared(self):
+        """测试已完成的请求不会被之后的调用复用"""
+        self.flights.do("key", self.slow(delay=0))
+        self.assertEqual(self.flights.do("key", self.slow(delay=0)), ("ls -la", False))
+        self.assertEqual(self.calls, 2)
+    
+    def test_waiter_timeout(self):
+        """测试等待者超时只影响自己"""
+        leader = threading.Thread(target=self.flights.do, args=("key", self.slow(delay=0.5)))
+        leader.start()
+        time.sleep(0.05)
+        
+        with self.assertRaises(CoalescedWaitTimeout):
+            self.flights.do("key", self.slow(), timeout=0.1)
+        leader.join()
+        self.assertEqual(self.calls, 1)
+    
+    def test_interrupted_leader(self):
+        """测试 leader 被中断时等待者重新发起请求"""
+        def interrupted():
+            time.sleep(0.2)
+            raise KeyboardInterrupt
+        
+        leader_errors = []
+        
+        def lead():
+            try:
+                self.flights.do("key", interrupted)
+            except KeyboardInterrupt as e:
+                leader_errors.append(e)
+        
+        leader = threading.Thread(target=lead)
+        leader.start()
+        time.sleep(0.05)
+        
+        self.assertEqual(self.flights.do("key", self.slow(delay=0)), ("ls -la", False))
+        leader.join()
+        self.assertEqual(len(leader_errors), 1)
+    
+    
+    def test_leader_only_error_retried(self):
+        """测试 leader 抛出 retry_on 中的异常时等待者重新发起请求，而不是收到这个异常"""
+        leader_errors = []
+        
+        def lead():
+            try:
+                self.flights.do("key", self.slow(error=LookupError("cancelled")), retry_on=(LookupError,))
+            except LookupError as e:
+                leader_errors.append(e)
+        
+        leader = threading.Thread(target=lead)
+        leader.start()
+        time.sleep(0.05)
+        
+        self.assertEqual(self.flights.do("key", self.slow(delay=0), retry_on=(LookupError,)), ("ls -la", False))
+        leader.join()
+        self.assertEqual(len(leader_errors), 1)
+        self.assertEqual(self.calls, 2)
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    """测试 SingleFlight 的异步合并与取消"""
+    
+    def test_waiter_cancelled(self):
+        """测试等待者被取消不影响 leader"""
+        async def main():
+            flights = SingleFlight()
+            
+            async def fn():
+                await asyncio.sleep(0.2)
+                return "ls -la"
+            
+            leader = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            return await leader
+        
+        self.assertEqual(asyncio.run(main()), ("ls -la", False))
+    
+    def test_leader_cancelled(self):
+        """测试 leader 被取消时等待者接替发起请求"""
+        async def main():
+            flights = SingleFlight()
+            calls = []
+            
+            async def fn():
+                calls.append(1)
+                await asyncio.sleep(0.2)
+                return "ls -la"
+            
+            leader = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            result = await waiter
+            return result, len(calls)
+        
+        self.assertEqual(asyncio.run(main()), (("ls -la", False), 2))
+
+
+class GatedStreamClient:
+    """模拟流式客户端：第一次请求输出第一段后等待放行，之后的请求直接输出"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        self.calls += 1
+        # 生成器可迭代、可关闭，与流式响应相同
+        return self._chunks(gated=self.calls == 1)
+    
+    def _chunks(self, gated):
+        for index, piece in enumerate(["ls", " -la"]):
+            if gated and index == 1:
+                self.started.set()
+                self.gate.wait(5)
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+class TestProviderCoalescing(unittest.TestCase):
+    """测试 AIProvider 合并并发的相同请求"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_COALESCE"):
+            os.environ.pop(name, None)
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def _provider(self):
+        provider = AIProvider()
+        provider.client = FakeClient(delay=0.2)
+        return provider
+    
+    def test_identical_requests_coalesced(self):
+        """测试相同请求只发出一次网络请求，遥测记录合并次数"""
+        provider = self._provider()
+        results, errors = run_threads(
+            lambda: provider.generate_response("system", "列出文件", caller="analyzer"), 4
+        )
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(results, ["ls -la"] * 4)
+        self.assertEqual(provider.client.calls, 1)
+        stats = provider.get_telemetry_stats()['callers']['analyzer']
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['coalesced'], 3)
+    
+    def test_different_context_not_coalesced(self):
+        """测试上下文不同的请求不合并"""
+        provider = self._provider()
+        contexts = iter(["cwd: /tmp", "cwd: /home", "cwd: /var"])
+        lock = threading.Lock()
+        
+        def call():
+            with lock:
+                context = next(contexts)
+            return provider.generate_response("system", "列出文件", context=context)
+        
+        run_threads(call, 3)
+        self.assertEqual(provider.client.calls, 3)
+    
+    def test_cancelled_leader_does_not_fail_waiters(self):
+        """测试 leader 被取消（如丢弃的投机解析）时，没有取消的等待者接替发起请求"""
+        provider = AIProvider()
+        provider.client = GatedStreamClient()
+        cancel = threading.Event()
+        outcomes = {}
+        
+        def call(name, **kwargs):
+            try:
+                outcomes[name] = provider.generate_response("system", "列出文件", stream=True, **kwargs)
+            except Exception as e:
+                outcomes[name] = e
+        
+        leader = threading.Thread(target=call, args=("leader",), kwargs={'cancel': cancel})
+        leader.start()
+        self.assertTrue(provider.client.started.wait(5))
+        waiter = threading.Thread(target=call, args=("waiter",))
+        waiter.start()
+        time.sleep(0.05)
+        cancel.set()
+        provider.client.gate.set()
+        leader.join(timeout=5)
+        waiter.join(timeout=5)
+        
+        self.assertIsInstance(outcomes['leader'], ai_provider.RequestCancelled)
+        self.assertEqual(outcomes['waiter'], "ls -la")
+        self.assertEqual(provider.client.calls, 2)
+    
+    def test_disabled(self):
+        """测试 AI_COALESCE=false 时不合并"""
+        os.environ["AI_COALESCE"] = "false"
+        provider = self._provider()
+        run_threads(lambda: provider.generate_response("system", "列出文件"), 3)
+        self.assertEqual(provider.client.calls, 3)
+
+
+class TestAsyncProviderCoalescing(unittest.TestCase):
+    """测试异步调用的合并"""
+    
+    def setUp(self):
+        self.server = LocalAIServer(latency_ms=200).start()
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "local"
+        os.environ["LOCAL_BASE_URL"] = self.server.base_url
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_COALESCE"):
+            os.environ.pop(name, None)
+        self.provider = AIProvider()
+    
+    def tearDown(self):
+        self.server.stop()
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_gather_identical(self):
+        """测试 asyncio.gather 中的相同请求共享一次调用"""
+        async def main():
+            return await asyncio.gather(*[
+                self.provider.agenerate_response("system", "查看磁盘空间") for _ in range(3)
+            ])
+        
+        self.assertEqual(asyncio.run(main()), ["df -h"] * 3)
+        self.assertEqual(self.server.request_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
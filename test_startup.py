@@ -0,0 +1,76 @@
+"""
+测试 AI 模块延迟加载
+Test that cli_ai starts without importing the AI stack (no real API calls)
+"""
+import io
+import os
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+import config
+from bench_startup import LAZY_MODULES
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestLazyImport(unittest.TestCase):
+    """测试启动时不导入 openai/httpx/dotenv"""
+    
+    def test_import_does_not_load_ai_stack(self):
+        """测试 import cli_ai 不导入重量级依赖，但能检测到 AI 可用"""
+        script = (
+            "import sys, cli_ai\n"
+            f"print(cli_ai.HAS_AI, [m for m in {LAZY_MODULES!r} if m in sys.modules])\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "True []")
+
+
+class TestLazyInit(unittest.TestCase):
+    """测试 AI 模块在首次使用时初始化"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        self.original_prewarm = config.AI_PREWARM_CONNECTION
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        config.AI_PREWARM_CONNECTION = False
+    
+    def tearDown(self):
+        config.AI_PREWARM_CONNECTION = self.original_prewarm
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_loaded_on_first_use(self):
+        """测试关闭预热时，AI 解析器在首次使用前不创建"""
+        from cli_ai import CLIAI
+        
+        app = CLIAI()
+        self.assertIsNone(app.ai_parser)
+        
+        app._ensure_ai()
+        self.assertIsNotNone(app.ai_parser)
+        self.assertTrue(app.use_ai_parsing)
+    
+    def test_init_error_shown_on_first_use(self):
+        """测试初始化失败的提示在首次使用时显示，并退回规则匹配"""
+        from cli_ai import CLIAI
+        
+        os.environ["AI_PROVIDER"] = "no-such-provider"
+        app = CLIAI()
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            app._ensure_ai()
+        
+        self.assertIn("初始化失败", output.getvalue())
+        self.assertFalse(app.use_ai_parsing)
+        self.assertIsNone(app.ai_parser)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+"""
+测试结构化输出模式
+Test JSON structured output for AICommandParser and its use in the CLI (no real API calls)
+"""
+import io
+import json
+import os
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from ai_command_parser import AICommandParser
+from fake_clients import FakeClient
+from local_ai_server import LocalAIServer
+
+
+def structured(**fields):
+    data = {"command": "df -h", "confidence": 0.9, "is_dangerous": False,
+            "needs_tty": False, "explanation": "显示磁盘空间"}
+    data.update(fields)
+    return json.dumps(data, ensure_ascii=False)
+
+
+class TestStructuredParsing(unittest.TestCase):
+    """测试结构化输出的请求与本地校验"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE", "AI_TEMPLATES", "AI_DYNAMIC_EXAMPLES"):
+            os.environ.pop(name, None)
+        self.parser = AICommandParser(use_context=False, stream=False, structured=True)
+        self.original_client = self.parser.ai_provider.client
+    
+    def tearDown(self):
+        self.parser.ai_provider.client = self.original_client
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def respond(self, content):
+        client = FakeClient(content)
+        self.parser.ai_provider.client = client
+        return client
+    
+    def test_valid_json(self):
+        """测试有效的 JSON 直接使用，格式说明追加在提示词之后"""
+        client = self.respond("```json\n" + structured(is_dangerous=True) + "\n```")
+        result = self.parser.parse_structured("查看磁盘空间")
+        self.assertEqual(result, {
+            'command': "df -h", 'confidence': 0.9, 'is_dangerous': True, 'needs_tty': False,
+            'explanation': "显示磁盘空间", 'structured': True
+        })
+        system_prompt = client.requests[0]['messages'][0]['content']
+        self.assertTrue(system_prompt.endswith(AICommandParser.STRUCTURED_INSTRUCTIONS))
+        self.assertEqual(self.parser.parse_command("查看磁盘空间"), "df -h")
+    
+    def test_field_validation(self):
+        """测试类型不符的字段视为未知，置信度限制在 0~1"""
+        parse = self.parser._parse_structured_response
+        result = parse(structured(confidence=3, is_dangerous="no", needs_tty=None, explanation=1))
+        self.assertEqual((result['confidence'], result['is_dangerous'], result['needs_tty'], result['explanation']),
+                         (1.0, None, None, ""))
+        self.assertIsNone(parse(structured(confidence=True))['confidence'])
+        self.assertIsNone(parse(structured(command="ls\nrm -rf ~")))
+        self.assertIsNone(parse(structured(command="")))
+        self.assertIsNone(parse("[1, 2]"))
+    
+    def test_text_fallback(self):
+        """测试模型返回普通文本时按原有方式清洗，残缺的 JSON 不当作命令"""
+        self.respond("命令是：df -h")
+        result = self.parser.parse_structured("查看磁盘空间")
+        self.assertEqual((result['command'], result['structured'], result['is_dangerous']), ("df -h", False, None))
+        
+        self.respond('{"command": "df -h", "confidence"')
+        with self.assertRaises(Exception):
+            self.parser.parse_structured("查看磁盘空间")
+    
+    def test_disabled_by_default(self):
+        """测试未设置 AI_STRUCTURED_OUTPUT 时不启用"""
+        self.assertFalse(AICommandParser(use_context=False).structured)
+    
+    def test_local_server(self):
+        """测试本地测试服务器模拟结构化输出"""
+        with LocalAIServer() as server:
+            os.environ["AI_PROVIDER"] = "local"
+            os.environ["LOCAL_BASE_URL"] = server.base_url
+            from ai_provider import AIProvider
+            self.parser.ai_provider = AIProvider()
+            self.original_client = self.parser.ai_provider.client
+            result = self.parser.parse_structured("查看磁盘空间")
+        self.assertEqual((result['command'], result['structured']), ("df -h", True))
+
+
+class TestCLIStructured(unittest.TestCase):
+    """测试 CLI 使用模型的判断"""
+    
+    def setUp(self):
+        from cli_ai import CLIAI
+        from command_executor import CommandExecutor
+        
+        self.app = CLIAI.__new__(CLIAI)
+        self.app.executor = CommandExecutor()
+        self.app.ai_error_analysis = False
+        self.app.auto_continue = False
+    
+    def test_model_can_add_danger_warning(self):
+        """测试模型判断危险时显示警告，本地危险规则不受模型影响"""
+        output = io.StringIO()
+        with redirect_stdout(output), mock.patch("builtins.input", return_value="n"):
+            self.app.confirm_execution("systemctl stop sshd", {'is_dangerous': True, 'explanation': "停止 SSH 服务"})
+        self.assertIn("危险命令", output.getvalue())
+        self.assertIn("说明: 停止 SSH 服务", output.getvalue())
+        
+        output = io.StringIO()
+        with redirect_stdout(output), mock.patch("builtins.input", return_value="n"):
+            self.app.confirm_execution("rm -rf /", {'is_dangerous': False})
+        self.assertIn("危险命令", output.getvalue())
+    
+    def test_needs_tty(self):
+        """测试模型判断需要终端时以交互模式执行"""
+        calls = []
+        self.app.executor.execute = lambda command, interactive=False: calls.append(interactive) or {
+            'success': True, 'output': "", 'error': "", 'return_code': 0
+        }
+        with redirect_stdout(io.StringIO()):
+            self.app.execute_command("mysql_secure_installation_wrapper", {'needs_tty': True})
+            self.app.execute_command("ls", None)
+        self.assertEqual(calls, [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,247 @@
+"""
+测试 AI 调用遥测
+Test token and latency telemetry (no real API calls)
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from ai_command_parser import AICommandParser
+from ai_provider import AIProvider
+from telemetry import Telemetry, percentile
+from token_utils import estimate_message_tokens, estimate_tokens
+
+
+def make_usage(prompt_tokens, completion_tokens):
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+class StreamWrapper:
+    """把块列表包装成可迭代、可关闭的流"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    def __iter__(self):
+        return iter(self.chunks)
+    
+    def close(self):
+        pass
+
+
+class UsageClient:
+    """返回固定内容和 token 用量的模拟客户端，支持流式"""
+    
+    def __init__(self, content="ls -la\n列出所有文件", usage=(120, 8)):
+        self.content = content
+        self.usage = make_usage(*usage)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs.get("stream"):
+            return self._stream()
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=self.usage)
+    
+    def _stream(self):
+        chunks = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+            for piece in self.content.split(" ")
+        ]
+        # include_usage 时最后一个块没有 choices，只带 usage
+        chunks.append(SimpleNamespace(choices=[], usage=self.usage))
+        return StreamWrapper(chunks)
+
+
+class TestTelemetry(unittest.TestCase):
+    """测试 Telemetry 汇总"""
+    
+    def test_percentile(self):
+        """测试百分位数计算"""
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([], 50), 0.0)
+        # 最近秩：第 ceil(pct/100 * n) 个样本
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 99), 5)
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 0), 1)
+    
+    def test_groups_by_caller_and_scenario(self):
+        """测试按调用方和场景汇总"""
+        telemetry = Telemetry()
+        telemetry.record("parser", "file_operations", "deepseek", "deepseek-chat", 100.0, 50, 5)
+        telemetry.record("parser", "network", "deepseek", "deepseek-chat", 300.0, 60, 6,
+                         first_token_ms=80.0)
+        telemetry.record("analyzer", None, "deepseek", "deepseek-chat", 500.0, 200, 40, success=False)
+        telemetry.record("parser", "network", "deepseek", "deepseek-chat", 0.1, cached=True)
+        
+        stats = telemetry.snapshot()
+        self.assertEqual(stats['total']['calls'], 4)
+        self.assertEqual(stats['total']['errors'], 1)
+        self.assertEqual(stats['total']['cached'], 1)
+        self.assertEqual(stats['total']['prompt_tokens'], 310)
+        self.assertEqual(stats['total']['completion_tokens'], 51)
+        self.assertEqual(stats['callers']['parser']['calls'], 3)
+        self.assertEqual(stats['scenarios']['network']['calls'], 2)
+        self.assertEqual(stats['scenarios']['network']['first_token_ms']['p50'], 80.0)
+        # 缓存命中不计入延迟直方图
+        self.assertEqual(stats['scenarios']['network']['latency_ms']['p50'], 300.0)
+        self.assertNotIn(None, stats['scenarios'])
+    
+    def test_jsonl_log(self):
+        """测试原始记录追加到 JSONL 文件"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "logs", "telemetry.jsonl")
+            telemetry = Telemetry(log_path=path)
+            telemetry.record("parser", "system_info", "deepseek", "deepseek-chat", 120.0, 30, 3)
+            telemetry.record("suggester", None, "deepseek", "deepseek-chat", 90.0, 40, 4)
+            telemetry.record("parser", None, "deepseek", "deepseek-chat", 80.0, 30, 2,
+                             cached_prompt_tokens=None, estimated=True)
+            
+            with open(path, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 3)
+            self.assertEqual(records[0]['caller'], "parser")
+            self.assertEqual(records[0]['scenario'], "system_info")
+            self.assertEqual(records[1]['completion_tokens'], 4)
+            # 估算用量的调用不知道前缀缓存命中数，记录为 null 而不是 0
+            self.assertIsNone(records[2]['cached_prompt_tokens'])
+            self.assertTrue(records[2]['estimated'])
+            self.assertEqual(telemetry.snapshot()['total']['cached_prompt_tokens'], 0)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class TestProviderTelemetry(unittest.TestCase):
+    """测试 AIProvider 记录遥测数据"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ.pop("AI_HEDGE", None)
+        os.environ.pop("AI_CACHE", None)
+        self.provider = AIProvider()
+        self.client = UsageClient()
+        self.provider.client = self.client
+    
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+    
+    def test_usage_recorded(self):
+        """测试非流式调用记录 token 用量和调用方"""
+        self.provider.generate_response("system", "列出文件", caller="analyzer")
+        stats = self.provider.get_telemetry_stats()
+        self.assertEqual(stats['callers']['analyzer']['prompt_tokens'], 120)
+        self.assertEqual(stats['callers']['analyzer']['completion_tokens'], 8)
+        self.assertEqual(stats['total']['first_token_ms']['p50'], 0.0)
+    
+    def test_cached_prompt_tokens(self):
+        """测试记录命中提供商前缀缓存的 prompt token（OpenAI 与 DeepSeek 两种格式）"""
+        self.client.usage = SimpleNamespace(
+            prompt_tokens=120, completion_tokens=8,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=96)
+        )
+        self.provider.generate_response("system", "列出文件", caller="parser")
+        
+        self.client.usage = SimpleNamespace(
+            prompt_tokens=120, completion_tokens=8, prompt_cache_hit_tokens=64
+        )
+        self.provider.generate_response("system", "列出目录", caller="parser")
+        
+        stats = self.provider.get_telemetry_stats()
+        self.assertEqual(stats['callers']['parser']['cached_prompt_tokens'], 160)
+    
+    def test_stream_usage_and_first_token(self):
+        """测试流式调用请求 usage 并记录首 token 延迟"""
+        self.provider.generate_response("system", "列出文件", stream=True, caller="parser",
+                                        scenario="file_operations")
+        self.assertEqual(self.client.requests[0]['stream_options'], {"include_usage": True})
+        
+        stats = self.provider.get_telemetry_stats()
+        scenario = stats['scenarios']['file_operations']
+        self.assertEqual(scenario['prompt_tokens'], 120)
+        self.assertGreater(scenario['first_token_ms']['p50'], 0.0)
+        self.assertEqual(scenario['estimated'], 0)
+    
+    def test_early_stop_usage_estimated(self):
+        """测试流式提前结束收不到 usage 时记录估算值并标记"""
+        result = self.provider.generate_response("system", "列出文件", stream=True, caller="parser",
+                                                 stop_when=lambda text: True)
+        self.assertEqual(result, "ls")
+        
+        messages = [{"role": "system", "content": "system"}, {"role": "user", "content": "列出文件"}]
+        total = self.provider.get_telemetry_stats()['total']
+        self.assertEqual(total['prompt_tokens'], sum(estimate_message_tokens(m['content']) for m in messages))
+        self.assertEqual(total['completion_tokens'], estimate_tokens("ls"))
+        self.assertEqual(total['estimated'], 1)
+    
+    def test_parser_tags_caller_and_scenario(self):
+        """测试命令解析器标记调用方和检测到的场景"""
+        parser = AICommandParser(stream=False)
+        parser.ai_provider = self.provider
+        self.assertEqual(parser.parse_command("查看磁盘空间"), "ls -la")
+        
+        stats = self.provider.get_telemetry_stats()
+        self.assertEqual(stats['callers']['parser']['calls'], 1)
+        self.assertEqual(list(stats['scenarios']), [parser._detect_scenario("查看磁盘空间")])
+    
+    def test_failure_recorded(self):
+        """测试失败的调用计入错误数"""
+        def fail(**kwargs):
+            raise ValueError("boom")
+        self.client.chat.completions.create = fail
+        
+        with self.assertRaises(Exception):
+            self.provider.generate_response("system", "列出文件", caller="suggester")
+        self.assertEqual(self.provider.get_telemetry_stats()['callers']['suggester']['errors'], 1)
+
+
+class TestCLIStats(unittest.TestCase):
+    """测试 stats 命令"""
+    
+    def test_stats_command(self):
+        """测试 stats 命令打印分层解析统计、百分位数和 token 总数"""
+        from cli_ai import CLIAI
+        from nlp_parser import NLPParser
+        from tiered_parser import TieredParser
+        
+        telemetry = Telemetry()
+        telemetry.record("parser", "network", "deepseek", "deepseek-chat", 250.0, 100, 10)
+        telemetry.record("parser", "network", "deepseek", "deepseek-chat", 250.0, 40, 2,
+                         cached_prompt_tokens=None, estimated=True)
+        provider = SimpleNamespace(get_telemetry_stats=telemetry.snapshot)
+        
+        app = CLIAI.__new__(CLIAI)
+        app.running = True
+        app._ai_loaded = True
+        app._ai_notices = []
+        app.ai_parser = SimpleNamespace(ai_provider=provider)
+        app.resolver = TieredParser(NLPParser(), lambda: None)
+        app.resolver.resolve("查看磁盘空间")
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            app.process_input("stats")
+        
+        text = output.getvalue()
+        self.assertIn("精确匹配: 1 次", text)
+        self.assertIn("p95 250ms", text)
+        self.assertIn("token 140 + 12（1 次为估算，不含前缀缓存命中数）", text)
+        self.assertIn("network", text)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
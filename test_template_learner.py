@@ -0,0 +1,181 @@
+"""
+测试参数模板学习
+Test learning parametric templates from confirmed AI translations (no real API calls)
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import config
+from ai_command_parser import AICommandParser
+from cli_ai import CLIAI
+from fake_clients import FakeClient
+from nlp_parser import NLPParser
+from template_learner import TemplateLearner, build_template, quote_argument
+from tiered_parser import TieredParser
+
+
+def extract(text):
+    """提取参数（extract_parameters 不依赖解析器的状态，无需创建 AI 客户端）"""
+    return AICommandParser.extract_parameters(AICommandParser.__new__(AICommandParser), text)
+
+
+class TestBuildTemplate(unittest.TestCase):
+    """测试从解析结果中学习模板"""
+    
+    def build(self, user_input, command):
+        return build_template(user_input, extract(user_input), command)
+    
+    def test_name_and_number_slots(self):
+        """测试中文输入中的英文名称和数字成为参数"""
+        template = self.build("创建文件夹 foo", "mkdir foo")
+        self.assertEqual((template.key, template.command_text()), ("创建文件夹 {0}", "mkdir {0}"))
+        
+        template = self.build("查看 app.log 最后 20 行", "tail -n 20 app.log")
+        self.assertEqual(template.key, "查看 {0} 最后 {1} 行")
+        self.assertEqual(template.command_text(), "tail -n {1} {0}")
+        self.assertEqual(template.slot_types, ['files', 'numbers'])
+    
+    def test_command_name_stays_literal(self):
+        """测试命令名和选项不作为参数，输入中对应的词成为固定文字"""
+        template = self.build("用 ls 列出 /tmp 目录", "ls -la /tmp")
+        self.assertEqual(template.key, "用 ls 列出 {0} 目录")
+        self.assertEqual(template.command_text(), "ls -la {0}")
+    
+    def test_unsafe_commands_not_learned(self):
+        """测试参数出现在其他词内部、无参数或命令无法解析时不学习"""
+        self.assertIsNone(self.build("压缩 foo", "tar czf foo.tar.gz foo"))
+        self.assertIsNone(self.build("查看磁盘空间", "df -h"))
+        self.assertIsNone(self.build("创建文件夹 foo", "mkdir 'foo"))
+        self.assertIsNone(self.build("把 foo 改名为 foo", "mv foo foo"))
+
+
+class TestTemplateLearner(unittest.TestCase):
+    """测试模板匹配与持久化"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "templates.db")
+        self.learner = TemplateLearner(self.path)
+    
+    def tearDown(self):
+        self.learner.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def learn(self, user_input, command):
+        return self.learner.learn(user_input, extract(user_input), command)
+    
+    def match(self, user_input):
+        return self.learner.match(user_input, extract(user_input))
+    
+    def test_new_arguments_filled_locally(self):
+        """测试只有参数不同的输入直接生成命令"""
+        self.learn("创建文件夹 foo", "mkdir foo")
+        self.learn("查看 app.log 最后 20 行", "tail -n 20 app.log")
+        self.assertEqual(self.match("创建文件夹 bar"), "mkdir bar")
+        self.assertEqual(self.match("查看 x.log 最后 5 行"), "tail -n 5 x.log")
+        self.assertIsNone(self.match("创建目录 bar"))
+        stats = self.learner.stats()
+        self.assertEqual((stats['templates'], stats['hits'], stats['misses']), (2, 2, 1))
+    
+    def test_argument_type_must_match(self):
+        """测试参数类型不同或含有 shell 特殊字符时不匹配"""
+        self.learn("创建文件夹 foo", "mkdir foo")
+        self.assertIsNone(self.match("创建文件夹 /"))
+        self.assertIsNone(self.match("创建文件夹 $(reboot)"))
+        self.assertIsNone(self.match("创建文件夹 a;rm"))
+        self.assertIsNone(self.match("创建文件夹 a b"))
+    
+    def test_quoting(self):
+        """测试参数经过 shell 转义，~ 开头的路径保留展开"""
+        self.assertEqual(quote_argument("a'b"), "'a'\"'\"'b'")
+        self.assertEqual(quote_argument("~/docs"), "~/docs")
+        self.assertEqual(quote_argument("~/my$dir"), "~/'my$dir'")
+        self.learn("进入 /tmp 目录", "cd /tmp")
+        self.assertEqual(self.match("进入 ~/work 目录"), "cd ~/work")
+    
+    def test_min_confirmations(self):
+        """测试确认次数不足时不使用模板"""
+        learner = TemplateLearner(":memory:", min_confirmations=2)
+        learner.learn("创建文件夹 foo", extract("创建文件夹 foo"), "mkdir foo")
+        self.assertIsNone(learner.match("创建文件夹 bar", extract("创建文件夹 bar")))
+        learner.learn("创建文件夹 baz", extract("创建文件夹 baz"), "mkdir baz")
+        self.assertEqual(learner.match("创建文件夹 bar", extract("创建文件夹 bar")), "mkdir bar")
+    
+    def test_relearn_replaces_command(self):
+        """测试同一个输入模板学到新命令时以最新的为准"""
+        self.learn("创建文件夹 foo", "mkdir foo")
+        self.learn("创建文件夹 foo", "mkdir -p foo")
+        self.assertEqual(self.match("创建文件夹 bar"), "mkdir -p bar")
+        self.assertEqual(self.learner.templates()[0]['confirmations'], 1)
+    
+    def test_persistent(self):
+        """测试重启后模板依然有效"""
+        self.learn("创建文件夹 foo", "mkdir foo")
+        self.learner.close()
+        self.learner = TemplateLearner(self.path)
+        self.assertEqual(self.match("创建文件夹 bar"), "mkdir bar")
+
+
+class TestParserTemplates(unittest.TestCase):
+    """测试解析器与 CLI 使用参数模板"""
+    
+    def setUp(self):
+        self.original_env = os.environ.copy()
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        os.environ["AI_TEMPLATES"] = "true"
+        os.environ["AI_TEMPLATES_PATH"] = os.path.join(self.tmpdir, "templates.db")
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE"):
+            os.environ.pop(name, None)
+        self.parser = AICommandParser(use_context=False, stream=False)
+        self.client = FakeClient(content="mkdir foo")
+        self.original_client = self.parser.ai_provider.client
+        self.parser.ai_provider.client = self.client
+    
+    def tearDown(self):
+        self.parser.ai_provider.client = self.original_client
+        self.parser.templates.close()
+        os.environ.clear()
+        os.environ.update(self.original_env)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+    
+    def test_learned_template_skips_ai(self):
+        """测试学到模板后新参数不再调用 AI"""
+        self.assertEqual(self.parser.parse_command("创建文件夹 foo"), "mkdir foo")
+        self.assertTrue(self.parser.learn_template("创建文件夹 foo", "mkdir foo"))
+        self.assertEqual(self.parser.parse_command("创建文件夹 bar"), "mkdir bar")
+        self.assertEqual(self.client.calls, 1)
+    
+    def test_cli_learns_after_confirmation(self):
+        """测试 CLI 只在用户确认执行 AI 解析的命令后学习"""
+        app = CLIAI.__new__(CLIAI)
+        app._ai_loaded = True
+        app._ai_notices = []
+        app.use_ai_parsing = True
+        app.conversation = None
+        app.ai_parser = self.parser
+        app.parser = NLPParser()
+        # "创建文件夹 foo" 本地规则即可解析，提高阈值并关闭投机解析，让请求直接走到 AI
+        app.resolver = TieredParser(app.parser, app._get_ai_parser, threshold=1.01)
+        app.execute_command = lambda command, details=None: None
+        patcher = mock.patch.object(config, "AI_SPECULATIVE_PARSING", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        with redirect_stdout(io.StringIO()), mock.patch.object(app, "confirm_execution", return_value=False):
+            app.process_input("创建文件夹 foo")
+        self.assertEqual(self.parser.templates.stats()['templates'], 0)
+        
+        with redirect_stdout(io.StringIO()), mock.patch.object(app, "confirm_execution", return_value=True):
+            app.process_input("创建文件夹 foo")
+        self.assertEqual(self.parser.templates.stats()['templates'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
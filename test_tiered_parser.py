@@ -0,0 +1,323 @@
+"""
+测试分层解析
+Test the tiered local-first resolver (no real API calls)
+"""
+import io
+import os
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+from ai_command_parser import AICommandParser
+from ai_provider import CircuitBreaker
+from nlp_parser import NLPParser
+from similarity_cache import SimilarityCache
+from tiered_parser import SpeculativeParse, TieredParser, describe_resolution
+
+
+class FakeAIParser:
+    """模拟 AI 解析器，记录 parse_command 的调用"""
+    
+    def __init__(self, command="ps -eo user= | sort | uniq -c", error=None, breaker=None):
+        self.command = command
+        self.error = error
+        self.calls = []
+        self.learned = []
+        self.templates = None
+        self.similar_cache = None
+        self.ai_provider = SimpleNamespace(breaker=breaker or CircuitBreaker())
+        # 设置 gate 后 parse_command 等待放行，模拟 AI 延迟
+        self.gate = None
+    
+    def parse_command(self, user_input, local_lookup=True, cancel=None):
+        self.calls.append((user_input, local_lookup))
+        if self.gate:
+            self.gate.wait(5)
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.command
+    
+    def learn_template(self, user_input, command):
+        self.learned.append((user_input, command))
+        return True
+
+
+class TestRuleTiers(unittest.TestCase):
+    """测试规则解析器的置信度"""
+    
+    def setUp(self):
+        self.parser = NLPParser()
+    
+    def test_exact(self):
+        """测试精确映射置信度为 1，带占位符的映射不直接采用"""
+        self.assertEqual(self.parser.match_exact("查看磁盘空间"), ("df -h", 1.0))
+        self.assertIsNone(self.parser.match_exact("统计每个用户的进程数"))
+    
+    def test_rules_and_fuzzy(self):
+        """测试参数规则和模糊匹配的置信度"""
+        command, confidence = self.parser.match_rules("创建文件夹 foo")
+        self.assertEqual(command, "mkdir foo")
+        self.assertGreaterEqual(confidence, 0.8)
+        command, confidence = self.parser.match_fuzzy("查看磁盘空间")
+        self.assertEqual(command, "df -h")
+        self.assertLessEqual(confidence, 0.9)
+    
+    def test_rules_need_whole_input(self):
+        """测试否定词和没有匹配上的词使规则置信度低于阈值，客套话和标点不影响"""
+        self.assertEqual(self.parser.match_rules("请删除文件 a.txt"), ("rm a.txt", 0.95))
+        self.assertEqual(self.parser.match_rules("uninstall vim"), ("sudo apt remove vim", 0.95))
+        self.assertLess(self.parser.match_rules("删除文件夹 build 里的日志")[1], 0.8)
+        self.assertLess(self.parser.match_rules("不要删除文件 a.txt")[1], 0.8)
+        self.assertLess(self.parser.match_fuzzy("别关机")[1], 0.8)
+    
+    def test_rules_keep_argument_case(self):
+        """测试规则短语不区分大小写，路径和文件名保持原样"""
+        self.assertEqual(self.parser.match_rules("删除文件 README.md"), ("rm README.md", 0.95))
+        self.assertEqual(self.parser.match_rules("cd /Home/Foo")[0], "cd /Home/Foo")
+        self.assertEqual(self.parser.match_rules("Make Directory MyDir")[0], "mkdir MyDir")
+        self.assertEqual(self.parser.parse("创建文件夹 Build"), "mkdir Build")
+        self.assertLess(self.parser.match_rules("Do Not remove file a.txt")[1], 0.8)
+
+
+class TestTieredParser(unittest.TestCase):
+    """测试分层解析流程"""
+    
+    def setUp(self):
+        self.ai_parser = FakeAIParser()
+        self.loads = 0
+        self.resolver = TieredParser(NLPParser(), self.get_ai_parser, threshold=0.8)
+    
+    def get_ai_parser(self):
+        self.loads += 1
+        return self.ai_parser
+    
+    def test_local_hit_skips_ai(self):
+        """测试本地规则达到阈值时不加载 AI 解析器"""
+        result = self.resolver.resolve("查看磁盘空间")
+        self.assertEqual((result['command'], result['tier'], result['accepted']), ("df -h", "exact", True))
+        self.assertEqual([attempt['tier'] for attempt in result['attempts']], ["exact"])
+        
+        result = self.resolver.resolve("创建文件夹 foo")
+        self.assertEqual((result['command'], result['tier']), ("mkdir foo", "rules"))
+        self.assertEqual(self.loads, 0)
+    
+    def test_falls_through_to_ai(self):
+        """测试本地各层都没有把握时调用 AI，且不再重复本地查找"""
+        result = self.resolver.resolve("统计每个用户的进程数")
+        self.assertEqual(result['tier'], "ai")
+        self.assertEqual(self.ai_parser.calls, [("统计每个用户的进程数", False)])
+        self.assertEqual([attempt['tier'] for attempt in result['attempts']],
+                         ["exact", "rules", "fuzzy", "templates", "similar", "ai"])
+    
+    def test_negated_or_narrowed_input_goes_to_ai(self):
+        """测试否定或限定了范围的删除输入不由本地规则直接回答，交给 AI"""
+        inputs = ["不要删除文件 a.txt", "do not remove file a.txt", "别删除文件夹 build", "删除文件夹 build 里的日志"]
+        for text in inputs:
+            result = self.resolver.resolve(text)
+            self.assertEqual(result['tier'], "ai", text)
+            rules = result['attempts'][1]
+            self.assertEqual(rules['tier'], "rules")
+            self.assertGreater(rules['confidence'], 0.0)
+        self.assertEqual([call[0] for call in self.ai_parser.calls], inputs)
+    
+    def test_ai_preferred_over_low_confidence(self):
+        """测试 AI 的结果优先于低于阈值的本地候选"""
+        resolver = TieredParser(NLPParser(), self.get_ai_parser, threshold=1.01)
+        result = resolver.resolve("创建文件夹 foo")
+        self.assertEqual(result['tier'], "ai")
+    
+    def test_best_candidate_when_ai_unavailable(self):
+        """测试 AI 未启用、失败或熔断时退回到置信度最高的候选"""
+        resolver = TieredParser(NLPParser(), lambda: None, threshold=1.01)
+        result = resolver.resolve("创建文件夹 foo")
+        self.assertEqual((result['command'], result['tier'], result['accepted']), ("mkdir foo", "rules", False))
+        self.assertIn("低于阈值", describe_resolution(result))
+        
+        self.ai_parser.error = "timeout"
+        result = self.resolver.resolve("统计每个用户的进程数")
+        self.assertIsNone(result['command'])
+        self.assertEqual(result['attempts'][-1]['error'], "timeout")
+        
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+        breaker.record_failure()
+        self.ai_parser = FakeAIParser(breaker=breaker)
+        result = self.resolver.resolve("统计每个用户的进程数")
+        self.assertEqual(result['circuit_open_until'], breaker.reopen_at)
+        self.assertEqual(self.ai_parser.calls, [])
+    
+    def test_similar_destructive_needs_identical_input(self):
+        """测试相似输入缓存中的破坏性命令只在输入相同时采用，相近的输入交给 AI"""
+        self.ai_parser.similar_cache = SimilarityCache(":memory:")
+        self.ai_parser._detect_scenario = lambda text: "file_operations"
+        self.ai_parser.similar_cache.put("删除所有日志文件", "file_operations", "rm *.log")
+        self.ai_parser.similar_cache.put("列出所有日志文件", "file_operations", "ls *.log")
+        
+        result = self.resolver.resolve("删除所有日志文件夹")
+        self.assertEqual(result['tier'], "ai")
+        similar = result['attempts'][-2]
+        self.assertEqual(similar['tier'], "similar")
+        self.assertLess(similar['confidence'], 0.8)
+        
+        result = self.resolver.resolve("删除所有日志文件")
+        self.assertEqual((result['command'], result['tier']), ("rm *.log", "similar"))
+        result = self.resolver.resolve("列出所有的日志文件")
+        self.assertEqual((result['command'], result['tier']), ("ls *.log", "similar"))
+        self.assertEqual(self.ai_parser.calls, [("删除所有日志文件夹", False)])
+    
+    def test_stats(self):
+        """测试按层统计给出结果的次数"""
+        self.resolver.resolve("查看磁盘空间")
+        self.resolver.resolve("查看磁盘空间")
+        self.resolver.resolve("统计每个用户的进程数")
+        self.ai_parser.command = None
+        self.resolver.resolve("统计每个用户的进程数")
+        stats = self.resolver.stats()
+        self.assertEqual(stats['tiers']['exact']['answered'], 2)
+        self.assertEqual(stats['tiers']['ai']['answered'], 1)
+        self.assertEqual(stats['unresolved'], 1)
+
+
+
+class GatedStream:
+    """模拟流式响应：输出第一段后等待放行再输出其余内容"""
+    
+    def __init__(self, pieces):
+        self.pieces = pieces
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.closed = False
+    
+    def __iter__(self):
+        for index, piece in enumerate(self.pieces):
+            if index == 1:
+                self.started.set()
+                self.gate.wait(5)
+            delta = SimpleNamespace(content=piece)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+    
+    def close(self):
+        self.closed = True
+
+
+class TestSpeculativeParse(unittest.TestCase):
+    """测试投机解析：先返回本地候选，AI 在后台确认或被取消"""
+    
+    def setUp(self):
+        self.ai_parser = FakeAIParser(command="mkdir -p foo")
+        self.ai_parser.gate = threading.Event()
+        self.resolver = TieredParser(NLPParser(), lambda: self.ai_parser, threshold=1.01)
+    
+    def tearDown(self):
+        self.ai_parser.gate.set()
+    
+    def test_candidate_returned_before_ai(self):
+        """测试本地候选立即返回，AI 完成后替换候选并更新统计"""
+        result = self.resolver.resolve("创建文件夹 foo", speculate=True)
+        self.assertEqual((result['command'], result['tier']), ("mkdir foo", "rules"))
+        speculation = result['speculation']
+        self.assertFalse(speculation.done())
+        self.assertFalse(self.resolver.adopt(result))
+        
+        self.ai_parser.gate.set()
+        self.assertTrue(speculation.wait(5))
+        self.assertTrue(self.resolver.adopt(result))
+        self.assertEqual((result['command'], result['tier'], result['accepted']), ("mkdir -p foo", "ai", True))
+        tiers = self.resolver.stats()['tiers']
+        self.assertEqual((tiers['rules']['answered'], tiers['ai']['answered']), (0, 1))
+    
+    def test_no_speculation_without_candidate(self):
+        """测试本地没有候选时照常等待 AI"""
+        self.ai_parser.gate.set()
+        result = self.resolver.resolve("统计每个用户的进程数", speculate=True)
+        self.assertIsNone(result['speculation'])
+        self.assertEqual(result['tier'], "ai")
+    
+    def test_callback_skipped_after_cancel(self):
+        """测试取消后不再通知完成"""
+        notified = []
+        result = self.resolver.resolve("创建文件夹 foo", speculate=True)
+        speculation = result['speculation']
+        speculation.on_done(notified.append)
+        speculation.cancel()
+        self.ai_parser.gate.set()
+        speculation.wait(5)
+        self.assertEqual(notified, [])
+        self.assertFalse(self.resolver.adopt(result))
+        self.assertEqual(result['tier'], "rules")
+    
+    def test_cancel_closes_ai_stream(self):
+        """测试取消后关闭流式连接，不计入熔断器"""
+        original_env = os.environ.copy()
+        self.addCleanup(lambda: (os.environ.clear(), os.environ.update(original_env)))
+        os.environ["AI_PROVIDER"] = "deepseek"
+        os.environ["DEEPSEEK_API_KEY"] = "sk-test-key"
+        for name in ("AI_CACHE", "AI_HEDGE", "AI_SIMILAR_CACHE", "AI_TEMPLATES"):
+            os.environ.pop(name, None)
+        parser = AICommandParser(use_context=False, stream=True)
+        stream = GatedStream(["mkdir", " -p foo", "\n"])
+        original_client = parser.ai_provider.client
+        parser.ai_provider.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: stream))
+        )
+        self.addCleanup(setattr, parser.ai_provider, "client", original_client)
+        
+        speculation = SpeculativeParse(parser, "创建文件夹 foo")
+        self.assertTrue(stream.started.wait(5))
+        speculation.cancel()
+        stream.gate.set()
+        self.assertTrue(speculation.wait(5))
+        self.assertIsNone(speculation.command)
+        self.assertIsNone(speculation.error)
+        self.assertTrue(stream.closed)
+        self.assertEqual(parser.ai_provider.breaker.snapshot()['consecutive_failures'], 0)
+
+
+class TestCLISpeculation(unittest.TestCase):
+    """测试 CLI 先显示规则候选，确认候选时取消 AI"""
+    
+    def setUp(self):
+        from cli_ai import CLIAI
+        
+        self.ai_parser = FakeAIParser(command="mkdir -p foo")
+        self.ai_parser.gate = threading.Event()
+        self.app = CLIAI.__new__(CLIAI)
+        self.app._ai_loaded = True
+        self.app._ai_notices = []
+        self.app.use_ai_parsing = True
+        self.app.conversation = None
+        self.app.ai_parser = self.ai_parser
+        self.app.parser = NLPParser()
+        self.app.executor = SimpleNamespace(is_dangerous_command=lambda command: False)
+        self.app.resolver = TieredParser(self.app.parser, self.app._get_ai_parser, threshold=1.01)
+        self.executed = []
+        self.app.execute_command = lambda command, details=None: self.executed.append(command)
+    
+    def tearDown(self):
+        self.ai_parser.gate.set()
+    
+    def run_input(self, answers):
+        with redirect_stdout(io.StringIO()), mock.patch("builtins.input", side_effect=answers):
+            self.app.process_input("创建文件夹 foo")
+    
+    def test_confirm_candidate_cancels_ai(self):
+        """测试确认规则候选后立即执行，不等待 AI"""
+        started = time.perf_counter()
+        self.run_input(["y"])
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(self.executed, ["mkdir foo"])
+        self.assertEqual(self.ai_parser.learned, [])
+    
+    def test_wait_for_ai(self):
+        """测试回车等待 AI，执行 AI 修正后的命令"""
+        self.ai_parser.gate.set()
+        self.run_input(["", "y"])
+        self.assertEqual(self.executed, ["mkdir -p foo"])
+        self.assertEqual(self.ai_parser.learned, [("创建文件夹 foo", "mkdir -p foo")])
+        self.assertEqual(self.app.resolver.stats()['tiers']['ai']['answered'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,347 @@
+"""
+分层解析
+Tiered local-first command resolution with confidence scores
+
+按成本从低到高依次尝试各层，第一个置信度达到阈值的结果直接采用：
+  1. exact     精确映射（command_mappings）
+  2. rules     参数规则（"创建文件夹 test" -> "mkdir test"）
+  3. fuzzy     模糊短语匹配
+  4. templates 从确认执行的 AI 结果中学到的参数模板
+  5. similar   相似输入缓存
+  6. ai        调用 AI 解析（最后一层，结果总是采用）
+
+前三层只用规则解析器，不加载 AI 模块，常见输入在几十微秒内完成；
+后三层需要 AI 解析器，只有前面的层都没有把握时才加载。
+指代之前对话的后续输入（"删除它"）跳过参数模板和相似输入缓存，
+也不投机，直接由带对话历史的 AI 解析。
+相似输入缓存给出的破坏性命令只在输入归一化后完全相同时采用。
+所有层都没有达到阈值（例如 AI 未启用、熔断或调用失败）时，
+退回到置信度最高的候选结果。
+
+投机解析（speculate=True）：本地已有低于阈值的候选时不等待 AI，
+AI 层在后台线程中运行，先返回本地候选供用户确认；
+用户先确认了本地候选时取消 AI 请求，否则用 AI 的结果替换或确认候选。
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+from nlp_parser import is_destructive_command
+
+
+TIERS = ('exact', 'rules', 'fuzzy', 'templates', 'similar', 'ai')
+
+TIER_NAMES = {
+    'exact': '精确匹配',
+    'rules': '参数规则',
+    'fuzzy': '模糊匹配',
+    'templates': '参数模板',
+    'similar': '相似输入缓存',
+    'ai': 'AI 解析'
+}
+
+# 参数模板由用户确认过的 AI 结果学习而来，且参数类型逐一校验
+TEMPLATE_CONFIDENCE = 0.95
+# 相似输入缓存给出的破坏性命令（删除、卸载、结束进程等）在输入不完全相同时，
+# 置信度压到阈值以下这么多，只作为候选，交给 AI 确认
+DESTRUCTIVE_MARGIN = 0.01
+# AI 是最后一层，结果总是采用；这个值只用于报告（结构化输出时使用模型给出的置信度）
+AI_CONFIDENCE = 0.9
+
+
+class TieredParser:
+    """分层解析器（各层统计线程安全）"""
+    
+    def __init__(self, rule_parser, get_ai_parser: Optional[Callable[[], Any]] = None,
+                 threshold: Optional[float] = None):
+        """
+        Args:
+            rule_parser: NLPParser 实例
+            get_ai_parser: 返回 AI 解析器的函数（未启用时返回 None），
+                只在需要后三层时调用，以便延迟加载 AI 模块
+            threshold: 采用结果所需的最低置信度，默认读取 config.TIERED_CONFIDENCE_THRESHOLD
+        """
+        self.rule_parser = rule_parser
+        self.get_ai_parser = get_ai_parser
+        self.threshold = config.TIERED_CONFIDENCE_THRESHOLD if threshold is None else threshold
+        self._lock = threading.Lock()
+        self._answered = {tier: 0 for tier in TIERS}
+        self._elapsed = {tier: 0.0 for tier in TIERS}
+        self.unresolved = 0
+    
+    def resolve(self, user_input: str, speculate: bool = False) -> Dict[str, Any]:
+        """
+        依次尝试各层，返回第一个达到阈值的结果
+        
+        Args:
+            user_input: 用户输入
+            speculate: 本地候选低于阈值时在后台运行 AI 层，立即返回本地候选
+        
+        Returns:
+            {
+                'command': 命令（无法解析时为 None）,
+                'tier': 给出结果的层（无法解析时为 None）,
+                'confidence': 置信度,
+                'accepted': 置信度是否达到阈值（False 表示退回到最佳候选）,
+                'elapsed_ms': 总耗时,
+                'attempts': [{'tier', 'confidence', 'elapsed_ms', 'error'}],
+                'circuit_open_until': AI 熔断时的恢复时间（时间戳），否则为 None,
+                'speculation': 后台运行的 SpeculativeParse（未投机时为 None）,
+                'details': AI 结构化输出的完整结果（见 AICommandParser.parse_structured），
+                    其他层或未启用结构化输出时为 None
+            }
+        """
+        started = time.perf_counter()
+        result: Dict[str, Any] = {
+            'command': None,
+            'tier': None,
+            'confidence': 0.0,
+            'accepted': False,
+            'elapsed_ms': 0.0,
+            'attempts': [],
+            'circuit_open_until': None,
+            'speculation': None,
+            'details': None
+        }
+        best: Optional[Tuple[str, str, float]] = None
+        ai_parser = None
+        follow_up = False
+        
+        for tier in TIERS:
+            if tier in ('templates', 'similar', 'ai'):
+                if ai_parser is None:
+                    ai_parser = self.get_ai_parser() if self.get_ai_parser else None
+                    if ai_parser is None:
+                        break
+                    follow_up = is_follow_up(ai_parser, user_input)
+                if follow_up and tier != 'ai':
+                    # 指代之前对话的输入取决于上下文，模板和缓存中的命令不适用
+                    continue
+            
+            if (tier == 'ai' and speculate and best is not None and not follow_up
+                    and not ai_parser.ai_provider.breaker.is_open()):
+                # 本地已有候选：AI 在后台解析，不阻塞显示
+                result['speculation'] = SpeculativeParse(ai_parser, user_input)
+                break
+            
+            tier_started = time.perf_counter()
+            error = None
+            try:
+                match = self._run_tier(tier, user_input, ai_parser, result)
+            except Exception as e:
+                match, error = None, str(e)
+            elapsed_ms = (time.perf_counter() - tier_started) * 1000
+            
+            attempt = {
+                'tier': tier,
+                'confidence': match[1] if match else 0.0,
+                'elapsed_ms': elapsed_ms,
+                'error': error
+            }
+            result['attempts'].append(attempt)
+            if not match:
+                continue
+            
+            command, confidence = match
+            if confidence >= self.threshold or tier == 'ai':
+                # AI 已经看过整句输入，它的结果优先于本地低置信度的候选
+                best = (tier, command, confidence)
+                result['accepted'] = True
+                break
+            if best is None or confidence > best[2]:
+                best = (tier, command, confidence)
+        
+        if best is not None:
+            result['tier'], result['command'], result['confidence'] = best
+        result['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        
+        with self._lock:
+            if best is None:
+                self.unresolved += 1
+            else:
+                self._answered[best[0]] += 1
+                self._elapsed[best[0]] += result['elapsed_ms']
+        return result
+    
+    def _run_tier(self, tier: str, user_input: str, ai_parser,
+                  result: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """运行一层，返回 (命令, 置信度) 或 None"""
+        if tier == 'exact':
+            return self.rule_parser.match_exact(user_input)
+        if tier == 'rules':
+            return self.rule_parser.match_rules(user_input)
+        if tier == 'fuzzy':
+            return self.rule_parser.match_fuzzy(user_input)
+        
+        if tier == 'templates':
+            templates = getattr(ai_parser, 'templates', None)
+            if not templates:
+                return None
+            text = user_input.strip()
+            command = templates.match(text, ai_parser.extract_parameters(text))
+            return (command, TEMPLATE_CONFIDENCE) if command else None
+        
+        if tier == 'similar':
+            similar_cache = getattr(ai_parser, 'similar_cache', None)
+            if not similar_cache:
+                return None
+            text = user_input.strip()
+            match = similar_cache.lookup(text, ai_parser._detect_scenario(text))
+            if not match:
+                return None
+            confidence = match['similarity']
+            if confidence < 1.0 and is_destructive_command(match['command']):
+                # 字面相近不代表意思相同（"删除所有日志文件夹" 与 "删除所有日志文件"），
+                # 破坏性命令只在归一化输入完全相同时直接采用
+                confidence = min(confidence, self.threshold - DESTRUCTIVE_MARGIN)
+            return match['command'], confidence
+        
+        breaker = ai_parser.ai_provider.breaker
+        if breaker.is_open():
+            # 熔断期间不访问网络，退回到本地的最佳候选
+            result['circuit_open_until'] = breaker.reopen_at
+            return None
+        command, details = parse_with_ai(ai_parser, user_input)
+        if not command:
+            return None
+        result['details'] = details
+        return command, model_confidence(details)
+    
+    def adopt(self, result: Dict[str, Any]) -> bool:
+        """
+        投机解析完成后用 AI 的结果替换本地候选（AI 失败或已取消时保留候选）
+        
+        Returns:
+            是否采用了 AI 的结果
+        """
+        speculation = result['speculation']
+        if speculation is None or speculation.cancelled or not speculation.done() or not speculation.command:
+            return False
+        
+        with self._lock:
+            self._answered[result['tier']] -= 1
+            self._elapsed[result['tier']] -= result['elapsed_ms']
+            self._answered['ai'] += 1
+            self._elapsed['ai'] += speculation.elapsed_ms
+        result.update({
+            'command': speculation.command,
+            'tier': 'ai',
+            'confidence': model_confidence(speculation.details),
+            'accepted': True,
+            'elapsed_ms': speculation.elapsed_ms,
+            'details': speculation.details
+        })
+        return True
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        各层给出结果的次数和平均耗时
+        
+        Returns:
+            {'tiers': {层: {'answered', 'avg_ms'}}, 'unresolved': 无法解析的次数}
+        """
+        with self._lock:
+            return {
+                'tiers': {
+                    tier: {
+                        'answered': self._answered[tier],
+                        'avg_ms': self._elapsed[tier] / self._answered[tier] if self._answered[tier] else 0.0
+                    }
+                    for tier in TIERS
+                },
+                'unresolved': self.unresolved
+            }
+
+
+def is_follow_up(ai_parser, user_input: str) -> bool:
+    """输入是否指代 AI 解析器对话记忆中之前的对话（未启用对话记忆时为 False）"""
+    check = getattr(ai_parser, 'is_follow_up', None)
+    return bool(check and check(user_input))
+
+
+def model_confidence(details: Optional[Dict[str, Any]]) -> float:
+    """AI 层的置信度：结构化输出给出了置信度时使用模型的判断"""
+    if details and details.get('confidence') is not None:
+        return details['confidence']
+    return AI_CONFIDENCE
+
+
+def parse_with_ai(ai_parser, user_input: str, cancel: Optional[threading.Event] = None
+                  ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """
+    调用 AI 解析（不再查本地模板和缓存）
+    
+    Returns:
+        (命令, 结构化结果)；未启用结构化输出时结构化结果为 None
+    """
+    if getattr(ai_parser, 'structured', False):
+        details = ai_parser.parse_structured(user_input, local_lookup=False, cancel=cancel)
+        return details['command'], details
+    return ai_parser.parse_command(user_input, local_lookup=False, cancel=cancel), None
+
+
+class SpeculativeParse:
+    """在后台线程中运行 AI 层，用户先确认本地候选时可以取消"""
+    
+    def __init__(self, ai_parser, user_input: str):
+        self.command: Optional[str] = None
+        self.details: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.elapsed_ms = 0.0
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[['SpeculativeParse'], None]] = []
+        threading.Thread(target=self._run, args=(ai_parser, user_input), daemon=True).start()
+    
+    def _run(self, ai_parser, user_input: str):
+        started = time.perf_counter()
+        try:
+            self.command, self.details = parse_with_ai(ai_parser, user_input, self._cancel)
+        except Exception as e:
+            if not self._cancel.is_set():
+                self.error = str(e)
+        self.elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        with self._lock:
+            self._done.set()
+            callbacks = self._callbacks if not self._cancel.is_set() else []
+            self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+    
+    def on_done(self, callback: Callable[['SpeculativeParse'], None]):
+        """AI 解析完成（成功或失败，不含取消）时在后台线程中调用 callback"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        if not self._cancel.is_set():
+            callback(self)
+    
+    def done(self) -> bool:
+        return self._done.is_set()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待 AI 解析完成，返回是否已完成"""
+        return self._done.wait(timeout)
+    
+    def cancel(self):
+        """取消 AI 请求（流式请求在收到下一段文本时关闭连接）"""
+        with self._lock:
+            self._cancel.set()
+            self._callbacks = []
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+
+def describe_resolution(result: Dict[str, Any]) -> str:
+    """一行说明结果来自哪一层，如 "精确匹配（置信度 1.00，0.02ms）" """
+    name = TIER_NAMES.get(result['tier'], result['tier'])
+    text = f"{name}（置信度 {result['confidence']:.2f}，{result['elapsed_ms']:.2f}ms）"
+    if not result['accepted']:
+        text += "，低于阈值的最佳候选"
+    return text
@@ -0,0 +1,42 @@
+"""
+Token 估算工具
+Token estimation helpers
+
+不依赖分词器，按 DeepSeek 文档给出的经验比例估算：
+1 个中文字符约 0.6 个 token，1 个英文字符约 0.3 个 token。
+用于在发送请求前控制批量大小，结果偏保守即可。
+"""
+import math
+import re
+
+
+# 中日韩统一表意文字及全角标点
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+
+# 每条消息的固定开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数
+    
+    Args:
+        text: 要估算的文本
+    
+    Returns:
+        估算的 token 数（向上取整，非空文本至少为 1）
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return max(1, math.ceil(cjk * CJK_TOKENS_PER_CHAR + other * OTHER_TOKENS_PER_CHAR))
+
+
+def estimate_message_tokens(content: str) -> int:
+    """估算一条聊天消息的 token 数（含固定开销）"""
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS